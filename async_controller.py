@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+asyncio-native Buzz Lightyear Controller
+
+AsyncBuzzController runs button actions, servo motion, strobe timing,
+LED frames, show cues, gestures, the reconciler, idle detection and config
+polling as timer callbacks on a single event loop instead of helper
+threads: every subsystem is given the loop, wrapped in LoopScheduler, as
+its scheduler. GPIO edges are bridged into the loop from RPi.GPIO's
+callback thread, and shutdown is awaitable.
+
+Sound file decoding, audio start-up and the costume sync socket still run
+on threads of their own, since they block.
+
+The synchronous BuzzController keeps its API, so existing subclasses such
+as CustomBuzzController in example_custom.py work unchanged. The button
+callbacks are shared by both controllers; here they run on the loop.
+
+Usage:
+    async def main():
+        controller = AsyncBuzzController(config)
+        await controller.run()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import os
+import signal
+
+from buzz_controller import CONFIG_FILE, BuzzController
+from config_reload import load_config_file
+from deadline_worker import LoopScheduler
+from event_dispatcher import EventDispatcher
+
+
+class AsyncBuzzController(BuzzController):
+    """Buzz Lightyear controller running every subsystem on one event loop"""
+
+    def __init__(self, config=None, backend=None):
+        """
+        Initialize the controller; must be called from a running event loop
+
+        Args:
+            config: Dictionary with pin configurations and settings
+            backend: GPIO/mixer/clock backend (default: HardwareBackend)
+        """
+        self.loop = asyncio.get_running_loop()
+        self._shutdown_event = asyncio.Event()
+        super().__init__(config, backend)
+
+    def _create_scheduler(self):
+        """Run every subsystem's timers as callbacks on the loop"""
+        if self.clock.virtual:
+            return super()._create_scheduler()
+        return LoopScheduler(self.loop)
+
+    def _start_control_server(self):
+        """Serve control clients on the controller's loop"""
+        self._control_started = self.loop.create_task(self.control.start())
+
+    def _create_dispatcher(self):
+        """Run button actions from loop callbacks; edges arrive on RPi.GPIO's thread"""
+        if self.clock.virtual:
+            return super()._create_dispatcher()
+        return EventDispatcher(
+            max_queue=self.config.dispatcher_queue_size,
+            policy=self.config.backpressure_policy,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler
+        )
+
+    async def run(self):
+        """Run until shutdown is requested, then clean up"""
+        print("Buzz Lightyear Controller running (asyncio)...")
+        print("Press Ctrl+C to exit")
+
+        for sig, handler in ((signal.SIGINT, self.request_shutdown),
+                             (signal.SIGTERM, self.request_shutdown),
+                             (signal.SIGUSR1, self.dump_recording)):
+            try:
+                self.loop.add_signal_handler(sig, handler)
+            except (NotImplementedError, RuntimeError):
+                # Not the main thread or not supported on this platform
+                pass
+        self._install_crash_dump()
+        if self.config_path is not None:
+            try:
+                self.loop.add_signal_handler(signal.SIGHUP, self.reload_config_file)
+            except (NotImplementedError, RuntimeError, AttributeError):
+                pass
+
+        try:
+            await self._shutdown_event.wait()
+            print("\nShutting down...")
+        finally:
+            await self.shutdown()
+
+    def _on_sync_cue(self, action, value):
+        """Sync callback: run the cue on the loop, next to the timers it drives"""
+        self._record_cue(action, value)
+        self.loop.call_soon_threadsafe(self.run_cue, action, value)
+
+    def request_shutdown(self):
+        """Ask run() to return; safe to call from the loop thread"""
+        self.running = False
+        self._shutdown_event.set()
+
+    async def shutdown(self):
+        """Close the control server on the loop, then release everything else"""
+        if self.control is not None:
+            await asyncio.gather(self._control_started, return_exceptions=True)
+            await self.control.aclose()
+            self.control = None
+        self.cleanup()
+
+
+async def async_main():
+    """Create the controller on the running loop and run it"""
+    config = load_config_file(CONFIG_FILE) if os.path.exists(CONFIG_FILE) else None
+    controller = AsyncBuzzController(config)
+    if config is not None:
+        controller.watch_config(CONFIG_FILE)
+    await controller.run()
+
+
+def main():
+    """Main entry point"""
+    asyncio.run(async_main())
+
+
+if __name__ == '__main__':
+    main()
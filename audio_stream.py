@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Streaming playback for long clips and background loops
+
+Short effects are decoded into memory by the sound bank. Long tracks
+(soundtracks, an ambient spaceship hum) would cost tens of megabytes that
+way, so they are streamed from disk through pygame.mixer.music instead:
+
+- loops play with loops=-1, which pygame repeats without a gap
+- switching tracks fades the current one out and the new one in
+- the stream is ducked while short effects play over it
+- a one-shot track (loops >= 0) plays in place of the loop, and the loop
+  comes back once it ends
+
+pygame.mixer.music has a single stream, so a track change is a fade out
+followed by a fade in rather than an overlapping crossfade.
+
+Volume ramps run on a small scheduler thread, or on an external
+scheduler such as the simulator's virtual clock.
+"""
+
+import time
+
+from deadline_worker import DeadlineWorker
+
+# Pending switch that stops the stream instead of starting a new track
+_STOP = object()
+
+# Seconds between end-of-track checks while a one-shot track plays
+END_POLL = 0.1
+
+
+def _approach(value, target, rate, elapsed):
+    """Move value towards target at rate per second for elapsed seconds"""
+    step = float('inf') if rate == float('inf') else rate * elapsed
+    if value < target:
+        return min(target, value + step)
+    return max(target, value - step)
+
+
+class StreamPlayer:
+    """Plays one streamed track at a time with fades and ducking"""
+
+    def __init__(self, music, volume=1.0, crossfade=1.0, duck_volume=0.3, duck_fade=0.05,
+                 update_hz=50, clock=time.monotonic, scheduler=None):
+        """
+        Initialize the stream player
+
+        Args:
+            music: pygame.mixer.music (or compatible object)
+            volume: Stream volume (0.0-1.0) when not ducked
+            crossfade: Seconds for a track change (half out, half in)
+            duck_volume: Fraction of the volume kept while ducked
+            duck_fade: Seconds to duck or recover
+            update_hz: Volume updates per second while ramping
+            clock: Function returning the current time in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+        """
+        self.music = music
+        self.volume = volume
+        self.crossfade = crossfade
+        self.duck_volume = duck_volume
+        self.duck_fade = duck_fade
+        self.update_interval = 1.0 / update_hz
+        self.clock = clock
+        self.scheduler = scheduler
+
+        # Stream state, guarded by the condition's lock
+        self._worker = DeadlineWorker(self._step, 'audio-stream', clock, scheduler)
+        self._cond = self._worker.cond
+        self._track = None            # Path of the playing track
+        self._loops = -1              # Extra repeats of the playing track; -1 loops
+        self._pending = None          # (path, loops) or _STOP, applied once faded out
+        self._resume = None           # Loop to return to when a one-shot ends
+        self._fade = 0.0
+        self._fade_target = 0.0
+        self._fade_rate = 0.0         # Fade change per second
+        self._duck = 1.0
+        self._duck_until = 0.0
+        self._applied = None          # Last volume written
+        self._last_step = clock()
+
+    @property
+    def track(self):
+        """Path of the track playing or fading in, or None"""
+        with self._cond:
+            if self._pending is not None:
+                return None if self._pending is _STOP else self._pending[0]
+            return self._track
+
+    def is_playing(self):
+        """Return True while a track is streaming"""
+        with self._cond:
+            return self._track is not None and bool(self.music.get_busy())
+
+    def play(self, path, loops=-1, crossfade=None):
+        """
+        Stream a track, fading out whatever is playing first
+
+        Args:
+            path: Audio file to stream
+            loops: Extra repeats; -1 loops until changed. Otherwise the loop
+                it replaces streams again once it has ended
+            crossfade: Seconds for the change (default: the player's crossfade)
+        """
+        crossfade = self.crossfade if crossfade is None else crossfade
+        with self._cond:
+            now = self._wake()
+            self._resume = None if loops < 0 else self._looping_track()
+            self._pending = (path, loops)
+            self._fade_rate = self._rate(crossfade)
+            if self._track is None or not self.music.get_busy():
+                # Nothing audible to fade out
+                self._fade = 0.0
+            self._fade_target = 0.0
+            self._kick(now)
+
+    def stop(self, fade=None):
+        """Fade out and stop the stream"""
+        fade = self.crossfade / 2.0 if fade is None else fade
+        with self._cond:
+            if self._track is None and self._pending is None:
+                return
+            now = self._wake()
+            self._pending = _STOP
+            self._resume = None
+            self._fade_target = 0.0
+            self._fade_rate = self._rate(fade * 2.0)
+            self._kick(now)
+
+    def duck_for(self, seconds):
+        """Lower the stream while an effect of the given length plays"""
+        with self._cond:
+            now = self._wake()
+            self._duck_until = max(self._duck_until, now + seconds)
+            self._kick(now)
+
+    def close(self):
+        """Stop the stream and the scheduler thread"""
+        self._worker.close()
+        self.music.stop()
+
+    def _rate(self, crossfade):
+        """Fade rate that covers half the crossfade time per direction"""
+        half = crossfade / 2.0
+        return 1.0 / half if half > 0 else float('inf')
+
+    def _looping_track(self):
+        """Loop playing, about to play or waiting out a one-shot, or None (lock must be held)"""
+        if self._pending is _STOP:
+            return None
+        if self._pending is not None:
+            path, loops = self._pending
+            return path if loops < 0 else self._resume
+        if self._track is not None and self._loops < 0:
+            return self._track
+        return self._resume
+
+    def _wake(self):
+        """Bring an idle player's step clock up to now (lock must be held)"""
+        now = self.clock()
+        if self._worker.deadline is None:
+            self._last_step = now
+        return now
+
+    def _kick(self, now):
+        """Run the next step as soon as possible (lock must be held)"""
+        self._worker.schedule(now)
+
+    def _step(self, now):
+        """
+        Advance fades, ducking and track switches (lock must be held)
+
+        Returns:
+            Tuple of (next deadline or None when nothing is changing, None)
+        """
+        elapsed = now - self._last_step
+        self._last_step = now
+
+        if (self._pending is None and self._track is not None and self._loops >= 0
+                and not self.music.get_busy()):
+            # The one-shot has ended: go back to the loop it replaced
+            self._track = None
+            if self._resume is not None:
+                self._pending = (self._resume, -1)
+                self._resume = None
+                self._fade = self._fade_target = 0.0
+                self._fade_rate = self._rate(self.crossfade)
+
+        self._fade = _approach(self._fade, self._fade_target, self._fade_rate, elapsed)
+        if self._pending is not None and self._fade <= 0.0:
+            if self._pending is _STOP:
+                self.music.stop()
+                self._track = None
+            else:
+                path, loops = self._pending
+                self.music.load(path)
+                self.music.set_volume(0.0)
+                self._applied = 0.0
+                self.music.play(loops=loops)
+                self._track = path
+                self._loops = loops
+                self._fade_target = 1.0
+            self._pending = None
+
+        duck_target = self.duck_volume if now < self._duck_until else 1.0
+        duck_rate = (1.0 - self.duck_volume) / self.duck_fade if self.duck_fade > 0 else float('inf')
+        self._duck = _approach(self._duck, duck_target, duck_rate, elapsed)
+
+        volume = self.volume * self._fade * self._duck
+        if volume != self._applied and self._track is not None:
+            self.music.set_volume(volume)
+            self._applied = volume
+
+        if self._fade != self._fade_target or self._duck != duck_target:
+            deadline = now + self.update_interval
+        elif now < self._duck_until:
+            deadline = self._duck_until
+        else:
+            deadline = None
+        if self._track is not None and self._loops >= 0:
+            # Watch for the end of the one-shot
+            deadline = now + END_POLL if deadline is None else min(deadline, now + END_POLL)
+        return deadline, None
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Hardware backends for the Buzz Lightyear Controller
+
+A backend bundles the three things the controller talks to:
+
+- gpio: an object with the RPi.GPIO API (setup, output, input, PWM,
+  add_event_detect, ...)
+- mixer: an object with the pygame.mixer API (init, Sound, Channel, ...)
+- clock: a time source with monotonic() and sleep()
+
+and pwm_root, the sysfs directory of hardware PWM chips (None: software PWM only),
+sound_cards, ALSA's list of sound cards (None: unknown), and pin_function(pin),
+what a pin is routed to, such as 'PWM0_0' (None as the attribute: cannot tell).
+
+HardwareBackend is the real thing. simulator.SimulatedBackend provides the
+same interface without hardware, with timestamped traces and an optional
+virtual clock.
+"""
+
+import time
+
+from hardware_pwm import PWM_ROOT, SOUND_CARDS, pin_function
+
+
+class SystemClock:
+    """Wall-clock time source used on real hardware"""
+
+    virtual = False
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class HardwareBackend:
+    """RPi.GPIO and pygame.mixer on a real Raspberry Pi"""
+
+    name = 'hardware'
+    pwm_root = PWM_ROOT
+    sound_cards = SOUND_CARDS
+
+    def __init__(self):
+        # Imported here so the controller module loads without it
+        import RPi.GPIO as GPIO
+
+        self.gpio = GPIO
+        self.clock = SystemClock()
+        self._mixer = None
+
+    @property
+    def mixer(self):
+        """pygame.mixer, imported on first use since importing pygame is slow"""
+        if self._mixer is None:
+            import pygame
+            self._mixer = pygame.mixer
+        return self._mixer
+
+    def pin_function(self, pin):
+        """What a pin is routed to, from pinctrl or raspi-gpio (None: unknown)"""
+        return pin_function(pin)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Press-to-effect latency benchmark for the Buzz Lightyear Controller
+
+Drives a real BuzzController (worker threads, servo engine and strobe all
+running in real time) through the simulated backend and measures how long
+it takes from a falling edge on a button pin until:
+
+- laser: the laser LED pin changes
+- wing: the servo duty cycle changes
+- any button: Sound.play is called
+
+Scenarios:
+- idle: presses spaced well apart
+- strobe: the same presses while the wing strobe is flashing
+- mashing: laser and phrase buttons hammered as fast as debounce allows
+
+Results (p50/p95/p99/max in ms per action and effect) are written to JSON.
+With --baseline, the run fails if a p95 or p99 regresses beyond the
+configured tolerance.
+
+Run with:
+    python3 bench_latency.py --save-baseline bench_baseline.json
+    python3 bench_latency.py --baseline bench_baseline.json
+"""
+
+import argparse
+import bisect
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+
+from backends import SystemClock
+from buzz_controller import BuzzController
+from event_dispatcher import percentile
+from simulator import DEFAULT_CLIPS, SimulatedBackend, write_silent_clips
+
+# Controller settings used for every scenario
+BENCH_CONFIG = {
+    'debounce_time': 20,
+    'strobe_frequency': 50,
+}
+
+# Metrics compared against a baseline
+COMPARED_STATS = ('p95_ms', 'p99_ms')
+
+
+def latency_stats(samples, lost=0):
+    """Summarize latency samples in seconds as milliseconds"""
+    return {
+        'count': len(samples),
+        'lost': lost,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000 if samples else 0.0,
+    }
+
+
+class LatencyBench:
+    """Runs one scenario against a fresh controller"""
+
+    def __init__(self, audio_path, controller_class=BuzzController):
+        self.backend = SimulatedBackend(clock=SystemClock())
+        config = dict(BENCH_CONFIG, audio_path=audio_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.controller = controller_class(config, backend=self.backend)
+        # Let the homing move finish before measuring
+        self.controller.servo_motion.wait_idle(2.0)
+
+        config = self.controller.config
+        self.buttons = {
+            'wing': config['wing_button_pin'],
+            'laser': config['laser_button_pin'],
+            'phrase': config['phrase_button_pin'],
+        }
+        # (action, effect) -> (trace kinds, trace target or None for any).
+        # A sound counts when Sound.play is called, even if no channel was free.
+        sound = ('sound', 'sound_drop')
+        self.effects = {
+            ('laser', 'led'): (('output',), config['laser_led_pin']),
+            ('wing', 'servo'): (('pwm_duty',), config['servo_pin']),
+            ('laser', 'sound'): (sound, None),
+            ('wing', 'sound'): (sound, None),
+            ('phrase', 'sound'): (sound, None),
+        }
+
+    def press(self, action, hold=0.005):
+        self.backend.press(self.buttons[action], hold=hold)
+
+    def settle(self):
+        """Wait until queued actions have run"""
+        self.controller.dispatcher.wait_idle(2.0)
+        time.sleep(0.02)
+
+    def close(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.controller.cleanup()
+
+    def measure(self):
+        """Match every press to the first following effect of its action"""
+        trace = list(self.backend.trace)
+        presses = {}
+        for action, pin in self.buttons.items():
+            presses[action] = [e.time for e in trace
+                               if e.kind == 'edge' and e.target == pin and e.value == 0]
+        all_presses = sorted(t for times in presses.values() for t in times)
+
+        results = {}
+        for (action, effect), (kinds, target) in self.effects.items():
+            effect_times = [e.time for e in trace
+                            if e.kind in kinds and (target is None or e.target == target)]
+            samples = []
+            lost = 0
+            for pressed in presses[action]:
+                # Effects that share a kind (sound) belong to the next press at the latest
+                later = bisect.bisect_right(all_presses, pressed)
+                limit = all_presses[later] if later < len(all_presses) else float('inf')
+                index = bisect.bisect_left(effect_times, pressed)
+                if index < len(effect_times) and effect_times[index] < limit:
+                    samples.append(effect_times[index] - pressed)
+                else:
+                    lost += 1
+            if presses[action]:
+                results[f'{action}.{effect}'] = latency_stats(samples, lost)
+        return results
+
+
+def scenario_idle(bench, presses):
+    """Presses spaced well apart on a quiet controller"""
+    for i in range(presses):
+        bench.press(('laser', 'phrase', 'wing')[i % 3])
+        bench.settle()
+        time.sleep(0.05)
+
+
+def scenario_strobe(bench, presses):
+    """Laser and phrase presses while the strobe flashes"""
+    bench.controller._wing_button_callback(None)
+    time.sleep(0.2)
+    for i in range(presses):
+        bench.press(('laser', 'phrase')[i % 2])
+        bench.settle()
+        time.sleep(0.05)
+
+
+def scenario_mashing(bench, presses):
+    """Laser and phrase hammered just slower than the debounce time"""
+    interval = BENCH_CONFIG['debounce_time'] / 1000.0 / 2 + 0.002
+    for i in range(presses):
+        bench.press(('laser', 'phrase')[i % 2], hold=0.002)
+        time.sleep(interval)
+    bench.settle()
+
+
+SCENARIOS = {
+    'idle': scenario_idle,
+    'strobe': scenario_strobe,
+    'mashing': scenario_mashing,
+}
+
+
+def run_benchmark(presses=60, scenarios=None, controller_class=BuzzController):
+    """
+    Run the latency scenarios
+
+    Args:
+        presses: Button presses per scenario
+        scenarios: Scenario names to run (default: all)
+        controller_class: Controller class to benchmark
+
+    Returns:
+        Dictionary with metadata and per-scenario latency statistics
+    """
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'presses': presses,
+            'timestamp': time.time(),
+        },
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory() as audio_path:
+        write_silent_clips(audio_path, DEFAULT_CLIPS)
+        for name in scenarios or SCENARIOS:
+            bench = LatencyBench(audio_path, controller_class)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    SCENARIOS[name](bench, presses)
+                results['scenarios'][name] = bench.measure()
+                results['scenarios'][name]['dispatcher'] = bench.controller.dispatcher.stats()
+            finally:
+                bench.close()
+    return results
+
+
+def compare(results, baseline, tolerance=0.5, slack_ms=2.0):
+    """
+    Compare results with a baseline
+
+    A metric regresses when it exceeds baseline * (1 + tolerance) + slack_ms.
+
+    Returns:
+        List of regression messages (empty if none)
+    """
+    regressions = []
+    for scenario, metrics in baseline.get('scenarios', {}).items():
+        for metric, stats in metrics.items():
+            current = results['scenarios'].get(scenario, {}).get(metric)
+            if current is None or 'p50_ms' not in stats:
+                continue
+            for stat in COMPARED_STATS:
+                limit = stats[stat] * (1 + tolerance) + slack_ms
+                if current[stat] > limit:
+                    regressions.append(
+                        f"{scenario} {metric} {stat}: {current[stat]:.2f} ms "
+                        f"> {limit:.2f} ms (baseline {stats[stat]:.2f} ms)"
+                    )
+    return regressions
+
+
+def print_results(results):
+    """Print a latency table"""
+    for scenario, metrics in results['scenarios'].items():
+        print(f"\n{scenario}")
+        for metric, stats in metrics.items():
+            if 'p50_ms' not in stats:
+                continue
+            print(f"  {metric:14s} n={stats['count']:<4d} lost={stats['lost']:<3d} "
+                  f"p50={stats['p50_ms']:6.2f}  p95={stats['p95_ms']:6.2f}  "
+                  f"p99={stats['p99_ms']:6.2f}  max={stats['max_ms']:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Press-to-effect latency benchmark")
+    parser.add_argument('--presses', type=int, default=60, help="Presses per scenario")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument('--output', default='bench_results.json', help="Results JSON file")
+    parser.add_argument('--baseline', help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', help="Write results as a new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative regression (0.5 = 50%%)")
+    parser.add_argument('--slack-ms', type=float, default=2.0,
+                        help="Allowed absolute regression in ms")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.presses, args.scenario)
+    print_results(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.slack_ms)
+        if regressions:
+            print("\n✗ Latency regressions:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("✓ No latency regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
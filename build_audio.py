@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Offline audio compiler for the Buzz Lightyear Controller
+
+Converts every WAV clip in the audio directory and its folders, such as
+the phrase tree, to the exact format the controller opens the mixer
+with, so pygame never has to convert a clip at load time:
+
+- resample to mixer_frequency and mix down (or up) to mixer_channels
+- convert to the mixer sample size (16- or 8-bit)
+- trim leading silence, which would otherwise be heard as latency
+- normalize loudness to a common RMS level with a peak ceiling
+
+Compiled clips go to <audio_path>/compiled, in the same folders as their
+sources, together with manifest.json,
+which records each clip's duration, decoded size and decode time. Clips
+are keyed by a hash of their contents and the build settings, so
+unchanged clips are skipped on the next run. The controller loads the
+compiled directory whenever a manifest matching its mixer format is
+present. With --pack, the compiled clips are also packed into one
+memory-mapped sounds.pak (see soundpack.py), which the controller
+prefers over the individual files. Clips are named by their path under
+the audio directory, e.g. phrases/greetings/hello_cadet.wav, in the
+manifest and the pack alike.
+
+Run with:
+    python3 build_audio.py
+    python3 build_audio.py --audio-path audio --target-dbfs -18
+    python3 build_audio.py --pack
+"""
+
+import argparse
+import array
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import time
+import wave
+
+from soundpack import PACK_NAME, write_pack
+
+COMPILED_DIR = 'compiled'
+MANIFEST_NAME = 'manifest.json'
+
+# Bumped whenever the processing changes, so old cache entries are rebuilt
+BUILD_VERSION = 1
+
+# Default processing settings
+DEFAULT_TARGET_DBFS = -18.0      # RMS loudness after normalization
+DEFAULT_PEAK_DBFS = -1.0         # Highest peak allowed after normalization
+DEFAULT_SILENCE_DBFS = -50.0     # Leading samples below this are trimmed
+
+
+def compiled_audio_path(audio_path):
+    """Return the directory compiled clips are written to"""
+    return os.path.join(audio_path, COMPILED_DIR)
+
+
+def load_manifest(path):
+    """
+    Load a manifest.json
+
+    Args:
+        path: Compiled audio directory
+
+    Returns:
+        Manifest dictionary, or None if missing or unreadable
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_matches(manifest, frequency, size, channels):
+    """Return True if a manifest was built for the given mixer format"""
+    if not manifest:
+        return False
+    fmt = manifest.get('format', {})
+    return (fmt.get('frequency') == frequency and fmt.get('size') == size
+            and fmt.get('channels') == channels)
+
+
+def _dbfs_to_linear(dbfs):
+    return 10 ** (dbfs / 20.0)
+
+
+def read_wav(path):
+    """
+    Read a WAV file into per-channel float samples in [-1, 1]
+
+    Returns:
+        (list of channel sample lists, sample rate)
+    """
+    with wave.open(path, 'rb') as clip:
+        channels = clip.getnchannels()
+        width = clip.getsampwidth()
+        rate = clip.getframerate()
+        data = clip.readframes(clip.getnframes())
+
+    if width == 1:
+        samples = [(b - 128) / 128.0 for b in data]
+    elif width in (2, 4):
+        pcm = array.array('h' if width == 2 else 'i')
+        pcm.frombytes(data[:len(data) - len(data) % width])
+        if sys.byteorder == 'big':
+            pcm.byteswap()
+        scale = float(1 << (8 * width - 1))
+        samples = [s / scale for s in pcm]
+    elif width == 3:
+        samples = [int.from_bytes(data[i:i + 3], 'little', signed=True) / 8388608.0
+                   for i in range(0, len(data) - 2, 3)]
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+
+    return [samples[c::channels] for c in range(channels)], rate
+
+
+def write_wav(path, channels, rate, size):
+    """Write per-channel float samples as a WAV file with the given sample size"""
+    width = abs(size) // 8
+    frames = len(channels[0]) if channels else 0
+    interleaved = [channels[c][i] for i in range(frames) for c in range(len(channels))]
+    if width == 2:
+        pcm = array.array('h', (max(-32768, min(32767, round(s * 32767))) for s in interleaved))
+        if sys.byteorder == 'big':
+            pcm.byteswap()
+        data = pcm.tobytes()
+    elif width == 1:
+        data = bytes(max(0, min(255, round(s * 127) + 128)) for s in interleaved)
+    else:
+        raise ValueError(f"Unsupported mixer sample size: {size}")
+
+    with wave.open(path, 'wb') as clip:
+        clip.setnchannels(len(channels))
+        clip.setsampwidth(width)
+        clip.setframerate(rate)
+        clip.writeframes(data)
+
+
+def remix(channels, count):
+    """Mix down to mono, or spread mono over count channels"""
+    if len(channels) == count:
+        return channels
+    frames = len(channels[0])
+    mono = [sum(ch[i] for ch in channels) / len(channels) for i in range(frames)]
+    return [mono] * count if count > 1 else [mono]
+
+
+def resample(samples, rate, target_rate):
+    """Linear-interpolation resample of one channel"""
+    if rate == target_rate or not samples:
+        return samples
+    count = max(1, int(len(samples) * target_rate / rate))
+    step = rate / float(target_rate)
+    last = len(samples) - 1
+    out = []
+    for i in range(count):
+        position = i * step
+        index = int(position)
+        if index >= last:
+            out.append(samples[last])
+            continue
+        fraction = position - index
+        out.append(samples[index] + (samples[index + 1] - samples[index]) * fraction)
+    return out
+
+
+def trim_leading_silence(channels, threshold):
+    """Drop leading frames where every channel is below threshold"""
+    frames = len(channels[0]) if channels else 0
+    start = frames
+    for i in range(frames):
+        if any(abs(ch[i]) >= threshold for ch in channels):
+            start = i
+            break
+    return [ch[start:] for ch in channels], start
+
+
+def normalize(channels, target_rms, peak_limit):
+    """Scale to the target RMS level without letting the peak exceed peak_limit"""
+    total = sum(s * s for ch in channels for s in ch)
+    count = sum(len(ch) for ch in channels)
+    peak = max((abs(s) for ch in channels for s in ch), default=0.0)
+    if not count or peak == 0.0:
+        return channels, 1.0
+    rms = math.sqrt(total / count)
+    gain = min(target_rms / rms, peak_limit / peak)
+    return [[s * gain for s in ch] for ch in channels], gain
+
+
+def clip_hash(path, settings):
+    """Cache key for a source clip built with the given settings"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _measure_clip(path):
+    """Duration, decoded PCM size and time to decode a compiled clip"""
+    began = time.perf_counter()
+    with wave.open(path, 'rb') as clip:
+        data = clip.readframes(clip.getnframes())
+        duration = clip.getnframes() / float(clip.getframerate())
+    return duration, len(data), (time.perf_counter() - began) * 1000
+
+
+class AudioCompiler:
+    """Converts the clips in an audio directory to the mixer format"""
+
+    def __init__(self, audio_path, frequency, size, channels, output_path=None,
+                 target_dbfs=DEFAULT_TARGET_DBFS, peak_dbfs=DEFAULT_PEAK_DBFS,
+                 silence_dbfs=DEFAULT_SILENCE_DBFS):
+        """
+        Initialize the compiler
+
+        Args:
+            audio_path: Directory with the source clips
+            frequency: Mixer sample rate in Hz
+            size: Mixer sample size as passed to mixer.init (-16, 16, 8)
+            channels: Mixer channel count (1 mono, 2 stereo)
+            output_path: Compiled clip directory (default: <audio_path>/compiled)
+            target_dbfs: RMS loudness after normalization
+            peak_dbfs: Peak ceiling after normalization
+            silence_dbfs: Level below which leading samples are trimmed
+        """
+        self.audio_path = audio_path
+        self.output_path = output_path or compiled_audio_path(audio_path)
+        self.settings = {
+            'version': BUILD_VERSION,
+            'frequency': frequency,
+            'size': size,
+            'channels': channels,
+            'target_dbfs': target_dbfs,
+            'peak_dbfs': peak_dbfs,
+            'silence_dbfs': silence_dbfs,
+        }
+        # name -> manifest entry plus 'cached', filled in by build()
+        self.results = {}
+
+    def build(self, force=False, pack=False):
+        """
+        Compile every clip, skipping clips whose cache entry is current
+
+        Args:
+            force: Rebuild every clip even if unchanged
+            pack: Also write the compiled clips to a sound pack; without it
+                any existing pack is removed so it cannot go stale
+
+        Returns:
+            The manifest that was written
+        """
+        os.makedirs(self.output_path, exist_ok=True)
+        previous = {} if force else (load_manifest(self.output_path) or {}).get('clips', {})
+
+        clips = {}
+        for name, source in self._sources():
+            key = clip_hash(source, self.settings)
+            cached = previous.get(name)
+            output = os.path.join(self.output_path, name)
+            if cached and cached.get('hash') == key and os.path.exists(output):
+                clips[name] = dict(cached, cached=True)
+                continue
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            clips[name] = self._compile(name, source, output, key)
+
+        # Remove compiled clips whose source is gone
+        for name in previous:
+            if name not in clips:
+                stale = os.path.join(self.output_path, name)
+                if os.path.exists(stale):
+                    os.unlink(stale)
+
+        pack_path = os.path.join(self.output_path, PACK_NAME)
+        if pack:
+            self._write_pack(pack_path, clips)
+        elif os.path.exists(pack_path):
+            os.unlink(pack_path)
+
+        manifest = {
+            'format': {k: self.settings[k] for k in ('frequency', 'size', 'channels')},
+            'settings': self.settings,
+            'pack': PACK_NAME if pack else None,
+            'clips': {name: {k: v for k, v in clip.items() if k != 'cached'}
+                      for name, clip in clips.items()},
+        }
+        tmp_path = os.path.join(self.output_path, MANIFEST_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.output_path, MANIFEST_NAME))
+
+        self.results = clips
+        return manifest
+
+    def _sources(self):
+        """
+        Find the source clips in the audio directory and its folders
+
+        Returns:
+            Sorted list of (name, path), name being the path under the
+            audio directory with '/' separators
+        """
+        output_path = os.path.abspath(self.output_path)
+        sources = []
+        for folder, dirs, files in os.walk(self.audio_path):
+            # Never compile the compiled clips again
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(folder, d)) != output_path]
+            for file_name in files:
+                if file_name.lower().endswith(('.wav', '.ogg')):
+                    path = os.path.join(folder, file_name)
+                    name = os.path.relpath(path, self.audio_path).replace(os.sep, '/')
+                    sources.append((name, path))
+        return sorted(sources)
+
+    def _write_pack(self, path, clips):
+        """Pack the PCM of every converted clip into one file"""
+        def pcm():
+            for name, clip in clips.items():
+                if not clip['converted']:
+                    continue
+                with wave.open(os.path.join(self.output_path, name), 'rb') as compiled:
+                    yield name, compiled.readframes(compiled.getnframes())
+
+        write_pack(path, pcm(), self.settings['frequency'], self.settings['size'],
+                   self.settings['channels'])
+
+    def _compile(self, name, source, output, key):
+        """Convert one clip and describe it for the manifest"""
+        settings = self.settings
+        entry = {'hash': key, 'source_bytes': os.path.getsize(source), 'cached': False}
+
+        if not name.lower().endswith('.wav'):
+            # No decoder for compressed formats without pygame; ship as-is
+            shutil.copyfile(source, output)
+            entry.update(converted=False, duration=None, decoded_bytes=None, decode_ms=None)
+            return entry
+
+        channels, rate = read_wav(source)
+        channels = remix(channels, settings['channels'])
+        channels = [resample(ch, rate, settings['frequency']) for ch in channels]
+        channels, trimmed = trim_leading_silence(
+            channels, _dbfs_to_linear(settings['silence_dbfs']))
+        channels, gain = normalize(
+            channels, _dbfs_to_linear(settings['target_dbfs']),
+            _dbfs_to_linear(settings['peak_dbfs']))
+
+        tmp_path = output + '.tmp'
+        write_wav(tmp_path, channels, settings['frequency'], settings['size'])
+        os.replace(tmp_path, output)
+
+        duration, decoded_bytes, decode_ms = _measure_clip(output)
+        entry.update(
+            converted=True,
+            source_rate=rate,
+            trimmed_ms=trimmed * 1000.0 / settings['frequency'],
+            gain_db=20 * math.log10(gain) if gain > 0 else 0.0,
+            duration=duration,
+            decoded_bytes=decoded_bytes,
+            decode_ms=decode_ms,
+        )
+        return entry
+
+
+def main():
+    from buzz_controller import DEFAULT_CONFIG
+
+    parser = argparse.ArgumentParser(description="Compile audio clips to the mixer format")
+    parser.add_argument('--audio-path', default=DEFAULT_CONFIG['audio_path'],
+                        help="Directory with the source clips")
+    parser.add_argument('--output', help="Compiled clip directory (default: <audio-path>/compiled)")
+    parser.add_argument('--frequency', type=int, default=DEFAULT_CONFIG['mixer_frequency'])
+    parser.add_argument('--size', type=int, default=DEFAULT_CONFIG['mixer_size'])
+    parser.add_argument('--channels', type=int, default=DEFAULT_CONFIG['mixer_channels'])
+    parser.add_argument('--target-dbfs', type=float, default=DEFAULT_TARGET_DBFS,
+                        help="RMS loudness after normalization")
+    parser.add_argument('--peak-dbfs', type=float, default=DEFAULT_PEAK_DBFS,
+                        help="Peak ceiling after normalization")
+    parser.add_argument('--silence-dbfs', type=float, default=DEFAULT_SILENCE_DBFS,
+                        help="Leading samples below this level are trimmed")
+    parser.add_argument('--force', action='store_true', help="Rebuild unchanged clips too")
+    parser.add_argument('--pack', action='store_true',
+                        help="Also write a memory-mapped sound pack (sounds.pak)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.audio_path):
+        print(f"✗ Audio directory '{args.audio_path}' not found")
+        sys.exit(1)
+
+    compiler = AudioCompiler(
+        args.audio_path, args.frequency, args.size, args.channels, args.output,
+        args.target_dbfs, args.peak_dbfs, args.silence_dbfs
+    )
+    manifest = compiler.build(force=args.force, pack=args.pack)
+
+    for name, clip in compiler.results.items():
+        if clip['cached']:
+            print(f"  {name:24s} unchanged")
+        elif not clip['converted']:
+            print(f"⚠️  {name:24s} copied without conversion (WAV only)")
+        else:
+            print(f"✓ {name:24s} {clip['duration']:5.2f} s  {clip['decoded_bytes'] / 1024:7.0f} KiB  "
+                  f"trimmed {clip['trimmed_ms']:5.1f} ms  gain {clip['gain_db']:+5.1f} dB")
+    fmt = manifest['format']
+    print(f"\n{len(manifest['clips'])} clip(s) compiled to {compiler.output_path} "
+          f"({fmt['frequency']} Hz, {abs(fmt['size'])}-bit, {fmt['channels']} channel(s))")
+    if manifest['pack']:
+        print(f"Sound pack written to {os.path.join(compiler.output_path, manifest['pack'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,12 +8,173 @@ Main controller for Raspberry Pi-based Buzz Lightyear costume with:
 - Audio playback for phrases and effects
 """
 
-import RPi.GPIO as GPIO
-import time
-import pygame
+import json
 import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from enum import Enum
-from threading import Thread, Event
+from functools import partial
+
+from audio_stream import StreamPlayer
+from backends import HardwareBackend
+from build_audio import compiled_audio_path, load_manifest, manifest_matches
+from channel_pool import STEAL_POLICIES, ChannelManager
+from config_reload import ConfigWatcher, config_class, load_config_file
+from control_server import ControlServer
+from costume_sync import SYNC_ROLES, CostumeSync, MulticastTransport
+from event_dispatcher import BACKPRESSURE_POLICIES, EventDispatcher
+from hardware_pwm import SERVO_PWM_MODES, analog_audio_card, is_pwm_function, open_sysfs_pwm
+from idle_monitor import IdleMonitor
+from input_gestures import GestureRecognizer, compile_bindings, gesture_names
+from led_patterns import LedEngine, strobe_frames
+from metrics import MetricsRegistry, NULL_METRICS
+from phrase_library import PHRASE_INDEX, PHRASE_MODES, PhraseLibrary, check_weights
+from reconciler import Reconciler
+from recorder import (CALLBACK_END, CALLBACK_START, CUE, ERROR, NULL_RECORDER, PRESS, SHOW, SOUND,
+                      EventRecorder, RecordingGPIO, RecordingPWM)
+from servo_motion import EASING_CURVES, ServoMotionEngine
+from sound_bank import SoundBank
+from soundpack import PACK_NAME, SoundPack
+from strobe import STROBE_BACKENDS
+from timeline import ShowRunner, load_shows
+
+# Default configuration; user configs only need to override what differs
+DEFAULT_CONFIG = {
+    'servo_pin': 18,          # GPIO pin for servo control
+    'strobe_led_pin': 23,     # GPIO pin for strobing LEDs
+    'laser_led_pin': 24,      # GPIO pin for laser LED
+    'wing_button_pin': 17,    # GPIO pin for wing toggle button
+    'laser_button_pin': 27,   # GPIO pin for laser button
+    'phrase_button_pin': 22,  # GPIO pin for phrase button
+    'servo_horizontal': 5.0,  # PWM duty cycle for horizontal (0 degrees)
+    'servo_vertical': 10.0,   # PWM duty cycle for vertical (90 degrees)
+    'servo_move_time': 0.5,   # Seconds for a full wing move
+    'servo_easing': 'ease_in_out',  # Easing curve for wing moves
+    'servo_update_hz': 50,    # Duty cycle updates per second while moving
+    'servo_pwm': 'auto',      # 'auto' (hardware PWM if the pin is routed to it and analog audio is off), 'hardware' or 'software' (GPIO.PWM)
+    'servo_pwm_chip': 0,      # Hardware PWM chip, /sys/class/pwm/pwmchipN
+    'servo_pwm_channel': None,  # Channel on the chip (None: from servo_pin, GPIO 18 is 0)
+    'strobe_frequency': 10,   # Strobe flashes per second
+    'strobe_backend': 'pattern',  # 'pattern' (LED engine), 'deadline' (own thread) or 'pwm' (GPIO.PWM)
+    'led_frame_rate': 200,    # LED pattern frames per second
+    'audio_path': 'audio',    # Path to audio files
+    'mixer_frequency': 22050, # Mixer sample rate; build_audio.py converts clips to it
+    'mixer_size': -16,        # Mixer sample size (negative: signed)
+    'mixer_channels': 1,      # 1 mono, 2 stereo
+    'mixer_buffer': 512,      # Mixer buffer in samples (smaller: lower latency)
+    'sound_pack': None,       # Packed sound bank file (None: compiled/sounds.pak if built)
+    'debounce_time': 20,      # Software debounce lockout after each accepted edge, in ms
+    'gestures': {},           # Gesture key -> action or 'show:<name>', e.g. {'laser:long_press': 'wing'}
+    'long_press_time': 0.8,   # Seconds held for a long press
+    'double_tap_time': 0.3,   # Most seconds between the taps of a double tap
+    'chord_window': 0.08,     # Most seconds between the presses of a chord
+    'reconcile_hold': 0.1,    # Seconds a laser/strobe change holds before the next is applied
+    'idle_timeout': None,     # Seconds without presses before releasing servo PWM and audio
+    'dispatcher_workers': 2,  # Worker threads running button actions
+    'dispatcher_queue_size': 16,  # Maximum queued button presses
+    'backpressure_policy': 'coalesce',  # coalesce, drop_newest or drop_oldest
+    'sound_cache_mb': 32,     # Memory budget for decoded sounds in MB
+    'metrics_enabled': False, # Collect hot-path counters and histograms
+    'metrics_file': None,     # Prometheus text file to write, if any
+    'metrics_socket': None,   # UNIX socket serving Prometheus text, if any
+    'metrics_interval': 10,   # Seconds between metrics file writes
+    'fast_start': False,      # Bring buttons up before audio is ready
+    'early_sound_policy': 'queue',  # 'queue' or 'skip' sounds before audio is ready
+    'early_sound_max_age': 2.0,     # Seconds a queued early sound stays worth playing
+    'sound_channels': 8,      # Mixer channels shared by all sounds
+    'sound_steal_policy': 'lowest_priority',  # oldest, quietest or lowest_priority
+    'sound_categories': None, # Category priorities/reservations (None: channel_pool defaults)
+    'stream_threshold_kb': 1024,  # Clips larger than this stream from disk instead of preloading
+    'background_loop': None,  # Clip looped in the background (streamed)
+    'wing_loop': None,        # Clip looped while the wings are open (streamed)
+    'stream_volume': 0.6,     # Volume of the streamed track
+    'stream_crossfade': 1.0,  # Seconds to fade between streamed tracks
+    'stream_duck_volume': 0.3,  # Stream volume fraction kept while effects play
+    'show_path': 'shows',     # Directory of show timeline files
+    'button_shows': {},       # Button action ('wing', 'laser', 'phrase') -> show name
+    'show_realtime_priority': None,  # SCHED_FIFO priority for the show thread (needs root)
+    'config_watch': True,     # Reload the config file when it is saved (SIGHUP always reloads)
+    'control_socket': None,   # UNIX socket for companion apps, if any
+    'control_port': None,     # TCP/WebSocket port for companion apps, if any
+    'control_host': '127.0.0.1',  # Address the control port listens on ('0.0.0.0' needs control_token)
+    'control_token': None,    # Shared secret control clients must send first, if any
+    'sync_role': None,        # 'leader' or 'follower' to act in step with other costumes
+    'sync_name': None,        # Name of this costume in the group (None: host name and a random suffix)
+    'sync_group': '239.255.42.99',  # Multicast group shared by the costumes
+    'sync_port': 5099,        # UDP port of the multicast group
+    'sync_lead': 0.25,        # Seconds from a leader press to every costume acting on it
+    'sync_interval': 2.0,     # Seconds between clock exchanges with the leader
+    'recorder_events': 65536, # Events kept in the binary event recorder (0: off)
+    'recorder_path': 'recordings',  # Directory recordings are dumped to
+    'random_seed': None,      # Seed for phrase picks (None: a new one each start)
+    'phrase_path': 'phrases', # Phrase tree under audio_path, one folder per category
+    'phrase_mode': 'shuffle', # 'shuffle', 'weighted' or 'sequential'
+    'phrase_tags': None,      # Only phrases in these folders, e.g. ['greetings'] (None: all)
+    'phrase_weights': {},     # Folder -> weight for 'weighted', e.g. {'catchphrases': 3}
+    'phrase_cache_mb': 8,     # Most decoded phrase audio kept in memory
+}
+
+# What to do with sounds requested before audio is ready in fast-start mode
+EARLY_SOUND_POLICIES = ('queue', 'skip')
+
+# Settings limited to a fixed set of values
+CONFIG_CHOICES = {
+    'servo_easing': tuple(EASING_CURVES),
+    'servo_pwm': SERVO_PWM_MODES,
+    'strobe_backend': tuple(STROBE_BACKENDS),
+    'backpressure_policy': BACKPRESSURE_POLICIES,
+    'early_sound_policy': EARLY_SOUND_POLICIES,
+    'sound_steal_policy': STEAL_POLICIES,
+    'sync_role': (None,) + SYNC_ROLES,
+    'phrase_mode': PHRASE_MODES,
+}
+
+
+def _check_strobe(config):
+    """Raise ValueError if the strobe cannot run at its frequency"""
+    if config.led_frame_rate <= 0:
+        raise ValueError(f"Config led_frame_rate must be above 0, got {config.led_frame_rate!r}")
+    if config.strobe_backend == 'pattern':
+        strobe_frames(config.strobe_frequency, config.led_frame_rate)
+    elif config.strobe_frequency <= 0:
+        raise ValueError(f"Config strobe_frequency must be above 0, got {config.strobe_frequency!r}")
+
+
+def _check_phrase_weights(config):
+    """Raise ValueError on a negative or non-numeric phrase weight"""
+    check_weights(config.phrase_weights)
+
+
+# DEFAULT_CONFIG compiled into a frozen object with one slot per setting
+Config = config_class(DEFAULT_CONFIG, CONFIG_CHOICES, checks=(_check_strobe, _check_phrase_weights))
+
+# Settings reload_config() keeps at their running values until a restart
+RESTART_SETTINGS = frozenset({
+    'servo_pin', 'servo_pwm', 'servo_pwm_chip', 'servo_pwm_channel',
+    'strobe_backend', 'led_frame_rate',
+    'mixer_frequency', 'mixer_size', 'mixer_channels', 'mixer_buffer',
+    'sound_channels', 'sound_steal_policy', 'sound_categories',
+    'stream_volume', 'stream_crossfade', 'stream_duck_volume',
+    'dispatcher_workers', 'dispatcher_queue_size', 'backpressure_policy',
+    'metrics_enabled', 'metrics_file', 'metrics_socket', 'metrics_interval',
+    'fast_start', 'show_realtime_priority', 'config_watch',
+    'control_socket', 'control_port', 'control_host', 'control_token',
+    'sync_role', 'sync_name', 'sync_group', 'sync_port', 'sync_interval',
+    'recorder_events', 'random_seed',
+})
+
+# Settings that rebuild the phrase library when reloaded
+PHRASE_SETTINGS = frozenset({
+    'audio_path', 'phrase_path', 'phrase_mode', 'phrase_tags', 'phrase_weights', 'phrase_cache_mb',
+})
+
+# Config file main() loads when present
+CONFIG_FILE = 'config.py'
 
 class WingPosition(Enum):
     """Wing position states"""
@@ -23,208 +184,1446 @@ class WingPosition(Enum):
 class BuzzController:
     """Main controller for Buzz Lightyear costume"""
     
-    def __init__(self, config=None):
+    # Dispatch priority per button action (lower runs first)
+    ACTION_PRIORITIES = {
+        'laser': 0,
+        'wing': 1,
+        'phrase': 2,
+    }
+    
+    # Sounds held back while audio starts in fast-start mode
+    EARLY_SOUND_QUEUE = 4
+    
+    # Compiled settings; subclasses with extra settings can build their own
+    CONFIG_CLASS = Config
+    
+    def __init__(self, config=None, backend=None):
         """
         Initialize the Buzz Lightyear controller
         
         Args:
             config: Dictionary with pin configurations and settings
+            backend: GPIO/mixer/clock backend (default: HardwareBackend)
+        
+        Raises:
+            ValueError: On an unknown setting or an invalid value
         """
-        # Default configuration
-        self.config = config or {
-            'servo_pin': 18,          # GPIO pin for servo control
-            'strobe_led_pin': 23,     # GPIO pin for strobing LEDs
-            'laser_led_pin': 24,      # GPIO pin for laser LED
-            'wing_button_pin': 17,    # GPIO pin for wing toggle button
-            'laser_button_pin': 27,   # GPIO pin for laser button
-            'phrase_button_pin': 22,  # GPIO pin for phrase button
-            'servo_horizontal': 5.0,  # PWM duty cycle for horizontal (0 degrees)
-            'servo_vertical': 10.0,   # PWM duty cycle for vertical (90 degrees)
-            'strobe_frequency': 10,   # Strobe flashes per second
-            'audio_path': 'audio',    # Path to audio files
-            'debounce_time': 200      # Button debounce time in ms
-        }
+        # Missing settings take the defaults; hot paths read attributes
+        self.config = self.CONFIG_CLASS(config)
+        self.config_path = None
+        self._config_watcher = None
+        self._reload_lock = threading.Lock()
+        
+        # Phase name -> seconds, filled in as startup progresses
+        self.startup_timings = {}
+        self._startup_began = time.perf_counter()
+        
+        # Hardware access goes through the backend; the mixer is fetched
+        # with the audio phase since importing pygame is slow
+        self.backend = backend or HardwareBackend()
+        self.gpio = self.backend.gpio
+        self.mixer = None
+        self.clock = self.backend.clock
+        self.scheduler = self._create_scheduler()
+        
+        # Edges, callbacks, pin writes, PWM changes and sounds go to a fixed ring buffer
+        if self.config.recorder_events:
+            self.recorder = EventRecorder(self.config.recorder_events, clock=self.clock.monotonic)
+            self.gpio = RecordingGPIO(self.gpio, self.recorder)
+        else:
+            self.recorder = NULL_RECORDER
+        # Random picks come from a seeded generator so a recording replays the same picks
+        self.random_seed = self.config.random_seed
+        if self.random_seed is None:
+            self.random_seed = random.getrandbits(32)
+        self._random = random.Random(self.random_seed)
+        
+        # Metrics cost next to nothing when disabled
+        self.metrics = MetricsRegistry() if self.config.metrics_enabled else NULL_METRICS
+        self._create_hot_path_metrics()
         
         # Initialize state
         self.wing_position = WingPosition.VERTICAL
         self.laser_on = False
         self.strobe_running = False
         self.running = True
+        self._shutdown_requested = threading.Event()
+        # Called with (key, value) when the applied state changes
+        self._state_listeners = []
+        
+        # Audio state; sounds requested before audio_ready follow the early sound policy
+        self.audio_ready = threading.Event()
+        self._audio_lock = threading.Lock()
+        self._early_sounds = deque(maxlen=self.EARLY_SOUND_QUEUE)
+        self._audio_thread = None
+        self.channels = None
+        self.stream = None
+        
+        # Resources released while idle
+        self._servo_released = False
+        self._audio_released = False
+        
+        # The bank is filled once the mixer is up
+        self.sound_pack = self._open_sound_pack()
+        self.sound_bank = SoundBank(
+            self._select_audio_path(),
+            None,
+            budget_bytes=int(self.config.sound_cache_mb * 1024 * 1024),
+            metrics=self.metrics,
+            pack=self.sound_pack,
+            stream_threshold=self.config.stream_threshold_kb * 1024
+        )
+        self.phrases = self._create_phrase_library()
+        
+        with self._startup_phase('gpio'):
+            self.gpio.setmode(self.gpio.BCM)
+            self.gpio.setwarnings(False)
+            
+            # Setup servo
+            self.servo_pwm = self._create_servo_pwm()
+            self.servo_pwm.start(0)
+            self.servo_motion = self._create_servo_motion()
+            
+            # Setup LEDs
+            self.gpio.setup(self.config.strobe_led_pin, self.gpio.OUT)
+            self.gpio.setup(self.config.laser_led_pin, self.gpio.OUT)
+            self.gpio.output(self.config.strobe_led_pin, self.gpio.LOW)
+            self.gpio.output(self.config.laser_led_pin, self.gpio.LOW)
+            
+            # All LED effects share one pattern engine
+            self.leds = self._create_led_engine()
+            
+            # Setup strobe backend
+            self.strobe = self._create_strobe()
+            
+            # Shows drive the same outputs from one timing thread
+            self.shows = self._create_show_runner()
+            
+            # Button actions set targets; the reconciler drives the hardware
+            self.reconciler = self._create_reconciler()
+            
+            # Setup buttons with pull-up resistors
+            self.gpio.setup(self.config.wing_button_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+            self.gpio.setup(self.config.laser_button_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+            self.gpio.setup(self.config.phrase_button_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        
+        # Without fast start, audio is ready before the first press is accepted
+        if not self.config.fast_start:
+            self._init_audio()
+        
+        with self._startup_phase('buttons'):
+            # Button actions run on the dispatcher, not the GPIO callback thread
+            self.dispatcher = self._create_dispatcher()
+            self._button_actions = self._button_table(self.config)
+            
+            # Gestures can run other actions than the button's own
+            self._gesture_actions = self._gesture_table(self.config, self._button_actions)
+            
+            # Debounce and gestures in software, from edges on both transitions
+            self.inputs = self._create_input_layer()
+            for pin in self._button_actions:
+                self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=self.inputs.on_edge)
         
-        # Threading events for strobe control
-        self.strobe_event = Event()
-        self.strobe_thread = None
+        # Initialize wing position to vertical (the move itself runs in the background)
+        with self._startup_phase('servo_home'):
+            self._set_servo_position(WingPosition.VERTICAL)
+        
+        # Release the servo PWM and audio device after a quiet period
+        self.idle = self._create_idle_monitor()
+        
+        self._start_metrics_export()
+        
+        # Companion apps press buttons and follow the state remotely
+        self.control = self._create_control_server()
+        if self.control is not None:
+            self._start_control_server()
+        
+        # Costumes in a group act on the leader's presses together
+        self.sync = None
+        if self.config.sync_role is not None:
+            self.start_sync(self.config.sync_role)
+        self.startup_timings['buttons_ready'] = time.perf_counter() - self._startup_began
+        
+        if self.config.fast_start:
+            self._audio_thread = threading.Thread(
+                target=self._init_audio, name='audio-init', daemon=True
+            )
+            self._audio_thread.start()
+        
+        print("Buzz Lightyear Controller initialized")
+        self._print_startup_timings()
+    
+    def _select_audio_path(self):
+        """Use clips compiled by build_audio.py when they match the mixer format"""
+        audio_path = self.config.audio_path
+        compiled = compiled_audio_path(audio_path)
+        manifest = load_manifest(compiled)
+        if manifest is None:
+            return audio_path
+        if not manifest_matches(manifest, self.config.mixer_frequency,
+                                self.config.mixer_size, self.config.mixer_channels):
+            print("Compiled audio does not match the mixer format, "
+                  "using source clips (rerun build_audio.py)")
+            return audio_path
+        return compiled
+    
+    def _open_sound_pack(self):
+        """Map the sound pack if one is configured or was built, else return None"""
+        path = self.config.sound_pack
+        if path is None:
+            path = os.path.join(compiled_audio_path(self.config.audio_path), PACK_NAME)
+            if not os.path.exists(path):
+                return None
+        try:
+            pack = SoundPack(path)
+        except (OSError, ValueError) as e:
+            print(f"Cannot open sound pack {path}, using clip files: {e}")
+            return None
+        if not pack.matches(self.config.mixer_frequency, self.config.mixer_size,
+                            self.config.mixer_channels):
+            print(f"Sound pack {path} does not match the mixer format, using clip files")
+            pack.close()
+            return None
+        return pack
+    
+    @contextmanager
+    def _startup_phase(self, name, timings=None):
+        """Record how long a startup phase takes in startup_timings (or timings)"""
+        timings = self.startup_timings if timings is None else timings
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = time.perf_counter() - began
+    
+    def _print_startup_timings(self):
+        """Print the startup phases recorded so far"""
+        phases = ', '.join(f"{name} {seconds * 1000:.1f} ms"
+                           for name, seconds in self.startup_timings.items())
+        print(f"Startup: {phases}")
+    
+    def _init_audio(self, timings=None):
+        """
+        Import and initialize the mixer, then decode every sound
         
-        # Initialize GPIO
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
+        Args:
+            timings: Dictionary for the phase timings (default: startup_timings)
+        """
+        startup = timings is None
+        timings = self.startup_timings if startup else timings
+        began = self._startup_began if startup else time.perf_counter()
+        try:
+            with self._startup_phase('mixer_import', timings):
+                mixer = self.backend.mixer
+            with self._startup_phase('mixer_init', timings):
+                mixer.init(
+                    frequency=self.config.mixer_frequency,
+                    size=self.config.mixer_size,
+                    channels=self.config.mixer_channels,
+                    buffer=self.config.mixer_buffer
+                )
+                channels = ChannelManager(
+                    mixer,
+                    categories=self.config.sound_categories,
+                    channels=self.config.sound_channels,
+                    steal_policy=self.config.sound_steal_policy,
+                    clock=self.clock.monotonic
+                )
+                stream = StreamPlayer(
+                    mixer.music,
+                    volume=self.config.stream_volume,
+                    crossfade=self.config.stream_crossfade,
+                    duck_volume=self.config.stream_duck_volume,
+                    clock=self.clock.monotonic,
+                    scheduler=self.scheduler
+                )
+            # Decode all sounds up front so button presses never hit the SD card
+            with self._startup_phase('sound_preload', timings):
+                self.sound_bank.mixer = mixer
+                self.sound_bank.load_all()
+                self.phrases.start(mixer)
+        except Exception as e:
+            if self._audio_thread is None:
+                raise
+            print(f"Audio initialization failed, continuing without sound: {e}")
+            return
         
-        # Setup servo
-        GPIO.setup(self.config['servo_pin'], GPIO.OUT)
-        self.servo_pwm = GPIO.PWM(self.config['servo_pin'], 50)  # 50Hz for servo
-        self.servo_pwm.start(0)
+        with self._audio_lock:
+            self.mixer = mixer
+            self.channels = channels
+            self.stream = stream
+            self._audio_released = False
+            self.audio_ready.set()
+            early = list(self._early_sounds)
+            self._early_sounds.clear()
+        timings['audio_ready'] = time.perf_counter() - began
+        self._update_stream_loop()
         
-        # Setup LEDs
-        GPIO.setup(self.config['strobe_led_pin'], GPIO.OUT)
-        GPIO.setup(self.config['laser_led_pin'], GPIO.OUT)
-        GPIO.output(self.config['strobe_led_pin'], GPIO.LOW)
-        GPIO.output(self.config['laser_led_pin'], GPIO.LOW)
+        if self._audio_thread is not None:
+            self._play_early_sounds(early)
+            if startup:
+                self._print_startup_timings()
+    
+    def _play_early_sounds(self, early):
+        """Play sounds queued before audio was ready, dropping stale ones"""
+        now = self.clock.monotonic()
+        for sound_file, category, requested in early:
+            if now - requested <= self.config.early_sound_max_age:
+                self._play_sound(sound_file, category)
+            else:
+                print(f"Skipping stale early sound: {sound_file}")
+    
+    def _defer_sound(self, sound_file, category):
+        """
+        Handle a sound requested before audio is ready
         
-        # Setup buttons with pull-up resistors
-        GPIO.setup(self.config['wing_button_pin'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(self.config['laser_button_pin'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(self.config['phrase_button_pin'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        Returns:
+            True if the request was queued or skipped, False if audio became
+            ready in the meantime and the sound should play now
+        """
+        with self._audio_lock:
+            if self.audio_ready.is_set():
+                return False
+            if self.config.early_sound_policy == 'queue':
+                self._early_sounds.append((sound_file, category, self.clock.monotonic()))
+            else:
+                print(f"Audio not ready, skipping sound: {sound_file}")
+            return True
+    
+    def _create_scheduler(self):
+        """
+        Timer source shared by the deadline-driven subsystems
         
-        # Initialize pygame mixer for audio
-        pygame.mixer.init()
+        Returns:
+            The virtual clock, which drives timers itself instead of helper
+            threads, or None to give each subsystem its own thread
+        """
+        return self.clock if self.clock.virtual else None
+    
+    def _create_hot_path_metrics(self):
+        """Look up hot-path metrics once so callbacks skip the registry"""
+        metrics = self.metrics
+        self._edge_counters = {
+            action: metrics.counter('buzz_button_edges_total', 'Button edges received', action=action)
+            for action in self.ACTION_PRIORITIES
+        }
+        self._action_timers = {
+            action: metrics.histogram('buzz_action_seconds', 'Button action run time', action=action)
+            for action in self.ACTION_PRIORITIES
+        }
+        self._sound_play_timer = metrics.histogram(
+            'buzz_sound_play_seconds', 'Time spent in _play_sound')
+        self._servo_command_timer = metrics.histogram(
+            'buzz_servo_command_seconds', 'Time spent in _set_servo_position')
+        self._servo_move_timer = metrics.histogram(
+            'buzz_servo_move_seconds', 'Servo command to settled')
+        self._strobe_start_timer = metrics.histogram(
+            'buzz_strobe_start_seconds', 'Cost of starting the strobe')
+        self._strobe_stop_timer = metrics.histogram(
+            'buzz_strobe_stop_seconds', 'Cost of stopping the strobe')
+        self._servo_command_time = None
+    
+    def _start_metrics_export(self):
+        """Register export-time gauges and start the configured exporters"""
+        if not self.metrics.enabled:
+            return
+        gauges = {
+            'buzz_dispatch_queue_depth': lambda: self.dispatcher.depth(),
+            'buzz_dispatch_wait_p99_ms': lambda: self.dispatcher.stats()['wait_p99_ms'],
+            'buzz_dispatch_dropped': lambda: self.dispatcher.stats()['dropped'],
+            'buzz_dispatch_coalesced': lambda: self.dispatcher.stats()['coalesced'],
+            'buzz_sound_cache_hits': lambda: self.sound_bank.stats()['hits'],
+            'buzz_sound_cache_misses': lambda: self.sound_bank.stats()['misses'],
+            'buzz_sound_cache_evictions': lambda: self.sound_bank.stats()['evictions'],
+            'buzz_sound_cache_bytes': lambda: self.sound_bank.stats()['used_bytes'],
+            'buzz_phrase_cache_hits': lambda: self.phrases.stats()['hits'],
+            'buzz_phrase_cache_misses': lambda: self.phrases.stats()['misses'],
+            'buzz_strobe_jitter_p99_ms': lambda: self.strobe_jitter()['jitter_p99_ms'],
+            'buzz_sound_stolen': lambda: self.sound_channel_stats()['stolen'],
+            'buzz_show_late_p99_ms': lambda: self.shows.lateness_stats()['late_p99_ms'],
+            'buzz_led_frame_late_p99_ms': lambda: self.leds.lateness_stats()['late_p99_ms'],
+            'buzz_idle': lambda: int(self.idle.idle),
+            'buzz_sound_dropped': lambda: self.sound_channel_stats()['dropped'],
+        }
+        for name, read in gauges.items():
+            self.metrics.gauge(name, read)
         
-        # Add button event detection
-        GPIO.add_event_detect(
-            self.config['wing_button_pin'],
-            GPIO.FALLING,
-            callback=self._wing_button_callback,
-            bouncetime=self.config['debounce_time']
+        if self.config.metrics_file:
+            self.metrics.start_file_exporter(
+                self.config.metrics_file, self.config.metrics_interval
+            )
+        if self.config.metrics_socket:
+            self.metrics.serve_unix_socket(self.config.metrics_socket)
+    
+    def _create_servo_pwm(self):
+        """
+        Open the 50Hz servo PWM: the hardware channel through sysfs when
+        there is one, the servo pin is routed to it and the analog audio
+        jack is not using the PWM block, else RPi.GPIO software PWM
+        
+        Returns:
+            PWM object with the RPi.GPIO PWM interface
+        
+        Raises:
+            OSError, ValueError: If servo_pwm is 'hardware' and the hardware
+                channel cannot be opened, or the servo pin is routed elsewhere
+        """
+        config = self.config
+        self._servo_sysfs = None
+        pwm_root = getattr(self.backend, 'pwm_root', None)
+        if pwm_root is None and config.servo_pwm == 'hardware':
+            raise OSError(f"The {self.backend.name} backend has no hardware PWM")
+        sound_cards = getattr(self.backend, 'sound_cards', None)
+        if pwm_root is not None and config.servo_pwm == 'auto' and sound_cards is not None:
+            card = analog_audio_card(sound_cards)
+            if card is not None:
+                # Taking the PWM block would silence the 3.5mm jack
+                print(f"Analog audio is on ({card}); using software PWM for the servo")
+                pwm_root = None
+        pin_function = getattr(self.backend, 'pin_function', None)
+        if pwm_root is not None and config.servo_pwm != 'software' and pin_function is not None:
+            function = pin_function(config.servo_pin)
+            # The overlay may route the channel to another pin, leaving the servo without pulses
+            if not is_pwm_function(function):
+                routed = f"routed to {function}" if function else "not known to be routed to PWM"
+                if config.servo_pwm == 'auto':
+                    print(f"GPIO {config.servo_pin} is {routed}; using software PWM for the servo")
+                    pwm_root = None
+                elif function is not None:
+                    raise OSError(f"GPIO {config.servo_pin} is {routed}, not PWM; "
+                                  "check the pin of the pwm overlay")
+        if pwm_root is not None and config.servo_pwm != 'software':
+            try:
+                self._servo_sysfs = open_sysfs_pwm(
+                    config.servo_pin, 50, root=pwm_root,
+                    chip=config.servo_pwm_chip, channel=config.servo_pwm_channel
+                )
+            except (OSError, ValueError) as e:
+                if config.servo_pwm == 'hardware':
+                    raise
+                print(f"Hardware PWM unavailable ({e}); using software PWM for the servo")
+        
+        if self._servo_sysfs is None:
+            self.gpio.setup(config.servo_pin, self.gpio.OUT)
+            return self.gpio.PWM(config.servo_pin, 50)  # 50Hz for servo
+        
+        # No GPIO.setup here: it would take the pin away from the PWM block
+        print(f"Servo on hardware PWM ({self._servo_sysfs.path})")
+        if self.recorder is not NULL_RECORDER:
+            return RecordingPWM(self._servo_sysfs, config.servo_pin, self.recorder)
+        return self._servo_sysfs
+    
+    def _close_servo_pwm(self):
+        """Stop the servo pulses and release the hardware channel"""
+        self.servo_pwm.stop()
+        if self._servo_sysfs is not None:
+            self._servo_sysfs.close()
+    
+    def _create_servo_motion(self):
+        """Create the wing servo motion engine"""
+        return ServoMotionEngine(
+            self.servo_pwm,
+            move_time=self.config.servo_move_time,
+            full_range=abs(self.config.servo_vertical - self.config.servo_horizontal),
+            easing=self.config.servo_easing,
+            update_hz=self.config.servo_update_hz,
+            # Hardware pulses do not jitter, so the servo keeps its hold torque
+            release=self._servo_sysfs is None,
+            on_complete=self._on_servo_motion_complete,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler
+        )
+    
+    def _create_idle_monitor(self):
+        """Create the monitor that parks the costume after idle_timeout seconds"""
+        return IdleMonitor(
+            self.config.idle_timeout,
+            self._enter_idle,
+            self._leave_idle,
+            busy=lambda: self.servo_motion.is_moving() or self.shows.current is not None,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler
+        )
+    
+    def _enter_idle(self):
+        """Release the servo PWM and, when nothing is audible, the audio device"""
+        if not self._servo_released:
+            self.servo_pwm.stop()
+            self._servo_released = True
+        released = self._release_audio()
+        print(f"Idle: servo PWM released{', audio released' if released else ''}")
+        self._notify_state('idle', True)
+    
+    def _release_audio(self):
+        """
+        Shut the mixer down until the next press
+        
+        Returns:
+            True if released; False if audio is not up or something is playing
+        """
+        with self._audio_lock:
+            if not self.audio_ready.is_set() or self.stream.track is not None or self.mixer.get_busy():
+                return False
+            self.audio_ready.clear()
+            self._audio_released = True
+            mixer, stream = self.mixer, self.stream
+            self.mixer = self.channels = self.stream = None
+        stream.close()
+        self.sound_bank.unload()
+        self.phrases.unload()
+        mixer.quit()
+        return True
+    
+    def _leave_idle(self):
+        """Reacquire what _enter_idle released, before the waking press runs"""
+        if self._servo_released:
+            # Hardware PWM holds the wings between moves, so resume their pulse
+            held = None if self.servo_motion.release else self.servo_motion.position
+            self.servo_pwm.start(held or 0)
+            self._servo_released = False
+        if self._audio_released:
+            self.wake_timings = {}
+            if self.clock.virtual:
+                self._init_audio(self.wake_timings)
+            else:
+                # Sounds of the waking press follow the early sound policy meanwhile
+                self._audio_thread = threading.Thread(
+                    target=self._init_audio, args=(self.wake_timings,), name='audio-init', daemon=True
+                )
+                self._audio_thread.start()
+        print("Awake")
+        self._notify_state('idle', False)
+    
+    def _create_reconciler(self):
+        """Create the reconciler that applies the latest wing, laser and strobe targets"""
+        reconciler = Reconciler(
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler,
+            metrics=self.metrics
+        )
+        self._add_reconciler_targets(reconciler)
+        return reconciler
+    
+    def _add_reconciler_targets(self, reconciler):
+        """Register the outputs button actions drive"""
+        hold = self.config.reconcile_hold
+        # A new wing target waits for the servo instead of stacking moves
+        reconciler.add('wings', self._apply_wings, self.wing_position,
+                       busy=self.servo_motion.is_moving)
+        reconciler.add('laser', self._apply_laser, self.laser_on, hold=hold)
+        reconciler.add('strobe', self._apply_strobe, self.strobe_running, hold=hold)
+    
+    def _create_led_engine(self):
+        """Create the LED pattern engine shared by all LED effects"""
+        return LedEngine(
+            self.gpio,
+            frame_rate=self.config.led_frame_rate,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler,
+            metrics=self.metrics
         )
-        GPIO.add_event_detect(
-            self.config['laser_button_pin'],
-            GPIO.FALLING,
-            callback=self._laser_button_callback,
-            bouncetime=self.config['debounce_time']
+    
+    def _create_strobe(self):
+        """Create the strobe backend selected by config['strobe_backend']"""
+        strobe_backend = self.config.strobe_backend
+        if strobe_backend not in STROBE_BACKENDS:
+            raise ValueError(f"Unknown strobe backend: {strobe_backend}")
+        return STROBE_BACKENDS[strobe_backend](
+            self.gpio, self.config.strobe_led_pin, self.config.strobe_frequency,
+            clock=self.clock.monotonic, scheduler=self.scheduler, metrics=self.metrics,
+            leds=self.leds
         )
-        GPIO.add_event_detect(
-            self.config['phrase_button_pin'],
-            GPIO.FALLING,
-            callback=self._phrase_button_callback,
-            bouncetime=self.config['debounce_time']
+    
+    def _create_show_runner(self):
+        """Create the show runner and load the show files"""
+        runner = ShowRunner(
+            self._show_handlers(),
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler,
+            realtime_priority=self.config.show_realtime_priority
         )
+        self._add_file_shows(runner)
+        return runner
+    
+    def _show_handlers(self):
+        """Return track name -> cue handler for the show runner"""
+        return {
+            'led': self._show_led,
+            'servo': self._show_servo,
+            'sound': self._play_sound,
+            'strobe': self._show_strobe,
+        }
+    
+    def _add_file_shows(self, runner):
+        """Load the show files into a runner"""
+        shows = self._load_file_shows(self.config)
+        for show in shows.values():
+            runner.add(show)
+        # Shows added later from code are kept when the files are reloaded
+        self._file_shows = set(shows)
+    
+    def _load_file_shows(self, config):
+        """Load the show files for a configuration; return name -> Show"""
+        return load_shows(config.show_path, *self.show_targets(config))
+    
+    def show_targets(self, config=None):
+        """Return the LED pin and servo position names shows can refer to"""
+        config = self.config if config is None else config
+        pins = {
+            'strobe': config.strobe_led_pin,
+            'laser': config.laser_led_pin,
+        }
+        servo_positions = {
+            'horizontal': config.servo_horizontal,
+            'vertical': config.servo_vertical,
+        }
+        return pins, servo_positions
+    
+    def _show_led(self, pin, level):
+        """Show cue: set an LED"""
+        self.leds.set(pin, level)
+    
+    def led_effect(self, name, pattern, pins=('laser',), **params):
+        """
+        Start an LED effect on the pattern engine
         
-        # Initialize wing position to vertical
-        self._set_servo_position(WingPosition.VERTICAL)
+        Args:
+            name: Effect name, used to stop it
+            pattern: Pattern name (strobe, pulse, chase, breathe, morse, sparkle, solid)
+            pins: LED names from show_targets() or GPIO pin numbers
+            **params: Pattern parameters, e.g. period=2.0 for breathe
+        """
+        names = self.show_targets()[0]
+        self.leds.start(name, [names.get(pin, pin) for pin in pins], pattern, **params)
+    
+    def stop_led_effect(self, name):
+        """Stop an LED effect started with led_effect()"""
+        self.leds.stop(name)
+    
+    def _show_servo(self, duty, duration, position):
+        """Show cue: move the wings, keeping the wing state in step"""
+        if position == 'horizontal':
+            self.wing_position = WingPosition.HORIZONTAL
+        elif position == 'vertical':
+            self.wing_position = WingPosition.VERTICAL
+        if position is not None:
+            self.reconciler.assume('wings', self.wing_position)
+            self._notify_state('wings', position)
+        self.servo_motion.move_to(duty, duration)
+    
+    def _show_strobe(self, on):
+        """Show cue: start or stop the strobe"""
+        self.reconciler.assume('strobe', bool(on))
+        if on:
+            self._start_strobe()
+        else:
+            self._stop_strobe()
+        self._notify_state('strobe', bool(on))
+    
+    def _show_button_callback(self, channel):
+        """Play the show mapped to a button"""
+        action = self._button_actions[channel][0]
+        self._cue('show', self.config.button_shows[action])
+    
+    def _create_dispatcher(self):
+        """Create the dispatcher that runs button actions"""
+        # Under a virtual clock actions run inline so timing is deterministic
+        return EventDispatcher(
+            workers=0 if self.clock.virtual else self.config.dispatcher_workers,
+            max_queue=self.config.dispatcher_queue_size,
+            policy=self.config.backpressure_policy,
+            clock=self.clock.monotonic
+        )
+    
+    def _create_input_layer(self):
+        """Create the software debouncer and gesture recognizer"""
+        return GestureRecognizer(
+            self.gpio,
+            {pin: action for pin, (action, handler) in self._button_actions.items()},
+            self._on_gesture,
+            bindings=self._gesture_actions,
+            lockout=self.config.debounce_time / 1000.0,
+            long_press=self.config.long_press_time,
+            double_tap=self.config.double_tap_time,
+            chord_window=self.config.chord_window,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler,
+            metrics=self.metrics
+        )
+    
+    def _button_table(self, config):
+        """Return input pin -> (action, handler) for a configuration"""
+        actions = {
+            config.wing_button_pin: ('wing', self._wing_button_callback),
+            config.laser_button_pin: ('laser', self._laser_button_callback),
+            config.phrase_button_pin: ('phrase', self._phrase_button_callback),
+        }
+        # Buttons mapped to a show play it instead of their usual action
+        for pin, (action, handler) in actions.items():
+            if action in config.button_shows:
+                actions[pin] = (action, self._show_button_callback)
+        return actions
+    
+    def _gesture_table(self, config, button_actions):
+        """Return gesture key -> (action, handler) for a configuration"""
+        return {
+            key: self._gesture_target(key, target, button_actions)
+            for key, target in config.gestures.items()
+        }
+    
+    def _gesture_target(self, key, target, button_actions=None):
+        """
+        Resolve a gesture binding to the action and handler it runs
         
-        print("Buzz Lightyear Controller initialized")
+        Args:
+            key: Gesture key, e.g. 'laser:double_tap' or 'laser+wing'
+            target: Button action name, or 'show:<name>' to play a show
+            button_actions: Pin -> (action, handler) table (default: the running one)
+        
+        Returns:
+            Tuple of (action, handler); the action sets the dispatch priority
+        """
+        button_actions = self._button_actions if button_actions is None else button_actions
+        handlers = {action: handler for action, handler in button_actions.values()}
+        if target in handlers:
+            return target, handlers[target]
+        if target.startswith('show:'):
+            show = target[len('show:'):]
+            action = min(gesture_names(key)[0], key=lambda name: self.ACTION_PRIORITIES.get(name, float('inf')))
+            return action, lambda channel: self._cue('show', show)
+        raise ValueError(f"Unknown gesture action for {key}: {target}")
+    
+    def _on_gesture(self, key, channel):
+        """Run a tap as the button's own action, other gestures as bound"""
+        self.idle.activity()
+        if key not in self._gesture_actions:
+            self._on_button_edge(channel)
+            return
+        action, handler = self._gesture_actions[key]
+        self.dispatcher.submit(
+            key, self._run_action, self.ACTION_PRIORITIES[action],
+            args=(action, handler, channel)
+        )
+    
+    def _on_button_edge(self, channel):
+        """GPIO edge callback: only enqueue the action for a worker"""
+        action, handler = self._button_actions[channel]
+        self._edge_counters[action].inc()
+        self.dispatcher.submit(
+            action, self._run_action, self.ACTION_PRIORITIES[action],
+            args=(action, handler, channel)
+        )
+    
+    def _run_action(self, action, handler, channel):
+        """Run a button action, timing and recording it from entry to exit"""
+        action_id = self.recorder.name_id(action)
+        self.recorder.record(CALLBACK_START, action_id, channel)
+        try:
+            with self._action_timers[action].time():
+                handler(channel)
+        except Exception:
+            self.recorder.record(ERROR, action_id, channel)
+            raise
+        self.recorder.record(CALLBACK_END, action_id, channel)
     
     def _set_servo_position(self, position):
-        """Set servo to specified wing position"""
+        """Start moving the servo to specified wing position (non-blocking)"""
         if position == WingPosition.HORIZONTAL:
-            duty_cycle = self.config['servo_horizontal']
+            duty_cycle = self.config.servo_horizontal
         else:
-            duty_cycle = self.config['servo_vertical']
+            duty_cycle = self.config.servo_vertical
         
-        self.servo_pwm.ChangeDutyCycle(duty_cycle)
-        time.sleep(0.5)  # Give servo time to move
-        self.servo_pwm.ChangeDutyCycle(0)  # Stop sending signal to prevent jitter
+        with self._servo_command_timer.time():
+            self._servo_command_time = time.perf_counter()
+            self.servo_motion.move_to(duty_cycle)
+    
+    def _on_servo_motion_complete(self, duty_cycle):
+        """Called from the motion engine once the servo has settled"""
+        if self._servo_command_time is not None:
+            self._servo_move_timer.observe(time.perf_counter() - self._servo_command_time)
+        # A wing target may have been waiting for the servo
+        self.reconciler.poke()
     
     def _start_strobe(self):
         """Start the LED strobe effect"""
         if not self.strobe_running:
             self.strobe_running = True
-            self.strobe_event.clear()
-            self.strobe_thread = Thread(target=self._strobe_loop)
-            self.strobe_thread.start()
+            with self._strobe_start_timer.time():
+                self.strobe.start()
     
     def _stop_strobe(self):
         """Stop the LED strobe effect"""
         if self.strobe_running:
             self.strobe_running = False
-            self.strobe_event.set()
-            if self.strobe_thread:
-                self.strobe_thread.join()
-            GPIO.output(self.config['strobe_led_pin'], GPIO.LOW)
-    
-    def _strobe_loop(self):
-        """Strobe LED loop running in separate thread"""
-        period = 1.0 / self.config['strobe_frequency']
-        half_period = period / 2
-        
-        while self.strobe_running and not self.strobe_event.is_set():
-            GPIO.output(self.config['strobe_led_pin'], GPIO.HIGH)
-            time.sleep(half_period)
-            GPIO.output(self.config['strobe_led_pin'], GPIO.LOW)
-            time.sleep(half_period)
-    
-    def _play_sound(self, sound_file):
-        """Play a sound effect"""
-        sound_path = os.path.join(self.config['audio_path'], sound_file)
-        if os.path.exists(sound_path):
-            try:
-                sound = pygame.mixer.Sound(sound_path)
-                sound.play()
-            except Exception as e:
-                print(f"Error playing sound {sound_file}: {e}")
+            with self._strobe_stop_timer.time():
+                self.strobe.stop()
+    
+    def strobe_jitter(self):
+        """Return measured strobe period jitter (p50/p99) for the active backend"""
+        return self.strobe.jitter_stats()
+    
+    def _play_sound(self, sound_file, category='effect'):
+        """
+        Play a sound effect from the preloaded sound bank
+        
+        Args:
+            sound_file: Clip name in the audio directory
+            category: Sound category deciding channel priority and reservation
+        """
+        self.recorder.record(SOUND, self.recorder.name_id(sound_file), self.recorder.name_id(category))
+        if not self.audio_ready.is_set() and self._defer_sound(sound_file, category):
+            return
+        with self._sound_play_timer.time():
+            self._play_cached_sound(sound_file, category)
+    
+    def _play_cached_sound(self, sound_file, category):
+        """Look up a sound in the bank and start it on a pooled channel"""
+        stream_path = self.sound_bank.stream_path(sound_file)
+        if stream_path is not None:
+            # Too large to preload: plays in place of the streamed loop, which resumes after
+            self.stream.play(stream_path, loops=0, crossfade=0)
+            return
+        if self.phrases.knows(sound_file):
+            sound = self.phrases.get(sound_file)
         else:
-            print(f"Sound file not found: {sound_path}")
+            sound = self.sound_bank.get(sound_file)
+        if sound is None:
+            if self.sound_bank.knows(sound_file):
+                print(f"Sound not in memory, reloading: {sound_file}")
+            else:
+                print(f"Sound file not found: {sound_file}")
+            return
+        try:
+            if self.channels.play(sound, category) is None:
+                print(f"No channel free, dropped sound: {sound_file}")
+            elif self.stream.is_playing():
+                self.stream.duck_for(sound.get_length())
+        except Exception as e:
+            print(f"Error playing sound {sound_file}: {e}")
+    
+    def _update_stream_loop(self):
+        """Crossfade the streamed loop to the one for the current wing state"""
+        if self.stream is None:
+            return
+        loop = self.config.background_loop
+        if self.wing_position == WingPosition.HORIZONTAL and self.config.wing_loop:
+            loop = self.config.wing_loop
+        path = self.sound_bank.path_of(loop) if loop else None
+        if loop and path is None:
+            print(f"Loop file not found: {loop}")
+        if path is None:
+            self.stream.stop()
+        elif path != self.stream.track:
+            self.stream.play(path, loops=-1)
+    
+    def sound_channel_stats(self):
+        """Return played/stolen/dropped counts from the mixer channel pool"""
+        if self.channels is None:
+            return {'played': 0, 'stolen': 0, 'dropped': 0, 'cut': 0, 'categories': {}}
+        return self.channels.stats()
     
     def _wing_button_callback(self, channel):
         """Handle wing toggle button press"""
-        # Toggle wing position
+        # Toggle the target wing position
         if self.wing_position == WingPosition.VERTICAL:
-            self.wing_position = WingPosition.HORIZONTAL
-            self._set_servo_position(WingPosition.HORIZONTAL)
+            self._cue('wings', 'horizontal')
+        else:
+            self._cue('wings', 'vertical')
+    
+    def set_wings(self, position):
+        """Set the target wing position; the strobe runs while the wings are open"""
+        self.wing_position = position
+        self.reconciler.set('wings', position)
+        self.reconciler.set('strobe', position == WingPosition.HORIZONTAL)
+    
+    def _apply_wings(self, position):
+        """Reconciler: move the wings and play their sound"""
+        self._set_servo_position(position)
+        self._update_stream_loop()
+        if position == WingPosition.HORIZONTAL:
+            self._play_sound('wings_open.wav', 'wing')
+            print("Wings: HORIZONTAL")
+        else:
+            self._play_sound('wings_close.wav', 'wing')
+            print("Wings: VERTICAL")
+        self._notify_state('wings', position.name.lower())
+    
+    def _apply_strobe(self, on):
+        """Reconciler: start or stop the strobe"""
+        if on:
             self._start_strobe()
-            self._play_sound('wings_open.wav')
-            print("Wings: HORIZONTAL - Strobe ON")
         else:
-            self.wing_position = WingPosition.VERTICAL
-            self._set_servo_position(WingPosition.VERTICAL)
             self._stop_strobe()
-            self._play_sound('wings_close.wav')
-            print("Wings: VERTICAL - Strobe OFF")
+        print(f"Strobe: {'ON' if on else 'OFF'}")
+        self._notify_state('strobe', on)
     
     def _laser_button_callback(self, channel):
         """Handle laser button press"""
-        # Toggle laser
-        self.laser_on = not self.laser_on
-        GPIO.output(self.config['laser_led_pin'], GPIO.HIGH if self.laser_on else GPIO.LOW)
-        
-        if self.laser_on:
-            self._play_sound('laser_on.wav')
+        # Toggle the target laser state
+        self._cue('laser', not self.laser_on)
+    
+    def set_laser(self, on):
+        """Set the target laser state"""
+        self.laser_on = on
+        self.reconciler.set('laser', on)
+    
+    def _apply_laser(self, on):
+        """Reconciler: switch the laser LED and play its sound"""
+        self.leds.set(self.config.laser_led_pin, on)
+        if on:
+            self._play_sound('laser_on.wav', 'laser')
             print("Laser: ON")
         else:
-            self._play_sound('laser_off.wav')
+            self._play_sound('laser_off.wav', 'laser')
             print("Laser: OFF")
+        self._notify_state('laser', on)
     
     def _phrase_button_callback(self, channel):
         """Handle phrase button press"""
-        # Play a random Buzz Lightyear phrase
-        phrases = [
-            'to_infinity.wav',
-            'buzz_lightyear.wav',
-            'not_flying.wav',
-            'space_ranger.wav'
-        ]
-        
-        # Select a random phrase
-        import random
-        phrase = random.choice(phrases)
-        self._play_sound(phrase)
-        print(f"Playing phrase: {phrase}")
+        # Picked on the previous press and decoded since, so it plays at once
+        phrase = self.phrases.take()
+        if phrase is None:
+            print("No phrases found")
+            return
+        self._cue('phrase', phrase)
+    
+    def run_cue(self, action, value):
+        """
+        Apply a button action's target: the wings, the laser, a phrase or a show
+        
+        Args:
+            action: 'wings', 'laser', 'phrase' or 'show'
+            value: Wing position name, laser on/off, phrase clip or show name
+        
+        Raises:
+            ValueError: On an unknown action
+        """
+        if action == 'wings':
+            self.set_wings(WingPosition[value.upper()])
+        elif action == 'laser':
+            self.set_laser(bool(value))
+        elif action == 'phrase':
+            self._play_sound(value, 'phrase')
+            print(f"Playing phrase: {value}")
+        elif action == 'show':
+            self.shows.trigger(value)
+        else:
+            raise ValueError(f"Unknown cue action: {action}")
+    
+    def _cue(self, action, value):
+        """Apply a target now, or, on a sync leader, on every costume at the same moment"""
+        if self.sync is not None and self.sync.leader:
+            self.sync.cue(action, value)
+        else:
+            self.run_cue(action, value)
+    
+    def actions(self):
+        """Return the button actions press() accepts"""
+        return [action for action, handler in self._button_actions.values()]
+    
+    def press(self, action):
+        """
+        Run a button action as if its button was tapped, e.g. for a companion app
+        
+        Args:
+            action: Button action name ('wing', 'laser' or 'phrase')
+        
+        Raises:
+            ValueError: If no button runs the action
+        """
+        for pin, (name, handler) in self._button_actions.items():
+            if name == action:
+                self.recorder.record(PRESS, self.recorder.name_id(action))
+                self.idle.activity()
+                self.dispatcher.submit(
+                    action, self._run_action, self.ACTION_PRIORITIES[action],
+                    args=(action, handler, pin)
+                )
+                return
+        raise ValueError(f"Unknown action: {action}")
+    
+    def play_show(self, name):
+        """
+        Start a show, e.g. for a companion app
+        
+        Returns:
+            True if the show started
+        """
+        self.recorder.record(SHOW, self.recorder.name_id(name))
+        return self.shows.trigger(name)
+    
+    def state(self):
+        """Return the applied costume state as JSON-friendly values"""
+        return {
+            'wings': self.reconciler.actual('wings').name.lower(),
+            'laser': self.reconciler.actual('laser'),
+            'strobe': self.strobe_running,
+            'show': self.shows.current,
+            'idle': self.idle.idle,
+            'audio_ready': self.audio_ready.is_set(),
+        }
+    
+    def add_state_listener(self, listener):
+        """Call listener(key, value) on every state change; it must not block"""
+        # Replaced rather than changed, so notifying threads never see it mid-update
+        self._state_listeners = self._state_listeners + [listener]
+    
+    def remove_state_listener(self, listener):
+        """Stop calling a state listener"""
+        self._state_listeners = [l for l in self._state_listeners if l != listener]
+    
+    def _notify_state(self, key, value):
+        """Tell the state listeners about a change"""
+        for listener in self._state_listeners:
+            listener(key, value)
+    
+    def _create_control_server(self):
+        """Create the control server if a control socket or port is configured"""
+        config = self.config
+        if config.control_socket is None and config.control_port is None:
+            return None
+        return ControlServer(
+            self,
+            socket_path=config.control_socket,
+            host=config.control_host,
+            port=config.control_port,
+            token=config.control_token,
+            metrics=self.metrics
+        )
+    
+    def _start_control_server(self):
+        """Serve control clients from a loop thread of their own"""
+        self.control.start_background()
+    
+    def start_sync(self, role, transport=None, name=None):
+        """
+        Join a group of costumes acting on the leader's presses together
+        
+        Args:
+            role: 'leader' or 'follower'
+            transport: Group transport (default: multicast on sync_group and sync_port)
+            name: Name of this costume in the group (default: sync_name, or the
+                host name and a random suffix)
+        
+        Raises:
+            ValueError: On an unknown role
+            OSError: If the multicast group cannot be joined
+        """
+        config = self.config
+        if self.sync is not None:
+            self.sync.close()
+            self.sync = None
+        if transport is None:
+            transport = MulticastTransport(config.sync_group, config.sync_port)
+        self.sync = CostumeSync(
+            role,
+            transport,
+            self._on_sync_cue,
+            name=name or config.sync_name,
+            lead=config.sync_lead,
+            interval=config.sync_interval,
+            clock=self.clock.monotonic,
+            scheduler=self.scheduler,
+            on_arrival=self._on_sync_arrival,
+            metrics=self.metrics
+        )
+        print(f"Costume sync: {role} as {self.sync.name}")
+    
+    def _on_sync_arrival(self, action, value):
+        """Sync callback (sync thread): a cue arrived, sync_lead ahead of its time"""
+        self.idle.activity()
+        if action == 'phrase':
+            # Decoded now, so the cue's due time is not spent decoding
+            self.phrases.prefetch(value)
+    
+    def _on_sync_cue(self, action, value):
+        """Sync callback (sync thread): a cue is due"""
+        self._record_cue(action, value)
+        self.run_cue(action, value)
+    
+    def _record_cue(self, action, value):
+        """Record a cue from the leader as an input, for replay"""
+        recorder = self.recorder
+        recorder.record(CUE, recorder.name_id(action), recorder.name_id(json.dumps(value)))
+    
+    def dump_recording(self, path=None):
+        """
+        Write the event recorder's buffer to disk, e.g. after a glitch at an event
+        
+        Args:
+            path: Output file (default: recorder_path/buzz-<date>-<time>.rec)
+        
+        Returns:
+            The file written, or None when recording is off
+        """
+        if self.recorder is NULL_RECORDER:
+            print("Recording is off (recorder_events is 0)")
+            return None
+        if path is None:
+            path = os.path.join(self.config.recorder_path, time.strftime('buzz-%Y%m%d-%H%M%S.rec'))
+        events = self.recorder.dump(path, {
+            'config': self.config.as_dict(), 'backend': self.backend.name, 'seed': self.random_seed,
+            'servo_pwm': 'software' if self._servo_sysfs is None else 'hardware',
+            'phrases': self.phrases.phrases if self.phrases.indexed else [],
+        })
+        print(f"Recording: {events} events written to {path} (replay with recorder.py)")
+        return path
+    
+    def _install_crash_dump(self):
+        """Dump the recording when an exception goes uncaught, in any thread"""
+        previous_hook, previous_thread_hook = sys.excepthook, threading.excepthook
+        
+        def excepthook(*args):
+            self._dump_after_crash()
+            previous_hook(*args)
+        
+        def thread_excepthook(args):
+            self._dump_after_crash()
+            previous_thread_hook(args)
+        
+        sys.excepthook = excepthook
+        threading.excepthook = thread_excepthook
+    
+    def _dump_after_crash(self):
+        """Dump the recording; a failure here must not hide the original error"""
+        try:
+            self.dump_recording()
+        except Exception as e:
+            print(f"Could not dump the recording: {e}")
+    
+    def watch_config(self, path):
+        """
+        Reload the configuration from a file on SIGHUP and, with config_watch, when it is saved
+        
+        Args:
+            path: Python config file defining CONFIG (see config_example.py)
+        """
+        self.config_path = path
+        if self.config.config_watch and self._config_watcher is None:
+            self._config_watcher = ConfigWatcher(
+                path, self._on_config_file_changed, clock=self.clock.monotonic, scheduler=self.scheduler
+            )
+            print(f"Watching {path} for changes ({self._config_watcher.mode})")
+    
+    def _on_config_file_changed(self, path):
+        """Config watcher callback (watcher thread or scheduler): apply the saved file"""
+        self.reload_config_file()
+    
+    def reload_config_file(self):
+        """
+        Load the config file again and apply it; a bad file keeps the running config
+        
+        Returns:
+            List of the settings applied, or None if the file was rejected
+        """
+        if self.config_path is None:
+            print("No config file to reload")
+            return None
+        try:
+            return self.reload_config(load_config_file(self.config_path))
+        except Exception as e:
+            print(f"Config reload failed, keeping the running config: {e}")
+            return None
+    
+    def reload_config(self, config):
+        """
+        Apply a new configuration without restarting
+        
+        The new settings are validated and diffed against the running ones
+        first; only the subsystems whose settings changed are reapplied.
+        Changed button pins are re-registered, the strobe is retuned in
+        place, and only clips that changed on disk are decoded again.
+        Settings in RESTART_SETTINGS keep their running values.
+        
+        Args:
+            config: Dictionary of settings as for __init__; missing keys take
+                the defaults, not the running values
+        
+        Returns:
+            Sorted list of the settings that changed and were applied
+        
+        Raises:
+            ValueError: If the configuration is invalid; nothing is changed.
+                If applying it fails, the running config is put back and
+                the subsystems already changed are reapplied with it
+        """
+        with self._reload_lock:
+            old = self.config
+            new = self.CONFIG_CLASS(config)
+            changed = set(new.diff(old))
+            restart = changed & RESTART_SETTINGS
+            if restart:
+                print(f"Restart needed to apply: {', '.join(sorted(restart))}")
+                new = new.replace(**{key: old[key] for key in restart})
+                changed -= restart
+            
+            # Everything that can fail runs before the first change
+            button_actions = self._button_table(new)
+            gesture_actions = self._gesture_table(new, button_actions)
+            compile_bindings({pin: action for pin, (action, handler) in button_actions.items()},
+                             gesture_actions)
+            shows = self._load_file_shows(new)
+            
+            # Each step's undo is queued before it runs, so a step that fails
+            # partway is also put back
+            undo = []
+            old_inputs = (self._button_actions, self._gesture_actions)
+            old_shows = {name: self.shows.shows[name] for name in self._file_shows
+                         if name in self.shows.shows}
+            self.config = new
+            try:
+                if changed & {'servo_horizontal', 'servo_vertical', 'servo_move_time',
+                              'servo_easing', 'servo_update_hz'}:
+                    undo.append(partial(self._reload_servo, new))
+                    self._reload_servo(old)
+                if changed & {'strobe_led_pin', 'laser_led_pin', 'strobe_frequency'}:
+                    undo.append(partial(self._reload_leds, new))
+                    self._reload_leds(old)
+                if changed & {'wing_button_pin', 'laser_button_pin', 'phrase_button_pin', 'button_shows',
+                              'gestures', 'debounce_time', 'long_press_time', 'double_tap_time',
+                              'chord_window'}:
+                    undo.append(partial(self._reload_inputs, *old_inputs))
+                    self._reload_inputs(button_actions, gesture_actions)
+                if 'sync_lead' in changed and self.sync is not None:
+                    undo.append(partial(setattr, self.sync, 'lead', old.sync_lead))
+                    self.sync.lead = new.sync_lead
+                if 'reconcile_hold' in changed:
+                    undo.append(self._reload_hold)
+                    self._reload_hold()
+                if 'idle_timeout' in changed:
+                    undo.append(self._reload_idle)
+                    self._reload_idle()
+                undo.append(partial(self._reload_shows, old_shows))
+                self._reload_shows(shows)
+                undo.append(partial(self._reload_sounds, new))
+                clips = self._reload_sounds(old)
+                # A new sound pack closed the one the phrases were decoding from
+                if (changed & PHRASE_SETTINGS or self.phrases.stale()
+                        or self.phrases.pack is not self.sound_pack):
+                    undo.append(self._reload_phrases)
+                    self._reload_phrases()
+                undo.append(self._update_stream_loop)
+                self._update_stream_loop()
+            except Exception:
+                self._undo_reload(old, undo)
+                raise
+        
+        print(f"Config reloaded: {', '.join(sorted(changed)) or 'no changes'}"
+              f"{f'; {len(clips)} clip(s) reloaded' if clips else ''}")
+        return sorted(changed)
+    
+    def _undo_reload(self, old, undo):
+        """Put the running config back after a failed reload and undo the steps applied"""
+        self.config = old
+        for step in reversed(undo):
+            try:
+                step()
+            except Exception as e:
+                print(f"Could not undo config reload step: {e}")
+    
+    def _reload_hold(self):
+        """Apply reconcile_hold to the laser and strobe"""
+        self.reconciler.set_hold('laser', self.config.reconcile_hold)
+        self.reconciler.set_hold('strobe', self.config.reconcile_hold)
+    
+    def _reload_idle(self):
+        """Replace the idle monitor with one for the new idle_timeout"""
+        # Wake first so nothing stays released under the old monitor
+        self.idle.activity()
+        self.idle.close()
+        self.idle = self._create_idle_monitor()
+    
+    def _reload_servo(self, old):
+        """Retune the wing motion; a moved end position is shown right away"""
+        config = self.config
+        self.servo_motion.configure(
+            config.servo_move_time,
+            abs(config.servo_vertical - config.servo_horizontal),
+            config.servo_easing,
+            config.servo_update_hz
+        )
+        # Lets the wings be fitted by editing the config while they stay in place
+        key = 'servo_horizontal' if self.reconciler.actual('wings') == WingPosition.HORIZONTAL \
+            else 'servo_vertical'
+        if config[key] != old[key] and not self._servo_released:
+            self._set_servo_position(self.reconciler.actual('wings'))
+    
+    def _reload_leds(self, old):
+        """Move the strobe or laser to new pins, or retune the strobe in place"""
+        config = self.config
+        if config.strobe_led_pin != old.strobe_led_pin:
+            # A new pin needs a new strobe; the old pin is left off
+            running = self.strobe_running
+            self._stop_strobe()
+            self.strobe.close()
+            self.gpio.setup(config.strobe_led_pin, self.gpio.OUT)
+            self.gpio.output(config.strobe_led_pin, self.gpio.LOW)
+            self.strobe = self._create_strobe()
+            if running:
+                self._start_strobe()
+        elif config.strobe_frequency != old.strobe_frequency:
+            self.strobe.set_frequency(config.strobe_frequency)
+        if config.laser_led_pin != old.laser_led_pin:
+            self.gpio.setup(config.laser_led_pin, self.gpio.OUT)
+            self.leds.set(old.laser_led_pin, 0)
+            self.leds.set(config.laser_led_pin, self.reconciler.actual('laser'))
+    
+    def _reload_inputs(self, button_actions, gesture_actions):
+        """Re-register event detection for changed button pins and retune the recognizer"""
+        config = self.config
+        old_pins, new_pins = set(self._button_actions), set(button_actions)
+        for pin in old_pins - new_pins:
+            self.gpio.remove_event_detect(pin)
+        for pin in new_pins - old_pins:
+            self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self._button_actions = button_actions
+        self._gesture_actions = gesture_actions
+        self.inputs.configure(
+            buttons={pin: action for pin, (action, handler) in button_actions.items()},
+            bindings=gesture_actions,
+            lockout=config.debounce_time / 1000.0,
+            long_press=config.long_press_time,
+            double_tap=config.double_tap_time,
+            chord_window=config.chord_window
+        )
+        for pin in new_pins - old_pins:
+            self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=self.inputs.on_edge)
+    
+    def _reload_shows(self, shows):
+        """Replace the shows loaded from files, keeping shows added from code"""
+        for name in self._file_shows - set(shows):
+            self.shows.shows.pop(name, None)
+        for show in shows.values():
+            self.shows.add(show)
+        self._file_shows = set(shows)
+    
+    def _reload_sounds(self, old):
+        """
+        Rescan the clips, decoding only those that changed
+        
+        Returns:
+            Names of the clips that were added, changed or removed
+        """
+        config = self.config
+        pack = self.sound_pack
+        if (config.audio_path, config.sound_pack) != (old.audio_path, old.sound_pack):
+            pack = self._open_sound_pack()
+        self.sound_bank.budget_bytes = int(config.sound_cache_mb * 1024 * 1024)
+        self.sound_bank.stream_threshold = config.stream_threshold_kb * 1024
+        # While audio is down the bank is refilled once the mixer is back
+        changed = self.sound_bank.reload(self._select_audio_path(), pack,
+                                         decode=self.audio_ready.is_set())
+        if pack is not self.sound_pack:
+            old_pack, self.sound_pack = self.sound_pack, pack
+            if old_pack is not None:
+                old_pack.close()
+        return changed
+    
+    def _create_phrase_library(self):
+        """Index the phrase tree; its manifest is kept with the compiled audio"""
+        config = self.config
+        phrases = PhraseLibrary(
+            os.path.join(config.audio_path, config.phrase_path),
+            index_path=os.path.join(compiled_audio_path(config.audio_path), PHRASE_INDEX),
+            mode=config.phrase_mode,
+            tags=config.phrase_tags,
+            weights=config.phrase_weights,
+            budget_bytes=int(config.phrase_cache_mb * 1024 * 1024),
+            rng=self._random,
+            metrics=self.metrics,
+            # Decoded from the compiled copy, or the sound pack, when built
+            clip_root=os.path.join(self.sound_bank.audio_path, config.phrase_path),
+            pack=self.sound_pack,
+            pack_prefix=config.phrase_path.strip('/') + '/'
+        )
+        if phrases.indexed:
+            print(f"Phrases: {len(phrases)} in {len(phrases.tags)} categories, {config.phrase_mode}"
+                  f"{' (reindexed)' if phrases.rebuilt else ''}")
+        return phrases
+    
+    def _reload_phrases(self):
+        """Reindex the phrase tree and rebuild the library with the new settings"""
+        old, self.phrases = self.phrases, self._create_phrase_library()
+        old.close()
+        with self._audio_lock:
+            mixer = self.mixer if self.audio_ready.is_set() else None
+        if mixer is not None:
+            self.phrases.start(mixer)
     
     def run(self):
-        """Main run loop - keep program alive"""
+        """Main run loop - block until shutdown is requested"""
         print("Buzz Lightyear Controller running...")
         print("Press Ctrl+C to exit")
+        self._install_crash_dump()
         
         try:
-            while self.running:
-                time.sleep(0.1)
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.request_shutdown())
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump_recording())
+            if self.config_path is not None:
+                signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_config_file())
+        except ValueError:
+            # Not the main thread
+            pass
+        
+        try:
+            # Everything runs on callbacks; this thread sleeps until shutdown
+            self._shutdown_requested.wait()
+            print("\nShutting down...")
         except KeyboardInterrupt:
             print("\nShutting down...")
         finally:
             self.cleanup()
     
+    def request_shutdown(self):
+        """Ask run() to return; safe to call from any thread or a signal handler"""
+        self.running = False
+        self._shutdown_requested.set()
+    
     def cleanup(self):
         """Clean up GPIO and resources"""
         print("Cleaning up...")
         self.running = False
+        self._shutdown_requested.set()
+        if self._config_watcher is not None:
+            self._config_watcher.close()
+        if self.control is not None:
+            self.control.close()
+        if self.sync is not None:
+            self.sync.close()
+        self.idle.close()
+        self.inputs.close()
+        self.reconciler.close()
+        self.dispatcher.stop()
+        self.shows.close()
         self._stop_strobe()
-        self.servo_pwm.stop()
-        GPIO.cleanup()
-        pygame.mixer.quit()
+        self.strobe.close()
+        self.leds.close()
+        self.servo_motion.stop()
+        self._close_servo_pwm()
+        self.gpio.cleanup()
+        self._close_audio()
+        self.metrics.close()
         print("Cleanup complete")
+    
+    def _close_audio(self):
+        """Wait for a fast-start audio init, then release the sound bank and mixer"""
+        if self._audio_thread is not None:
+            self._audio_thread.join(timeout=5.0)
+        if self.stream is not None:
+            self.stream.close()
+        self.sound_bank.close()
+        self.phrases.close()
+        if self.sound_pack is not None:
+            self.sound_pack.close()
+        if self.mixer is not None:
+            self.mixer.quit()
 
 def main():
     """Main entry point"""
-    controller = BuzzController()
+    config = load_config_file(CONFIG_FILE) if os.path.exists(CONFIG_FILE) else None
+    controller = BuzzController(config)
+    if config is not None:
+        controller.watch_config(CONFIG_FILE)
     controller.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Mixer channel pool for the Buzz Lightyear Controller
+
+Sound.play() lets pygame pick any free channel and silently drops the
+sound when all of them are busy. ChannelManager picks the channel itself:
+
+- Every sound category (wing, laser, phrase, ...) has a priority and a
+  number of reserved channels that only that category may use; the rest
+  of the pool is shared.
+- When no usable channel is free, a voice is stolen according to the
+  steal policy. A voice is only ever stolen by a sound of the same or a
+  higher priority; otherwise the new sound is dropped.
+- Categories with cut_previous stop their own previous sound first, so
+  mashing the phrase button restarts the phrase instead of layering it.
+
+Priorities follow the dispatcher convention: lower numbers are more
+important.
+"""
+
+import threading
+import time
+
+# How to choose the voice to steal when no channel is free
+STEAL_POLICIES = ('oldest', 'quietest', 'lowest_priority')
+
+# category -> priority, reserved channel count, cut previous sound
+DEFAULT_CATEGORIES = {
+    'wing': {'priority': 0, 'reserved': 1, 'cut_previous': True},
+    'laser': {'priority': 1, 'reserved': 1, 'cut_previous': True},
+    'phrase': {'priority': 2, 'reserved': 1, 'cut_previous': True},
+    'effect': {'priority': 3, 'reserved': 0, 'cut_previous': False},
+}
+
+
+class Voice:
+    """A sound the manager started on a channel"""
+
+    __slots__ = ('sound', 'category', 'priority', 'started')
+
+    def __init__(self, sound, category, priority, started):
+        self.sound = sound
+        self.category = category
+        self.priority = priority
+        self.started = started
+
+
+class ChannelManager:
+    """Assigns mixer channels by category priority with voice stealing"""
+
+    def __init__(self, mixer, categories=None, channels=8, steal_policy='lowest_priority',
+                 clock=time.monotonic):
+        """
+        Initialize the channel pool
+
+        Args:
+            mixer: Initialized pygame.mixer module (or compatible object)
+            categories: Dictionary of category -> {'priority', 'reserved',
+                'cut_previous'}; defaults to DEFAULT_CATEGORIES
+            channels: Total number of mixer channels
+            steal_policy: 'oldest', 'quietest' or 'lowest_priority'
+            clock: Function returning the current time in seconds
+        """
+        if steal_policy not in STEAL_POLICIES:
+            raise ValueError(f"Unknown steal policy: {steal_policy}")
+        categories = categories or DEFAULT_CATEGORIES
+        reserved_total = sum(c.get('reserved', 0) for c in categories.values())
+        if reserved_total > channels:
+            raise ValueError(f"{reserved_total} reserved channels do not fit in {channels}")
+
+        self.mixer = mixer
+        self.steal_policy = steal_policy
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        mixer.set_num_channels(channels)
+        # Keep pygame's own Sound.play() off the reserved channels
+        mixer.set_reserved(reserved_total)
+        self._channels = [mixer.Channel(i) for i in range(channels)]
+        self._voices = [None] * channels
+
+        # Reserved channels come first, in category order; the rest are shared
+        self._categories = {}
+        shared = list(range(reserved_total, channels))
+        index = 0
+        for name, settings in categories.items():
+            reserved = list(range(index, index + settings.get('reserved', 0)))
+            index += len(reserved)
+            self._categories[name] = {
+                'priority': settings.get('priority', 0),
+                'cut_previous': settings.get('cut_previous', False),
+                'channels': reserved + shared,
+            }
+        self._fallback = {
+            'priority': max((c['priority'] for c in self._categories.values()), default=0) + 1,
+            'cut_previous': False,
+            'channels': shared,
+        }
+
+        self._counts = {name: self._new_counts() for name in self._categories}
+
+    @staticmethod
+    def _new_counts():
+        return {'played': 0, 'stolen': 0, 'dropped': 0, 'cut': 0}
+
+    def play(self, sound, category):
+        """
+        Play a sound on a channel chosen for its category
+
+        Args:
+            sound: pygame Sound to play
+            category: Sound category name; unknown categories get the
+                lowest priority and only the shared channels
+
+        Returns:
+            The Channel playing the sound, or None if it was dropped
+        """
+        settings = self._categories.get(category, self._fallback)
+        priority = settings['priority']
+        with self._lock:
+            counts = self._counts.setdefault(category, self._new_counts())
+            if settings['cut_previous']:
+                counts['cut'] += self._cut_locked(category)
+
+            index = self._free_channel_locked(settings['channels'])
+            if index is None:
+                index = self._victim_locked(settings['channels'], priority)
+                if index is None:
+                    counts['dropped'] += 1
+                    return None
+                victim = self._voices[index]
+                if victim is not None:
+                    self._counts.setdefault(victim.category, self._new_counts())['stolen'] += 1
+                self._channels[index].stop()
+
+            channel = self._channels[index]
+            channel.play(sound)
+            self._voices[index] = Voice(sound, category, priority, self.clock())
+            counts['played'] += 1
+            return channel
+
+    def stats(self):
+        """Return totals and per-category played/stolen/dropped/cut counts"""
+        with self._lock:
+            categories = {name: dict(counts) for name, counts in self._counts.items()}
+        totals = self._new_counts()
+        for counts in categories.values():
+            for key, value in counts.items():
+                totals[key] += value
+        totals['channels'] = len(self._channels)
+        totals['busy'] = sum(1 for channel in self._channels if channel.get_busy())
+        totals['categories'] = categories
+        return totals
+
+    def stop(self):
+        """Stop every channel"""
+        with self._lock:
+            for index, channel in enumerate(self._channels):
+                channel.stop()
+                self._voices[index] = None
+
+    def _cut_locked(self, category):
+        """Stop sounds of a category still playing; return how many were cut"""
+        cut = 0
+        for index, voice in enumerate(self._voices):
+            if voice is not None and voice.category == category:
+                if self._channels[index].get_busy():
+                    self._channels[index].stop()
+                    cut += 1
+                self._voices[index] = None
+        return cut
+
+    def _free_channel_locked(self, candidates):
+        for index in candidates:
+            if not self._channels[index].get_busy():
+                return index
+        return None
+
+    def _victim_locked(self, candidates, priority):
+        """Pick a voice of equal or lower importance to steal, or None"""
+        victims = []
+        for index in candidates:
+            voice = self._voices[index]
+            # A busy channel we did not start is treated as least important
+            if voice is None or voice.priority >= priority:
+                victims.append(index)
+        if not victims:
+            return None
+
+        def started(index):
+            voice = self._voices[index]
+            return voice.started if voice is not None else float('-inf')
+
+        if self.steal_policy == 'oldest':
+            return min(victims, key=started)
+        if self.steal_policy == 'quietest':
+            return min(victims, key=lambda index: (self._volume(index), started(index)))
+
+        def importance(index):
+            voice = self._voices[index]
+            return -voice.priority if voice is not None else float('-inf')
+
+        return min(victims, key=lambda index: (importance(index), started(index)))
+
+    def _volume(self, index):
+        """Effective volume of the voice on a channel"""
+        volume = self._channels[index].get_volume()
+        voice = self._voices[index]
+        if voice is not None:
+            volume *= voice.sound.get_volume()
+        return volume
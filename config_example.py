@@ -21,13 +21,107 @@ CONFIG = {
     # Servo settings (PWM duty cycle percentages for 50Hz)
     'servo_horizontal': 5.0,      # Duty cycle for horizontal position (0°)
     'servo_vertical': 10.0,       # Duty cycle for vertical position (90°)
+    'servo_move_time': 0.5,       # Seconds for a full wing move
+    'servo_easing': 'ease_in_out',  # linear, ease_in, ease_out or ease_in_out
+    'servo_update_hz': 50,        # Duty cycle updates per second while moving
+    'servo_pwm': 'auto',          # 'auto' (hardware PWM if the pin is routed to it and analog audio is off), 'hardware' or 'software' (GPIO.PWM)
+    'servo_pwm_chip': 0,          # Hardware PWM chip, /sys/class/pwm/pwmchipN
+    'servo_pwm_channel': None,    # Channel on the chip (None: from servo_pin, GPIO 18 is 0)
     
     # LED settings
     'strobe_frequency': 10,       # Strobe flashes per second
+    'strobe_backend': 'pattern',  # 'pattern' (LED engine), 'deadline' (own thread) or 'pwm' (GPIO.PWM)
+    'led_frame_rate': 200,        # LED pattern frames per second
     
     # Audio settings
     'audio_path': 'audio',        # Directory containing audio files
+    'mixer_frequency': 22050,     # Mixer sample rate; build_audio.py converts clips to it
+    'mixer_size': -16,            # Mixer sample size (-16: signed 16-bit)
+    'mixer_channels': 1,          # 1 mono, 2 stereo
+    'mixer_buffer': 512,          # Mixer buffer in samples (smaller: lower latency)
+    'sound_pack': None,           # Packed sound bank (None: audio/compiled/sounds.pak if built)
+    'stream_threshold_kb': 1024,  # Larger clips stream from disk instead of preloading
+    'background_loop': None,      # e.g. 'spaceship_hum.ogg', looped in the background
+    'wing_loop': None,            # Loop crossfaded in while the wings are open
+    'stream_volume': 0.6,         # Volume of the streamed loop
+    'stream_crossfade': 1.0,      # Seconds to fade between loops
+    'stream_duck_volume': 0.3,    # Loop volume fraction kept while effects play
+    'sound_cache_mb': 32,         # Memory budget for preloaded sounds (MB)
+    'sound_channels': 8,          # Mixer channels shared by all sounds
+    'sound_steal_policy': 'lowest_priority',  # oldest, quietest or lowest_priority
+    # Per-category priority (lower is more important), reserved channels and
+    # whether a new sound cuts the category's previous one
+    'sound_categories': {
+        'wing': {'priority': 0, 'reserved': 1, 'cut_previous': True},
+        'laser': {'priority': 1, 'reserved': 1, 'cut_previous': True},
+        'phrase': {'priority': 2, 'reserved': 1, 'cut_previous': True},
+        'effect': {'priority': 3, 'reserved': 0, 'cut_previous': False},
+    },
     
     # Button settings
-    'debounce_time': 200          # Button debounce time in milliseconds
+    'debounce_time': 20,          # Debounce lockout after each accepted edge (ms)
+    
+    # Gesture settings; taps always run the button's own action at once
+    # Keys: 'laser:double_tap', 'phrase:long_press' or chords like 'laser+wing'
+    # Values: a button action ('wing', 'laser', 'phrase') or 'show:<name>'
+    'gestures': {},
+    'long_press_time': 0.8,       # Seconds held for a long press
+    'double_tap_time': 0.3,       # Most seconds between the taps of a double tap
+    'chord_window': 0.08,         # Most seconds between the presses of a chord
+    
+    # Hammered buttons apply only their latest target
+    'reconcile_hold': 0.1,        # Seconds a laser/strobe change holds before the next
+    
+    # Power settings
+    'idle_timeout': None,         # e.g. 120: release servo PWM and audio after 2 quiet minutes
+    
+    # Button dispatch settings
+    'dispatcher_workers': 2,      # Worker threads running button actions
+    'dispatcher_queue_size': 16,  # Maximum queued button presses
+    'backpressure_policy': 'coalesce',  # coalesce, drop_newest or drop_oldest
+    
+    # Metrics settings
+    'metrics_enabled': False,     # Collect hot-path counters and histograms
+    'metrics_file': None,         # e.g. '/run/buzz/metrics.prom' for node_exporter
+    'metrics_socket': None,       # e.g. '/tmp/buzz-metrics.sock'
+    'metrics_interval': 10,       # Seconds between metrics file writes
+    
+    # Startup settings
+    'fast_start': False,          # Buttons live before pygame finishes loading
+    'early_sound_policy': 'queue',  # 'queue' or 'skip' sounds pressed before audio is ready
+    'early_sound_max_age': 2.0,   # Drop queued early sounds older than this (seconds)
+    
+    # Show settings
+    'show_path': 'shows',         # Directory of show timeline files (.json, .yaml)
+    'button_shows': {},           # e.g. {'laser': 'triple_flash'} plays a show on press
+    'show_realtime_priority': None,  # SCHED_FIFO priority for the show thread (needs root)
+    
+    # Reload settings; SIGHUP always reloads this file
+    'config_watch': True,         # Apply this file again whenever it is saved
+    
+    # Control server settings (companion apps)
+    'control_socket': None,       # e.g. '/tmp/buzz-control.sock' for local clients
+    'control_port': None,         # e.g. 8765 for JSON lines or WebSocket over TCP
+    'control_host': '127.0.0.1',  # '0.0.0.0' for phones on the network (needs control_token)
+    'control_token': None,        # Shared secret clients send with 'auth' first
+    
+    # Group sync settings (several costumes acting together)
+    'sync_role': None,            # 'leader' on one costume, 'follower' on the others
+    'sync_name': None,            # Name in the group, unique (None: host name and a random suffix)
+    'sync_group': '239.255.42.99',  # Multicast group shared by the costumes
+    'sync_port': 5099,            # UDP port of the group
+    'sync_lead': 0.25,            # Seconds from a leader press to every costume acting
+    'sync_interval': 2.0,         # Seconds between clock exchanges with the leader
+    
+    # Recorder settings (SIGUSR1 dumps the last events for replay)
+    'recorder_events': 65536,     # Events kept in memory, 16 bytes each (0: off)
+    'recorder_path': 'recordings',  # Directory recordings are dumped to
+    'random_seed': None,          # Seed for phrase picks (None: a new one each start)
+    
+    # Phrase settings (see audio/README.md for the phrase folders)
+    'phrase_path': 'phrases',     # Phrase tree under audio_path, one folder per category
+    'phrase_mode': 'shuffle',     # 'shuffle', 'weighted' or 'sequential'; none repeats early
+    'phrase_tags': None,          # e.g. ['greetings'] to play only those folders (None: all)
+    'phrase_weights': {},         # e.g. {'catchphrases': 3} for 'weighted'
+    'phrase_cache_mb': 8          # Most decoded phrase audio kept in memory
 }
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Compiled configuration and hot reload for the Buzz Lightyear Controller
+
+The controller's settings are compiled once into a frozen object with one
+slot per setting. Hot paths read config.laser_led_pin instead of looking
+keys up in a dict, and a reload swaps in a whole new object, so no thread
+ever sees a half-applied configuration.
+
+Compiling validates the settings: unknown keys (usually typos), values of
+the wrong type, unknown choices and settings that do not work together
+(checked by the class's CHECKS) raise ValueError, so a bad edit to the
+config file is rejected and the running configuration is kept. The
+controller diffs the new configuration against the running one and
+reapplies only the subsystems whose settings changed.
+
+ConfigWatcher reloads when the config file is saved. It uses inotify on
+Linux, so its thread sleeps in the kernel until the file changes; where
+inotify is missing it falls back to checking the file's mtime. Given a
+scheduler, such as an event loop wrapped in LoopScheduler, it checks the
+mtime from timer callbacks instead of starting a thread.
+"""
+
+import copy
+import ctypes
+import os
+import runpy
+import select
+import struct
+import time
+from numbers import Number
+from threading import Thread
+
+# inotify event masks (linux/inotify.h)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class FrozenConfig:
+    """Read-only settings with one slot per key; build classes with config_class()"""
+
+    __slots__ = ()
+    DEFAULTS = {}
+    CHOICES = {}
+    CHECKS = ()
+
+    def __init__(self, overrides=None):
+        """
+        Compile and validate a configuration
+
+        Args:
+            overrides: Dictionary of settings; missing keys take the defaults
+
+        Raises:
+            ValueError: On an unknown key, a value of the wrong type, an
+                unknown choice or a failed check
+        """
+        overrides = dict(overrides or {})
+        unknown = set(overrides) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown config key(s): {', '.join(sorted(unknown))}")
+        for key, default in self.DEFAULTS.items():
+            value = overrides.get(key, default)
+            _check_value(key, value, default, self.CHOICES.get(key))
+            # Copied so later changes to the caller's dicts cannot leak in
+            object.__setattr__(self, key, copy.deepcopy(value))
+        for check in self.CHECKS:
+            check(self)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Config is read-only; apply changes with reload_config()")
+
+    def __delattr__(self, key):
+        raise AttributeError("Config is read-only")
+
+    def __getitem__(self, key):
+        if key not in self.DEFAULTS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.DEFAULTS
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    def get(self, key, default=None):
+        """Return a setting, or default for an unknown key"""
+        return getattr(self, key) if key in self.DEFAULTS else default
+
+    def keys(self):
+        return self.DEFAULTS.keys()
+
+    def as_dict(self):
+        """Return the settings as a new dictionary"""
+        return {key: getattr(self, key) for key in self.DEFAULTS}
+
+    def replace(self, **changes):
+        """Return a copy with some settings changed"""
+        values = self.as_dict()
+        values.update(changes)
+        return type(self)(values)
+
+    def diff(self, other):
+        """Return the sorted keys whose values differ from other"""
+        return sorted(key for key in self.DEFAULTS if getattr(self, key) != other[key])
+
+
+def config_class(defaults, choices=None, name='Config', checks=()):
+    """
+    Build a FrozenConfig class with one slot per default setting
+
+    Args:
+        defaults: Dictionary of setting -> default value
+        choices: Dictionary of setting -> allowed values
+        name: Class name
+        checks: Callables run with the compiled config that raise
+            ValueError on settings that do not work together
+
+    Returns:
+        The new class; instantiate it with a dictionary of overrides
+    """
+    return type(name, (FrozenConfig,), {
+        '__slots__': tuple(defaults),
+        'DEFAULTS': dict(defaults),
+        'CHOICES': dict(choices or {}),
+        'CHECKS': tuple(checks),
+    })
+
+
+def _check_value(key, value, default, choices):
+    """Raise ValueError if value does not fit the setting"""
+    if choices is not None:
+        if value not in choices:
+            raise ValueError(f"Unknown {key}: {value!r} (use {', '.join(map(str, choices))})")
+        return
+    if default is None:
+        # Optional setting; any value goes
+        return
+    if isinstance(default, bool):
+        ok, kind = isinstance(value, bool), 'True or False'
+    elif key.endswith('_pin'):
+        ok, kind = isinstance(value, int) and not isinstance(value, bool), 'a pin number'
+    elif isinstance(default, Number):
+        ok, kind = isinstance(value, Number) and not isinstance(value, bool), 'a number'
+    else:
+        ok, kind = isinstance(value, type(default)), f'a {type(default).__name__}'
+    if not ok:
+        raise ValueError(f"Config {key} must be {kind}, got {value!r}")
+
+
+def load_config_file(path, name='CONFIG'):
+    """
+    Load the settings dictionary from a Python config file like config_example.py
+
+    Args:
+        path: Config file path
+        name: Name of the dictionary in the file
+
+    Returns:
+        The settings dictionary
+
+    Raises:
+        ValueError: If the file does not define the dictionary
+        Exception: Whatever running the file raised (e.g. SyntaxError)
+    """
+    namespace = runpy.run_path(path)
+    config = namespace.get(name)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} does not define a {name} dictionary")
+    return config
+
+
+def _inotify_watch(directory):
+    """
+    Open an inotify descriptor reporting files written or moved into directory
+
+    Returns:
+        The descriptor, or None where inotify is not available
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, TypeError, AttributeError):
+        return None
+    fd = init(os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if add_watch(fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _inotify_names(data):
+    """Return the file names in a buffer of inotify events"""
+    names = set()
+    offset = 0
+    while offset + _INOTIFY_EVENT.size <= len(data):
+        _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+        offset += _INOTIFY_EVENT.size
+        names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+        offset += length
+    return names
+
+
+class ConfigWatcher:
+    """Calls on_change from its own thread, or a scheduler callback, after the config file is saved"""
+
+    def __init__(self, path, on_change, settle=0.2, poll_interval=2.0,
+                 clock=time.monotonic, scheduler=None):
+        """
+        Start watching a file
+
+        Args:
+            path: File to watch; editors that save by replacing it are fine,
+                since the directory is watched
+            on_change: Called with the path once the file has changed and
+                stayed quiet for settle seconds
+            settle: Seconds without further writes before reporting a change
+            poll_interval: Seconds between mtime checks without inotify
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback); when
+                given, no thread is started and the mtime is polled
+        """
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._name = os.path.basename(self.path)
+        if scheduler is not None:
+            self._inotify = None
+            self._stop_read = self._stop_write = None
+            self._thread = None
+            # Last stamp reported, and the one seen by the previous check
+            self._reported = self._checked = self._stamp()
+            self._timer = scheduler.call_at(clock() + poll_interval, self._on_timer)
+            return
+        self._inotify = _inotify_watch(os.path.dirname(self.path))
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    @property
+    def mode(self):
+        """'inotify' or 'poll'"""
+        return 'poll' if self._inotify is None else 'inotify'
+
+    def close(self):
+        """Stop watching"""
+        if self._thread is None:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+        os.write(self._stop_write, b'x')
+        self._thread.join()
+        for fd in (self._stop_read, self._stop_write, self._inotify):
+            if fd is not None:
+                os.close(fd)
+
+    def _stamp(self):
+        """Return what identifies the file's current contents, or None if missing"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _wait(self, timeout):
+        """
+        Wait for a file event, close() or the timeout
+
+        Returns:
+            'changed' (the watched file), 'other' (another file in the
+            directory), 'closed' or 'timeout'
+        """
+        fds = [self._stop_read] if self._inotify is None else [self._stop_read, self._inotify]
+        ready, _, _ = select.select(fds, [], [], timeout)
+        if self._stop_read in ready:
+            return 'closed'
+        if not ready:
+            return 'timeout'
+        names = _inotify_names(os.read(self._inotify, 4096))
+        return 'changed' if self._name in names else 'other'
+
+    def _run(self):
+        """Watcher thread: sleep until the file changes, then report it"""
+        stamp = self._stamp()
+        timeout = self.poll_interval if self._inotify is None else None
+        while True:
+            event = self._wait(timeout)
+            if event == 'closed':
+                return
+            if event == 'other':
+                continue
+            if event == 'changed':
+                # Editors save in several writes; wait until the file is quiet
+                while event != 'timeout':
+                    event = self._wait(self.settle)
+                    if event == 'closed':
+                        return
+            current = self._stamp()
+            if current is None or current == stamp:
+                continue
+            stamp = current
+            self._report()
+
+    def _on_timer(self):
+        """External scheduler callback: report a change once the file has stayed quiet"""
+        current = self._stamp()
+        changed = current is not None and current != self._reported
+        if changed and current == self._checked:
+            self._reported = current
+            self._report()
+            changed = False
+        self._checked = current
+        # Editors save in several writes; check again after settle
+        delay = self.settle if changed else self.poll_interval
+        self._timer = self.scheduler.call_at(self.clock() + delay, self._on_timer)
+
+    def _report(self):
+        """Call on_change, reporting errors instead of raising"""
+        try:
+            self.on_change(self.path)
+        except Exception as e:
+            print(f"Config reload failed: {e}")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Client and load test for the control server
+
+ControlClient pipelines requests over the UNIX socket, the TCP port or a
+WebSocket: every request gets an id, and responses are matched to their
+requests by it, so many can be in flight at once. State events from a
+subscription arrive on client.events.
+
+The load test opens several clients, keeps a window of requests in
+flight on each and reports the round-trip latency of every command, and
+optionally how many state events a set of subscribers received.
+
+Run against a running controller:
+    python3 control_client.py --socket /tmp/buzz-control.sock
+    python3 control_client.py --port 8765 --websocket --command state
+
+or against a controller started on the simulated backend:
+    python3 control_client.py --self-test --command press --action laser --subscribers 20
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from itertools import count
+
+from control_server import (ControlError, OP_CLOSE, OP_PING, OP_PONG, OP_TEXT, encode_frame,
+                            encode_message, read_frame)
+from event_dispatcher import percentile
+
+
+class ControlClient:
+    """Pipelining client for the control server"""
+
+    def __init__(self, reader, writer, websocket=False):
+        """
+        Wrap a connected stream; use ControlClient.connect() to open one
+
+        Args:
+            reader: asyncio StreamReader
+            writer: asyncio StreamWriter
+            websocket: Speak WebSocket frames instead of JSON lines
+        """
+        self.reader = reader
+        self.writer = writer
+        self.websocket = websocket
+        self.events = asyncio.Queue()
+        self._ids = count(1)
+        self._pending = {}
+        self._task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def connect(cls, socket_path=None, host='127.0.0.1', port=None, websocket=False,
+                      origin=None):
+        """
+        Connect to the UNIX socket, or to the TCP port
+
+        Args:
+            socket_path: UNIX socket of the server
+            host: Host of the TCP port
+            port: TCP port, used when no socket_path is given
+            websocket: Upgrade the TCP connection to a WebSocket
+            origin: Origin header to send with the upgrade, as a browser
+                does (None: none)
+
+        Returns:
+            Connected ControlClient
+        """
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            return cls(reader, writer)
+        reader, writer = await asyncio.open_connection(host, port)
+        if websocket:
+            key = 'YnV6ei1jb250cm9sLWtleQ=='
+            origin_header = f'Origin: {origin}\r\n' if origin else ''
+            writer.write((f'GET / HTTP/1.1\r\nHost: {host}:{port}\r\n'
+                          'Upgrade: websocket\r\nConnection: Upgrade\r\n' + origin_header +
+                          f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+            status = await reader.readline()
+            if b' 101 ' not in status:
+                writer.close()
+                raise ConnectionError(f"WebSocket upgrade refused: {status.decode().strip()}")
+            while await reader.readline() not in (b'\r\n', b''):
+                pass
+        return cls(reader, writer, websocket)
+
+    def send(self, cmd=None, batch=None, **args):
+        """
+        Send a request without waiting for its response
+
+        Args:
+            cmd: Command name
+            batch: List of command dictionaries to run as one request instead
+            **args: Command arguments
+
+        Returns:
+            Future resolved with the response dictionary
+        """
+        request_id = next(self._ids)
+        request = {'id': request_id}
+        if batch is not None:
+            request['batch'] = batch
+        else:
+            request['cmd'] = cmd
+            request.update(args)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        payload = encode_message(request)
+        if self.websocket:
+            self.writer.write(encode_frame(payload, mask=os.urandom(4)))
+        else:
+            self.writer.write(payload + b'\n')
+        return future
+
+    async def request(self, cmd, **args):
+        """
+        Run a command and return its result
+
+        Raises:
+            ControlError: If the server reports an error
+        """
+        response = await self.send(cmd, **args)
+        if not response.get('ok'):
+            raise ControlError(response.get('error'))
+        return response.get('result')
+
+    async def batch(self, commands):
+        """Run several commands in one request; return their result dictionaries"""
+        response = await self.send(batch=commands)
+        if not response.get('ok'):
+            raise ControlError(response.get('error'))
+        return response['results']
+
+    async def close(self):
+        """Close the connection"""
+        if self.websocket:
+            self.writer.write(encode_frame(b'\x03\xe8', OP_CLOSE, mask=os.urandom(4)))
+        self.writer.close()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _read_message(self):
+        """Return the next message, or None once the server closes"""
+        if not self.websocket:
+            line = await self.reader.readline()
+            return json.loads(line) if line else None
+        while True:
+            fin, opcode, payload = await read_frame(self.reader)
+            if opcode == OP_CLOSE:
+                return None
+            if opcode == OP_PING:
+                self.writer.write(encode_frame(payload, OP_PONG, mask=os.urandom(4)))
+            elif opcode == OP_TEXT:
+                return json.loads(payload)
+
+    async def _read_loop(self):
+        """Route responses to their requests and events to the events queue"""
+        try:
+            while True:
+                message = await self._read_message()
+                if message is None:
+                    break
+                if 'event' in message:
+                    self.events.put_nowait(message)
+                    continue
+                future = self._pending.pop(message.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Control server closed the connection"))
+            self._pending.clear()
+
+
+async def load_test(connect, clients=4, requests=1000, window=16, command='ping', args=None,
+                    subscribers=0):
+    """
+    Measure command round trips with pipelined clients
+
+    Args:
+        connect: Coroutine function returning a connected ControlClient
+        clients: Concurrent command clients
+        requests: Commands sent by each client
+        window: Most requests in flight per client
+        command: Command to send
+        args: Command arguments
+        subscribers: Extra clients subscribed to state events
+
+    Returns:
+        Dictionary with request count, seconds, requests per second,
+        round-trip p50/p99/max in milliseconds, errors and events received
+    """
+    args = args or {}
+    listeners = [await connect() for _ in range(subscribers)]
+    for listener in listeners:
+        await listener.request('subscribe')
+    senders = [await connect() for _ in range(clients)]
+
+    rtts = []
+    errors = 0
+
+    async def drive(client):
+        nonlocal errors
+        in_flight = asyncio.Semaphore(window)
+
+        def done(future, sent):
+            nonlocal errors
+            in_flight.release()
+            if future.exception() is not None or not future.result().get('ok'):
+                errors += 1
+            else:
+                rtts.append(time.perf_counter() - sent)
+
+        futures = []
+        for _ in range(requests):
+            await in_flight.acquire()
+            sent = time.perf_counter()
+            future = client.send(command, **args)
+            future.add_done_callback(lambda f, sent=sent: done(f, sent))
+            futures.append(future)
+        await asyncio.gather(*futures, return_exceptions=True)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(drive(client) for client in senders))
+    seconds = time.perf_counter() - began
+    # Let the last state events arrive
+    await asyncio.sleep(0.1)
+    events = sum(listener.events.qsize() for listener in listeners)
+    for client in senders + listeners:
+        await client.close()
+
+    total = clients * requests
+    return {
+        'requests': total,
+        'seconds': seconds,
+        'requests_per_s': total / seconds if seconds else 0.0,
+        'rtt_p50_ms': percentile(rtts, 0.50) * 1000,
+        'rtt_p99_ms': percentile(rtts, 0.99) * 1000,
+        'rtt_max_ms': max(rtts, default=0.0) * 1000,
+        'errors': errors,
+        'events': events,
+    }
+
+
+def print_report(result):
+    """Print a load test result"""
+    print(f"{result['requests']} requests in {result['seconds']:.2f} s "
+          f"({result['requests_per_s']:.0f}/s), {result['errors']} error(s)")
+    print(f"Round trip: p50 {result['rtt_p50_ms']:.2f} ms, p99 {result['rtt_p99_ms']:.2f} ms, "
+          f"max {result['rtt_max_ms']:.2f} ms")
+    print(f"State events received by subscribers: {result['events']}")
+
+
+def self_test(args):
+    """Run the load test against a controller on the simulated backend"""
+    from backends import SystemClock
+    from buzz_controller import BuzzController
+    from simulator import DEFAULT_CLIPS, SimulatedBackend, write_silent_clips
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.ExitStack() as stack:
+        write_silent_clips(tmp, DEFAULT_CLIPS)
+        socket_path = os.path.join(tmp, 'control.sock')
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        controller = BuzzController(
+            {'audio_path': tmp, 'control_socket': socket_path, 'reconcile_hold': 0.0},
+            backend=SimulatedBackend(clock=SystemClock())
+        )
+        stack.callback(controller.cleanup)
+        result = asyncio.run(run_load_test(args, socket_path=socket_path))
+    return result
+
+
+async def run_load_test(args, socket_path=None):
+    """Run the load test described by the command line arguments"""
+    async def connect():
+        return await ControlClient.connect(socket_path or args.socket, args.host, args.port,
+                                           websocket=args.websocket)
+
+    command_args = {'action': args.action} if args.command == 'press' else {}
+    return await load_test(connect, clients=args.clients, requests=args.requests,
+                           window=args.window, command=args.command, args=command_args,
+                           subscribers=args.subscribers)
+
+
+def main():
+    """Run the load test from the command line"""
+    parser = argparse.ArgumentParser(description='Control server round-trip load test')
+    parser.add_argument('--socket', help='UNIX socket of the control server')
+    parser.add_argument('--host', default='127.0.0.1', help='Host of the TCP port')
+    parser.add_argument('--port', type=int, help='TCP port of the control server')
+    parser.add_argument('--websocket', action='store_true', help='Connect over WebSocket')
+    parser.add_argument('--self-test', action='store_true',
+                        help='Start a simulated controller and test against it')
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent command clients')
+    parser.add_argument('--requests', type=int, default=1000, help='Commands per client')
+    parser.add_argument('--window', type=int, default=16, help='Requests in flight per client')
+    parser.add_argument('--command', default='ping', help='ping, state, press, ...')
+    parser.add_argument('--action', default='laser', help='Action for --command press')
+    parser.add_argument('--subscribers', type=int, default=0, help='Clients subscribed to state events')
+    args = parser.parse_args()
+
+    if args.self_test:
+        result = self_test(args)
+    elif args.socket or args.port:
+        result = asyncio.run(run_load_test(args))
+    else:
+        parser.error('give --socket, --port or --self-test')
+    print_report(result)
+    return 0 if result['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+"""
+Control server for the Buzz Lightyear Controller
+
+Lets companion apps (a phone, a show-control laptop) do what the buttons
+do, over a UNIX socket and a TCP port on the local network:
+
+- Plain connections exchange one JSON object per line.
+- A TCP connection that opens with an HTTP upgrade request is a
+  WebSocket, with one JSON object per text message, so browsers can
+  connect directly.
+
+A request may carry an id, which is echoed in its response:
+
+    {"id": 1, "cmd": "press", "action": "wing"}
+    {"id": 1, "ok": true, "result": null}
+
+Commands:
+
+- ping: returns the server's monotonic time
+- actions: lists the button actions that can be pressed
+- press {action}: runs the action like a tap of its button
+- show {name} / stop_show: plays or stops a show
+- state: wing, laser, strobe, show and idle state
+- subscribe / unsubscribe: state changes arrive as
+  {"event": "state", "key": "laser", "value": true}
+- stats: server counters
+- dump: writes the event recorder's buffer to disk and returns the file
+- auth {token}: required before anything but ping when control_token is set
+
+The TCP port listens on the loopback interface unless a host is given;
+listening on any other address requires a token. Without a token,
+WebSocket upgrades are only accepted from pages on this machine (or from
+clients that send no Origin), so a web page opened in a browser on the
+Pi cannot drive the costume through ws://127.0.0.1.
+
+Clients may pipeline requests without waiting for responses; responses
+come back in request order. {"id": 2, "batch": [{...}, {...}]} runs
+several commands and answers with one response holding every result.
+
+Everything runs on one asyncio loop: the controller's own for
+AsyncBuzzController, otherwise a thread of its own. Presses are queued
+on the controller's dispatcher like button presses, and state changes
+cross over from the controller's threads with a single
+call_soon_threadsafe, so a slow or stalled client never holds up a GPIO
+callback. Each subscriber keeps at most subscriber_queue undelivered
+events; older ones are dropped and counted instead of growing memory.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from metrics import NULL_METRICS
+
+# Longest request line or WebSocket message accepted, in bytes
+MAX_MESSAGE = 64 * 1024
+
+# Responses queued for a client before its requests stop being read
+MAX_PENDING = 256
+
+# Magic value from RFC 6455 for the handshake accept key
+_WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# WebSocket opcodes
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ControlError(Exception):
+    """A request that cannot be carried out; reported to the client"""
+
+
+def encode_message(message):
+    """Encode a message as compact JSON bytes"""
+    return json.dumps(message, separators=(',', ':')).encode()
+
+
+def websocket_accept(key):
+    """Return the Sec-WebSocket-Accept value for a Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _is_loopback(host):
+    """Return True if only this machine can connect to host"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _is_local_origin(origin):
+    """Return True if a WebSocket Origin header names a page on this machine"""
+    try:
+        host = urlsplit(origin).hostname
+    except ValueError:
+        return False
+    return host is not None and _is_loopback(host)
+
+
+def _mask(payload, key):
+    """XOR a payload with a 4-byte WebSocket masking key"""
+    length = len(payload)
+    if not length:
+        return payload
+    key = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(payload, opcode=OP_TEXT, mask=None):
+    """
+    Encode one final WebSocket frame
+
+    Args:
+        payload: Frame payload bytes
+        opcode: Frame opcode
+        mask: 4-byte masking key; clients must mask, servers must not
+    """
+    length = len(payload)
+    first = 0x80 | opcode
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('!BB', first, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', first, mask_bit | 126, length)
+    else:
+        header = struct.pack('!BBQ', first, mask_bit | 127, length)
+    if mask:
+        return header + mask + _mask(payload, mask)
+    return header + payload
+
+
+async def read_frame(reader):
+    """
+    Read one WebSocket frame
+
+    Returns:
+        Tuple of (fin, opcode, unmasked payload)
+
+    Raises:
+        ValueError: If the frame is larger than MAX_MESSAGE
+        asyncio.IncompleteReadError: If the connection closes mid-frame
+    """
+    head = await reader.readexactly(2)
+    fin = bool(head[0] & 0x80)
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE:
+        raise ValueError(f"WebSocket frame of {length} bytes is too large")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = _mask(payload, mask)
+    return fin, opcode, payload
+
+
+class _Connection:
+    """One client: requests are read in order, responses and events written by one task"""
+
+    def __init__(self, server, reader, writer, websocket):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.websocket = websocket
+        self.authenticated = server.token is None
+        self.task = None
+
+        # Encoded JSON waiting to be written; events may be dropped, responses not
+        self._responses = deque()
+        self._events = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._closing = False
+
+    def send(self, message):
+        """Queue a response"""
+        self._responses.append(encode_message(message))
+        if len(self._responses) >= MAX_PENDING:
+            self._drained.clear()
+        self._wakeup.set()
+
+    def send_event(self, payload):
+        """
+        Queue an encoded event, dropping the oldest if the client is behind
+
+        Returns:
+            True if an older event was dropped
+        """
+        dropped = len(self._events) >= self.server.subscriber_queue
+        if dropped:
+            self._events.popleft()
+        self._events.append(payload)
+        self._wakeup.set()
+        return dropped
+
+    def close(self):
+        """Write what is queued, then stop the writer"""
+        self._closing = True
+        self._wakeup.set()
+
+    async def write_loop(self):
+        """Writer task: flush everything queued in one write per wakeup"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            messages = list(self._responses) + list(self._events)
+            self._responses.clear()
+            self._events.clear()
+            self._drained.set()
+            if messages:
+                self.writer.write(b''.join(self._frame(m) for m in messages))
+                await self.writer.drain()
+            if self._closing:
+                return
+
+    def _frame(self, payload):
+        return encode_frame(payload) if self.websocket else payload + b'\n'
+
+    async def read_lines(self, first=b''):
+        """Handle one request per line until the client disconnects"""
+        line = first
+        while True:
+            if not line:
+                line = await self.reader.readline()
+                if not line:
+                    return
+            if line.strip():
+                await self.server.handle(self, line)
+            line = b''
+            await self._drained.wait()
+
+    async def read_websocket(self):
+        """Handle one request per WebSocket message until the client closes"""
+        parts = []
+        while True:
+            fin, opcode, payload = await read_frame(self.reader)
+            if opcode == OP_CLOSE:
+                self.writer.write(encode_frame(payload[:2], OP_CLOSE))
+                return
+            if opcode == OP_PING:
+                self.writer.write(encode_frame(payload, OP_PONG))
+                continue
+            if opcode == OP_PONG:
+                continue
+            parts.append(payload)
+            if sum(map(len, parts)) > MAX_MESSAGE:
+                raise ValueError("WebSocket message is too large")
+            if fin:
+                await self.server.handle(self, b''.join(parts))
+                parts = []
+                await self._drained.wait()
+
+
+class ControlServer:
+    """Serves controller actions, state and state changes to companion apps"""
+
+    def __init__(self, controller, socket_path=None, host='127.0.0.1', port=None, token=None,
+                 subscriber_queue=64, max_batch=64, metrics=NULL_METRICS):
+        """
+        Initialize the server (start() or start_background() begins serving)
+
+        Args:
+            controller: BuzzController whose actions and state are served
+            socket_path: UNIX socket to listen on, if any
+            host: Address for the TCP port
+            port: TCP port for line and WebSocket clients, if any (0: any free port)
+            token: Shared secret clients must send with auth first, if any;
+                required when host is not a loopback address
+            subscriber_queue: Most undelivered events kept per subscriber
+            max_batch: Most commands in one batch
+            metrics: Registry for command and dropped-event counters
+
+        Raises:
+            ValueError: If the TCP port would be reachable from the network without a token
+        """
+        if port is not None and token is None and not _is_loopback(host):
+            raise ValueError(f"control_host {host!r} is reachable from the network; "
+                             "set a control_token or listen on 127.0.0.1")
+        self.controller = controller
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.token = token
+        self.subscriber_queue = subscriber_queue
+        self.max_batch = max_batch
+
+        self.loop = None
+        self._servers = []
+        self._connections = set()
+        self._subscribers = set()
+        self._thread = None
+        self._stats = {'commands': 0, 'errors': 0, 'events_sent': 0, 'events_dropped': 0,
+                       'origins_refused': 0}
+        self._command_counter = metrics.counter(
+            'buzz_control_commands_total', 'Commands received by the control server')
+        self._dropped_counter = metrics.counter(
+            'buzz_control_events_dropped_total', 'State events dropped for slow subscribers')
+
+        self._commands = {
+            'ping': self._cmd_ping,
+            'auth': self._cmd_auth,
+            'actions': self._cmd_actions,
+            'press': self._cmd_press,
+            'show': self._cmd_show,
+            'stop_show': self._cmd_stop_show,
+            'state': self._cmd_state,
+            'subscribe': self._cmd_subscribe,
+            'unsubscribe': self._cmd_unsubscribe,
+            'stats': self._cmd_stats,
+            'dump': self._cmd_dump,
+        }
+
+    async def start(self):
+        """Start listening on the running loop"""
+        self.loop = asyncio.get_running_loop()
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                # Left behind by a previous run
+                os.unlink(self.socket_path)
+            self._servers.append(await asyncio.start_unix_server(
+                self._on_unix_client, path=self.socket_path, limit=MAX_MESSAGE))
+        if self.port is not None:
+            server = await asyncio.start_server(
+                self._on_tcp_client, self.host, self.port, limit=MAX_MESSAGE)
+            self._servers.append(server)
+            self.port = server.sockets[0].getsockname()[1]
+        self.controller.add_state_listener(self._on_state_change)
+        where = [f"socket {self.socket_path}"] if self.socket_path else []
+        where += [f"port {self.port}"] if self.port is not None else []
+        print(f"Control server listening on {' and '.join(where)}")
+
+    async def aclose(self):
+        """Stop listening and disconnect every client"""
+        self.controller.remove_state_listener(self._on_state_change)
+        for server in self._servers:
+            server.close()
+        tasks = [conn.task for conn in self._connections if conn.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def start_background(self):
+        """
+        Serve from a loop thread of its own; returns once listening
+
+        Raises:
+            OSError: If a socket or port cannot be bound
+        """
+        started = threading.Event()
+        failure = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e:
+                failure.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self._shutdown_background())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name='control-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            self._thread = None
+            raise failure[0]
+
+    async def _shutdown_background(self):
+        """Close, then cancel what is left, such as clients still in the WebSocket handshake"""
+        await self.aclose()
+        leftover = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in leftover:
+            task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+
+    def close(self):
+        """Stop a server started with start_background()"""
+        if self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Return client counts and command/event counters"""
+        stats = dict(self._stats)
+        stats['clients'] = len(self._connections)
+        stats['subscribers'] = len(self._subscribers)
+        return stats
+
+    async def handle(self, conn, data):
+        """Answer one request (runs on the loop)"""
+        try:
+            request = json.loads(data)
+        except ValueError:
+            self._stats['errors'] += 1
+            conn.send({'ok': False, 'error': 'Request is not valid JSON'})
+            return
+        if not isinstance(request, dict):
+            self._stats['errors'] += 1
+            conn.send({'ok': False, 'error': 'Request must be a JSON object'})
+            return
+        response = {'id': request['id']} if 'id' in request else {}
+        if 'batch' in request:
+            commands = request['batch']
+            if not isinstance(commands, list) or len(commands) > self.max_batch:
+                self._stats['errors'] += 1
+                response.update(ok=False, error=f"batch must be a list of at most {self.max_batch} commands")
+            else:
+                response.update(ok=True, results=[await self._run(conn, command) for command in commands])
+        else:
+            response.update(await self._run(conn, request))
+        conn.send(response)
+
+    async def _run(self, conn, request):
+        """Run one command; return {'ok': True, 'result': ...} or {'ok': False, 'error': ...}"""
+        self._stats['commands'] += 1
+        self._command_counter.inc()
+        try:
+            if not isinstance(request, dict):
+                raise ControlError("Command must be a JSON object")
+            cmd = request.get('cmd')
+            handler = self._commands.get(cmd)
+            if handler is None:
+                raise ControlError(f"Unknown command: {cmd}")
+            if not conn.authenticated and cmd not in ('auth', 'ping'):
+                raise ControlError("Not authenticated; send auth with the control token first")
+            result = handler(conn, request)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return {'ok': True, 'result': result}
+        except (ControlError, ValueError) as e:
+            self._stats['errors'] += 1
+            return {'ok': False, 'error': str(e)}
+
+    @staticmethod
+    def _argument(request, name):
+        if name not in request:
+            raise ControlError(f"{request.get('cmd')} needs {name}")
+        return request[name]
+
+    def _cmd_ping(self, conn, request):
+        return {'time': time.monotonic()}
+
+    def _cmd_auth(self, conn, request):
+        token = str(self._argument(request, 'token'))
+        if self.token is not None and not hmac.compare_digest(token, self.token):
+            raise ControlError("Wrong control token")
+        conn.authenticated = True
+
+    def _cmd_actions(self, conn, request):
+        return self.controller.actions()
+
+    def _cmd_press(self, conn, request):
+        self.controller.press(self._argument(request, 'action'))
+
+    def _cmd_show(self, conn, request):
+        name = self._argument(request, 'name')
+        if not self.controller.play_show(name):
+            raise ControlError(f"Show not started: {name}")
+
+    def _cmd_stop_show(self, conn, request):
+        self.controller.shows.stop()
+
+    def _cmd_state(self, conn, request):
+        return self.controller.state()
+
+    def _cmd_subscribe(self, conn, request):
+        self._subscribers.add(conn)
+        return self.controller.state()
+
+    def _cmd_unsubscribe(self, conn, request):
+        self._subscribers.discard(conn)
+
+    def _cmd_stats(self, conn, request):
+        return self.stats()
+
+    async def _cmd_dump(self, conn, request):
+        # Writing the buffer to the SD card must not stall the other clients
+        path = await self.loop.run_in_executor(None, self.controller.dump_recording)
+        if path is None:
+            raise ControlError("Recording is off")
+        return path
+
+    def _on_state_change(self, key, value):
+        """Controller state listener: hand the change to the loop without blocking"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._publish, key, value)
+        except RuntimeError:
+            # Loop closed while shutting down
+            pass
+
+    def _publish(self, key, value):
+        """Queue a state event for every subscriber (runs on the loop)"""
+        if not self._subscribers:
+            return
+        payload = encode_message({'event': 'state', 'key': key, 'value': value})
+        for conn in self._subscribers:
+            if conn.send_event(payload):
+                self._stats['events_dropped'] += 1
+                self._dropped_counter.inc()
+        self._stats['events_sent'] += len(self._subscribers)
+
+    async def _on_unix_client(self, reader, writer):
+        await self._serve(reader, writer, websocket=False)
+
+    async def _on_tcp_client(self, reader, writer):
+        """TCP clients speak JSON lines, or WebSocket if they open with an upgrade"""
+        try:
+            first = await reader.readline()
+        except (ValueError, ConnectionError):
+            writer.close()
+            return
+        if first.startswith(b'GET '):
+            if await self._handshake(reader, writer):
+                await self._serve(reader, writer, websocket=True)
+            else:
+                writer.close()
+            return
+        await self._serve(reader, writer, websocket=False, first=first)
+
+    async def _handshake(self, reader, writer):
+        """Answer a WebSocket upgrade request; return False if it is not one"""
+        headers = {}
+        for _ in range(100):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if 'websocket' not in headers.get('upgrade', '').lower() or not key:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        origin = headers.get('origin')
+        if self.token is None and origin is not None and not _is_local_origin(origin):
+            # A page from elsewhere, running in a browser on this machine
+            self._stats['origins_refused'] += 1
+            writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n')
+            return False
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n').encode())
+        await writer.drain()
+        return True
+
+    async def _serve(self, reader, writer, websocket, first=b''):
+        """Run one client connection until it closes"""
+        conn = _Connection(self, reader, writer, websocket)
+        conn.task = asyncio.current_task()
+        self._connections.add(conn)
+        write_task = asyncio.ensure_future(conn.write_loop())
+        try:
+            if websocket:
+                await conn.read_websocket()
+            else:
+                await conn.read_lines(first)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            # Line or message over MAX_MESSAGE
+            conn.send({'ok': False, 'error': str(e)})
+        finally:
+            self._subscribers.discard(conn)
+            conn.close()
+            try:
+                await asyncio.wait_for(write_task, 1.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+                write_task.cancel()
+            writer.close()
+            # Tracked until here so aclose() waits for the connection to wind down
+            self._connections.discard(conn)
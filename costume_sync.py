@@ -0,0 +1,843 @@
+#!/usr/bin/env python3
+"""
+Synchronized shows across several Buzz costumes
+
+One controller is the leader; the others follow it over UDP multicast on
+the local network:
+
+- Every follower keeps an estimate of the leader's clock. It sends a
+  sync request stamped with its own clock (t1); the leader stamps its
+  receive (t2) and reply (t3) times, and the follower stamps the reply's
+  arrival (t4), as in NTP. Queueing only ever adds delay, so the fastest
+  exchanges are trusted most, and a line fitted through them gives both
+  the offset and the drift (how fast the follower's crystal runs against
+  the leader's) between exchanges.
+- The leader's presses become cues stamped with an execution time a little
+  in the future (sync_lead) on the leader's clock. Every costume,
+  the leader included, runs the cue when its own clock, corrected by the
+  estimate, reaches that time, so the network delay does not show.
+
+Cues carry the target (wings open, this phrase) rather than a toggle, so
+costumes that were out of step come back into step with the next cue.
+Every cue is sent three times over the first half of the lead time and
+deduplicated, so a lost datagram, or a short burst of them on Wi-Fi, does
+not leave a costume behind.
+
+The loopback harness runs several simulated controllers with offset,
+drifting clocks on one virtual clock, joined by an in-process network with
+latency, jitter and loss, and reports the skew between costumes:
+    python3 costume_sync.py --costumes 4 --cues 30
+    python3 costume_sync.py --drift-ppm 200 --jitter 0.005 --loss 0.05
+    python3 costume_sync.py --multicast    (real sockets, in real time)
+"""
+
+import argparse
+import contextlib
+import heapq
+import io
+import json
+import math
+import os
+import random
+import select
+import socket
+import struct
+import sys
+import tempfile
+import time
+from collections import deque
+from itertools import count
+from threading import Lock, Thread, current_thread
+
+from event_dispatcher import percentile
+from metrics import NULL_METRICS
+
+SYNC_ROLES = ('leader', 'follower')
+
+# Administratively scoped multicast group; a TTL of 1 keeps it on the local network
+DEFAULT_GROUP = '239.255.42.99'
+DEFAULT_PORT = 5099
+
+PROTOCOL = 1
+MAX_DATAGRAM = 1400
+
+# Copies sent of every cue, spread over the first half of the lead time;
+# followers run each cue once
+CUE_REPEATS = 3
+# A cue this late is dropped instead of run out of step
+MAX_LATE = 0.5
+# Exchanges at this interval until the estimate has settled
+FAST_INTERVAL = 0.2
+# Drift estimates beyond this are treated as noise (crystals are within 100 ppm)
+MAX_DRIFT = 500e-6
+
+
+def default_name():
+    """
+    Name for a costume that was not given one: host name and a random suffix
+
+    Stock Raspberry Pi OS names every Pi raspberrypi, and costumes drop
+    datagrams sent under their own name, so the host name alone is not
+    unique in the group.
+    """
+    return f"{socket.gethostname()}-{os.urandom(3).hex()}"
+
+
+class ClockEstimator:
+    """Offset and drift of a remote clock from NTP-style exchanges"""
+
+    def __init__(self, samples=32, min_samples=4, min_drift_span=10.0):
+        """
+        Initialize an empty estimate
+
+        Args:
+            samples: Most recent exchanges kept
+            min_samples: Exchanges needed before the estimate counts as synced
+            min_drift_span: Seconds the trusted exchanges must span before
+                drift is estimated
+        """
+        self.min_samples = min_samples
+        self.min_drift_span = min_drift_span
+        self.offset = 0.0
+        self.drift = 0.0
+        self.delay = None
+        self._ref = 0.0
+        self._samples = deque(maxlen=samples)
+
+    @property
+    def synced(self):
+        return len(self._samples) >= self.min_samples
+
+    @property
+    def count(self):
+        return len(self._samples)
+
+    def add(self, t1, t2, t3, t4):
+        """
+        Add one exchange
+
+        Args:
+            t1: Local time the request was sent
+            t2: Remote time the request arrived
+            t3: Remote time the reply was sent
+            t4: Local time the reply arrived
+
+        Returns:
+            Tuple of (offset, round-trip delay) of this exchange
+        """
+        delay = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        self._samples.append(((t1 + t4) / 2, offset, delay))
+        self._fit()
+        return offset, delay
+
+    def reset(self):
+        """Forget every exchange, e.g. when the remote clock restarted"""
+        self._samples.clear()
+        self.offset = 0.0
+        self.drift = 0.0
+        self.delay = None
+        self._ref = 0.0
+
+    def to_remote(self, local):
+        """Convert a local time to the remote clock"""
+        return local + self.offset + self.drift * (local - self._ref)
+
+    def to_local(self, remote):
+        """Convert a remote time to the local clock"""
+        return (remote - self.offset + self.drift * self._ref) / (1 + self.drift)
+
+    def _fit(self):
+        """Fit offset and drift through the fastest half of the exchanges"""
+        samples = sorted(self._samples, key=lambda sample: sample[2])
+        trusted = samples[:max(2, (len(samples) + 1) // 2)]
+        self.delay = samples[0][2]
+        times = [sample[0] for sample in trusted]
+        if len(trusted) < 3 or max(times) - min(times) < self.min_drift_span:
+            # Too little history for a slope; use the fastest exchange
+            self._ref, self.offset = samples[0][0], samples[0][1]
+            return
+        mean_t = sum(times) / len(times)
+        mean_offset = sum(sample[1] for sample in trusted) / len(trusted)
+        spread = sum((t - mean_t) ** 2 for t in times)
+        slope = sum((t - mean_t) * (sample[1] - mean_offset)
+                    for t, sample in zip(times, trusted)) / spread
+        self._ref = mean_t
+        self.offset = mean_offset
+        self.drift = max(-MAX_DRIFT, min(MAX_DRIFT, slope))
+
+
+class MulticastTransport:
+    """UDP multicast socket shared by every costume in the group"""
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, interface='0.0.0.0', ttl=1):
+        """
+        Join a multicast group
+
+        Args:
+            group: Multicast group address
+            port: UDP port
+            interface: Address of the interface to join on (0.0.0.0: default)
+            ttl: Hops datagrams may travel; 1 keeps them on the local network
+
+        Raises:
+            OSError: If the socket cannot be bound or the group joined
+        """
+        self.group = group
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            # Several costumes on one host (or a restarted one) share the port
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(('', port))
+            membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.sock.setblocking(False)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, data):
+        """Send a datagram to the whole group"""
+        self.sock.sendto(data, (self.group, self.port))
+
+    def recv(self):
+        """Return the next datagram, or None if none is waiting"""
+        try:
+            return self.sock.recv(MAX_DATAGRAM)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def close(self):
+        self.sock.close()
+
+
+class LoopbackNetwork:
+    """In-process stand-in for a multicast group, delivering on a virtual clock"""
+
+    def __init__(self, clock, latency=0.002, jitter=0.001, loss=0.0, seed=0):
+        """
+        Initialize the network
+
+        Args:
+            clock: Clock with call_later(delay, callback, *args) that delivers
+                the datagrams, such as the simulator's VirtualClock
+            latency: Smallest one-way delay in seconds
+            jitter: Extra random one-way delay, up to this many seconds
+            loss: Fraction of datagrams lost
+            seed: Random seed for jitter and loss
+        """
+        self.clock = clock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.sent = 0
+        self.lost = 0
+        self._rng = random.Random(seed)
+        self._endpoints = []
+
+    def endpoint(self):
+        """Return a new transport attached to the network"""
+        endpoint = LoopbackEndpoint(self)
+        self._endpoints.append(endpoint)
+        return endpoint
+
+    def _send(self, source, data):
+        """Deliver a datagram to every other endpoint after its own delay"""
+        self.sent += 1
+        for endpoint in self._endpoints:
+            if endpoint is source or endpoint.receiver is None:
+                continue
+            if self._rng.random() < self.loss:
+                self.lost += 1
+                continue
+            delay = self.latency + self._rng.uniform(0.0, self.jitter)
+            self.clock.call_later(delay, endpoint.deliver, data)
+
+
+class LoopbackEndpoint:
+    """Transport of one costume on a LoopbackNetwork"""
+
+    def __init__(self, network):
+        self.network = network
+        self.receiver = None
+
+    def listen(self, receiver):
+        """Call receiver(data) for every datagram that arrives"""
+        self.receiver = receiver
+
+    def send(self, data):
+        """Send a datagram to every other endpoint"""
+        self.network._send(self, data)
+
+    def deliver(self, data):
+        if self.receiver is not None:
+            self.receiver(data)
+
+    def close(self):
+        self.receiver = None
+
+
+class CostumeSync:
+    """Leader or follower in a group of synchronized costumes"""
+
+    def __init__(self, role, transport, on_cue, name=None, lead=0.25, interval=2.0,
+                 clock=time.monotonic, scheduler=None, on_arrival=None, metrics=NULL_METRICS):
+        """
+        Join the group
+
+        Args:
+            role: 'leader' or 'follower'
+            transport: MulticastTransport, or a transport with listen(receiver)
+                such as a LoopbackEndpoint when a scheduler is given
+            on_cue: Called with (action, value) when a cue is due
+            name: Name of this costume in the group, unique within it
+                (default: default_name())
+            lead: Seconds between the leader sending a cue and every costume running it
+            interval: Seconds between clock exchanges once synced
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given and the transport has listen(),
+                no thread is started and datagrams arrive through it
+            on_arrival: Optional callable run with (action, value) when a
+                cue arrives, before it is due, e.g. to wake the costume from
+                idle and decode the cue's phrase ahead
+            metrics: Registry for cue counters
+
+        Raises:
+            ValueError: On an unknown role
+        """
+        if role not in SYNC_ROLES:
+            raise ValueError(f"Unknown sync role: {role} (use {', '.join(SYNC_ROLES)})")
+
+        self.role = role
+        self.leader = role == 'leader'
+        self.transport = transport
+        self.on_cue = on_cue
+        self.name = name or default_name()
+        self.lead = lead
+        self.interval = interval
+        self.clock = clock
+        # A socket transport is read with select on the sync thread
+        self.scheduler = scheduler if hasattr(transport, 'listen') else None
+        self.on_arrival = on_arrival
+
+        self._lock = Lock()
+        self._running = True
+        # Changes whenever the leader restarts, so followers start over
+        self._epoch = random.getrandbits(32)
+        self._seq = count(1)
+        self._cues = []
+        self._resends = []
+        self._seen = deque(maxlen=64)
+        self._estimator = ClockEstimator()
+        self._leader_epoch = None
+        self._requests = {}
+        self._next_sync = None if self.leader else clock()
+        self._peers = {}
+        self._lateness = deque(maxlen=256)
+        self._stats = {'cues_sent': 0, 'cues_run': 0, 'late': 0, 'dropped': 0, 'unsynced': 0,
+                       'exchanges': 0, 'send_errors': 0}
+        self._cue_counter = metrics.counter(
+            'buzz_sync_cues_total', 'Synchronized cues run', role=role)
+        self._late_counter = metrics.counter(
+            'buzz_sync_late_cues_total', 'Synchronized cues that arrived after their time', role=role)
+
+        self._timer = None
+        self._thread = None
+        if self.scheduler is not None:
+            transport.listen(self._on_datagram)
+            with self._lock:
+                self._arm()
+        else:
+            self._wake_read, self._wake_write = os.pipe()
+            self._thread = Thread(target=self._run, name='costume-sync', daemon=True)
+            self._thread.start()
+
+    @property
+    def synced(self):
+        """True once cues can be run on the leader's time"""
+        if self.leader:
+            return True
+        with self._lock:
+            return self._estimator.synced
+
+    def now(self):
+        """Return the current time on the leader's clock"""
+        with self._lock:
+            return self._group_time(self.clock())
+
+    def cue(self, action, value=None, lead=None):
+        """
+        Run an action on every costume at the same moment (leader only)
+
+        Args:
+            action: Cue action, passed to on_cue
+            value: Cue value; a target, not a toggle, e.g. 'horizontal'
+            lead: Seconds until the cue runs (default: self.lead)
+
+        Returns:
+            The time on the leader's clock at which the cue runs
+
+        Raises:
+            RuntimeError: If this costume is a follower
+        """
+        if not self.leader:
+            raise RuntimeError("Only the sync leader sends cues")
+        with self._lock:
+            seq = next(self._seq)
+            at = self.clock() + (self.lead if lead is None else lead)
+            message = {'type': 'cue', 'epoch': self._epoch, 'seq': seq, 'at': at,
+                       'action': action, 'value': value}
+            self._send(message)
+            now = self.clock()
+            for i in range(1, CUE_REPEATS):
+                heapq.heappush(self._resends,
+                               (now + (at - now) * i / (2 * (CUE_REPEATS - 1)), seq, message))
+            self._stats['cues_sent'] += 1
+            heapq.heappush(self._cues, (at, seq, action, value))
+            self._arm()
+        return at
+
+    def peers(self):
+        """
+        Return what the leader knows about each follower
+
+        Returns:
+            Dictionary of follower name -> offset and round-trip delay in ms,
+            drift in ppm, late and dropped cue counts and seconds since last heard
+        """
+        with self._lock:
+            now = self.clock()
+            return {name: dict(peer, seen=now - peer['seen']) for name, peer in self._peers.items()}
+
+    def stats(self):
+        """Return cue and exchange counters, the clock estimate and how late cues ran"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['role'] = self.role
+            stats['synced'] = self.leader or self._estimator.synced
+            if not self.leader:
+                stats['offset_ms'] = self._estimator.offset * 1000
+                stats['drift_ppm'] = self._estimator.drift * 1e6
+                stats['delay_ms'] = None if self._estimator.delay is None \
+                    else self._estimator.delay * 1000
+            lateness = list(self._lateness)
+        stats['late_p99_ms'] = percentile(lateness, 0.99) * 1000
+        return stats
+
+    def close(self):
+        """Leave the group"""
+        with self._lock:
+            self._running = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._thread is not None:
+            os.write(self._wake_write, b'x')
+            self._thread.join()
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+        self.transport.close()
+
+    def _group_time(self, local):
+        """Convert a local time to the leader's clock (lock must be held)"""
+        return local if self.leader else self._estimator.to_remote(local)
+
+    def _send(self, message):
+        """Send a message to the group (lock must be held)"""
+        message['v'] = PROTOCOL
+        message['from'] = self.name
+        try:
+            self.transport.send(json.dumps(message, separators=(',', ':')).encode())
+        except OSError:
+            # Wi-Fi dropping out must not stop the costume; the next exchange retries
+            self._stats['send_errors'] += 1
+
+    def _arm(self):
+        """Schedule the next wakeup for a due cue or exchange (lock must be held)"""
+        deadline = self._deadline()
+        if self.scheduler is not None:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if deadline is not None and self._running:
+                self._timer = self.scheduler.call_at(deadline, self._on_timer)
+        elif self._thread is not None and current_thread() is not self._thread:
+            os.write(self._wake_write, b'x')
+
+    def _deadline(self):
+        """Return when the next cue or exchange is due (lock must be held)"""
+        deadlines = [queue[0][0] for queue in (self._cues, self._resends) if queue]
+        if self._next_sync is not None:
+            deadlines.append(self._next_sync)
+        return min(deadlines, default=None)
+
+    def _step(self, now):
+        """
+        Send due clock exchanges and cue copies, and collect due cues (lock must be held)
+
+        Returns:
+            List of (action, value) to run
+        """
+        if self._next_sync is not None and now >= self._next_sync:
+            self._request_sync(now)
+        while self._resends and self._resends[0][0] <= now:
+            self._send(heapq.heappop(self._resends)[2])
+        due = []
+        while self._cues and self._cues[0][0] <= now:
+            at, seq, action, value = heapq.heappop(self._cues)
+            self._lateness.append(now - at)
+            self._stats['cues_run'] += 1
+            due.append((action, value))
+        return due
+
+    def _request_sync(self, now):
+        """Send a clock exchange request (lock must be held)"""
+        seq = next(self._seq)
+        self._requests[seq] = now
+        # Replies that never came are forgotten
+        for old in [s for s in self._requests if s < seq - 8]:
+            del self._requests[old]
+        estimator = self._estimator
+        self._send({'type': 'sync', 'seq': seq, 't1': now,
+                    'offset': estimator.offset, 'drift': estimator.drift, 'delay': estimator.delay,
+                    'late': self._stats['late'], 'dropped': self._stats['dropped']})
+        settled = estimator.count >= 2 * estimator.min_samples
+        self._next_sync = now + (self.interval if settled else FAST_INTERVAL)
+
+    def _on_datagram(self, data):
+        """Handle one datagram from the group"""
+        received = self.clock()
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(message, dict) or message.get('v') != PROTOCOL \
+                or message.get('from') == self.name:
+            return
+        kind = message.get('type')
+        arrived = None
+        try:
+            with self._lock:
+                if not self._running:
+                    return
+                if kind == 'sync' and self.leader:
+                    self._on_sync_request(message, received)
+                elif kind == 'sync_reply' and not self.leader and message.get('to') == self.name:
+                    self._on_sync_reply(message, received)
+                elif kind == 'cue' and not self.leader:
+                    arrived = self._on_cue(message, received)
+                due = self._step(self.clock())
+                self._arm()
+        except (KeyError, TypeError, ValueError):
+            # Malformed message from some other program on the group
+            return
+        if arrived is not None and self.on_arrival is not None:
+            self.on_arrival(*arrived)
+        self._run_cues(due)
+
+    def _on_sync_request(self, message, received):
+        """Leader: answer a clock exchange and note the follower's estimate (lock must be held)"""
+        self._send({'type': 'sync_reply', 'to': message['from'], 'epoch': self._epoch,
+                    'seq': message['seq'], 't1': message['t1'], 't2': received,
+                    't3': self.clock()})
+        delay = message.get('delay')
+        self._peers[message['from']] = {
+            'offset_ms': message['offset'] * 1000,
+            'drift_ppm': message['drift'] * 1e6,
+            'delay_ms': None if delay is None else delay * 1000,
+            'late': message.get('late', 0),
+            'dropped': message.get('dropped', 0),
+            'seen': received,
+        }
+
+    def _on_sync_reply(self, message, received):
+        """Follower: add a clock exchange to the estimate (lock must be held)"""
+        t1 = self._requests.pop(message['seq'], None)
+        if t1 is None or t1 != message['t1']:
+            return
+        if message['epoch'] != self._leader_epoch:
+            # A new leader, or the leader restarted with a new clock
+            self._estimator.reset()
+            self._leader_epoch = message['epoch']
+        self._estimator.add(t1, message['t2'], message['t3'], received)
+        self._stats['exchanges'] += 1
+
+    def _on_cue(self, message, received):
+        """
+        Follower: schedule a cue on the local clock (lock must be held)
+
+        Returns:
+            (action, value) if the cue is new, else None
+        """
+        key = (message['epoch'], message['seq'])
+        if key in self._seen:
+            return None
+        self._seen.append(key)
+        action, value = message['action'], message.get('value')
+        if message['epoch'] != self._leader_epoch or not self._estimator.count:
+            # No estimate of this leader's clock yet: run at once rather than never
+            self._stats['unsynced'] += 1
+            heapq.heappush(self._cues, (received, message['seq'], action, value))
+            return action, value
+        at = self._estimator.to_local(message['at'])
+        if at < received:
+            if received - at > MAX_LATE:
+                self._stats['dropped'] += 1
+                return None
+            self._stats['late'] += 1
+            self._late_counter.inc()
+        heapq.heappush(self._cues, (at, message['seq'], action, value))
+        return action, value
+
+    def _run_cues(self, due):
+        """Run due cues outside the lock"""
+        for action, value in due:
+            self._cue_counter.inc()
+            try:
+                self.on_cue(action, value)
+            except Exception as e:
+                print(f"Sync cue {action} failed: {e}")
+
+    def _on_timer(self):
+        """External scheduler callback: run due cues and exchanges"""
+        with self._lock:
+            self._timer = None
+            if not self._running:
+                return
+            due = self._step(self.clock())
+            self._arm()
+        self._run_cues(due)
+
+    def _run(self):
+        """Sync thread: sleep in select until a datagram, a due cue or exchange, or close()"""
+        while True:
+            with self._lock:
+                if not self._running:
+                    return
+                deadline = self._deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            ready, _, _ = select.select([self._wake_read, self.transport], [], [], timeout)
+            if self._wake_read in ready:
+                os.read(self._wake_read, 64)
+            if self.transport in ready:
+                data = self.transport.recv()
+                while data is not None:
+                    self._on_datagram(data)
+                    data = self.transport.recv()
+            with self._lock:
+                if not self._running:
+                    return
+                due = self._step(self.clock())
+            self._run_cues(due)
+
+
+
+class DriftingClock:
+    """Clock of one simulated costume: offset from, and running fast or slow against, a base clock"""
+
+    def __init__(self, base, offset=0.0, drift_ppm=0.0):
+        """
+        Args:
+            base: Shared clock, e.g. a VirtualClock or SystemClock
+            offset: Seconds this clock reads ahead of the base
+            drift_ppm: Parts per million this clock runs fast (negative: slow)
+        """
+        self.base = base
+        self.offset = offset
+        self.rate = 1 + drift_ppm * 1e-6
+        self.virtual = base.virtual
+
+    def monotonic(self):
+        return self.from_base(self.base.monotonic())
+
+    def to_base(self, local):
+        """Convert a reading of this clock to the base clock"""
+        return (local - self.offset) / self.rate
+
+    def from_base(self, when):
+        """Convert a base clock time to this clock"""
+        return self.offset + when * self.rate
+
+    def sleep(self, seconds):
+        self.base.sleep(seconds / self.rate)
+
+    def call_at(self, when, callback, *args):
+        # Rounded up, so the timer never runs while this clock still reads before when
+        base_when = self.to_base(when)
+        while self.from_base(base_when) < when:
+            base_when = math.nextafter(base_when, math.inf)
+        return self.base.call_at(base_when, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.monotonic() + delay, callback, *args)
+
+
+def run_sync_test(costumes=3, cues=20, spacing=2.0, settle=30.0, latency=0.002, jitter=0.001,
+                  loss=0.0, drift_ppm=100.0, max_offset=60.0, lead=0.25, seed=0, multicast=False,
+                  port=DEFAULT_PORT + 1):
+    """
+    Run simulated costumes in one process and measure how far apart they act
+
+    The leader presses wing, laser and phrase in turn; every press is a cue
+    that plays a sound on every costume, and the skew of a cue is the spread
+    of the moments those sounds started, in true (base clock) time.
+
+    Args:
+        costumes: Number of costumes, one of them the leader
+        cues: Presses made by the leader
+        spacing: Seconds between presses
+        settle: Seconds the followers sync before the first press
+        latency: Smallest one-way network delay in seconds
+        jitter: Extra random one-way delay, up to this many seconds
+        loss: Fraction of datagrams lost
+        drift_ppm: Largest clock drift of a costume against true time
+        max_offset: Largest clock offset of a costume in seconds
+        lead: Seconds between a press and its cue running
+        seed: Random seed for clocks and the network
+        multicast: Use real multicast sockets in real time instead of the
+            loopback network on a virtual clock (latency, jitter and loss
+            then come from the network stack)
+        port: UDP port for multicast, apart from running costumes by default
+
+    Returns:
+        Dictionary with skew_p50/p99/max_ms, unsynced_skew_max_ms (the skew
+        had every costume run cues on its own uncorrected clock),
+        offset_error_max_ms (follower estimates against the leader's
+        clock), missed cue runs and the follower sync stats
+    """
+    from backends import SystemClock
+    from buzz_controller import BuzzController
+    from simulator import DEFAULT_CLIPS, SimulatedBackend, VirtualClock, write_silent_clips
+
+    rng = random.Random(seed)
+    base = SystemClock() if multicast else VirtualClock()
+    network = None if multicast else LoopbackNetwork(base, latency, jitter, loss, seed)
+
+    def wait(seconds):
+        if multicast:
+            time.sleep(seconds)
+        else:
+            base.advance(seconds)
+
+    with tempfile.TemporaryDirectory() as audio_path, contextlib.ExitStack() as stack:
+        write_silent_clips(audio_path, DEFAULT_CLIPS)
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        controllers = []
+        for i in range(costumes):
+            # The leader's clock is the reference; followers are off by up to max_offset
+            clock = DriftingClock(base,
+                                  offset=0.0 if i == 0 else rng.uniform(-max_offset, max_offset),
+                                  drift_ppm=rng.uniform(-drift_ppm, drift_ppm))
+            controller = BuzzController(
+                {'audio_path': audio_path, 'reconcile_hold': 0.0, 'sync_lead': lead,
+                 'config_watch': False},
+                backend=SimulatedBackend(clock=clock)
+            )
+            stack.callback(controller.cleanup)
+            transport = MulticastTransport(port=port) if multicast else network.endpoint()
+            controller.start_sync(SYNC_ROLES[0] if i == 0 else SYNC_ROLES[1], transport,
+                                  name=f'buzz{i}')
+            controllers.append(controller)
+
+        leader = controllers[0]
+        wait(settle)
+        marks = [len(controller.backend.trace) for controller in controllers]
+        for i in range(cues):
+            leader.press(('wing', 'laser', 'phrase')[i % 3])
+            wait(spacing)
+        leader.dispatcher.wait_idle(5.0)
+
+        # Sound starts of every costume, in true time
+        starts = []
+        for controller, mark in zip(controllers, marks):
+            clock = controller.clock
+            starts.append([(clock.to_base(event.time), event.target)
+                           for event in controller.backend.trace[mark:] if event.kind == 'sound'])
+        played = len(starts[0])
+        skews, unsynced = [], []
+        missed = 0
+        for when, clip in starts[0]:
+            times = [when]
+            for costume in starts[1:]:
+                # The same clip started closest to the leader's is this cue's
+                matches = [t for t, name in costume if name == clip and abs(t - when) < spacing / 2]
+                if matches:
+                    times.append(min(matches, key=lambda t: abs(t - when)))
+                else:
+                    missed += 1
+            skews.append(max(times) - min(times))
+            # Without sync, a costume runs the cue when its own clock reads the leader's time
+            at = leader.clock.from_base(when)
+            ideal = [controller.clock.to_base(at) for controller in controllers]
+            unsynced.append(max(ideal) - min(ideal))
+        errors = [abs(controller.sync.now() - leader.clock.monotonic()) for controller in controllers[1:]]
+        follower_stats = {controller.sync.name: controller.sync.stats() for controller in controllers[1:]}
+        network_stats = None if network is None else {'sent': network.sent, 'lost': network.lost}
+    return {
+        'costumes': costumes,
+        'cues': cues,
+        'played': played,
+        'missed': missed,
+        'skew_p50_ms': percentile(skews, 0.50) * 1000,
+        'skew_p99_ms': percentile(skews, 0.99) * 1000,
+        'skew_max_ms': max(skews, default=0.0) * 1000,
+        'unsynced_skew_max_ms': max(unsynced, default=0.0) * 1000,
+        'offset_error_max_ms': max(errors, default=0.0) * 1000,
+        'followers': follower_stats,
+        'network': network_stats,
+    }
+
+
+def print_sync_report(result):
+    """Print a sync test result"""
+    print(f"{result['costumes']} costumes, {result['cues']} cues, "
+          f"{result['played']} sounds on the leader, {result['missed']} missed by followers")
+    print(f"Skew between costumes: p50 {result['skew_p50_ms']:.3f} ms, "
+          f"p99 {result['skew_p99_ms']:.3f} ms, max {result['skew_max_ms']:.3f} ms")
+    print(f"Skew without clock sync: max {result['unsynced_skew_max_ms']:.0f} ms")
+    print(f"Follower clock error: max {result['offset_error_max_ms']:.3f} ms")
+    for name, stats in result['followers'].items():
+        print(f"  {name}: drift {stats['drift_ppm']:+.1f} ppm, delay {stats['delay_ms']:.2f} ms, "
+              f"{stats['exchanges']} exchanges, {stats['late']} late, {stats['dropped']} dropped")
+    if result['network'] is not None:
+        print(f"Network: {result['network']['sent']} datagrams sent, "
+              f"{result['network']['lost']} deliveries lost")
+
+
+def main():
+    """Run the loopback sync test from the command line"""
+    parser = argparse.ArgumentParser(description='Multi-costume sync test')
+    parser.add_argument('--costumes', type=int, default=3, help='Costumes, one of them the leader')
+    parser.add_argument('--cues', type=int, default=20, help='Presses made by the leader')
+    parser.add_argument('--spacing', type=float, default=2.0, help='Seconds between presses')
+    parser.add_argument('--settle', type=float, default=30.0, help='Seconds of syncing before the first press')
+    parser.add_argument('--latency', type=float, default=0.002, help='Smallest one-way delay (s)')
+    parser.add_argument('--jitter', type=float, default=0.001, help='Extra random one-way delay (s)')
+    parser.add_argument('--loss', type=float, default=0.0, help='Fraction of datagrams lost')
+    parser.add_argument('--drift-ppm', type=float, default=100.0, help='Largest clock drift')
+    parser.add_argument('--lead', type=float, default=0.25, help='Seconds from press to cue')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--multicast', action='store_true',
+                        help='Use real multicast sockets in real time')
+    parser.add_argument('--json', help='Also write the result to this file')
+    args = parser.parse_args()
+
+    result = run_sync_test(args.costumes, args.cues, args.spacing, args.settle, args.latency,
+                           args.jitter, args.loss, args.drift_ppm, lead=args.lead, seed=args.seed,
+                           multicast=args.multicast)
+    print_sync_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if result['missed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Deadline-driven background work for the Buzz Lightyear Controller
+
+Servo moves, the strobe, LED frames, show cues, stream fades, gesture
+timers, the reconciler and the idle monitor all work the same way: state
+guarded by a lock, and a step that must run once the next deadline has
+passed. DeadlineWorker does the waiting for all of them:
+
+- without a scheduler the step runs on a thread of its own, started on
+  first use, that sleeps on the condition until the deadline
+- with a scheduler (anything with call_at(when, callback) returning a
+  handle with cancel(), such as the simulator's virtual clock or an
+  asyncio loop wrapped in LoopScheduler) one timer is armed at a time and
+  the step runs from its callback, with no thread
+
+The owner keeps its state under worker.cond, calls schedule(when) with the
+lock held whenever the next deadline changes, and has its step called
+with the lock held once that deadline has passed.
+"""
+
+import asyncio
+import time
+from threading import Condition, Thread, current_thread
+
+
+class DeadlineWorker:
+    """Runs a step at the scheduled deadline, on its own thread or an external scheduler"""
+
+    def __init__(self, step, name, clock=time.monotonic, scheduler=None, on_start=None):
+        """
+        Initialize the worker (the thread starts on the first schedule())
+
+        Args:
+            step: Called as step(now) with the lock held once the deadline
+                has passed. Returns (next deadline or None, after), where
+                after is None or a callable to run once the lock is released.
+                A None deadline keeps anything the step scheduled itself.
+            name: Name of the worker thread
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+            on_start: Optional callable run first on the worker thread
+        """
+        self.step = step
+        self.name = name
+        self.clock = clock
+        self.scheduler = scheduler
+        self.on_start = on_start
+
+        self.cond = Condition()
+        self._deadline = None
+        self._running = True
+        self._timer = None
+        self._thread = None
+
+    @property
+    def deadline(self):
+        """When the step runs next, or None (lock must be held)"""
+        return self._deadline
+
+    @property
+    def running(self):
+        """False once close() has been called"""
+        return self._running
+
+    def schedule(self, when):
+        """Run the step at when, replacing the current deadline (lock must be held)"""
+        if not self._running:
+            return
+        self._deadline = when
+        if self.scheduler is not None:
+            self._cancel_timer()
+            self._timer = self.scheduler.call_at(when, self._on_timer)
+        elif self._thread is None:
+            self._thread = Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        # Owners may wait on the same condition, so wake everyone
+        self.cond.notify_all()
+
+    def cancel(self):
+        """Drop the current deadline (lock must be held)"""
+        self._deadline = None
+        self._cancel_timer()
+
+    def close(self):
+        """Stop running steps and wait for the thread to finish"""
+        with self.cond:
+            self._running = False
+            self.cancel()
+            self.cond.notify_all()
+        if self._thread is not None and self._thread is not current_thread():
+            self._thread.join()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _run_step(self, now):
+        """Run the step for the passed deadline and arm the next (lock must be held)"""
+        self._deadline = None
+        deadline, after = self.step(now)
+        if deadline is not None:
+            self.schedule(deadline)
+        return after
+
+    def _on_timer(self):
+        """External scheduler callback: run one step"""
+        with self.cond:
+            self._timer = None
+            if not self._running or self._deadline is None:
+                return
+            after = self._run_step(self.clock())
+        if after is not None:
+            after()
+
+    def _run(self):
+        """Worker thread: sleep until the deadline, then run the step"""
+        if self.on_start is not None:
+            self.on_start()
+        while True:
+            with self.cond:
+                while self._running:
+                    now = self.clock()
+                    if self._deadline is not None and now >= self._deadline:
+                        break
+                    self.cond.wait(None if self._deadline is None else self._deadline - now)
+                if not self._running:
+                    return
+                after = self._run_step(now)
+            if after is not None:
+                after()
+
+
+class LoopTimer:
+    """Timer armed by LoopScheduler; cancel() is safe from any thread"""
+
+    __slots__ = ('callback', 'args', 'cancelled')
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # The loop may already hold the handle; the flag makes it a no-op
+        self.cancelled = True
+
+    def _arm(self, loop, when):
+        if not self.cancelled:
+            loop.call_at(when, self._fire)
+
+    def _fire(self):
+        if not self.cancelled:
+            self.callback(*self.args)
+
+
+class LoopScheduler:
+    """
+    call_at() on an asyncio event loop, safe to call from any thread
+
+    Timer callbacks always run on the loop. Times are on the loop's clock,
+    loop.time(), which is time.monotonic() for the default loops.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def time(self):
+        return self.loop.time()
+
+    def call_at(self, when, callback, *args):
+        """Schedule callback(*args) on the loop at loop time when"""
+        timer = LoopTimer(callback, args)
+        if self._on_loop():
+            timer._arm(self.loop, when)
+        else:
+            self.loop.call_soon_threadsafe(timer._arm, self.loop, when)
+        return timer
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
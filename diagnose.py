@@ -4,12 +4,35 @@ Diagnostic script for Buzz Lightyear Controller
 
 This script helps diagnose hardware and software issues.
 Run with: sudo python3 diagnose.py
+
+With --perf it measures performance instead (GPIO, edge callbacks, PWM,
+mixer, clip decoding, strobe) and writes a JSON report to compare across
+Pi models and SD cards:
+    sudo python3 diagnose.py --perf --loopback 5:6 --json pi4-sandisk.json
+    sudo python3 diagnose.py --perf --compare pi4-sandisk.json
 """
 
+import argparse
+import json
 import sys
 import os
 import subprocess
 
+# Clips the controller plays
+REQUIRED_AUDIO_FILES = [
+    'wings_open.wav',
+    'wings_close.wav',
+    'laser_on.wav',
+    'laser_off.wav',
+    'to_infinity.wav',
+    'buzz_lightyear.wav',
+    'not_flying.wav',
+    'space_ranger.wav'
+]
+
+# Compiled clips slower than this to decode are flagged
+SLOW_DECODE_MS = 50.0
+
 def print_header(text):
     """Print a section header"""
     print("\n" + "="*50)
@@ -90,16 +113,7 @@ def check_audio_files():
     """Check if audio files exist"""
     print_header("Audio Files")
     
-    required_files = [
-        'wings_open.wav',
-        'wings_close.wav',
-        'laser_on.wav',
-        'laser_off.wav',
-        'to_infinity.wav',
-        'buzz_lightyear.wav',
-        'not_flying.wav',
-        'space_ranger.wav'
-    ]
+    required_files = REQUIRED_AUDIO_FILES
     
     audio_path = 'audio'
     missing = []
@@ -124,6 +138,68 @@ def check_audio_files():
         print("\n✓ All required audio files present")
         return True
 
+def check_audio_manifest():
+    """Check compiled audio against the mixer format and memory budget"""
+    print_header("Compiled Audio")
+    from build_audio import clip_hash, compiled_audio_path, load_manifest, manifest_matches
+    from buzz_controller import DEFAULT_CONFIG
+    
+    audio_path = 'audio'
+    compiled = compiled_audio_path(audio_path)
+    manifest = load_manifest(compiled)
+    if manifest is None:
+        print("⚠️  No compiled audio manifest found")
+        print("  Build it with: python3 build_audio.py")
+        return False
+    
+    ok = True
+    fmt = manifest['format']
+    if manifest_matches(manifest, DEFAULT_CONFIG['mixer_frequency'],
+                        DEFAULT_CONFIG['mixer_size'], DEFAULT_CONFIG['mixer_channels']):
+        print(f"✓ Built for the mixer format ({fmt['frequency']} Hz, "
+              f"{abs(fmt['size'])}-bit, {fmt['channels']} channel(s))")
+    else:
+        print(f"✗ Built for {fmt['frequency']} Hz, {abs(fmt['size'])}-bit, "
+              f"{fmt['channels']} channel(s), which does not match the mixer")
+        ok = False
+    
+    clips = manifest.get('clips', {})
+    total_bytes = 0
+    for filename in REQUIRED_AUDIO_FILES:
+        clip = clips.get(filename)
+        source = os.path.join(audio_path, filename)
+        if clip is None or not os.path.exists(os.path.join(compiled, filename)):
+            print(f"✗ {filename} - NOT COMPILED")
+            ok = False
+            continue
+        if os.path.exists(source) and clip_hash(source, manifest['settings']) != clip['hash']:
+            print(f"⚠️  {filename} - changed since last build")
+            ok = False
+        if not clip.get('converted'):
+            print(f"⚠️  {filename} - not converted (only WAV clips are)")
+            ok = False
+            continue
+        total_bytes += clip['decoded_bytes']
+        line = (f"{filename:24s} {clip['duration']:5.2f} s  "
+                f"{clip['decoded_bytes'] / 1024:6.0f} KiB  decode {clip['decode_ms']:5.1f} ms")
+        if clip['duration'] <= 0:
+            print(f"✗ {line} - EMPTY")
+            ok = False
+        elif clip['decode_ms'] > SLOW_DECODE_MS:
+            print(f"⚠️  {line} - SLOW TO DECODE")
+            ok = False
+        else:
+            print(f"✓ {line}")
+    
+    budget = DEFAULT_CONFIG['sound_cache_mb'] * 1024 * 1024
+    if total_bytes > budget:
+        print(f"\n⚠️  {total_bytes / 1024:.0f} KiB decoded exceeds the "
+              f"{DEFAULT_CONFIG['sound_cache_mb']} MB sound cache")
+        ok = False
+    elif ok:
+        print(f"\n✓ Compiled audio up to date ({total_bytes / 1024:.0f} KiB decoded)")
+    return ok
+
 def check_audio_output():
     """Check audio output devices"""
     print_header("Audio Output Devices")
@@ -146,6 +222,40 @@ def check_audio_output():
         print(f"⚠️  Error checking audio: {e}")
         return False
 
+def check_hardware_pwm():
+    """Check for a hardware PWM channel on the servo pin"""
+    print_header("Hardware PWM")
+    
+    from hardware_pwm import (PWM_CHANNELS, PWM_ROOT, analog_audio_card, is_pwm_function,
+                              list_pwm_chips, pin_function)
+    chips = list_pwm_chips()
+    card = analog_audio_card()
+    if not chips:
+        print(f"⚠️  No PWM chips in {PWM_ROOT}; the servo uses software PWM")
+        print("  For jitter-free wings add to /boot/config.txt: dtoverlay=pwm,pin=18,func=2")
+        if card is not None:
+            print(f"  That takes over the 3.5mm audio jack ({card}): use USB, I2S or HDMI audio first")
+        return True
+    
+    if card is not None:
+        print(f"⚠️  Analog audio is on ({card}) and shares the PWM block; "
+              "servo_pwm 'auto' uses software PWM")
+    
+    for chip, channels in chips.items():
+        print(f"✓ pwmchip{chip}: {channels} channel(s)")
+    print(f"  Hardware PWM pins: {', '.join(f'GPIO {pin} (channel {channel})' for pin, channel in sorted(PWM_CHANNELS.items()))}")
+    functions = {pin: pin_function(pin) for pin in sorted(PWM_CHANNELS)}
+    if not any(functions.values()):
+        print("⚠️  Could not read pin functions (pinctrl or raspi-gpio missing); "
+              "servo_pwm 'auto' uses software PWM")
+        return True
+    routed = [f'GPIO {pin} ({function})' for pin, function in functions.items() if is_pwm_function(function)]
+    if routed:
+        print(f"✓ Routed to PWM: {', '.join(routed)}; set servo_pin to one of them")
+    else:
+        print("⚠️  No pin is routed to PWM; check the pin of the pwm overlay")
+    return True
+
 def test_gpio_pins():
     """Test GPIO pin access"""
     print_header("GPIO Pin Test")
@@ -205,8 +315,107 @@ def check_dependencies():
         print("⚠️  requirements.txt not found")
         return False
 
+def print_perf_report(report):
+    """Print the results of the performance probes"""
+    meta = report['meta']
+    print_header("Performance")
+    print(f"{meta['model'] or meta['machine']} ({meta['backend']} backend), "
+          f"SD card {meta['sd_card'] or 'unknown'}, Python {meta['python']}")
+    for name, result in report['probes'].items():
+        if 'skipped' in result:
+            print(f"⚠️  {name}: skipped - {result['skipped']}")
+        elif 'error' in result:
+            print(f"✗ {name}: {result['error']}")
+        elif name == 'gpio_toggle':
+            print(f"✓ GPIO writes: {result['toggles_per_s']:,.0f}/s ({result['write_us']:.2f} us each)")
+        elif name == 'edge_latency':
+            print(f"✓ Edge callback latency: p50 {result['p50_us']:.0f} us, "
+                  f"p99 {result['p99_us']:.0f} us, max {result['max_us']:.0f} us, "
+                  f"{result['lost']} lost")
+        elif name == 'pwm_jitter':
+            print(f"✓ Servo PWM jitter: period p99 {result['period_jitter_p99_us']:.0f} us, "
+                  f"duty p99 {result['duty_jitter_p99']:.3f}% "
+                  f"(sampled every {result['sample_interval_us']:.1f} us)")
+        elif name == 'mixer_open':
+            print(f"✓ Mixer open: first {result['first_open_ms']:.1f} ms, "
+                  f"then p50 {result['open_p50_ms']:.1f} ms")
+        elif name == 'clip_decode':
+            for clip, stats in result['clips'].items():
+                if stats.get('missing'):
+                    print(f"⚠️  {clip:24s} MISSING")
+                else:
+                    mark = '⚠️ ' if stats['decode_ms'] > SLOW_DECODE_MS else '✓'
+                    print(f"{mark} {clip:24s} decode {stats['decode_ms']:6.1f} ms  "
+                          f"{stats['decoded_kib']:6.0f} KiB decoded")
+            print(f"  All clips: {result['total_ms']:.1f} ms of decoding, "
+                  f"{result['wall_ms']:.1f} ms wall, {result['decoded_kib']:.0f} KiB")
+        elif name == 'strobe':
+            print(f"✓ Software strobe keeps up to {result['max_frequency_hz'] or 0} Hz")
+            for frequency, stats in result['frequencies'].items():
+                print(f"  {frequency:>5s} Hz  jitter p99 {stats['jitter_p99_ms']:.3f} ms, "
+                      f"{stats['overruns']} missed edge(s)")
+
+def print_perf_comparison(report, baseline):
+    """Print the headline numbers of a report next to a baseline report"""
+    from perf_probe import compare_reports
+    
+    meta = baseline['meta']
+    print_header(f"Compared with {meta['model'] or meta['machine']}, SD card {meta['sd_card'] or 'unknown'}")
+    print(f"{'':34s} {'this run':>14s} {'baseline':>14s}")
+    for metric, value, base in compare_reports(report, baseline):
+        value = '-' if value is None else f"{value:,.2f}"
+        base = '-' if base is None else f"{base:,.2f}"
+        print(f"{metric:34s} {value:>14s} {base:>14s}")
+
+def run_perf(args):
+    """Run the performance probes"""
+    from backends import HardwareBackend, SystemClock
+    from buzz_controller import DEFAULT_CONFIG
+    from perf_probe import run_probes
+    from simulator import SimulatedBackend
+    
+    backend = None
+    if not args.simulate:
+        try:
+            backend = HardwareBackend()
+        except ImportError:
+            print("⚠️  RPi.GPIO not available; probing the simulated backend")
+    if backend is None:
+        backend = SimulatedBackend(clock=SystemClock())
+    
+    loopback = None
+    if args.loopback:
+        out_pin, in_pin = args.loopback.split(':')
+        loopback = (int(out_pin), int(in_pin))
+    
+    report = run_probes(backend, DEFAULT_CONFIG, files=REQUIRED_AUDIO_FILES, loopback=loopback,
+                        seconds=args.seconds)
+    print_perf_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_perf_comparison(report, json.load(f))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+    failed = [name for name, result in report['probes'].items() if 'error' in result]
+    return not failed
+
 def main():
     """Run all diagnostics"""
+    parser = argparse.ArgumentParser(description="Buzz Lightyear Controller diagnostics")
+    parser.add_argument('--perf', action='store_true', help="Measure performance instead")
+    parser.add_argument('--loopback', metavar='OUT:IN',
+                        help="Output and input pins jumpered together, for edge latency")
+    parser.add_argument('--seconds', type=float, default=0.5, help="Duration of each timed probe")
+    parser.add_argument('--simulate', action='store_true', help="Probe the simulated backend")
+    parser.add_argument('--json', help="Write the performance report to this file")
+    parser.add_argument('--compare', help="Performance report to compare with")
+    args = parser.parse_args()
+    
+    if args.perf:
+        sys.exit(0 if run_perf(args) else 1)
+    
     print("\n" + "🔍" * 25)
     print("  Buzz Lightyear Controller Diagnostics")
     print("🔍" * 25)
@@ -218,7 +427,9 @@ def main():
     results.append(("GPIO Access", check_gpio_access()))
     results.append(("pygame", check_pygame()))
     results.append(("Audio Files", check_audio_files()))
+    results.append(("Compiled Audio", check_audio_manifest()))
     results.append(("Audio Output", check_audio_output()))
+    results.append(("Hardware PWM", check_hardware_pwm()))
     results.append(("Dependencies", check_dependencies()))
     
     if os.geteuid() == 0:
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Prioritized event dispatcher for the Buzz Lightyear Controller
+
+RPi.GPIO runs every edge callback on one shared thread, so a slow action
+delays all later presses. The dispatcher keeps that thread free: the edge
+callback only timestamps the press and enqueues it, and a small pool of
+worker threads (or an external scheduler such as the event loop of
+AsyncBuzzController) runs the actions in priority order. Events for the same
+action never run concurrently, and a bounded queue with an explicit
+backpressure policy absorbs presses that arrive faster than they can be
+handled.
+"""
+
+import time
+from collections import deque
+from itertools import count
+from threading import Thread, Condition
+
+# What to do when the queue is full (or a press repeats a queued one)
+BACKPRESSURE_POLICIES = ('drop_newest', 'drop_oldest', 'coalesce')
+
+
+class DispatchEvent:
+    """A queued action"""
+
+    __slots__ = ('key', 'handler', 'args', 'priority', 'seq', 'timestamp')
+
+    def __init__(self, key, handler, args, priority, seq, timestamp):
+        self.key = key
+        self.handler = handler
+        self.args = args
+        self.priority = priority
+        self.seq = seq
+        self.timestamp = timestamp
+
+    def sort_key(self):
+        return (self.priority, self.seq)
+
+
+def percentile(samples, fraction):
+    """Return the given percentile (0..1) of a sequence, or 0.0 if empty"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+class EventDispatcher:
+    """Bounded priority queue drained by a worker pool"""
+
+    def __init__(self, workers=2, max_queue=16, policy='coalesce',
+                 clock=time.monotonic, scheduler=None, wait_samples=256):
+        """
+        Initialize the dispatcher and start its workers
+
+        Args:
+            workers: Number of worker threads (0 runs actions inline on submit)
+            max_queue: Maximum number of queued events
+            policy: Backpressure policy (see BACKPRESSURE_POLICIES)
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as an asyncio loop wrapped in LoopScheduler; when given, no
+                workers are started and queued actions run from its callbacks
+            wait_samples: Number of recent queue-wait samples kept for percentiles
+        """
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+
+        self.max_queue = max_queue
+        self.policy = policy
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._cond = Condition()
+        self._queue = []
+        self._running_keys = set()
+        self._seq = count()
+        self._running = True
+        self._timer = None
+
+        # Metrics
+        self.submitted = 0
+        self.executed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._waits = deque(maxlen=wait_samples)
+        self._max_wait = 0.0
+
+        self._workers = [
+            Thread(target=self._worker, name=f'dispatcher-{i}', daemon=True)
+            for i in range(0 if scheduler is not None else workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, handler, priority=0, args=()):
+        """
+        Queue an action; safe to call from the GPIO callback thread
+
+        Args:
+            key: Action name; queued events with the same key may be coalesced
+            handler: Callable run by a worker
+            priority: Lower values run first
+            args: Positional arguments for the handler
+
+        Returns:
+            True if the event was queued, False if it was dropped or coalesced
+        """
+        timestamp = self.clock()
+        with self._cond:
+            self.submitted += 1
+            if not self._running:
+                self.dropped += 1
+                return False
+
+            if self.policy == 'coalesce' and any(e.key == key for e in self._queue):
+                self.coalesced += 1
+                return False
+
+            if len(self._queue) >= self.max_queue:
+                if self.policy == 'drop_oldest':
+                    oldest = min(self._queue, key=lambda e: e.seq)
+                    self._queue.remove(oldest)
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+
+            event = DispatchEvent(key, handler, args, priority, next(self._seq), timestamp)
+            if not self._workers and self.scheduler is None:
+                self._record_wait(event)
+            else:
+                self._queue.append(event)
+                self.max_depth = max(self.max_depth, len(self._queue))
+                if self.scheduler is None:
+                    self._cond.notify()
+                elif self._timer is None:
+                    self._timer = self.scheduler.call_at(timestamp, self._on_timer)
+                return True
+
+        # Inline mode: run on the caller's thread
+        self._execute(event)
+        return True
+
+    def depth(self):
+        """Current number of queued events"""
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """Return queue metrics as a dictionary (waits in milliseconds)"""
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'executed': self.executed,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'wait_p50_ms': percentile(waits, 0.50) * 1000,
+                'wait_p99_ms': percentile(waits, 0.99) * 1000,
+                'wait_max_ms': self._max_wait * 1000,
+            }
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until the queue is empty and no action is running; return True if idle
+
+        With an external scheduler nothing can progress while blocked, so
+        this only reports the current state.
+        """
+        with self._cond:
+            if self.scheduler is not None:
+                return not self._queue and not self._running_keys
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._running_keys, timeout
+            )
+
+    def stop(self):
+        """Stop the workers; queued events are discarded"""
+        with self._cond:
+            self._running = False
+            self.dropped += len(self._queue)
+            self._queue.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _record_wait(self, event):
+        """Record queue wait for an event about to run (lock must be held)"""
+        wait = self.clock() - event.timestamp
+        self._waits.append(wait)
+        self._max_wait = max(self._max_wait, wait)
+
+    def _next_event(self):
+        """Highest-priority event whose action is not already running"""
+        ready = [e for e in self._queue if e.key not in self._running_keys]
+        if not ready:
+            return None
+        event = min(ready, key=DispatchEvent.sort_key)
+        self._queue.remove(event)
+        return event
+
+    def _execute(self, event):
+        """Run an event's handler, reporting errors instead of raising"""
+        try:
+            event.handler(*event.args)
+        except Exception as e:
+            print(f"Error handling {event.key} event: {e}")
+        with self._cond:
+            self.executed += 1
+
+    def _on_timer(self):
+        """External scheduler callback: run the highest-priority queued event"""
+        with self._cond:
+            self._timer = None
+            event = self._next_event() if self._running else None
+            if event is None:
+                return
+            self._running_keys.add(event.key)
+            self._record_wait(event)
+            if self._queue:
+                # One action per callback, so due timers run between actions
+                self._timer = self.scheduler.call_at(self.clock(), self._on_timer)
+
+        self._execute(event)
+
+        with self._cond:
+            self._running_keys.discard(event.key)
+            self._cond.notify_all()
+
+    def _worker(self):
+        """Worker thread: run queued events in priority order"""
+        while True:
+            with self._cond:
+                event = None
+                while self._running:
+                    event = self._next_event()
+                    if event is not None:
+                        break
+                    self._cond.wait()
+                if event is None:
+                    return
+                self._running_keys.add(event.key)
+                self._record_wait(event)
+
+            self._execute(event)
+
+            with self._cond:
+                self._running_keys.discard(event.key)
+                self._cond.notify_all()
@@ -6,13 +6,13 @@ This example shows how to extend the base controller with custom features.
 """
 
 from buzz_controller import BuzzController, WingPosition
-import time
+from timeline import compile_show
 
 class CustomBuzzController(BuzzController):
     """Extended controller with custom features"""
     
-    def __init__(self, config=None):
-        super().__init__(config)
+    def __init__(self, config=None, backend=None):
+        super().__init__(config, backend)
         
         # Add custom state
         self.activation_count = 0
@@ -33,44 +33,28 @@ class CustomBuzzController(BuzzController):
             self._play_sound('easter_egg.wav')
             print("🎉 Easter egg unlocked!")
     
-    def _phrase_button_callback(self, channel):
-        """Override phrase button for sequential phrases"""
-        # Cycle through phrases in order instead of random
-        phrases = [
-            'to_infinity.wav',
-            'buzz_lightyear.wav',
-            'not_flying.wav',
-            'space_ranger.wav'
-        ]
-        
-        if not hasattr(self, 'phrase_index'):
-            self.phrase_index = 0
-        
-        phrase = phrases[self.phrase_index]
-        self._play_sound(phrase)
-        print(f"Playing phrase {self.phrase_index + 1}/{len(phrases)}: {phrase}")
-        
-        # Move to next phrase
-        self.phrase_index = (self.phrase_index + 1) % len(phrases)
-    
     def custom_strobe_pattern(self):
-        """Example: Different strobe pattern"""
-        import RPi.GPIO as GPIO
-        
+        """Example: Different strobe pattern, played as a show timeline"""
         print("Activating custom strobe pattern...")
         
         # Stop default strobe
         self._stop_strobe()
         
-        # Custom pattern: 3 quick flashes
-        for _ in range(3):
-            self._play_sound('beep.wav')
-            for __ in range(3):
-                GPIO.output(self.config['strobe_led_pin'], GPIO.HIGH)
-                time.sleep(0.1)
-                GPIO.output(self.config['strobe_led_pin'], GPIO.LOW)
-                time.sleep(0.1)
-            time.sleep(0.5)
+        # Custom pattern: 3 groups of a laser zap and 3 quick flashes. The show is
+        # compiled once and runs on the show thread, so this returns at once
+        # and the zaps stay in step with the flashes.
+        if 'custom_strobe' not in self.shows.shows:
+            groups = [i * 1.1 for i in range(3)]
+            show = compile_show({
+                'name': 'custom_strobe',
+                'tracks': {
+                    'sound': [{'at': at, 'clip': 'laser_on.wav'} for at in groups],
+                    'led': [{'at': at, 'pin': 'strobe', 'pattern': 'blink',
+                             'count': 3, 'on': 0.1, 'off': 0.1} for at in groups],
+                },
+            }, *self.show_targets())
+            self.shows.add(show)
+        self.shows.trigger('custom_strobe')
 
 # Example configuration with custom settings
 CUSTOM_CONFIG = {
@@ -84,7 +68,12 @@ CUSTOM_CONFIG = {
     'servo_vertical': 11.0,     # Different position
     'strobe_frequency': 15,     # Faster strobe
     'audio_path': 'audio',
-    'debounce_time': 300        # Longer debounce
+    'debounce_time': 30,        # Longer debounce lockout
+    'phrase_mode': 'sequential',  # Cycle through phrases in order instead of random
+    'gestures': {
+        'phrase:long_press': 'show:triple_flash',  # Hold phrase for a light show
+        'wing+laser': 'phrase',                    # Both together for a phrase
+    }
 }
 
 def main():
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Hardware PWM for the Buzz Lightyear Controller wing servo
+
+SysfsPWM drives one channel of the SoC's PWM block through the kernel's
+sysfs interface (/sys/class/pwm/pwmchipN/pwmM). The pulse train comes from
+the PWM peripheral itself, so holding the wings costs no CPU and the pulse
+width does not jitter, unlike RPi.GPIO's software PWM thread. Period and
+duty cycle are written in nanoseconds through file descriptors that stay
+open, so each duty cycle change is a single write.
+
+SysfsPWM has the same start/ChangeDutyCycle/ChangeFrequency/stop methods as
+an RPi.GPIO PWM object, so the servo motion engines drive either one.
+
+The pin must be routed to the PWM block by a device tree overlay, e.g. in
+/boot/config.txt (GPIO 18 is PWM channel 0 on a Pi 1-4):
+    dtoverlay=pwm,pin=18,func=2
+
+On a Pi 1-4 the 3.5mm audio jack is driven by the same PWM block, so the
+overlay and analog audio cannot be used together; play sound through a
+USB or I2S audio adapter (or HDMI) instead. analog_audio_card() spots the
+jack's sound card so the controller can keep to software PWM.
+
+A pwmchip channel exists whenever the overlay is loaded, whichever pin it
+routes the channel to (e.g. pin=12 instead of 18), so pin_function() asks
+pinctrl (or raspi-gpio on older systems) what the servo pin is actually
+routed to before the controller relies on it.
+"""
+
+import errno
+import os
+import subprocess
+import time
+
+# Where the kernel lists the PWM chips
+PWM_ROOT = '/sys/class/pwm'
+
+# Where ALSA lists the sound cards
+SOUND_CARDS = '/proc/asound/cards'
+
+# Sound card names of the Pi's analog audio, driven by the PWM block
+ANALOG_AUDIO_CARDS = ('bcm2835 Headphones', 'bcm2835 ALSA')
+
+# Commands that report a pin's function: pinctrl, or raspi-gpio before Bookworm
+PIN_TOOLS = (('pinctrl', 'get'), ('raspi-gpio', 'get'))
+
+# BCM pins that can carry a hardware PWM channel on a Pi 1-4, and the channel
+PWM_CHANNELS = {12: 0, 18: 0, 13: 1, 19: 1}
+
+# How the servo PWM is chosen: hardware when available, or one of the two
+SERVO_PWM_MODES = ('auto', 'hardware', 'software')
+
+# Attributes written while running, kept open
+_ATTRIBUTES = ('period', 'duty_cycle', 'enable')
+
+
+class SysfsPWM:
+    """One hardware PWM channel, with the RPi.GPIO PWM object interface"""
+
+    def __init__(self, chip, channel, frequency, root=PWM_ROOT, export_timeout=1.0):
+        """
+        Export the channel if needed and open its attributes
+
+        Args:
+            chip: Number of the PWM chip (pwmchipN)
+            channel: Channel on the chip (pwmM)
+            frequency: Pulse frequency in Hz
+            root: Directory holding the pwmchipN directories
+            export_timeout: Seconds to wait for udev to make a newly
+                exported channel writable
+
+        Raises:
+            OSError: If the chip does not exist or the channel cannot be
+                exported or opened
+        """
+        chip_path = os.path.join(root, f'pwmchip{chip}')
+        if not os.path.isdir(chip_path):
+            raise OSError(errno.ENOENT, "No such PWM chip", chip_path)
+
+        self.path = os.path.join(chip_path, f'pwm{channel}')
+        self._unexport = None
+        if not os.path.isdir(self.path):
+            _write_file(os.path.join(chip_path, 'export'), channel)
+            self._unexport = (os.path.join(chip_path, 'unexport'), channel)
+
+        self._fds = self._open_attributes(export_timeout)
+        # A channel left exported by an earlier run keeps its settings
+        self._period = _read_int(os.path.join(self.path, 'period'))
+        self._duty = _read_int(os.path.join(self.path, 'duty_cycle'))
+        self._enabled = _read_int(os.path.join(self.path, 'enable')) == 1
+        self._frequency = frequency
+        self._duty_cycle = 0.0
+
+    @property
+    def frequency(self):
+        """Pulse frequency in Hz"""
+        return self._frequency
+
+    @property
+    def duty_cycle(self):
+        """Duty cycle in percent"""
+        return self._duty_cycle
+
+    def start(self, duty_cycle):
+        """Set the duty cycle in percent and enable the output"""
+        self.ChangeDutyCycle(duty_cycle)
+        if not self._enabled:
+            self._write('enable', 1)
+            self._enabled = True
+
+    def ChangeDutyCycle(self, duty_cycle):
+        """Set the duty cycle in percent (0.0-100.0)"""
+        if not 0.0 <= duty_cycle <= 100.0:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self._duty_cycle = duty_cycle
+        self._apply(self._frequency, duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        """Set the frequency in Hz, keeping the duty cycle in percent"""
+        if frequency <= 0.0:
+            raise ValueError("frequency must be greater than 0.0")
+        self._apply(frequency, self._duty_cycle)
+        self._frequency = frequency
+
+    def stop(self):
+        """Disable the output; start() enables it again"""
+        if self._enabled:
+            self._write('enable', 0)
+            self._enabled = False
+
+    def close(self):
+        """Disable the output, close the attributes and unexport the channel if we exported it"""
+        if self._fds is None:
+            return
+        try:
+            self.stop()
+        finally:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = None
+            if self._unexport is not None:
+                try:
+                    _write_file(*self._unexport)
+                except OSError:
+                    pass
+
+    def _apply(self, frequency, duty_cycle):
+        """Write the period and pulse width in nanoseconds, skipping unchanged values"""
+        period = int(round(1e9 / frequency))
+        duty = int(round(period * duty_cycle / 100.0))
+        # The kernel rejects a pulse wider than the period at every step
+        if period < self._duty:
+            self._write('duty_cycle', duty)
+            self._duty = duty
+        if period != self._period:
+            self._write('period', period)
+            self._period = period
+        if duty != self._duty:
+            self._write('duty_cycle', duty)
+            self._duty = duty
+
+    def _write(self, name, value):
+        os.pwrite(self._fds[name], b'%d\n' % value, 0)
+
+    def _open_attributes(self, timeout):
+        """Open the attributes write-only, retrying while udev sets their permissions"""
+        deadline = time.monotonic() + timeout
+        while True:
+            fds = {}
+            try:
+                for name in _ATTRIBUTES:
+                    fds[name] = os.open(os.path.join(self.path, name), os.O_WRONLY)
+                return fds
+            except (FileNotFoundError, PermissionError):
+                for fd in fds.values():
+                    os.close(fd)
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+
+
+def open_sysfs_pwm(pin, frequency, root=PWM_ROOT, chip=0, channel=None):
+    """
+    Open the hardware PWM channel for a pin
+
+    Args:
+        pin: BCM pin number
+        frequency: Pulse frequency in Hz
+        root: Directory holding the pwmchipN directories
+        chip: Number of the PWM chip
+        channel: Channel on the chip (None: from PWM_CHANNELS)
+
+    Returns:
+        SysfsPWM for the channel, not yet started
+
+    Raises:
+        ValueError: If no channel is given and the pin has no PWM channel
+        OSError: If the channel cannot be opened
+    """
+    if channel is None:
+        if pin not in PWM_CHANNELS:
+            raise ValueError(f"GPIO {pin} has no hardware PWM channel")
+        channel = PWM_CHANNELS[pin]
+    return SysfsPWM(chip, channel, frequency, root=root)
+
+
+def list_pwm_chips(root=PWM_ROOT):
+    """
+    List the PWM chips the kernel exposes
+
+    Returns:
+        Dictionary of chip number -> channel count (empty without any)
+    """
+    chips = {}
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return chips
+    for name in names:
+        if name.startswith('pwmchip') and name[7:].isdigit():
+            chips[int(name[7:])] = _read_int(os.path.join(root, name, 'npwm'))
+    return dict(sorted(chips.items()))
+
+
+def analog_audio_card(path=SOUND_CARDS):
+    """
+    Find the Pi's analog audio (3.5mm jack) among the sound cards
+
+    Returns:
+        Name of the analog audio card, or None if there is none
+    """
+    try:
+        with open(path) as f:
+            cards = f.read()
+    except OSError:
+        return None
+    for name in ANALOG_AUDIO_CARDS:
+        if name in cards:
+            return name
+    return None
+
+
+def pin_function(pin, tools=PIN_TOOLS):
+    """
+    Ask pinctrl or raspi-gpio what a pin is routed to
+
+    Returns:
+        Function name as the tool reports it, e.g. 'PWM0_0' or 'output',
+        or None if no tool could tell
+    """
+    for tool in tools:
+        try:
+            result = subprocess.run([*tool, str(pin)], capture_output=True, text=True, timeout=2.0)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        function = _parse_pin_function(result.stdout)
+        if result.returncode == 0 and function is not None:
+            return function
+    return None
+
+
+def is_pwm_function(function):
+    """Return True if a pin function from pin_function() is a PWM channel"""
+    return function is not None and function.upper().startswith('PWM')
+
+
+def _parse_pin_function(output):
+    """
+    Function from one line of tool output:
+        pinctrl:    18: a5    pd | lo // GPIO18 = PWM0_0
+        raspi-gpio: GPIO 18: level=0 fsel=2 alt=5 func=PWM0 pull=DOWN
+    """
+    for token in output.split():
+        if token.startswith('func='):
+            return token[5:] or None
+    _, _, comment = output.partition('//')
+    _, equals, function = comment.rpartition('=')
+    if not equals:
+        return None
+    return function.strip() or None
+
+
+def _write_file(path, value):
+    with open(path, 'w') as f:
+        f.write(f'{value}\n')
+
+
+def _read_int(path):
+    """First line of an attribute as an integer; 0 if missing or unreadable"""
+    try:
+        with open(path) as f:
+            return int(f.readline().strip() or 0)
+    except (OSError, ValueError):
+        return 0
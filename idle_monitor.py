@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Inactivity tracking for the Buzz Lightyear Controller
+
+On a USB power bank every wakeup and every open device costs battery.
+IdleMonitor calls on_idle once nothing has happened for `timeout`
+seconds, and on_wake on the next activity, before that activity is
+handled, so the controller can release the servo PWM and the audio
+device in between and reacquire them on the next press.
+
+Noting activity is a timestamp update; the monitor sleeps until the
+earliest moment the timeout could expire and only then looks again, so
+it wakes at most once per timeout while presses keep coming.
+"""
+
+import time
+from threading import Lock
+
+from deadline_worker import DeadlineWorker
+
+
+class IdleMonitor:
+    """Calls on_idle after a period without activity and on_wake after it"""
+
+    def __init__(self, timeout, on_idle, on_wake, busy=None, clock=time.monotonic, scheduler=None):
+        """
+        Initialize the monitor and start the inactivity timer
+
+        Args:
+            timeout: Seconds without activity before going idle; None disables
+            on_idle: Called when going idle
+            on_wake: Called on the first activity after going idle, before
+                activity() returns
+            busy: Optional callable returning True while something is still
+                running (a servo move, a show) that should keep the costume awake
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+        """
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.on_wake = on_wake
+        self.busy = busy
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._worker = DeadlineWorker(self._step, 'idle-monitor', clock, scheduler)
+        self._cond = self._worker.cond
+        # Serializes on_idle and on_wake
+        self._transition = Lock()
+        self._idle = False
+        self._last_activity = clock()
+        self._stats = {'idle_periods': 0, 'idle_seconds': 0.0}
+        self._idle_since = None
+
+        if timeout is not None:
+            with self._cond:
+                self._worker.schedule(self._last_activity + timeout)
+
+    @property
+    def idle(self):
+        with self._cond:
+            return self._idle
+
+    def activity(self):
+        """Note activity, waking from idle first if needed"""
+        if self.timeout is None:
+            return
+        with self._cond:
+            now = self.clock()
+            self._last_activity = now
+            was_idle = self._idle
+            if was_idle:
+                self._idle = False
+                self._stats['idle_seconds'] += now - self._idle_since
+                self._idle_since = None
+            if self._worker.deadline is None:
+                self._worker.schedule(now + self.timeout)
+        if was_idle:
+            with self._transition:
+                self.on_wake()
+
+    def stats(self):
+        """Return whether the costume is idle, how often it went idle and for how long"""
+        with self._cond:
+            stats = dict(self._stats)
+            if self._idle:
+                stats['idle_seconds'] += self.clock() - self._idle_since
+            stats['idle'] = self._idle
+            return stats
+
+    def close(self):
+        """Stop the inactivity timer"""
+        self._worker.close()
+
+    def _step(self, now):
+        """
+        Check for inactivity at a deadline (lock must be held)
+
+        Returns:
+            Tuple of (next check or None, _go_idle if the monitor just went idle)
+        """
+        if self._idle:
+            return None, None
+        expires = self._last_activity + self.timeout
+        if now < expires:
+            # Activity since the timer was armed
+            return expires, None
+        if self.busy is not None and self.busy():
+            return now + self.timeout, None
+        self._idle = True
+        self._idle_since = now
+        self._stats['idle_periods'] += 1
+        return None, self._go_idle
+
+    def _go_idle(self):
+        """Run on_idle unless activity already woke the monitor again"""
+        with self._transition:
+            if self.idle:
+                self.on_idle()
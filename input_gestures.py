@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Software button input layer for the Buzz Lightyear Controller
+
+RPi.GPIO's bouncetime drops every edge for a fixed time after the last
+one, which also drops legitimate fast presses and says nothing about how
+a button was pressed. GestureRecognizer takes raw edges on both
+transitions and works from their timestamps instead:
+
+- Leading-edge debounce: the first edge that changes a button's state is
+  acted on at once; edges within `lockout` seconds of it are bounce. If
+  the button ended up in a different state after the bounce, that is
+  picked up when the lockout ends.
+- tap: fires on the press edge, with no added latency
+- double_tap: a second tap within `double_tap` seconds; only recognized
+  for buttons with a double tap binding, and fires instead of the tap
+- long_press: the button is still held `long_press` seconds after the press
+- chord: buttons pressed within `chord_window` seconds of each other, e.g.
+  'wing+laser'. Taps are never delayed, so the first button of a chord
+  has already tapped; the chord replaces the tap of the last one.
+
+Gestures are reported as keys: 'laser' for a tap, 'laser:double_tap',
+'laser:long_press' and 'laser+wing' (names sorted) for a chord. Timers
+for long presses and lockout ends run on one thread that sleeps until the
+next deadline, or on an external scheduler such as a virtual clock.
+"""
+
+import time
+from functools import partial
+
+from deadline_worker import DeadlineWorker
+from metrics import NULL_METRICS
+
+# Gestures that can be bound per button, as 'name:gesture'
+BUTTON_GESTURES = ('double_tap', 'long_press')
+
+
+def gesture_names(key):
+    """
+    Split a gesture key into its button names and gesture
+
+    Args:
+        key: Gesture key, e.g. 'laser', 'laser:long_press' or 'laser+wing'
+
+    Returns:
+        Tuple of (button names, gesture)
+    """
+    if '+' in key:
+        return tuple(sorted(key.split('+'))), 'chord'
+    name, _, gesture = key.partition(':')
+    return (name,), gesture or 'tap'
+
+
+def compile_bindings(buttons, bindings):
+    """
+    Validate gesture bindings and normalize chord keys
+
+    Args:
+        buttons: Dictionary of input pin -> button name
+        bindings: Gesture keys with an action
+
+    Returns:
+        Set of gesture keys, chords with their names sorted
+
+    Raises:
+        ValueError: If a binding names an unknown button or gesture
+    """
+    compiled = set()
+    for key in bindings:
+        names, gesture = gesture_names(key)
+        unknown = set(names) - set(buttons.values())
+        if unknown:
+            raise ValueError(f"Gesture {key} names unknown button(s): {', '.join(sorted(unknown))}")
+        if gesture == 'chord' and len(names) < 2:
+            raise ValueError(f"Chord {key} needs at least two buttons")
+        if gesture not in BUTTON_GESTURES + ('chord',):
+            raise ValueError(f"Unknown gesture in {key}; use {', '.join(BUTTON_GESTURES)} or a chord")
+        compiled.add('+'.join(names) if gesture == 'chord' else key)
+    return compiled
+
+
+class _Button:
+    """Debounce and gesture state of one button"""
+
+    __slots__ = ('name', 'pressed', 'changed_at', 'last_edge', 'settle_at',
+                 'long_at', 'last_tap', 'in_chord')
+
+    def __init__(self, name):
+        self.name = name
+        self.pressed = False
+        self.changed_at = float('-inf')   # Edge time of the last accepted transition
+        self.last_edge = float('-inf')    # Time of the last raw edge
+        self.settle_at = None             # Lockout end to re-read the level
+        self.long_at = None               # Long press deadline
+        self.last_tap = None
+        self.in_chord = False
+
+
+class GestureRecognizer:
+    """Debounces button edges and turns them into taps and gestures"""
+
+    def __init__(self, gpio, buttons, on_gesture, bindings=(), lockout=0.02, long_press=0.8,
+                 double_tap=0.3, chord_window=0.08, clock=time.monotonic, scheduler=None,
+                 metrics=NULL_METRICS):
+        """
+        Initialize the recognizer
+
+        Args:
+            gpio: GPIO module, read for the level behind each edge
+            buttons: Dictionary of input pin -> button name (active low)
+            on_gesture: Called with (gesture key, pin) for every gesture
+            bindings: Gesture keys with an action; double taps, long presses
+                and chords are only recognized when bound
+            lockout: Seconds after an accepted edge during which edges are bounce
+            long_press: Seconds a button must be held for a long press
+            double_tap: Most seconds between the taps of a double tap
+            chord_window: Most seconds between the presses of a chord
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+            metrics: Registry for bounce and gesture counters
+
+        Raises:
+            ValueError: If a binding names an unknown button or gesture
+        """
+        self.gpio = gpio
+        self.on_gesture = on_gesture
+        self.lockout = lockout
+        self.long_press = long_press
+        self.double_tap = double_tap
+        self.chord_window = chord_window
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._buttons = {pin: _Button(name) for pin, name in buttons.items()}
+        self.bindings = compile_bindings(buttons, bindings)
+
+        self._worker = DeadlineWorker(self._step, 'input-gestures', clock, scheduler)
+        self._cond = self._worker.cond
+
+        self._stats = {'bounces': 0, 'tap': 0, 'double_tap': 0, 'long_press': 0, 'chord': 0}
+        self._bounce_counter = metrics.counter(
+            'buzz_button_bounces_total', 'Edges suppressed as contact bounce')
+        self._gesture_counters = {
+            gesture: metrics.counter('buzz_gestures_total', 'Recognized button gestures', gesture=gesture)
+            for gesture in ('tap', 'double_tap', 'long_press', 'chord')
+        }
+
+    def on_edge(self, channel):
+        """GPIO edge callback for either transition"""
+        now = self.clock()
+        pressed = self.gpio.input(channel) == self.gpio.LOW
+        with self._cond:
+            button = self._buttons.get(channel)
+            if button is None:
+                # Pin removed by configure() while the edge was in flight
+                return
+            button.last_edge = now
+            if now - button.changed_at < self.lockout:
+                # Bounce; the level is checked again once the lockout ends
+                self._stats['bounces'] += 1
+                self._bounce_counter.inc()
+                if button.settle_at is None:
+                    button.settle_at = button.changed_at + self.lockout
+                    self._kick(button.settle_at)
+                return
+            events = self._transition(channel, button, pressed, now)
+        self._emit(events)
+
+    def configure(self, buttons=None, bindings=None, lockout=None, long_press=None,
+                  double_tap=None, chord_window=None):
+        """
+        Change buttons, bindings or timings in place, e.g. on a config reload
+
+        Buttons that keep their pin and name keep their state; arguments
+        left as None are unchanged.
+
+        Raises:
+            ValueError: If a binding names an unknown button or gesture;
+                nothing is changed
+        """
+        with self._cond:
+            if buttons is None:
+                buttons = {pin: button.name for pin, button in self._buttons.items()}
+            compiled = compile_bindings(buttons, self.bindings if bindings is None else bindings)
+            self._buttons = {
+                pin: self._buttons[pin] if pin in self._buttons and self._buttons[pin].name == name
+                else _Button(name)
+                for pin, name in buttons.items()
+            }
+            self.bindings = compiled
+            if lockout is not None:
+                self.lockout = lockout
+            if long_press is not None:
+                self.long_press = long_press
+            if double_tap is not None:
+                self.double_tap = double_tap
+            if chord_window is not None:
+                self.chord_window = chord_window
+
+    def is_pressed(self, name):
+        """Return True while the named button is held"""
+        with self._cond:
+            return any(b.pressed for b in self._buttons.values() if b.name == name)
+
+    def stats(self):
+        """Return counts of suppressed bounces and recognized gestures"""
+        with self._cond:
+            return dict(self._stats)
+
+    def close(self):
+        """Cancel pending timers and stop the timer thread"""
+        self._worker.close()
+
+    def _transition(self, channel, button, pressed, when):
+        """
+        Apply an accepted press or release (lock must be held)
+
+        Returns:
+            List of (gesture key, pin) to report
+        """
+        if pressed == button.pressed:
+            return []
+        button.pressed = pressed
+        button.changed_at = when
+        if not pressed:
+            button.long_at = None
+            button.in_chord = False
+            return []
+
+        chord = self._chord(button, when)
+        if chord is not None:
+            return [(chord, channel)]
+
+        key = f'{button.name}:double_tap'
+        if key in self.bindings and button.last_tap is not None \
+                and when - button.last_tap <= self.double_tap:
+            button.last_tap = None
+        else:
+            button.last_tap = when
+            key = button.name
+
+        long_key = f'{button.name}:long_press'
+        if long_key in self.bindings:
+            button.long_at = when + self.long_press
+            self._kick(button.long_at)
+        return [(key, channel)]
+
+    def _chord(self, button, when):
+        """Return the bound chord this press completes, if any (lock must be held)"""
+        held = [b for b in self._buttons.values()
+                if b is not button and b.pressed and not b.in_chord
+                and when - b.changed_at <= self.chord_window]
+        if not held:
+            return None
+        # Prefer every button pressed together, then pairs with the latest press
+        candidates = [held] + [[b] for b in sorted(held, key=lambda b: b.changed_at, reverse=True)]
+        for others in candidates:
+            key = '+'.join(sorted([button.name] + [b.name for b in others]))
+            if key in self.bindings:
+                for b in others + [button]:
+                    b.in_chord = True
+                    b.long_at = None
+                return key
+        return None
+
+    def _emit(self, events):
+        """Count and report gestures (called without the lock)"""
+        for key, channel in events:
+            gesture = gesture_names(key)[1]
+            with self._cond:
+                self._stats[gesture] += 1
+            self._gesture_counters[gesture].inc()
+            self.on_gesture(key, channel)
+
+    def _kick(self, when):
+        """Make sure the timer wakes by when (lock must be held)"""
+        deadline = self._worker.deadline
+        if deadline is None or when < deadline:
+            self._worker.schedule(when)
+
+    def _step(self, now):
+        """
+        Resolve lockout ends and long presses due at now (lock must be held)
+
+        Returns:
+            Tuple of (next timer deadline or None, call reporting the gestures or None)
+        """
+        events = []
+        for channel, button in self._buttons.items():
+            if button.settle_at is not None and now >= button.settle_at:
+                button.settle_at = None
+                pressed = self.gpio.input(channel) == self.gpio.LOW
+                # Date the transition from the edge that caused it
+                events += self._transition(channel, button, pressed, button.last_edge)
+            if button.long_at is not None and now >= button.long_at:
+                button.long_at = None
+                if button.pressed and not button.in_chord:
+                    events.append((f'{button.name}:long_press', channel))
+
+        deadlines = [t for b in self._buttons.values() for t in (b.settle_at, b.long_at) if t is not None]
+        return min(deadlines, default=None), partial(self._emit, events) if events else None
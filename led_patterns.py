@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+LED pattern engine for the Buzz Lightyear Controller
+
+Every LED effect is a pattern rendered once into per-pin sample arrays at
+a fixed frame rate (1 = on, 0 = off):
+
+    strobe    square wave at a frequency and duty cycle
+    pulse     a short flash once per period
+    chase     one pin lit at a time, stepping along the pins
+    breathe   slow fade in and out through software PWM
+    morse     a message in Morse code
+    sparkle   random twinkling at a given density
+    solid     steady on or off
+
+Rendered patterns are cached by their parameters, and are built with
+vectorized NumPy operations when NumPy is installed (plain Python loops
+otherwise).
+
+LedEngine plays all effects from one render loop. Each wakeup works out
+the level of every pin that is due, and all pins that changed are written
+in one batched GPIO.output(pins, levels) call. The loop only wakes on
+frames where some pin changes, and sleeps while nothing is animated.
+Starting or stopping an effect is a dictionary update, not a thread.
+"""
+
+import math
+import random
+import time
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache
+
+from deadline_worker import DeadlineWorker
+from event_dispatcher import percentile
+from metrics import NULL_METRICS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# International Morse code
+MORSE_CODE = {
+    'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.', 'F': '..-.',
+    'G': '--.', 'H': '....', 'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..',
+    'M': '--', 'N': '-.', 'O': '---', 'P': '.--.', 'Q': '--.-', 'R': '.-.',
+    'S': '...', 'T': '-', 'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-',
+    'Y': '-.--', 'Z': '--..', '0': '-----', '1': '.----', '2': '..---',
+    '3': '...--', '4': '....-', '5': '.....', '6': '-....', '7': '--...',
+    '8': '---..', '9': '----.',
+}
+
+
+class Pattern:
+    """A rendered pattern: per-pin samples and the frames where levels change"""
+
+    __slots__ = ('name', 'samples', 'loop', 'length', 'changes')
+
+    def __init__(self, name, samples, loop):
+        """
+        Args:
+            name: Pattern name
+            samples: One bytes object of 0/1 levels per pin, all the same length
+            loop: Repeat the samples forever; otherwise the pins go off at the end
+        """
+        self.name = name
+        self.samples = tuple(samples)
+        self.loop = loop
+        self.length = len(self.samples[0])
+
+        # Frames (within one pass) where any pin differs from the frame
+        # before; frame 0 compares with the last frame when looping
+        changes = []
+        for frame in range(self.length):
+            if frame == 0 and not self.loop:
+                changes.append(0)
+            elif any(s[frame] != s[frame - 1] for s in self.samples):
+                changes.append(frame)
+        if not self.loop:
+            changes.append(self.length)
+        self.changes = tuple(changes)
+
+    def levels(self, frame):
+        """Return the pin levels at a frame offset, or None once a one-shot pattern ended"""
+        if self.loop:
+            frame %= self.length
+        elif frame >= self.length:
+            return None
+        return [s[frame] for s in self.samples]
+
+    def next_change(self, frame):
+        """
+        Return the first frame offset after frame where a level changes
+
+        Returns:
+            Frame offset, or None if the pattern never changes again
+        """
+        if not self.changes:
+            return None
+        if self.loop:
+            base = frame - frame % self.length
+            index = bisect_right(self.changes, frame % self.length)
+            if index == len(self.changes):
+                return base + self.length + self.changes[0]
+            return base + self.changes[index]
+        index = bisect_right(self.changes, frame)
+        return self.changes[index] if index < len(self.changes) else None
+
+
+def _frames(seconds, frame_rate):
+    return max(1, int(round(seconds * frame_rate)))
+
+
+def _square(frames, period, on):
+    """One pin that is on for the first `on` frames of every `period` frames"""
+    if np is not None:
+        return (np.arange(frames) % period < on).astype(np.uint8).tobytes()
+    return bytes(1 if i % period < on else 0 for i in range(frames))
+
+
+def _solid(frame_rate, pins, level=1):
+    return [bytes([1 if level else 0])] * pins, True
+
+
+def strobe_frames(frequency, frame_rate):
+    """
+    Frames in one strobe period at a frame rate
+
+    Raises:
+        ValueError: If the frequency is not above 0 or too fast to render
+    """
+    if frequency <= 0:
+        raise ValueError(f"Strobe frequency must be above 0 Hz, got {frequency}")
+    period = _frames(1.0 / frequency, frame_rate)
+    if period < 2:
+        raise ValueError(f"Strobe at {frequency} Hz is too fast for {frame_rate} frames per second")
+    return period
+
+
+def _strobe(frame_rate, pins, frequency=10.0, duty=0.5):
+    period = strobe_frames(frequency, frame_rate)
+    on = min(period - 1, max(1, int(round(period * duty))))
+    return [_square(period, period, on)] * pins, True
+
+
+def _pulse(frame_rate, pins, period=1.0, width=0.05):
+    frames = _frames(period, frame_rate)
+    return [_square(frames, frames, min(frames - 1, _frames(width, frame_rate)))] * pins, True
+
+
+def _chase(frame_rate, pins, step=0.1):
+    step_frames = _frames(step, frame_rate)
+    frames = step_frames * pins
+    if np is not None:
+        lit = np.arange(frames) // step_frames
+        return [(lit == pin).astype(np.uint8).tobytes() for pin in range(pins)], True
+    return [bytes(1 if i // step_frames == pin else 0 for i in range(frames))
+            for pin in range(pins)], True
+
+
+def _breathe(frame_rate, pins, period=2.0, pwm_frequency=50.0):
+    """Brightness follows a raised cosine, rendered as a PWM duty cycle per window"""
+    frames = _frames(period, frame_rate)
+    window = max(2, int(frame_rate // pwm_frequency))
+    frames = max(window, frames - frames % window)
+    if np is not None:
+        index = np.arange(frames)
+        start = index - index % window
+        brightness = (1.0 - np.cos(2.0 * np.pi * start / frames)) / 2.0
+        on = np.rint(brightness * window)
+        return [(index % window < on).astype(np.uint8).tobytes()] * pins, True
+    samples = bytearray(frames)
+    for start in range(0, frames, window):
+        brightness = (1.0 - math.cos(2.0 * math.pi * start / frames)) / 2.0
+        on = int(round(brightness * window))
+        for i in range(start, start + on):
+            samples[i] = 1
+    return [bytes(samples)] * pins, True
+
+
+def _morse(frame_rate, pins, text='SOS', unit=0.1, loop=True):
+    """Dot = 1 unit on, dash = 3, gaps of 1/3/7 units between symbols, letters and words"""
+    unit_frames = _frames(unit, frame_rate)
+    on = b'\x01' * unit_frames
+    off = b'\x00' * unit_frames
+    out = bytearray()
+    for word in text.upper().split():
+        letters = [MORSE_CODE[c] for c in word if c in MORSE_CODE]
+        for i, code in enumerate(letters):
+            out += off.join(on * (3 if mark == '-' else 1) for mark in code)
+            if i < len(letters) - 1:
+                out += off * 3
+        out += off * 7
+    if not out:
+        raise ValueError(f"Nothing to send in Morse: {text!r}")
+    return [bytes(out)] * pins, loop
+
+
+def _sparkle(frame_rate, pins, density=0.1, duration=2.0, twinkle=0.05, seed=0):
+    """Each pin lights for `twinkle` seconds at random; `seed` keeps the render cacheable"""
+    hold = _frames(twinkle, frame_rate)
+    steps = max(1, _frames(duration, frame_rate) // hold)
+    if np is not None:
+        lit = np.random.default_rng(seed).random((pins, steps)) < density
+        return [np.repeat(row, hold).astype(np.uint8).tobytes() for row in lit], True
+    rng = random.Random(seed)
+    return [bytes(level for _ in range(steps)
+                  for level in [1 if rng.random() < density else 0] * hold)
+            for _ in range(pins)], True
+
+
+# Pattern generators: (frame_rate, pins, **params) -> (samples per pin, loop)
+PATTERNS = {
+    'solid': _solid,
+    'strobe': _strobe,
+    'pulse': _pulse,
+    'chase': _chase,
+    'breathe': _breathe,
+    'morse': _morse,
+    'sparkle': _sparkle,
+}
+
+
+@lru_cache(maxsize=64)
+def _render(pattern, frame_rate, pins, params):
+    samples, loop = PATTERNS[pattern](frame_rate, pins, **dict(params))
+    return Pattern(pattern, samples, loop)
+
+
+def render_pattern(pattern, frame_rate, pins=1, **params):
+    """
+    Render a pattern into per-pin samples, reusing earlier renders
+
+    Args:
+        pattern: Pattern name (see PATTERNS)
+        frame_rate: Frames per second
+        pins: Number of pins the pattern drives
+        **params: Pattern parameters, e.g. frequency=10 for a strobe
+
+    Returns:
+        Pattern
+
+    Raises:
+        ValueError: If the pattern is unknown or its parameters are invalid
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown LED pattern: {pattern}")
+    try:
+        return _render(pattern, frame_rate, pins, tuple(sorted(params.items())))
+    except (TypeError, ZeroDivisionError) as e:
+        raise ValueError(f"Bad parameters for LED pattern {pattern}: {e}")
+
+
+class _Effect:
+    """A pattern playing on some pins from a start frame"""
+
+    __slots__ = ('pins', 'pattern', 'origin')
+
+    def __init__(self, pins, pattern, origin):
+        self.pins = pins
+        self.pattern = pattern
+        self.origin = origin
+
+
+class LedEngine:
+    """Plays LED patterns on any number of pins from one render loop"""
+
+    def __init__(self, gpio, frame_rate=200, clock=time.monotonic, scheduler=None,
+                 metrics=NULL_METRICS, lateness_samples=512):
+        """
+        Initialize the engine (the render thread starts on first use)
+
+        Args:
+            gpio: GPIO module (or compatible object)
+            frame_rate: Pattern frames per second
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+            metrics: Registry for the frame lateness histogram
+            lateness_samples: Number of recent frame latenesses kept
+        """
+        self.gpio = gpio
+        self.frame_rate = frame_rate
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._worker = DeadlineWorker(self._render_due, 'led-patterns', clock, scheduler)
+        self._cond = self._worker.cond
+        self._effects = {}            # effect name -> _Effect
+        self._levels = {}             # pin -> last level written
+        self._released = set()        # Pins of stopped effects, switched off next frame
+        self._epoch = clock()         # Frame 0
+        self._due = None              # Deadline of the frame being rendered
+        self.overruns = 0
+        self._last_frame = None
+        self._lateness = deque(maxlen=lateness_samples)
+        self._late = metrics.histogram('buzz_led_frame_late_seconds', 'LED frame lateness')
+
+    def start(self, name, pins, pattern, **params):
+        """
+        Start (or replace) an effect
+
+        A pin belongs to one effect at a time: any other effect driving one
+        of the pins is stopped.
+
+        Args:
+            name: Effect name, used to stop it
+            pins: Output pins, in pattern order (e.g. chase order)
+            pattern: Pattern name (see PATTERNS)
+            **params: Pattern parameters
+        """
+        pins = tuple(pins)
+        rendered = render_pattern(pattern, self.frame_rate, len(pins), **params)
+        with self._cond:
+            self._stop_effect(name)
+            self._release(pins)
+            now = self.clock()
+            if self._worker.deadline is None and not self._effects:
+                # Idle: start the frame grid now so the first frame is exact
+                self._epoch = now
+                self._last_frame = None
+            self._effects[name] = _Effect(pins, rendered, self._frame_at(now))
+            self._released.difference_update(pins)
+            self._kick(now)
+
+    def stop(self, name):
+        """Stop an effect; its pins are switched off"""
+        with self._cond:
+            if self._stop_effect(name):
+                self._kick(self.clock())
+
+    def set(self, pin, level):
+        """Drive a pin steadily, stopping any effect on it; written at once"""
+        level = 1 if level else 0
+        with self._cond:
+            if self._release((pin,)):
+                self._kick(self.clock())
+            self._released.discard(pin)
+            self._write({pin: level})
+
+    def active(self):
+        """Return the names of the running effects"""
+        with self._cond:
+            return sorted(self._effects)
+
+    def lateness_stats(self):
+        """Return frame lateness p50/p99 in milliseconds and skipped frames"""
+        with self._cond:
+            samples = list(self._lateness)
+        return {
+            'samples': len(samples),
+            'late_p50_ms': percentile(samples, 0.50) * 1000,
+            'late_p99_ms': percentile(samples, 0.99) * 1000,
+            'overruns': self.overruns,
+        }
+
+    def close(self):
+        """Stop the render loop and switch every driven pin off"""
+        self._worker.close()
+        with self._cond:
+            self._effects.clear()
+            self._write({pin: 0 for pin in self._levels})
+
+    def _frame_at(self, now):
+        # Small tolerance so a wakeup exactly on a frame deadline lands on it
+        return int((now - self._epoch) * self.frame_rate + 1e-6)
+
+    def _stop_effect(self, name):
+        """Remove an effect and queue its pins to go off (lock must be held)"""
+        effect = self._effects.pop(name, None)
+        if effect is None:
+            return False
+        self._released.update(effect.pins)
+        return True
+
+    def _release(self, pins):
+        """Stop effects driving any of the pins (lock must be held)"""
+        pins = set(pins)
+        clashing = [name for name, effect in self._effects.items() if pins.intersection(effect.pins)]
+        for name in clashing:
+            self._stop_effect(name)
+        return bool(clashing)
+
+    def _write(self, levels):
+        """Write the pins whose level changed in one batched call (lock must be held)"""
+        changed = [(pin, level) for pin, level in levels.items() if self._levels.get(pin) != level]
+        if not changed:
+            return
+        pins = [pin for pin, _ in changed]
+        values = [self.gpio.HIGH if level else self.gpio.LOW for _, level in changed]
+        self.gpio.output(pins, values)
+        for pin, level in changed:
+            self._levels[pin] = level
+
+    def _kick(self, now):
+        """Render as soon as possible (lock must be held)"""
+        self._due = now
+        self._worker.schedule(now)
+
+    def _step(self, now):
+        """
+        Write the levels due at now (lock must be held)
+
+        Returns:
+            Next deadline, or None when no pin will change
+        """
+        frame = self._frame_at(now)
+        if self._last_frame is not None and frame > self._last_frame + 1:
+            self.overruns += frame - self._last_frame - 1
+        self._last_frame = frame
+
+        levels = {pin: 0 for pin in self._released}
+        self._released.clear()
+        next_frame = None
+        for name, effect in list(self._effects.items()):
+            offset = frame - effect.origin
+            pattern_levels = effect.pattern.levels(offset)
+            if pattern_levels is None:
+                del self._effects[name]
+                levels.update((pin, 0) for pin in effect.pins)
+                continue
+            levels.update(zip(effect.pins, pattern_levels))
+            change = effect.pattern.next_change(offset)
+            if change is not None:
+                change += effect.origin
+                next_frame = change if next_frame is None else min(next_frame, change)
+        self._write(levels)
+
+        if next_frame is None:
+            return None
+        return self._epoch + next_frame / self.frame_rate
+
+    def _render_due(self, now):
+        """
+        Run a step for the current deadline and record how late it ran
+
+        Returns:
+            Tuple of (next frame deadline or None, None)
+        """
+        if self._due is not None and self._effects:
+            late = max(0.0, now - self._due)
+            self._lateness.append(late)
+            self._late.observe(late)
+        self._due = self._step(now)
+        return self._due, None
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Low-overhead metrics for the Buzz Lightyear Controller
+
+Counters, histograms and timing spans for the hot paths (button callbacks,
+sound playback, servo commands, strobe timing), readable as Prometheus
+text from a file or a local UNIX socket:
+
+    socat - UNIX-CONNECT:/tmp/buzz-metrics.sock
+
+When metrics are disabled the controller uses NULL_METRICS, whose
+counters, histograms and spans are shared do-nothing singletons, so the
+instrumentation costs one method call per use.
+
+Updates are not locked: on a rare thread switch mid-update a count can
+be lost, which is an acceptable trade for staying off the hot path.
+"""
+
+import bisect
+import os
+import socket
+import time
+from threading import Thread, Event
+
+# Histogram bucket upper bounds in seconds (100 us .. 2.5 s)
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """Context manager that observes the time spent inside it"""
+        return Span(self)
+
+
+class Span:
+    """Times a block of code into a histogram"""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """Collection of named metrics with Prometheus text export"""
+
+    enabled = True
+
+    def __init__(self):
+        # (name, labels) -> metric; name -> (type, help)
+        self._metrics = {}
+        self._meta = {}
+        # name -> (callable returning a number, help)
+        self._gauges = {}
+        self._stop = Event()
+        self._threads = []
+        self._socket = None
+        self._socket_path = None
+
+    def counter(self, name, help='', **labels):
+        """Get or create a counter"""
+        return self._get(name, 'counter', help, labels, Counter)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels):
+        """Get or create a histogram"""
+        return self._get(name, 'histogram', help, labels, lambda: Histogram(buckets))
+
+    def span(self, name, help='', **labels):
+        """Time a block into the histogram called name"""
+        return self.histogram(name, help, **labels).time()
+
+    def gauge(self, name, read, help=''):
+        """Register a gauge whose value is read only at export time"""
+        self._gauges[name] = (read, help)
+
+    def _get(self, name, kind, help, labels, factory):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = factory()
+            self._meta.setdefault(name, (kind, help))
+        return metric
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format"""
+        lines = []
+        by_name = {}
+        for (name, labels), metric in list(self._metrics.items()):
+            by_name.setdefault(name, []).append((labels, metric))
+
+        for name in sorted(by_name):
+            kind, help = self._meta[name]
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in by_name[name]:
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {metric.value}')
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + ('+Inf',), metric.counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', bound),)
+                    lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {metric.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {metric.count}')
+
+        for name in sorted(self._gauges):
+            read, help = self._gauges[name]
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path):
+        """Atomically write the Prometheus text to a file"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_file_exporter(self, path, interval=10.0):
+        """Rewrite the metrics file every interval seconds"""
+        def export():
+            while not self._stop.wait(interval):
+                self.write_file(path)
+            self.write_file(path)
+
+        self._start_thread(export, 'metrics-file')
+
+    def serve_unix_socket(self, path):
+        """Answer every connection on a UNIX socket with the current metrics"""
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(4)
+        server.settimeout(0.5)
+        self._socket = server
+        self._socket_path = path
+
+        def serve():
+            while not self._stop.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                with conn:
+                    conn.sendall(self.render().encode())
+
+        self._start_thread(serve, 'metrics-socket')
+
+    def close(self):
+        """Stop exporters and remove the socket"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self._socket is not None:
+            self._socket.close()
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            self._socket = None
+
+    def _start_thread(self, target, name):
+        thread = Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+
+class _NullMetric:
+    """Counter, histogram and span that do nothing"""
+
+    __slots__ = ()
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullRegistry:
+    """Registry used when metrics are disabled"""
+
+    enabled = False
+    _null = _NullMetric()
+
+    def counter(self, name, help='', **labels):
+        return self._null
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels):
+        return self._null
+
+    def span(self, name, help='', **labels):
+        return self._null
+
+    def gauge(self, name, read, help=''):
+        pass
+
+    def render(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = NullRegistry()
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Performance probes for the Buzz Lightyear Controller
+
+Where diagnose.py checks that things are present, these probes measure
+what decides how responsive the costume feels on a given Pi and SD card:
+
+- gpio_toggle: output writes per second on the strobe pin
+- edge_latency: time from driving a pin to its edge callback running,
+  over a jumper from an output to an input (--loopback OUT:IN); on the
+  simulator the input is driven directly, which measures the Python side
+- pwm_jitter: period and duty-cycle jitter of software PWM on the servo
+  pin, read back by sampling the pin (hardware only; the simulator's PWM
+  has no waveform)
+- mixer_open: time to open and close the mixer in the controller's format
+- clip_decode: decode time and decoded size of every clip
+- strobe: period jitter of the software strobe at rising frequencies,
+  and the highest frequency it keeps up with
+
+Probes that measure timing run alone, one after another, so they do not
+disturb each other. Clip decodes run on a thread pool: each one waits on
+the SD card and on SDL with the GIL released, and the pool's wall time
+shows how long preloading every clip takes.
+
+The report is a JSON dictionary whose meta section names the Pi model,
+SD card and backend, so reports from different boards and cards can be
+compared with compare_reports(), or with: diagnose.py --perf --compare.
+"""
+
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from event_dispatcher import percentile
+from strobe import DeadlineStrobe
+
+PROBES = ('gpio_toggle', 'edge_latency', 'pwm_jitter', 'mixer_open', 'clip_decode', 'strobe')
+
+# Software strobe frequencies tried, in Hz
+STROBE_FREQUENCIES = (10, 25, 50, 100, 200, 500, 1000)
+
+# The strobe keeps up while its median period error stays under this share of
+# the period and it misses at most STROBE_MAX_MISSED of its edges
+STROBE_MAX_ERROR = 0.1
+STROBE_MAX_MISSED = 0.01
+
+# Periods the strobe runs for at least, at every frequency
+STROBE_MIN_PERIODS = 25
+
+# Numbers compare_reports() lists, as (probe, key)
+COMPARED_METRICS = (
+    ('gpio_toggle', 'toggles_per_s'),
+    ('edge_latency', 'p50_us'),
+    ('edge_latency', 'p99_us'),
+    ('pwm_jitter', 'period_jitter_p99_us'),
+    ('pwm_jitter', 'duty_jitter_p99'),
+    ('mixer_open', 'open_p50_ms'),
+    ('clip_decode', 'total_ms'),
+    ('clip_decode', 'wall_ms'),
+    ('clip_decode', 'decoded_kib'),
+    ('strobe', 'max_frequency_hz'),
+)
+
+
+def _read_first_line(path):
+    """Return the first line of a small system file, or None"""
+    try:
+        with open(path, 'rb') as f:
+            return f.readline().rstrip(b'\0\n').decode('utf-8', 'replace').strip() or None
+    except OSError:
+        return None
+
+
+def board_info():
+    """
+    Describe the machine the report comes from
+
+    Returns:
+        Dictionary with Python version, machine, Pi model and SD card
+        name and manufacturer id (None where not available)
+    """
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'model': _read_first_line('/proc/device-tree/model'),
+        'sd_card': _read_first_line('/sys/block/mmcblk0/device/name'),
+        'sd_manfid': _read_first_line('/sys/block/mmcblk0/device/manfid'),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _us_stats(samples, prefix=''):
+    """Summarize samples in seconds as microseconds"""
+    return {
+        f'{prefix}p50_us': percentile(samples, 0.50) * 1e6,
+        f'{prefix}p99_us': percentile(samples, 0.99) * 1e6,
+        f'{prefix}max_us': max(samples, default=0.0) * 1e6,
+    }
+
+
+def probe_gpio_toggle(gpio, pin, seconds=0.5):
+    """
+    Measure how fast an output pin can be written
+
+    Args:
+        gpio: GPIO module (or compatible object)
+        pin: Output pin to toggle
+        seconds: How long to toggle
+
+    Returns:
+        Dictionary with toggles per second and microseconds per write
+    """
+    gpio.setup(pin, gpio.OUT)
+    output, high, low = gpio.output, gpio.HIGH, gpio.LOW
+    toggles = 0
+    began = time.perf_counter()
+    deadline = began + seconds
+    # Check the time every 100 writes so the clock read does not dominate
+    while time.perf_counter() < deadline:
+        for _ in range(50):
+            output(pin, high)
+            output(pin, low)
+        toggles += 100
+    elapsed = time.perf_counter() - began
+    output(pin, low)
+    return {
+        'pin': pin,
+        'toggles': toggles,
+        'toggles_per_s': toggles / elapsed,
+        'write_us': elapsed / toggles * 1e6,
+    }
+
+
+def probe_edge_latency(gpio, out_pin, in_pin, samples=200, timeout=0.1, drive=None):
+    """
+    Measure the time from driving a pin until its edge callback runs
+
+    Args:
+        gpio: GPIO module (or compatible object)
+        out_pin: Output wired to in_pin
+        in_pin: Input with the edge callback
+        samples: Edges to measure
+        timeout: Seconds to wait for each callback before counting it lost
+        drive: Called with a level instead of writing out_pin, e.g. the
+            simulator's set_input on in_pin
+
+    Returns:
+        Dictionary with latency p50/p99/max in microseconds and lost edges
+    """
+    fired = threading.Event()
+    arrived = [0.0]
+
+    def on_edge(channel):
+        arrived[0] = time.perf_counter()
+        fired.set()
+
+    if drive is None:
+        gpio.setup(out_pin, gpio.OUT, initial=gpio.LOW)
+
+        def drive(level):
+            gpio.output(out_pin, level)
+    gpio.setup(in_pin, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+    gpio.add_event_detect(in_pin, gpio.BOTH, callback=on_edge)
+    latencies = []
+    lost = 0
+    level = gpio.LOW
+    try:
+        for _ in range(samples):
+            level = gpio.HIGH if level == gpio.LOW else gpio.LOW
+            fired.clear()
+            sent = time.perf_counter()
+            drive(level)
+            if fired.wait(timeout):
+                latencies.append(arrived[0] - sent)
+            else:
+                lost += 1
+            # Let the pin settle so edges are not merged
+            time.sleep(0.001)
+    finally:
+        gpio.remove_event_detect(in_pin)
+        drive(gpio.LOW)
+    result = {'out_pin': out_pin, 'in_pin': in_pin, 'count': len(latencies), 'lost': lost}
+    result.update(_us_stats(latencies))
+    return result
+
+
+def probe_pwm_jitter(gpio, pin, duty_cycle, frequency=50, seconds=1.0):
+    """
+    Measure software PWM jitter by sampling the pin's level
+
+    The pin is sampled in a tight loop, so the resolution is the sample
+    interval reported alongside the jitter.
+
+    Args:
+        gpio: GPIO module (or compatible object)
+        pin: PWM output pin (the servo pin)
+        duty_cycle: Duty cycle in percent; use the servo's rest position
+        frequency: PWM frequency in Hz
+        seconds: How long to sample
+
+    Returns:
+        Dictionary with period and duty-cycle jitter, or 'skipped' with the
+        reason when the pin never toggled
+    """
+    gpio.setup(pin, gpio.OUT)
+    pwm = gpio.PWM(pin, frequency)
+    pwm.start(duty_cycle)
+    read, high = gpio.input, gpio.HIGH
+    rises, falls = [], []
+    reads = 0
+    try:
+        last = read(pin)
+        began = time.perf_counter()
+        deadline = began + seconds
+        now = began
+        while now < deadline:
+            level = read(pin)
+            now = time.perf_counter()
+            reads += 1
+            if level != last:
+                (rises if level == high else falls).append(now)
+                last = level
+        elapsed = now - began
+    finally:
+        pwm.stop()
+
+    if len(rises) < 3:
+        return {'pin': pin, 'skipped': 'the pin did not toggle when read back'}
+    period = 1.0 / frequency
+    periods = [b - a for a, b in zip(rises, rises[1:])]
+    duties = []
+    for rise, next_rise in zip(rises, rises[1:]):
+        fall = next((t for t in falls if rise < t < next_rise), None)
+        if fall is not None:
+            duties.append((fall - rise) / (next_rise - rise) * 100.0)
+    period_errors = [abs(p - period) for p in periods]
+    duty_errors = [abs(d - duty_cycle) for d in duties]
+    result = {
+        'pin': pin,
+        'frequency_hz': frequency,
+        'duty_cycle': duty_cycle,
+        'periods': len(periods),
+        'sample_interval_us': elapsed / reads * 1e6,
+        'mean_period_us': sum(periods) / len(periods) * 1e6,
+        'duty_jitter_p99': percentile(duty_errors, 0.99),
+        'duty_jitter_max': max(duty_errors, default=0.0),
+    }
+    result.update(_us_stats(period_errors, 'period_jitter_'))
+    return result
+
+
+def probe_mixer_open(mixer, frequency, size, channels, buffer, repeats=5):
+    """
+    Measure opening and closing the mixer; leaves it open for clip_decode
+
+    Returns:
+        Dictionary with open and close times in milliseconds
+    """
+    opens, closes = [], []
+    for i in range(repeats):
+        began = time.perf_counter()
+        mixer.pre_init(frequency=frequency, size=size, channels=channels, buffer=buffer)
+        mixer.init(frequency=frequency, size=size, channels=channels, buffer=buffer)
+        opens.append(time.perf_counter() - began)
+        if i < repeats - 1:
+            began = time.perf_counter()
+            mixer.quit()
+            closes.append(time.perf_counter() - began)
+    return {
+        'repeats': repeats,
+        'open_p50_ms': percentile(opens, 0.50) * 1000,
+        'open_max_ms': max(opens) * 1000,
+        'first_open_ms': opens[0] * 1000,
+        'close_p50_ms': percentile(closes, 0.50) * 1000,
+    }
+
+
+def probe_clip_decode(mixer, audio_path, files, workers=None):
+    """
+    Decode every clip on a thread pool, timing each one
+
+    The mixer must be open, so decoded sizes match what the sound bank holds.
+
+    Args:
+        mixer: pygame.mixer (or compatible object)
+        audio_path: Directory of the clips
+        files: Clip file names; missing ones are reported as such
+        workers: Decoding threads (default: one per CPU)
+
+    Returns:
+        Dictionary with per-clip decode time and decoded size, their totals
+        and the wall time of decoding them all
+    """
+    frequency, fmt, channels = mixer.get_init()
+    bytes_per_frame = channels * (abs(fmt) // 8)
+
+    def decode(name):
+        path = os.path.join(audio_path, name)
+        if not os.path.exists(path):
+            return name, {'missing': True}
+        began = time.perf_counter()
+        sound = mixer.Sound(path)
+        decode_ms = (time.perf_counter() - began) * 1000
+        length = sound.get_length()
+        return name, {
+            'decode_ms': decode_ms,
+            'seconds': length,
+            'decoded_kib': int(length * frequency) * bytes_per_frame / 1024,
+            'file_kib': os.path.getsize(path) / 1024,
+        }
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        clips = dict(pool.map(decode, files))
+    wall = time.perf_counter() - began
+    decoded = [clip for clip in clips.values() if not clip.get('missing')]
+    return {
+        'clips': clips,
+        'missing': len(clips) - len(decoded),
+        'total_ms': sum(clip['decode_ms'] for clip in decoded),
+        'wall_ms': wall * 1000,
+        'decoded_kib': sum(clip['decoded_kib'] for clip in decoded),
+        'slowest_ms': max((clip['decode_ms'] for clip in decoded), default=0.0),
+    }
+
+
+def probe_strobe(gpio, pin, frequencies=STROBE_FREQUENCIES, seconds=0.5):
+    """
+    Run the software strobe at rising frequencies and measure its jitter
+
+    Returns:
+        Dictionary with jitter per frequency and the highest frequency the
+        strobe keeps up with (see STROBE_MAX_ERROR)
+    """
+    gpio.setup(pin, gpio.OUT)
+    results = {}
+    max_frequency = None
+    for frequency in frequencies:
+        run_for = max(seconds, STROBE_MIN_PERIODS / frequency)
+        strobe = DeadlineStrobe(gpio, pin, frequency, jitter_samples=int(run_for * frequency) + 1)
+        strobe.start()
+        time.sleep(run_for)
+        stats = strobe.jitter_stats()
+        strobe.close()
+        edges = run_for * frequency * 2
+        keeps_up = (stats['samples'] > 0 and stats['overruns'] <= edges * STROBE_MAX_MISSED
+                    and stats['jitter_p50_ms'] / 1000 < STROBE_MAX_ERROR / frequency)
+        results[str(frequency)] = {
+            'jitter_p50_ms': stats['jitter_p50_ms'],
+            'jitter_p99_ms': stats['jitter_p99_ms'],
+            'overruns': stats['overruns'],
+            'keeps_up': keeps_up,
+        }
+        if not keeps_up:
+            break
+        max_frequency = frequency
+    return {'frequencies': results, 'max_frequency_hz': max_frequency}
+
+
+def run_probes(backend, config, audio_path=None, files=(), loopback=None, probes=PROBES,
+               seconds=0.5, workers=None):
+    """
+    Run the performance probes against a backend
+
+    Args:
+        backend: HardwareBackend, or a SimulatedBackend on a SystemClock
+        config: Controller settings (pins, servo duty cycles, mixer format)
+        audio_path: Clip directory (default: config audio_path)
+        files: Clip file names to decode
+        loopback: (output pin, input pin) jumpered together for
+            edge_latency; the simulator needs none
+        probes: Names of the probes to run
+        seconds: Duration of each timed probe
+        workers: Clip decoding threads
+
+    Returns:
+        Report dictionary with meta and one entry per probe; a probe that
+        cannot run here has a 'skipped' reason, one that failed an 'error'
+    """
+    gpio, mixer = backend.gpio, backend.mixer
+    audio_path = audio_path or config['audio_path']
+    simulated = hasattr(gpio, 'set_input')
+
+    def edge_latency():
+        if loopback is None and not simulated:
+            return {'skipped': 'jumper an output to an input and pass --loopback OUT:IN'}
+        if simulated:
+            in_pin = config['laser_button_pin']
+            return probe_edge_latency(gpio, None, in_pin,
+                                      drive=lambda level: gpio.set_input(in_pin, level))
+        return probe_edge_latency(gpio, loopback[0], loopback[1])
+
+    def mixer_open():
+        return probe_mixer_open(mixer, config['mixer_frequency'], config['mixer_size'],
+                                config['mixer_channels'], config['mixer_buffer'])
+
+    def clip_decode():
+        if not mixer.get_init():
+            mixer_open()
+        return probe_clip_decode(mixer, audio_path, files, workers)
+
+    runners = {
+        'gpio_toggle': lambda: probe_gpio_toggle(gpio, config['strobe_led_pin'], seconds),
+        'edge_latency': edge_latency,
+        'pwm_jitter': lambda: probe_pwm_jitter(gpio, config['servo_pin'],
+                                               config['servo_vertical'], seconds=seconds * 2),
+        'mixer_open': mixer_open,
+        'clip_decode': clip_decode,
+        'strobe': lambda: probe_strobe(gpio, config['strobe_led_pin'], seconds=seconds),
+    }
+
+    report = {
+        'meta': dict(board_info(), backend=backend.name, timestamp=time.time()),
+        'probes': {},
+    }
+    gpio.setwarnings(False)
+    gpio.setmode(gpio.BCM)
+    try:
+        for name in PROBES:
+            if name not in probes:
+                continue
+            try:
+                report['probes'][name] = runners[name]()
+            except Exception as e:
+                report['probes'][name] = {'error': f'{type(e).__name__}: {e}'}
+    finally:
+        if mixer.get_init():
+            mixer.quit()
+        gpio.cleanup()
+    return report
+
+
+def compare_reports(report, baseline):
+    """
+    Line up the headline numbers of two reports
+
+    Returns:
+        List of (metric, report value, baseline value); a value is None
+        where that report lacks the metric
+    """
+    rows = []
+    for probe, key in COMPARED_METRICS:
+        value = report['probes'].get(probe, {}).get(key)
+        base = baseline['probes'].get(probe, {}).get(key)
+        if value is not None or base is not None:
+            rows.append((f'{probe}.{key}', value, base))
+    return rows
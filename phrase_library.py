@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Phrase library for the Buzz Lightyear Controller
+
+Phrases live in a directory tree, one folder per category; the folders a
+clip sits in are its tags:
+
+    audio/phrases/greetings/hello_cadet.wav
+    audio/phrases/catchphrases/to_infinity.wav
+    audio/phrases/catchphrases/star_command/come_in.wav
+
+The tree is indexed once into a compact manifest, which is reused while
+every folder's modification time still matches, so starting with
+hundreds of phrases costs one stat per folder instead of one per clip.
+
+Selection modes, none of which repeats a phrase sooner than it must:
+
+- shuffle: a shuffle bag; every phrase plays once per round, in random
+  order, and a round never starts with the phrase that ended the last
+- weighted: random, weighted by tag, skipping the last few phrases played
+- sequential: every phrase in order
+
+The library picks the next phrase one press ahead and decodes it on a
+background thread while the current one plays, so a press finds its
+phrase already in memory. Decoded phrases are kept under a memory
+budget, least recently used evicted first; the phrase just played and
+the next one always stay. A phrase known ahead of time some other way,
+such as a cue from the group leader, can be decoded early with prefetch().
+
+Phrases are decoded from the copy build_audio.py compiled, or from its
+sound pack, when there is one; the tree itself is only indexed.
+
+Without a phrase tree the library picks from the four classic phrases in
+the audio directory, which the sound bank holds anyway.
+"""
+
+import json
+import os
+import random
+import threading
+from collections import OrderedDict, deque
+from numbers import Number
+
+from metrics import NULL_METRICS
+from sound_bank import SOUND_EXTENSIONS, decoded_size
+
+PHRASE_MODES = ('shuffle', 'weighted', 'sequential')
+
+# Phrases in the audio directory, used when there is no phrase tree
+DEFAULT_PHRASES = (
+    'to_infinity.wav',
+    'buzz_lightyear.wav',
+    'not_flying.wav',
+    'space_ranger.wav',
+)
+
+# Manifest file name and format version
+PHRASE_INDEX = 'phrase_index.json'
+INDEX_VERSION = 1
+
+# Weighted selection skips the last half of the phrases played, up to this many,
+# so the weights still choose among the other half
+RECENT_PHRASES = 8
+
+
+def scan_phrases(root):
+    """
+    Walk a phrase tree
+
+    Args:
+        root: Top folder of the tree
+
+    Returns:
+        Tuple of (folder -> modification time in ns, sorted list of
+        (clip path relative to root, tags, file size)); folders are
+        relative to root, '' being root itself, with None for a missing root
+    """
+    folders = {}
+    phrases = []
+    pending = ['']
+    while pending:
+        folder = pending.pop()
+        path = os.path.join(root, folder)
+        try:
+            folders[folder] = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            if not folder:
+                # Noted so creating the tree later counts as a change
+                folders[folder] = None
+            continue
+        tags = tuple(folder.split('/')) if folder else ()
+        for entry in entries:
+            name = f'{folder}/{entry.name}' if folder else entry.name
+            if entry.is_dir():
+                pending.append(name)
+            elif entry.is_file() and entry.name.lower().endswith(SOUND_EXTENSIONS):
+                phrases.append((name, tags, entry.stat().st_size))
+    return folders, sorted(phrases)
+
+
+def index_is_fresh(root, index):
+    """Return True if no folder of the tree changed since the index was built"""
+    for folder, mtime in index['folders'].items():
+        try:
+            current = os.stat(os.path.join(root, folder)).st_mtime_ns
+        except OSError:
+            current = None
+        if current != mtime:
+            return False
+    return True
+
+
+def load_index(root, index_path):
+    """
+    Return the phrase index, rebuilding and saving it if the tree changed
+
+    The manifest stores every tag once and refers to tags by number:
+        {"version": 1, "folders": {"": mtime, ...}, "tags": [...],
+         "phrases": [[path, [tag numbers], size], ...]}
+
+    Args:
+        root: Top folder of the tree
+        index_path: Manifest file; kept outside the tree, since writing it
+            would change the modification time of the folder it is in.
+            None keeps the index in memory only.
+
+    Returns:
+        Index dictionary as above, with 'rebuilt' telling whether the tree
+        was scanned
+    """
+    if index_path is not None:
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if (index.get('version') == INDEX_VERSION and index.get('root') == os.path.abspath(root)
+                    and index_is_fresh(root, index)):
+                index['rebuilt'] = False
+                return index
+        except (OSError, ValueError):
+            pass
+
+    folders, phrases = scan_phrases(root)
+    tag_list = sorted({tag for _, tags, _ in phrases for tag in tags})
+    tag_ids = {tag: i for i, tag in enumerate(tag_list)}
+    index = {
+        'version': INDEX_VERSION,
+        'root': os.path.abspath(root),
+        'folders': folders,
+        'tags': tag_list,
+        'phrases': [[path, [tag_ids[tag] for tag in tags], size] for path, tags, size in phrases],
+    }
+    if index_path is not None and folders[''] is not None:
+        try:
+            directory = os.path.dirname(index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{index_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Could not save the phrase index: {e}")
+    index['rebuilt'] = True
+    return index
+
+
+def check_weights(weights):
+    """Raise ValueError unless every tag weight is a number of 0 or more"""
+    for tag, weight in weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, Number) or not weight >= 0:
+            raise ValueError(f"Phrase weight for {tag!r} must be a number of 0 or more, got {weight!r}")
+
+
+class PhraseLibrary:
+    """Indexed phrases with no-repeat selection and one-ahead prefetch"""
+
+    def __init__(self, root, index_path=None, mode='shuffle', tags=None, weights=None,
+                 budget_bytes=8 * 1024 * 1024, rng=None, fallback=DEFAULT_PHRASES,
+                 metrics=NULL_METRICS, clip_root=None, pack=None, pack_prefix=''):
+        """
+        Index the phrase tree and choose the first phrase
+
+        Args:
+            root: Top folder of the phrase tree
+            index_path: Manifest file (None: index in memory only)
+            mode: 'shuffle', 'weighted' or 'sequential'
+            tags: Only phrases with at least one of these tags (None: all)
+            weights: Tag -> weight for weighted mode; a phrase takes the
+                largest weight of its tags, 1.0 without any. A weight of 0
+                leaves a phrase out unless only such phrases are left
+            budget_bytes: Most decoded phrase audio kept in memory
+            rng: random.Random to pick with (seed it for repeatable picks)
+            fallback: Clips in the audio directory to pick from when the
+                tree has no phrases; the sound bank plays these
+            metrics: Registry for phrase decode timings
+            clip_root: Folder to decode phrases from, such as the compiled
+                copy of the tree; phrases missing there come from root
+                (default: root)
+            pack: Optional SoundPack to decode phrases from where it has them
+            pack_prefix: Folder of the tree in the pack's clip names, e.g. 'phrases/'
+
+        Raises:
+            ValueError: On an unknown mode or a weight that is not a number of 0 or more
+        """
+        if mode not in PHRASE_MODES:
+            raise ValueError(f"Unknown phrase mode: {mode!r} (use {', '.join(PHRASE_MODES)})")
+        check_weights(weights or {})
+        self.root = root
+        self.clip_root = clip_root or root
+        self.pack = pack
+        self.pack_prefix = pack_prefix
+        self.index_path = index_path
+        self.mode = mode
+        self.budget_bytes = budget_bytes
+        self.rng = rng or random.Random()
+        self.mixer = None
+        self._load_timer = metrics.histogram('buzz_phrase_load_seconds', 'Phrase decode time')
+
+        index = load_index(root, index_path)
+        self._index = index
+        self.rebuilt = index['rebuilt']
+        self.tags = index['tags']
+        wanted = None if tags is None else set(tags)
+        weights = weights or {}
+        self._weights = {}
+        for path, tag_ids, _ in index['phrases']:
+            phrase_tags = [self.tags[i] for i in tag_ids]
+            if wanted is not None and not wanted.intersection(phrase_tags):
+                continue
+            self._weights[path] = max((weights.get(tag, 1.0) for tag in phrase_tags), default=1.0)
+        self.indexed = bool(self._weights)
+        self.phrases = list(self._weights) if self.indexed else list(fallback)
+
+        # Selection state
+        self._lock = threading.Lock()
+        self._position = 0
+        self._bag = []
+        self._recent = deque(maxlen=min(RECENT_PHRASES, len(self.phrases) // 2))
+        self._last = None
+        self._current = None
+        self._next = self._pick()
+        self._cued = None
+
+        # phrase -> (Sound, decoded size in bytes), most recently used last
+        self._sounds = OrderedDict()
+        self.used_bytes = 0
+        self._loaded = threading.Condition(self._lock)
+        self._loading = None
+        self._wanted = None
+        self._loader_thread = None
+        self._running = True
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def knows(self, name):
+        """Return True if the phrase comes from the tree, so this library decodes it"""
+        return self.indexed and name in self._weights
+
+    def stale(self):
+        """Return True if the phrase tree changed since it was indexed"""
+        return not index_is_fresh(self.root, self._index)
+
+    def peek(self):
+        """Return the phrase the next take() will return"""
+        with self._lock:
+            return self._next
+
+    def take(self):
+        """
+        Return the phrase to play now and start decoding the one after it
+
+        Returns:
+            Phrase name (a path under the tree, or a fallback clip name), or
+            None if there are no phrases
+        """
+        with self._lock:
+            phrase = self._next
+            self._current = phrase
+            self._next = self._pick()
+            self._prefetch_locked()
+        return phrase
+
+    def start(self, mixer):
+        """Start decoding ahead with the mixer that is now up"""
+        with self._lock:
+            self.mixer = mixer
+            self._prefetch_locked()
+
+    def prefetch(self, name):
+        """Decode a phrase in the background ahead of get(), e.g. for a cue due later"""
+        with self._lock:
+            if not self.knows(name):
+                return
+            self._cued = name
+            self._prefetch_locked()
+
+    def get(self, name):
+        """
+        Return the decoded Sound for a phrase
+
+        The phrase has usually been decoded ahead. If it is still being
+        decoded this waits for it; otherwise (e.g. a cue from the group
+        leader) it is decoded now.
+
+        Returns:
+            Sound, or None if the mixer is down or the clip cannot be decoded
+        """
+        with self._lock:
+            while self._loading == name:
+                self._loaded.wait()
+            if self._cued == name:
+                self._cued = None
+            entry = self._sounds.get(name)
+            if entry is not None:
+                self._sounds.move_to_end(name)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            if self._wanted == name:
+                # Queued but not started; decode it here instead
+                self._wanted = None
+                self._loaded.notify_all()
+            mixer = self.mixer
+        if mixer is None or not self.knows(name):
+            return None
+        return self._load(mixer, name)
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until the next phrase has been decoded
+
+        Returns:
+            True if the loader is idle, False on timeout
+        """
+        with self._lock:
+            return self._loaded.wait_for(
+                lambda: self._wanted is None and self._loading is None, timeout)
+
+    def stats(self):
+        """Return library and cache counters as a dictionary"""
+        with self._lock:
+            return {
+                'phrases': len(self.phrases),
+                'indexed': self.indexed,
+                'tags': len(self.tags),
+                'mode': self.mode,
+                'decoded': len(self._sounds),
+                'used_bytes': self.used_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetches': self.prefetches,
+                'evictions': self.evictions,
+            }
+
+    def unload(self):
+        """Drop every decoded phrase, e.g. before the mixer is shut down; start() refills"""
+        with self._lock:
+            self.mixer = None
+            self._wanted = None
+            self._cued = None
+            self._sounds.clear()
+            self.used_bytes = 0
+
+    def close(self):
+        """Stop the loader thread and drop every decoded phrase"""
+        with self._lock:
+            self._running = False
+            self._loaded.notify_all()
+            thread = self._loader_thread
+        if thread is not None:
+            thread.join()
+        self.unload()
+
+    def _pick(self):
+        """Choose the next phrase (lock must be held, except from __init__)"""
+        phrases = self.phrases
+        if not phrases:
+            return None
+        if self.mode == 'sequential':
+            phrase = phrases[self._position % len(phrases)]
+            self._position += 1
+        elif self.mode == 'shuffle':
+            if not self._bag:
+                self._bag = list(phrases)
+                self.rng.shuffle(self._bag)
+                # The bag is popped from the end; never start a round with the last phrase
+                if len(self._bag) > 1 and self._bag[-1] == self._last:
+                    self._bag[0], self._bag[-1] = self._bag[-1], self._bag[0]
+            phrase = self._bag.pop()
+        else:
+            candidates = [p for p in phrases if p not in self._recent]
+            weights = [self._weights.get(p, 1.0) for p in candidates]
+            # Only zero-weight phrases left: pick among them evenly
+            phrase = self.rng.choices(candidates, weights if sum(weights) > 0 else None)[0]
+            self._recent.append(phrase)
+        self._last = phrase
+        return phrase
+
+    def _prefetch_locked(self):
+        """Have the loader decode the cued phrase, then the next one (lock must be held)"""
+        if self.mixer is None:
+            return
+        for name in (self._cued, self._next):
+            if name is not None and self.knows(name) and name not in self._sounds:
+                break
+        else:
+            return
+        self._wanted = name
+        if self._loader_thread is None:
+            self._loader_thread = threading.Thread(
+                target=self._loader_loop, name='phrase-loader', daemon=True
+            )
+            self._loader_thread.start()
+        self._loaded.notify_all()
+
+    def _loader_loop(self):
+        """Decode the phrase picked for the next press"""
+        while True:
+            with self._lock:
+                while self._running:
+                    if self._wanted in self._sounds:
+                        self._wanted = None
+                        self._loaded.notify_all()
+                    if self._wanted is not None:
+                        break
+                    self._loaded.wait()
+                if not self._running:
+                    return
+                name, mixer = self._wanted, self.mixer
+                self._wanted = None
+                self._loading = name
+            try:
+                if self._load(mixer, name) is not None:
+                    with self._lock:
+                        self.prefetches += 1
+                        # A cued phrase went first; the next one may still be waiting
+                        if self._wanted is None:
+                            self._prefetch_locked()
+            finally:
+                with self._lock:
+                    self._loading = None
+                    self._loaded.notify_all()
+
+    def _load(self, mixer, name):
+        """Decode a phrase and insert it into the cache"""
+        key = self.pack_prefix + name
+        packed = self.pack is not None and key in self.pack
+        path = None if packed else self._path(name)
+        try:
+            with self._load_timer.time():
+                if packed:
+                    sound = mixer.Sound(buffer=self.pack.clip(key))
+                else:
+                    sound = mixer.Sound(path)
+        except Exception as e:
+            print(f"Error loading phrase {name}: {e}")
+            return None
+        size = decoded_size(mixer, sound)
+        if size is None:
+            size = len(self.pack.clip(key)) if packed else os.path.getsize(path)
+        with self._lock:
+            if self.mixer is not mixer:
+                # Unloaded while decoding
+                return None
+            old = self._sounds.pop(name, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self._sounds[name] = (sound, size)
+            self.used_bytes += size
+            self._evict_locked()
+        return sound
+
+    def _path(self, name):
+        """File to decode a phrase from: the compiled copy if there is one"""
+        path = os.path.join(self.clip_root, name)
+        if self.clip_root != self.root and not os.path.isfile(path):
+            path = os.path.join(self.root, name)
+        return path
+
+    def _evict_locked(self):
+        """Evict least recently used phrases until within budget, keeping current, next and cued"""
+        keep = {self._current, self._next, self._cued}
+        for name in list(self._sounds):
+            if self.used_bytes <= self.budget_bytes:
+                break
+            if name in keep:
+                continue
+            _, size = self._sounds.pop(name)
+            self.used_bytes -= size
+            self.evictions += 1
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Wakeup and CPU profile for battery-powered operation
+
+Runs a BuzzController in real time and measures, for each state:
+
+- active: wings open with the strobe flashing and a laser press every second
+- idle: wings closed, no presses, before idle_timeout has passed
+- parked: after idle_timeout, with the servo PWM and audio released
+
+and reports per state:
+
+- wakeups per second: voluntary context switches of every thread in the
+  process (each one is a thread going to sleep and being woken again),
+  read from /proc/self/task/*/status
+- CPU time per minute: user + system time of the process
+
+By default the controller runs on the simulated backend, so the numbers
+show what the Python side costs anywhere; with --hardware it drives the
+real GPIO and mixer on the Pi.
+
+Run with:
+    python3 power_profile.py --seconds 20
+    python3 power_profile.py --hardware --json power.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from backends import HardwareBackend, SystemClock
+from buzz_controller import BuzzController
+from simulator import DEFAULT_CLIPS, SimulatedBackend, write_silent_clips
+
+PHASES = ('active', 'idle', 'parked')
+
+
+def thread_wakeups():
+    """
+    Return voluntary context switches per thread of this process
+
+    Returns:
+        Dictionary of thread name -> count, or None where /proc is missing
+    """
+    names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    counts = {}
+    try:
+        tids = os.listdir('/proc/self/task')
+    except OSError:
+        return None
+    for tid in tids:
+        try:
+            with open(f'/proc/self/task/{tid}/status') as f:
+                for line in f:
+                    if line.startswith('voluntary_ctxt_switches:'):
+                        name = names.get(int(tid), f'tid-{tid}')
+                        counts[name] = counts.get(name, 0) + int(line.split()[1])
+                        break
+        except OSError:
+            # Thread exited while reading
+            continue
+    return counts
+
+
+def cpu_seconds():
+    """Return user + system CPU time of the process in seconds"""
+    times = os.times()
+    return times.user + times.system
+
+
+def measure(seconds, tick=None, tick_interval=1.0):
+    """
+    Measure wakeups and CPU time over a period
+
+    Args:
+        seconds: Length of the measurement
+        tick: Optional callable run every tick_interval seconds (e.g. a press)
+        tick_interval: Seconds between ticks
+
+    Returns:
+        Dictionary with wakeups_per_s (None without /proc), cpu_ms_per_min
+        and per-thread wakeups per second
+    """
+    before = thread_wakeups()
+    cpu_before = cpu_seconds()
+    start = time.monotonic()
+    end = start + seconds
+    next_tick = start
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        if tick is not None and now >= next_tick:
+            tick()
+            next_tick += tick_interval
+        wake = end if tick is None else min(end, next_tick)
+        time.sleep(max(0.0, wake - time.monotonic()))
+    elapsed = time.monotonic() - start
+    cpu = cpu_seconds() - cpu_before
+    after = thread_wakeups()
+
+    result = {'seconds': elapsed, 'cpu_ms_per_min': cpu * 1000 * 60 / elapsed}
+    if before is None or after is None:
+        result['wakeups_per_s'] = None
+        result['threads'] = {}
+        return result
+    threads = {name: (count - before.get(name, 0)) / elapsed for name, count in after.items()}
+    result['threads'] = {name: rate for name, rate in sorted(threads.items()) if rate > 0}
+    result['wakeups_per_s'] = sum(threads.values())
+    return result
+
+
+def run_profile(seconds=10.0, hardware=False, config=None):
+    """
+    Profile the controller through the active, idle and parked states
+
+    Args:
+        seconds: Length of each state
+        hardware: Use the real GPIO and mixer instead of the simulated backend
+        config: Extra controller configuration
+
+    Returns:
+        Dictionary of state -> measurement (see measure()), plus 'idle_stats'
+    """
+    with contextlib.ExitStack() as stack:
+        profile_config = {'idle_timeout': seconds}
+        if hardware:
+            backend = HardwareBackend()
+        else:
+            backend = SimulatedBackend(clock=SystemClock())
+            audio_path = stack.enter_context(tempfile.TemporaryDirectory())
+            write_silent_clips(audio_path, DEFAULT_CLIPS)
+            profile_config['audio_path'] = audio_path
+        profile_config.update(config or {})
+
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        controller = BuzzController(profile_config, backend=backend)
+        stack.callback(controller.cleanup)
+        laser_pin = controller.config['laser_button_pin']
+        wing_pin = controller.config['wing_button_pin']
+
+        results = {}
+        # The measurement itself sleeps between ticks, so its own thread
+        # adds about one wakeup per tick to every state
+        controller._on_gesture('wing', wing_pin)
+        results['active'] = measure(seconds, lambda: controller._on_gesture('laser', laser_pin))
+        controller._on_gesture('wing', wing_pin)
+        controller.dispatcher.wait_idle(5.0)
+        controller.servo_motion.wait_idle(5.0)
+        # Idle until just before the timeout, then parked once it has passed
+        results['idle'] = measure(seconds * 0.9)
+        time.sleep(seconds * 0.2)
+        results['parked'] = measure(seconds)
+        results['idle_stats'] = controller.idle.stats()
+    return results
+
+
+def print_profile(results):
+    """Print a table of the profile"""
+    print(f"{'state':<8} {'wakeups/s':>10} {'CPU ms/min':>11}")
+    for phase in PHASES:
+        result = results[phase]
+        wakeups = result['wakeups_per_s']
+        wakeups = 'n/a' if wakeups is None else f'{wakeups:.1f}'
+        print(f"{phase:<8} {wakeups:>10} {result['cpu_ms_per_min']:>11.1f}")
+    for phase in PHASES:
+        threads = ', '.join(f'{name} {rate:.1f}' for name, rate in results[phase]['threads'].items())
+        print(f"  {phase} threads (wakeups/s): {threads or 'none'}")
+    stats = results['idle_stats']
+    print(f"Went idle {stats['idle_periods']} time(s); idle now: {stats['idle']}")
+
+
+def main():
+    """Run the profile from the command line"""
+    parser = argparse.ArgumentParser(description='Wakeup and CPU profile of the controller')
+    parser.add_argument('--seconds', type=float, default=10.0, help='Length of each state')
+    parser.add_argument('--hardware', action='store_true', help='Use the real GPIO and mixer')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = run_profile(args.seconds, hardware=args.hardware)
+    print_profile(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
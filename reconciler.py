@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Target-state reconciler for the Buzz Lightyear Controller
+
+Button actions say what the costume should look like (wings open, laser
+on, strobe off) instead of driving the hardware themselves. The
+reconciler keeps that desired state next to the state the hardware was
+last driven to, and applies the difference:
+
+- a target that can be applied right away is applied at once, on the
+  caller's thread, so a single press is as fast as before
+- while an output is busy (the servo still moving) or inside its hold
+  time after the last change, new targets only replace the desired value;
+  when the output frees up, only the latest target is applied
+- toggles that cancel out before they were applied do nothing at all
+
+Hammering a button therefore costs at most one more servo motion, sound
+and strobe change however many presses were made, and every superseded
+transition is counted as coalesced.
+"""
+
+import time
+from functools import partial
+
+from deadline_worker import DeadlineWorker
+from metrics import NULL_METRICS
+
+
+class _Target:
+    """Desired and applied state of one output"""
+
+    __slots__ = ('apply', 'desired', 'actual', 'hold', 'busy', 'held_until', 'applying', 'requests')
+
+    def __init__(self, apply, initial, hold, busy):
+        self.apply = apply
+        self.desired = initial
+        self.actual = initial
+        self.hold = hold
+        self.busy = busy
+        self.held_until = float('-inf')
+        self.applying = False
+        self.requests = 0             # Changes to the desired value since the last apply
+
+
+class Reconciler:
+    """Converges outputs to their latest desired state"""
+
+    def __init__(self, clock=time.monotonic, scheduler=None, metrics=NULL_METRICS):
+        """
+        Initialize the reconciler (the thread starts on first use)
+
+        Args:
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock or an asyncio loop; when given, no thread
+                is started and deferred targets are applied from its callbacks
+            metrics: Registry for applied and coalesced transition counters
+        """
+        self.clock = clock
+        self.scheduler = scheduler
+
+        self._worker = DeadlineWorker(self._step, 'reconciler', clock, scheduler)
+        self._cond = self._worker.cond
+        self._targets = {}
+
+        self._stats = {'applied': 0, 'coalesced': 0}
+        self._applied_counter = metrics.counter(
+            'buzz_transitions_applied_total', 'Target state changes applied to the hardware')
+        self._coalesced_counter = metrics.counter(
+            'buzz_transitions_coalesced_total', 'Target state changes superseded before being applied')
+
+    def add(self, key, apply, initial, hold=0.0, busy=None):
+        """
+        Register an output
+
+        Args:
+            key: Output name, e.g. 'wings'
+            apply: Called with the target value to drive the hardware
+            initial: Value the hardware starts in
+            hold: Seconds after a change during which new targets wait
+            busy: Optional callable returning True while the output cannot
+                take a new target; call poke() once it frees up
+        """
+        with self._cond:
+            self._targets[key] = _Target(apply, initial, hold, busy)
+
+    def set(self, key, value):
+        """
+        Request a target value, applying it at once if the output is free
+
+        Returns:
+            True if the value was applied before returning
+        """
+        with self._cond:
+            target = self._targets[key]
+            if value == target.desired:
+                return False
+            target.desired = value
+            target.requests += 1
+            if not self._claim(target, self.clock()):
+                return False
+        self._apply(target)
+        return True
+
+    def set_hold(self, key, hold):
+        """Change an output's hold time; the current hold runs out as planned"""
+        with self._cond:
+            self._targets[key].hold = hold
+
+    def desired(self, key):
+        """Return the latest requested value"""
+        with self._cond:
+            return self._targets[key].desired
+
+    def actual(self, key):
+        """Return the value the hardware was last driven to"""
+        with self._cond:
+            return self._targets[key].actual
+
+    def assume(self, key, value):
+        """Record that the hardware was driven to value by someone else (e.g. a show)"""
+        with self._cond:
+            target = self._targets[key]
+            self._coalesce(target.requests)
+            target.requests = 0
+            target.desired = value
+            target.actual = value
+
+    def poke(self):
+        """Re-check waiting targets, e.g. after a busy output finished"""
+        with self._cond:
+            if any(t.desired != t.actual for t in self._targets.values()):
+                self._kick(self.clock())
+
+    def stats(self):
+        """Return counts of applied and coalesced transitions"""
+        with self._cond:
+            return dict(self._stats)
+
+    def close(self):
+        """Drop waiting targets and stop the thread"""
+        self._worker.close()
+
+    def _coalesce(self, count):
+        if count > 0:
+            self._stats['coalesced'] += count
+            self._coalesced_counter.inc(count)
+
+    def _claim(self, target, now):
+        """
+        Take a target for applying if it can change now (lock must be held)
+
+        Returns:
+            True if the caller must apply it; otherwise a retry is scheduled
+        """
+        if target.applying or not self._worker.running:
+            return False
+        if target.desired == target.actual:
+            # Toggled back before it was applied
+            self._coalesce(target.requests)
+            target.requests = 0
+            return False
+        if now < target.held_until:
+            self._kick(target.held_until)
+            return False
+        if target.busy is not None and target.busy():
+            # Retried from poke()
+            return False
+        target.applying = True
+        return True
+
+    def _apply(self, target):
+        """Drive the hardware to the latest target (called without the lock)"""
+        with self._cond:
+            value = target.desired
+            self._coalesce(target.requests - 1)
+            target.requests = 0
+        try:
+            target.apply(value)
+        finally:
+            with self._cond:
+                target.actual = value
+                target.applying = False
+                target.held_until = self.clock() + target.hold
+                self._stats['applied'] += 1
+                self._applied_counter.inc()
+                if target.desired != target.actual:
+                    # Changed again while applying
+                    self._kick(target.held_until)
+                else:
+                    self._coalesce(target.requests)
+                    target.requests = 0
+
+    def _kick(self, when):
+        """Make sure a reconcile pass runs by when (lock must be held)"""
+        deadline = self._worker.deadline
+        if deadline is None or when < deadline:
+            self._worker.schedule(when)
+
+    def _step(self, now):
+        """Claim every target that can be applied now (lock must be held)"""
+        due = [t for t in self._targets.values() if t.desired != t.actual and self._claim(t, now)]
+        return None, partial(self._apply_all, due) if due else None
+
+    def _apply_all(self, targets):
+        for target in targets:
+            self._apply(target)
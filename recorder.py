@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Binary event recorder and deterministic replay for the Buzz Lightyear Controller
+
+EventRecorder keeps the last `capacity` events in one preallocated ring
+buffer of fixed-size binary records:
+
+    time     float64  controller clock, seconds
+    kind     uint8    EDGE, PIN, PWM_DUTY, SOUND, CALLBACK_START, ...
+    target   uint16   pin number, or the id of a name (action, clip)
+    value    float32  level, duty cycle, channel, or the id of a name
+
+Recording packs the record into its slot with struct.pack_into: no
+buffer, list entry or string is created per event, so the recorder adds
+no garbage to the hot path and its memory never grows. Names (actions,
+clips) are interned once, the first time they are seen.
+
+The controller records every input edge, button callback start and end,
+pin write, PWM change and sound trigger, plus presses and cues from the
+control server and the group leader. dump() writes the buffer to disk,
+oldest event first, with the names and the controller's configuration;
+the controller dumps on SIGUSR1, on the control server's dump command
+and when an exception goes uncaught.
+
+replay() feeds a recording's inputs back through a controller on the
+simulated backend at their recorded times, records the replay the same
+way, and compares what each output did, so a bug seen in the field can
+be reproduced, stepped through and profiled offline:
+    python3 recorder.py recordings/buzz-20261017-211502.rec
+    python3 recorder.py recordings/buzz-20261017-211502.rec --realtime --profile
+"""
+
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from itertools import count
+
+from event_dispatcher import percentile
+
+RECORDING_MAGIC = b'BUZZREC1'
+RECORDING_VERSION = 1
+
+RECORD = struct.Struct('<dBxHf')
+_HEADER = struct.Struct('<8sIIIddI')
+
+# Event kinds
+EDGE = 1            # Input edge: pin, level read in the callback
+CALLBACK_START = 2  # Button action started: action, channel
+CALLBACK_END = 3    # Button action returned: action, channel
+PIN = 4             # Output write: pin, level
+PWM_START = 5       # PWM started: pin, duty cycle
+PWM_DUTY = 6        # PWM duty cycle change: pin, duty cycle
+PWM_FREQUENCY = 7   # PWM frequency change: pin, frequency
+PWM_STOP = 8        # PWM stopped: pin
+SOUND = 9           # Sound triggered: clip, category
+PRESS = 10          # Remote press: action
+CUE = 11            # Cue from the group leader: action, JSON value
+SHOW = 12           # Remote show start: show
+ERROR = 13          # Button action raised: action
+DUMP = 14           # A dump was taken here
+
+KIND_NAMES = {
+    EDGE: 'edge', CALLBACK_START: 'callback_start', CALLBACK_END: 'callback_end',
+    PIN: 'pin', PWM_START: 'pwm_start', PWM_DUTY: 'pwm_duty', PWM_FREQUENCY: 'pwm_frequency',
+    PWM_STOP: 'pwm_stop', SOUND: 'sound', PRESS: 'press', CUE: 'cue', SHOW: 'show',
+    ERROR: 'error', DUMP: 'dump',
+}
+
+# Kinds whose target, or value, is the id of a name
+NAMED_TARGETS = frozenset({CALLBACK_START, CALLBACK_END, SOUND, PRESS, CUE, SHOW, ERROR})
+NAMED_VALUES = frozenset({SOUND, CUE})
+
+# What replay() feeds back in, and what it compares
+INPUT_KINDS = frozenset({EDGE, PRESS, CUE, SHOW})
+OUTPUT_KINDS = frozenset({PIN, PWM_START, PWM_DUTY, PWM_FREQUENCY, PWM_STOP, SOUND})
+
+# One decoded event; target and value are names for the named kinds
+RecordedEvent = namedtuple('RecordedEvent', ['time', 'kind', 'target', 'value'])
+
+# A loaded recording
+Recording = namedtuple('Recording', ['events', 'meta'])
+
+
+class EventRecorder:
+    """Fixed-size ring buffer of binary event records"""
+
+    def __init__(self, capacity=65536, clock=time.monotonic):
+        """
+        Preallocate the buffer
+
+        Args:
+            capacity: Events kept; older ones are overwritten
+            clock: Monotonic time source in seconds
+        """
+        self.capacity = capacity
+        self.clock = clock
+        self._buffer = bytearray(capacity * RECORD.size)
+        # next() on a count is atomic, so threads never share a slot
+        self._slots = count()
+        self._names = {}
+        self._name_list = []
+        self._names_lock = threading.Lock()
+
+    def record(self, kind, target=0, value=0.0):
+        """Record one event; target must be a pin number or name_id()"""
+        RECORD.pack_into(self._buffer, next(self._slots) % self.capacity * RECORD.size,
+                         self.clock(), kind, target, value)
+
+    def name_id(self, name):
+        """Return the id of a name, interning it the first time"""
+        try:
+            return self._names[name]
+        except KeyError:
+            with self._names_lock:
+                if name not in self._names:
+                    self._names[name] = len(self._name_list)
+                    self._name_list.append(name)
+                return self._names[name]
+
+    def snapshot(self):
+        """
+        Return the recorded events, oldest first
+
+        Returns:
+            Tuple of (raw records as bytes, events recorded in total)
+        """
+        # Taking a slot for the marker also tells how far recording has got
+        slot = next(self._slots)
+        RECORD.pack_into(self._buffer, slot % self.capacity * RECORD.size, self.clock(), DUMP, 0, 0.0)
+        total = slot + 1
+        if total <= self.capacity:
+            return bytes(self._buffer[:total * RECORD.size]), total
+        split = total % self.capacity * RECORD.size
+        return bytes(self._buffer[split:] + self._buffer[:split]), total
+
+    def events(self):
+        """Return the recorded events decoded, oldest first"""
+        data, total = self.snapshot()
+        with self._names_lock:
+            names = list(self._name_list)
+        return decode_records(data, names)
+
+    def dump(self, path, meta=None):
+        """
+        Write the recorded events to a file
+
+        Args:
+            path: Output file; written to a temporary file and renamed
+            meta: Extra JSON-serializable information, e.g. the configuration
+
+        Returns:
+            Number of events written
+        """
+        data, total = self.snapshot()
+        with self._names_lock:
+            names = list(self._name_list)
+        meta = dict(meta or {})
+        meta['names'] = names
+        meta['overwritten'] = max(0, total - self.capacity)
+        meta_bytes = json.dumps(meta, default=str).encode('utf-8')
+        events = len(data) // RECORD.size
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, RECORD.size, events,
+                                 self.clock(), time.time(), len(meta_bytes)))
+            f.write(meta_bytes)
+            f.write(data)
+        os.replace(tmp_path, path)
+        return events
+
+
+class _NullRecorder:
+    """Recorder that records nothing, used when recording is off"""
+
+    capacity = 0
+
+    def record(self, kind, target=0, value=0.0):
+        pass
+
+    def name_id(self, name):
+        return 0
+
+    def events(self):
+        return []
+
+
+NULL_RECORDER = _NullRecorder()
+
+
+class RecordingPWM:
+    """RPi.GPIO PWM object that records its changes"""
+
+    def __init__(self, pwm, pin, recorder):
+        self._pwm = pwm
+        self._pin = pin
+        self._recorder = recorder
+
+    def start(self, duty_cycle):
+        self._recorder.record(PWM_START, self._pin, duty_cycle)
+        self._pwm.start(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self._recorder.record(PWM_DUTY, self._pin, duty_cycle)
+        self._pwm.ChangeDutyCycle(duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        self._recorder.record(PWM_FREQUENCY, self._pin, frequency)
+        self._pwm.ChangeFrequency(frequency)
+
+    def stop(self):
+        self._recorder.record(PWM_STOP, self._pin)
+        self._pwm.stop()
+
+    def __getattr__(self, name):
+        return getattr(self._pwm, name)
+
+
+class RecordingGPIO:
+    """RPi.GPIO stand-in that records edges, pin writes and PWM changes and passes them on"""
+
+    def __init__(self, gpio, recorder):
+        self._gpio = gpio
+        self._recorder = recorder
+
+    def output(self, channel, value):
+        record = self._recorder.record
+        if isinstance(channel, (list, tuple)):
+            if isinstance(value, (list, tuple)):
+                for pin, level in zip(channel, value):
+                    record(PIN, pin, level)
+            else:
+                for pin in channel:
+                    record(PIN, pin, value)
+        else:
+            record(PIN, channel, value)
+        self._gpio.output(channel, value)
+
+    def PWM(self, channel, frequency):
+        return RecordingPWM(self._gpio.PWM(channel, frequency), channel, self._recorder)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if callback is not None:
+            callback = self._recording_callback(callback)
+        if bouncetime is None:
+            self._gpio.add_event_detect(channel, edge, callback=callback)
+        else:
+            self._gpio.add_event_detect(channel, edge, callback=callback, bouncetime=bouncetime)
+
+    def _recording_callback(self, callback):
+        """Wrap an edge callback to record the edge and the level it left the pin at"""
+        gpio, record = self._gpio, self._recorder.record
+
+        def on_edge(channel):
+            record(EDGE, channel, gpio.input(channel))
+            callback(channel)
+        return on_edge
+
+    def __getattr__(self, name):
+        # Constants and everything not recorded go straight to the real module
+        return getattr(self._gpio, name)
+
+
+def decode_records(data, names):
+    """
+    Decode raw records
+
+    Args:
+        data: Bytes of whole records
+        names: Name list the ids refer to
+
+    Returns:
+        List of RecordedEvent, with names in place of ids for named kinds
+    """
+    events = []
+    for time_, kind, target, value in RECORD.iter_unpack(data):
+        if kind in NAMED_TARGETS:
+            target = names[target] if target < len(names) else target
+        if kind in NAMED_VALUES:
+            index = int(value)
+            value = names[index] if index < len(names) else value
+        events.append(RecordedEvent(time_, kind, target, value))
+    return events
+
+
+def load_recording(path):
+    """
+    Read a file written by EventRecorder.dump()
+
+    Returns:
+        Recording of the decoded events and the metadata (names, config,
+        random seed, phrase list, clock and wall time of the dump, events
+        overwritten before it)
+
+    Raises:
+        ValueError: If the file is not a recording or is truncated
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{path} is not a Buzz recording")
+        magic, version, record_size, events, clock, wall_time, meta_size = _HEADER.unpack(header)
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a Buzz recording (version {RECORDING_VERSION})")
+        meta = json.loads(f.read(meta_size))
+        data = f.read(events * RECORD.size)
+    if len(data) != events * RECORD.size:
+        raise ValueError(f"{path} is truncated")
+    meta['clock'] = clock
+    meta['wall_time'] = wall_time
+    return Recording(decode_records(data, meta['names']), meta)
+
+
+def callback_latency(events):
+    """
+    Return how long each button action ran in a recording
+
+    Returns:
+        Dictionary of action -> sorted list of seconds from start to end
+    """
+    started = {}
+    durations = {}
+    for event in events:
+        if event.kind == CALLBACK_START:
+            started[event.target] = event.time
+        elif event.kind == CALLBACK_END and event.target in started:
+            durations.setdefault(event.target, []).append(event.time - started.pop(event.target))
+    return {action: sorted(times) for action, times in durations.items()}
+
+
+def compare_outputs(recorded, replayed):
+    """
+    Compare what every output did in two event lists
+
+    Outputs are compared one by one, so unrelated outputs (an LED frame
+    and a servo update) may interleave differently without counting as a
+    difference.
+
+    Returns:
+        Dictionary of output name -> recorded count, replayed count and the
+        first differing (index, recorded, replayed) values or None
+    """
+    def by_output(events):
+        outputs = {}
+        for event in events:
+            if event.kind in OUTPUT_KINDS:
+                outputs.setdefault(f'{KIND_NAMES[event.kind]}:{event.target}', []).append(event)
+        return outputs
+
+    recorded, replayed = by_output(recorded), by_output(replayed)
+    result = {}
+    for name in sorted(set(recorded) | set(replayed)):
+        a, b = recorded.get(name, []), replayed.get(name, [])
+        first = None
+        for i in range(max(len(a), len(b))):
+            va = a[i].value if i < len(a) else None
+            vb = b[i].value if i < len(b) else None
+            if va != vb:
+                first = (i, va, vb)
+                break
+        result[name] = {'recorded': len(a), 'replayed': len(b), 'first_difference': first}
+    return result
+
+
+def replay(recording, realtime=False, audio_path=None, settle=2.0):
+    """
+    Feed a recording's inputs back through a controller on the simulated backend
+
+    Edges, remote presses, cues and remote show starts are applied at their
+    recorded times, relative to the first recorded event. On the default
+    virtual clock the replay is deterministic and takes no wall time;
+    with realtime=True it runs on the system clock with the controller's
+    own threads, to reproduce timing problems.
+
+    Args:
+        recording: Recording from load_recording()
+        realtime: Run in real time instead of on a virtual clock
+        audio_path: Clip directory (default: silent stand-ins for every recorded clip)
+        settle: Seconds to keep running after the last input
+
+    Returns:
+        Dictionary with the replayed events, output comparison and input count
+    """
+    from backends import SystemClock
+    from buzz_controller import DEFAULT_CONFIG, BuzzController
+    from simulator import DEFAULT_CLIPS, SimulatedBackend, write_fake_pwmchip, write_silent_clips
+
+    events = recording.events
+    inputs = [event for event in events if event.kind in INPUT_KINDS]
+    start = events[0].time if events else 0.0
+    # The whole phrase tree, since every phrase in it takes part in the picks
+    phrases = recording.meta.get('phrases', [])
+    clips = sorted(({event.target for event in events if event.kind == SOUND} | set(DEFAULT_CLIPS))
+                   - set(phrases))
+
+    with contextlib.ExitStack() as stack:
+        # Settings from other versions are skipped; nothing may reach out of the process
+        config = {key: value for key, value in recording.meta.get('config', {}).items()
+                  if key in DEFAULT_CONFIG}
+        if audio_path is None:
+            audio_path = stack.enter_context(tempfile.TemporaryDirectory())
+            write_silent_clips(audio_path, clips)
+            write_silent_clips(os.path.join(audio_path, 'phrases'), phrases)
+            config['phrase_path'] = 'phrases'
+        config.update({
+            'audio_path': audio_path, 'sound_pack': None, 'fast_start': False,
+            'control_socket': None, 'control_port': None, 'sync_role': None,
+            'metrics_file': None, 'metrics_socket': None, 'config_watch': False,
+            'recorder_events': len(events) * 4 + 4096,
+            'random_seed': recording.meta.get('seed'),
+            'servo_pwm': recording.meta.get('servo_pwm', 'software'),
+        })
+        # A servo on hardware PWM holds its position, so it replays on a fake PWM chip
+        pwm_root = None
+        if config['servo_pwm'] == 'hardware':
+            pwm_root = stack.enter_context(tempfile.TemporaryDirectory())
+            channel = config.get('servo_pwm_channel') or 0
+            write_fake_pwmchip(pwm_root, config.get('servo_pwm_chip', 0), channels=max(2, channel + 1))
+        clock = SystemClock() if realtime else None
+        backend = SimulatedBackend(clock=clock, pwm_root=pwm_root)
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        controller = BuzzController(config, backend=backend)
+        stack.callback(controller.cleanup)
+        began = backend.clock.monotonic()
+
+        def apply(event):
+            if event.kind == EDGE:
+                backend.gpio.set_input(event.target, int(event.value))
+            elif event.kind == PRESS:
+                controller.press(event.target)
+            elif event.kind == CUE:
+                controller.run_cue(event.target, json.loads(event.value))
+            elif event.kind == SHOW:
+                controller.play_show(event.target)
+
+        for event in inputs:
+            due = began + event.time - start
+            if realtime:
+                time.sleep(max(0.0, due - backend.clock.monotonic()))
+                apply(event)
+            else:
+                backend.clock.call_at(due, apply, event)
+        end = began + (inputs[-1].time - start if inputs else 0.0) + settle
+        if realtime:
+            time.sleep(max(0.0, end - backend.clock.monotonic()))
+        else:
+            backend.clock.run_until(end)
+        controller.dispatcher.wait_idle(5.0)
+        replayed = controller.recorder.events()
+    return {
+        'inputs': len(inputs),
+        'events': replayed,
+        'outputs': compare_outputs(events, replayed),
+    }
+
+
+def print_report(recording, result=None):
+    """Print a summary of a recording and, if given, of its replay"""
+    events = recording.events
+    meta = recording.meta
+    span = events[-1].time - events[0].time if events else 0.0
+    dumped = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['wall_time']))
+    overwritten = meta['overwritten']
+    print(f"{len(events)} events over {span:.1f} s, dumped {dumped}"
+          f"{f' ({overwritten} older events overwritten)' if overwritten else ''}")
+    kinds = {}
+    for event in events:
+        kind = KIND_NAMES.get(event.kind, str(event.kind))
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print("  " + ", ".join(f"{kind} {n}" for kind, n in sorted(kinds.items())))
+    for action, times in sorted(callback_latency(events).items()):
+        print(f"  {action} callback: {len(times)} runs, p50 {percentile(times, 0.50) * 1000:.2f} ms, "
+              f"p99 {percentile(times, 0.99) * 1000:.2f} ms, max {times[-1] * 1000:.2f} ms")
+    if result is None:
+        return
+    if meta['overwritten']:
+        print("Replay starts from the power-on state; the recording began mid-session")
+    outputs = result['outputs']
+    differing = {name: output for name, output in outputs.items() if output['first_difference']}
+    print(f"Replayed {result['inputs']} inputs: {len(outputs) - len(differing)} of "
+          f"{len(outputs)} outputs did the same")
+    for name, output in differing.items():
+        index, recorded, replayed = output['first_difference']
+        print(f"  {name}: {output['recorded']} recorded, {output['replayed']} replayed; "
+              f"#{index} was {recorded}, replayed {replayed}")
+
+
+def main():
+    """Replay a recording from the command line"""
+    parser = argparse.ArgumentParser(description='Replay a controller recording on the simulated backend')
+    parser.add_argument('recording', help='File written by the recorder')
+    parser.add_argument('--realtime', action='store_true', help='Replay in real time on the system clock')
+    parser.add_argument('--profile', action='store_true', help='Profile the replay with cProfile')
+    parser.add_argument('--summary', action='store_true', help='Only summarize the recording')
+    parser.add_argument('--audio', help='Clip directory (default: silent stand-ins)')
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording)
+    if args.summary:
+        print_report(recording)
+        return 0
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    result = replay(recording, realtime=args.realtime, audio_path=args.audio)
+    if profiler is not None:
+        profiler.disable()
+    print_report(recording, result)
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+    return 0 if not any(o['first_difference'] for o in result['outputs'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Servo motion engine for the Buzz Lightyear Controller
+
+Moves the wing servo on its own scheduler thread so button callbacks never
+sleep. A move interpolates the PWM duty cycle along an easing curve; a new
+target preempts the move in flight and continues from the current
+interpolated position. Once the servo has settled the PWM signal is
+released to stop jitter, and a completion callback is fired.
+"""
+
+import math
+import time
+from functools import partial
+
+from deadline_worker import DeadlineWorker
+
+
+def _linear(t):
+    return t
+
+
+def _ease_in(t):
+    return t * t
+
+
+def _ease_out(t):
+    return 1.0 - (1.0 - t) * (1.0 - t)
+
+
+def _ease_in_out(t):
+    return 0.5 - 0.5 * math.cos(math.pi * t)
+
+
+# Easing curves map move progress (0..1) to position progress (0..1)
+EASING_CURVES = {
+    'linear': _linear,
+    'ease_in': _ease_in,
+    'ease_out': _ease_out,
+    'ease_in_out': _ease_in_out,
+}
+
+
+class Trajectory:
+    """A single eased move from one duty cycle to another"""
+
+    __slots__ = ('start', 'target', 'start_time', 'duration', 'easing')
+
+    def __init__(self, start, target, start_time, duration, easing):
+        self.start = start
+        self.target = target
+        self.start_time = start_time
+        self.duration = duration
+        self.easing = easing
+
+    @classmethod
+    def plan(cls, start, target, now, move_time, full_range, easing, duration=None):
+        """
+        Plan a move, timing it by the distance travelled unless given
+
+        A start of None (unknown position) plans an immediate jump.
+        """
+        if start is None:
+            return cls(target, target, now, 0.0, easing)
+        if duration is None:
+            distance = abs(target - start) / full_range if full_range else 1.0
+            duration = move_time * min(1.0, distance)
+        return cls(start, target, now, duration, easing)
+
+    def finished(self, now):
+        """Return True once the move time has elapsed"""
+        return now - self.start_time >= self.duration
+
+    def position(self, now):
+        """Duty cycle along the trajectory at time now"""
+        if self.duration <= 0:
+            return self.target
+        progress = min(1.0, max(0.0, (now - self.start_time) / self.duration))
+        return self.start + (self.target - self.start) * self.easing(progress)
+
+
+class ServoMotionEngine:
+    """Non-blocking, preemptible servo trajectory runner"""
+
+    def __init__(self, pwm, move_time=0.5, full_range=5.0, easing='ease_in_out',
+                 update_hz=50, settle_time=0.1, release=True, on_complete=None,
+                 clock=time.monotonic, scheduler=None):
+        """
+        Initialize the motion engine (the thread starts with the first move)
+
+        Args:
+            pwm: PWM object with a ChangeDutyCycle(duty) method
+            move_time: Seconds to travel the full range
+            full_range: Duty cycle span that takes move_time to travel
+            easing: Name of the easing curve (see EASING_CURVES)
+            update_hz: Duty cycle updates per second while moving
+            settle_time: Seconds to hold the target before releasing
+            release: Set duty cycle to 0 after settling to prevent jitter
+            on_complete: Called with the target duty cycle when a move finishes
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+        """
+        if easing not in EASING_CURVES:
+            raise ValueError(f"Unknown easing curve: {easing}")
+
+        self.pwm = pwm
+        self.move_time = move_time
+        self.full_range = full_range
+        self.easing = EASING_CURVES[easing]
+        self.update_interval = 1.0 / update_hz
+        self.settle_time = settle_time
+        self.release = release
+        self.on_complete = on_complete
+        self.clock = clock
+        self.scheduler = scheduler
+
+        # Motion state, guarded by the condition's lock
+        self._worker = DeadlineWorker(self._step, 'servo-motion', clock, scheduler)
+        self._cond = self._worker.cond
+        self._phase = 'idle'          # idle, moving or settling
+        self._position = None         # Last duty cycle written (None = unknown)
+        self._move = None             # Current Trajectory
+        self._hold = 0.0
+
+    @property
+    def position(self):
+        """Current duty cycle, or None before the first move"""
+        with self._cond:
+            return self._position
+
+    @property
+    def target(self):
+        """Duty cycle of the current or last move"""
+        with self._cond:
+            return self._move.target if self._move else None
+
+    def is_moving(self):
+        """Return True while a move is running or settling"""
+        with self._cond:
+            return self._phase != 'idle'
+
+    def configure(self, move_time, full_range, easing, update_hz):
+        """
+        Change the motion settings in place; the move in flight keeps its plan
+
+        Raises:
+            ValueError: If the easing curve is unknown
+        """
+        if easing not in EASING_CURVES:
+            raise ValueError(f"Unknown easing curve: {easing}")
+        with self._cond:
+            self.move_time = move_time
+            self.full_range = full_range
+            self.easing = EASING_CURVES[easing]
+            self.update_interval = 1.0 / update_hz
+
+    def move_to(self, duty, duration=None):
+        """
+        Start moving towards a duty cycle and return immediately
+
+        Args:
+            duty: Target duty cycle
+            duration: Move time in seconds; defaults to a time proportional
+                to the distance travelled
+        """
+        with self._cond:
+            now = self.clock()
+            if self._phase == 'moving':
+                # Preempt: continue from where the servo is right now
+                self._position = self._move.position(now)
+            start = self._position
+
+            self._move = Trajectory.plan(start, duty, now, self.move_time,
+                                         self.full_range, self.easing, duration)
+            # A jump from an unknown position needs a full move time to settle
+            self._hold = self.settle_time + (self.move_time if start is None else 0.0)
+            self._phase = 'moving'
+            self._worker.schedule(now)
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until the current move has completed; return True if idle
+
+        With an external scheduler nothing can progress while blocked, so
+        this only reports the current state.
+        """
+        with self._cond:
+            if self.scheduler is not None:
+                return self._phase == 'idle'
+            return self._cond.wait_for(lambda: self._phase == 'idle', timeout)
+
+    def stop(self):
+        """Stop the scheduler thread"""
+        self._worker.close()
+
+    def _step(self, now):
+        """
+        Advance the motion state machine (lock must be held)
+
+        Returns:
+            Tuple of (next deadline or None, on_complete call or None)
+        """
+        if self._phase == 'moving':
+            if self._move.finished(now):
+                self._position = self._move.target
+                self.pwm.ChangeDutyCycle(self._position)
+                self._phase = 'settling'
+                return now + self._hold, None
+            self._position = self._move.position(now)
+            self.pwm.ChangeDutyCycle(self._position)
+            return now + self.update_interval, None
+
+        if self._phase == 'settling':
+            if self.release:
+                self.pwm.ChangeDutyCycle(0)
+            self._phase = 'idle'
+            self._cond.notify_all()
+            if self.on_complete:
+                return None, partial(self.on_complete, self._move.target)
+
+        return None, None
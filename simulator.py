@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Simulated hardware backend for the Buzz Lightyear Controller
+
+SimulatedBackend implements the backend interface (see backends.py) with
+no hardware at all:
+
+- SimGPIO injects button edges the way the kernel delivers them,
+  including configurable contact bounce, and honours bouncetime
+- SimMixer decodes nothing but knows each clip's length and which
+  channel is busy
+- VirtualClock lets a whole session run without waiting in real time
+
+Every pin write, PWM change, edge and sound start is appended to
+backend.trace as a timestamped TraceEvent.
+
+Run with: python3 simulator.py [presses]
+"""
+
+import contextlib
+import heapq
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import namedtuple
+from itertools import count
+
+
+# One timestamped entry in the simulation trace
+TraceEvent = namedtuple('TraceEvent', ['time', 'kind', 'target', 'value'])
+
+
+class TimerHandle:
+    """A scheduled VirtualClock callback"""
+
+    __slots__ = ('when', 'seq', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, seq, callback, args):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    """
+    Discrete-event clock: time only moves when advance() is called
+
+    Timers scheduled with call_at() run in deadline order as time advances,
+    so subsystems that accept a scheduler run without helper threads.
+    The clock is meant to be driven from a single thread.
+    """
+
+    virtual = True
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._timers = []
+        self._seq = count()
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def call_at(self, when, callback, *args):
+        """Schedule callback(*args) at virtual time when"""
+        handle = TimerHandle(when, next(self._seq), callback, args)
+        heapq.heappush(self._timers, handle)
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) after delay seconds of virtual time"""
+        return self.call_at(self._now + delay, callback, *args)
+
+    def advance(self, seconds):
+        """Move time forward, running every timer that falls due"""
+        self.run_until(self._now + seconds)
+
+    def run_until(self, target):
+        """Run timers due up to target, then set the time to target"""
+        while self._timers and self._timers[0].when <= target:
+            handle = heapq.heappop(self._timers)
+            if handle.cancelled:
+                continue
+            self._now = max(self._now, handle.when)
+            handle.callback(*handle.args)
+        self._now = max(self._now, target)
+
+    def pending(self):
+        """Number of timers still scheduled"""
+        return sum(1 for handle in self._timers if not handle.cancelled)
+
+
+class SimPWM:
+    """GPIO.PWM stand-in that traces every change"""
+
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+
+    def start(self, duty_cycle):
+        self.running = True
+        self.duty_cycle = duty_cycle
+        self.gpio._record('pwm_start', self.pin, duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.gpio._record('pwm_duty', self.pin, duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self.gpio._record('pwm_freq', self.pin, frequency)
+
+    def stop(self):
+        self.running = False
+        self.gpio._record('pwm_stop', self.pin, 0)
+
+
+class SimGPIO:
+    """RPi.GPIO stand-in with edge injection and a timestamped trace"""
+
+    # Same values as RPi.GPIO
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, clock, trace):
+        self.clock = clock
+        self.trace = trace
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        # pin -> [edge, callback, bouncetime in seconds, time of last callback]
+        self.detections = {}
+
+    def _record(self, kind, target, value):
+        self.trace.append(TraceEvent(self.clock.monotonic(), kind, target, value))
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        for pin in self._channels(channel):
+            self.directions[pin] = direction
+            if direction == self.IN:
+                self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+            else:
+                self.levels[pin] = self.LOW if initial is None else initial
+
+    def output(self, channel, value):
+        pins = self._channels(channel)
+        values = value if isinstance(value, (list, tuple)) else [value] * len(pins)
+        for pin, level in zip(pins, values):
+            self.levels[pin] = level
+            self._record('output', pin, level)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.LOW)
+
+    def PWM(self, channel, frequency):
+        return SimPWM(self, channel, frequency)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=0):
+        self.detections[channel] = [edge, callback, (bouncetime or 0) / 1000.0, None]
+
+    def remove_event_detect(self, channel):
+        self.detections.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.detections.clear()
+        else:
+            for pin in self._channels(channel):
+                self.detections.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """Drive an input pin, delivering an edge to its callback if detected"""
+        if self.levels.get(pin) == level:
+            return
+        self.levels[pin] = level
+        edge = self.RISING if level == self.HIGH else self.FALLING
+        self._record('edge', pin, level)
+
+        detection = self.detections.get(pin)
+        if detection is None:
+            return
+        wanted, callback, bouncetime, last = detection
+        if wanted not in (edge, self.BOTH) or callback is None:
+            return
+        now = self.clock.monotonic()
+        if last is not None and now - last < bouncetime:
+            return
+        detection[3] = now
+        callback(pin)
+
+    @staticmethod
+    def _channels(channel):
+        return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+class SimChannel:
+    """pygame.mixer.Channel stand-in"""
+
+    def __init__(self, mixer, index):
+        self.mixer = mixer
+        self.index = index
+        self._sound = None
+        self._end = 0.0
+        self._started = 0.0
+        self._volume = 1.0
+
+    def play(self, sound, loops=0, maxtime=0, fade_ms=0):
+        now = self.mixer.clock.monotonic()
+        self._sound = sound
+        self._started = now
+        if loops < 0:
+            self._end = float('inf')
+        else:
+            self._end = now + sound.get_length() * (loops + 1)
+        if maxtime:
+            self._end = min(self._end, now + maxtime / 1000.0)
+        self.mixer._record('sound', sound.name, self.index)
+        return self
+
+    def stop(self):
+        if self.get_busy():
+            self.mixer._record('sound_stop', self._sound.name, self.index)
+        self._end = self.mixer.clock.monotonic()
+
+    def fadeout(self, time_ms):
+        self.stop()
+
+    def get_busy(self):
+        return self._sound is not None and self.mixer.clock.monotonic() < self._end
+
+    def get_sound(self):
+        return self._sound if self.get_busy() else None
+
+    def set_volume(self, value, right=None):
+        self._volume = value
+
+    def get_volume(self):
+        return self._volume
+
+
+class SimSound:
+    """pygame.mixer.Sound stand-in with a known length"""
+
+    def __init__(self, mixer, name, length):
+        self.mixer = mixer
+        self.name = name
+        self._length = length
+        self._volume = 1.0
+
+    def play(self, loops=0, maxtime=0, fade_ms=0):
+        channel = self.mixer.find_channel()
+        if channel is None:
+            # pygame drops the sound when every channel is busy
+            self.mixer._record('sound_drop', self.name, None)
+            return None
+        return channel.play(self, loops, maxtime, fade_ms)
+
+    def stop(self):
+        for channel in self.mixer._channels:
+            if channel.get_sound() is self:
+                channel.stop()
+
+    def get_length(self):
+        return self._length
+
+    def set_volume(self, value):
+        self._volume = value
+
+    def get_volume(self):
+        return self._volume
+
+    def get_num_channels(self):
+        return sum(1 for channel in self.mixer._channels if channel.get_sound() is self)
+
+
+class SimMusic:
+    """pygame.mixer.music stand-in that traces loads, plays and volume"""
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self._name = None
+        self._length = 0.0
+        self._end = 0.0
+        self._volume = 1.0
+
+    def load(self, filename):
+        self._name = os.path.basename(filename)
+        self._length = self.mixer._clip_length(filename)
+        self._end = 0.0
+        self.mixer._record('music_load', self._name, None)
+
+    def play(self, loops=0, start=0.0, fade_ms=0):
+        now = self.mixer.clock.monotonic()
+        self._end = float('inf') if loops < 0 else now + self._length * (loops + 1)
+        self.mixer._record('music_play', self._name, loops)
+
+    def stop(self):
+        if self.get_busy():
+            self.mixer._record('music_stop', self._name, None)
+        self._end = 0.0
+
+    def fadeout(self, time_ms):
+        self.stop()
+
+    def get_busy(self):
+        return self._name is not None and self.mixer.clock.monotonic() < self._end
+
+    def set_volume(self, value):
+        self._volume = value
+        self.mixer._record('music_volume', self._name, value)
+
+    def get_volume(self):
+        return self._volume
+
+
+class SimMixer:
+    """pygame.mixer stand-in that traces sound starts"""
+
+    def __init__(self, clock, trace, sound_length=1.0):
+        self.clock = clock
+        self.trace = trace
+        self.sound_length = sound_length
+        self._init = None
+        self._reserved = 0
+        self._channels = [SimChannel(self, i) for i in range(8)]
+        self.music = SimMusic(self)
+
+    def _record(self, kind, target, value):
+        self.trace.append(TraceEvent(self.clock.monotonic(), kind, target, value))
+
+    def pre_init(self, frequency=44100, size=-16, channels=2, buffer=512):
+        pass
+
+    def init(self, frequency=44100, size=-16, channels=2, buffer=512):
+        self._init = (frequency, size, channels)
+        self._record('mixer_init', None, frequency)
+
+    def get_init(self):
+        return self._init
+
+    def quit(self):
+        self._init = None
+        self._record('mixer_quit', None, 0)
+
+    def Sound(self, file=None, buffer=None):
+        if buffer is not None:
+            frequency, size, channels = self._init or (44100, -16, 2)
+            length = len(buffer) / float(frequency * channels * (abs(size) // 8))
+            return SimSound(self, '<buffer>', length)
+        return SimSound(self, os.path.basename(file), self._clip_length(file))
+
+    def Channel(self, index):
+        return self._channels[index]
+
+    def set_num_channels(self, count):
+        while len(self._channels) < count:
+            self._channels.append(SimChannel(self, len(self._channels)))
+        del self._channels[count:]
+
+    def get_num_channels(self):
+        return len(self._channels)
+
+    def set_reserved(self, count):
+        self._reserved = min(count, len(self._channels))
+        return self._reserved
+
+    def find_channel(self, force=False):
+        free = self._channels[self._reserved:]
+        for channel in free:
+            if not channel.get_busy():
+                return channel
+        if force and free:
+            return min(free, key=lambda channel: channel._started)
+        return None
+
+    def get_busy(self):
+        return any(channel.get_busy() for channel in self._channels)
+
+    def stop(self):
+        for channel in self._channels:
+            channel.stop()
+
+    def _clip_length(self, path):
+        """Length from the WAV header, or the default for anything else"""
+        try:
+            with wave.open(path, 'rb') as clip:
+                return clip.getnframes() / float(clip.getframerate())
+        except (OSError, EOFError, wave.Error):
+            return self.sound_length
+
+
+class SimulatedBackend:
+    """Backend with simulated GPIO, mixer and (by default) a virtual clock"""
+
+    name = 'simulated'
+
+    def __init__(self, clock=None, bounce_count=0, bounce_interval=0.0005,
+                 sound_length=1.0, pwm_root=None, pin_functions=None):
+        """
+        Initialize the simulated backend
+
+        Args:
+            clock: Time source; defaults to a new VirtualClock. Pass
+                backends.SystemClock() to simulate in real time.
+            bounce_count: Extra contact bounces on every press and release
+            bounce_interval: Seconds between bounce edges
+            sound_length: Length of clips whose length cannot be read
+            pwm_root: Hardware PWM sysfs tree, e.g. one from
+                write_fake_pwmchip() (None: software PWM only)
+            pin_functions: Pin -> function as pinctrl reports it, e.g.
+                {18: 'PWM0_0'} (None: pin routing is not simulated)
+        """
+        self.clock = clock or VirtualClock()
+        self.trace = []
+        self.gpio = SimGPIO(self.clock, self.trace)
+        self.mixer = SimMixer(self.clock, self.trace, sound_length)
+        self.bounce_count = bounce_count
+        self.bounce_interval = bounce_interval
+        self.pwm_root = pwm_root
+        self.pin_function = None if pin_functions is None else dict(pin_functions).get
+
+    def press(self, pin, hold=0.08):
+        """Press and release an active-low button, with contact bounce"""
+        self._bounce(pin, self.gpio.LOW, 0.0)
+        self._bounce(pin, self.gpio.HIGH, hold)
+
+    def _bounce(self, pin, level, delay):
+        """Schedule the edges for one transition, ending at level"""
+        other = self.gpio.HIGH if level == self.gpio.LOW else self.gpio.LOW
+        levels = [level, other] * self.bounce_count + [level]
+        for i, edge_level in enumerate(levels):
+            self._call_later(delay + i * self.bounce_interval,
+                             self.gpio.set_input, pin, edge_level)
+
+    def _call_later(self, delay, callback, *args):
+        if self.clock.virtual:
+            self.clock.call_later(delay, callback, *args)
+        elif delay <= 0:
+            callback(*args)
+        else:
+            timer = threading.Timer(delay, callback, args)
+            timer.daemon = True
+            timer.start()
+
+    def events(self, kind=None, target=None):
+        """Trace entries filtered by kind and/or target"""
+        return [e for e in self.trace
+                if (kind is None or e.kind == kind) and (target is None or e.target == target)]
+
+
+def write_silent_clips(audio_path, names, length=0.5, frequency=22050):
+    """Write silent mono WAV clips so a simulation has real files to index"""
+    os.makedirs(audio_path, exist_ok=True)
+    frames = b'\x00\x00' * int(length * frequency)
+    for name in names:
+        path = os.path.join(audio_path, name)
+        # Names may be paths into a tree, such as phrase categories
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with wave.open(path, 'wb') as clip:
+            clip.setnchannels(1)
+            clip.setsampwidth(2)
+            clip.setframerate(frequency)
+            clip.writeframes(frames)
+
+
+def write_fake_pwmchip(root, chip=0, channels=2):
+    """
+    Write a sysfs PWM chip as plain files, with every channel already exported
+
+    Attribute files are overwritten in place from the start, so read them
+    back with their first line.
+
+    Returns:
+        Path of the pwmchipN directory
+    """
+    chip_path = os.path.join(root, f'pwmchip{chip}')
+    os.makedirs(chip_path, exist_ok=True)
+    for name, value in (('npwm', channels), ('export', ''), ('unexport', '')):
+        with open(os.path.join(chip_path, name), 'w') as f:
+            f.write(f'{value}\n')
+    for channel in range(channels):
+        channel_path = os.path.join(chip_path, f'pwm{channel}')
+        os.makedirs(channel_path, exist_ok=True)
+        for name, value in (('period', 0), ('duty_cycle', 0), ('enable', 0), ('polarity', 'normal')):
+            with open(os.path.join(channel_path, name), 'w') as f:
+                f.write(f'{value}\n')
+    return chip_path
+
+
+# Clips the default controller plays
+DEFAULT_CLIPS = [
+    'wings_open.wav', 'wings_close.wav', 'laser_on.wav', 'laser_off.wav',
+    'to_infinity.wav', 'buzz_lightyear.wav', 'not_flying.wav', 'space_ranger.wav',
+]
+
+
+def simulate_session(presses=300, seed=0, bounce_count=3, controller_class=None, config=None):
+    """
+    Simulate a session of random button presses on a virtual clock
+
+    Args:
+        presses: Number of button presses
+        seed: Random seed for press timing and button choice
+        bounce_count: Contact bounces per edge
+        controller_class: Controller class (default: BuzzController)
+        config: Extra configuration for the controller
+
+    Returns:
+        Tuple of (controller, backend) after cleanup
+    """
+    from buzz_controller import BuzzController
+
+    controller_class = controller_class or BuzzController
+    rng = random.Random(seed)
+    backend = SimulatedBackend(bounce_count=bounce_count)
+
+    with tempfile.TemporaryDirectory() as audio_path:
+        write_silent_clips(audio_path, DEFAULT_CLIPS)
+        session_config = {'audio_path': audio_path}
+        session_config.update(config or {})
+
+        # The controller prints on every press; keep the output quiet
+        with contextlib.redirect_stdout(io.StringIO()):
+            controller = controller_class(session_config, backend=backend)
+            buttons = [controller.config['wing_button_pin'],
+                       controller.config['laser_button_pin'],
+                       controller.config['phrase_button_pin']]
+            backend.clock.advance(1.0)
+            for _ in range(presses):
+                backend.press(rng.choice(buttons))
+                backend.clock.advance(rng.uniform(0.15, 2.0))
+            controller.cleanup()
+    return controller, backend
+
+
+def main():
+    """Simulate a session and print a summary"""
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    start = time.perf_counter()
+    controller, backend = simulate_session(presses)
+    elapsed = time.perf_counter() - start
+
+    kinds = {}
+    for event in backend.trace:
+        kinds[event.kind] = kinds.get(event.kind, 0) + 1
+
+    print(f"Simulated {presses} presses over {backend.clock.monotonic():.1f} s "
+          f"of virtual time in {elapsed * 1000:.0f} ms")
+    for kind in sorted(kinds):
+        print(f"  {kind:12s} {kinds[kind]}")
+    print(f"Dispatcher: {controller.dispatcher.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Sound bank for the Buzz Lightyear Controller
+
+Decodes every clip in the audio directory once at startup and keeps the
+decoded pygame Sound objects in memory, so a button press never has to
+touch the SD card. The bank stays under a configurable memory budget by
+evicting the least recently used clips; evicted clips are decoded again
+on a background thread the next time they are requested.
+
+With a sound pack (soundpack.py) clips are built from slices of one
+memory-mapped file instead of individual WAV files.
+
+Clips larger than the stream threshold are never decoded; they are
+listed as streams for audio_stream.StreamPlayer to play from disk.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import NULL_METRICS
+
+# File types pygame.mixer.Sound can decode
+SOUND_EXTENSIONS = ('.wav', '.ogg')
+
+
+def decoded_size(mixer, sound):
+    """
+    Return the memory a decoded clip uses in the mixer's format
+
+    Returns:
+        Size in bytes, or None if the mixer does not report its format
+    """
+    try:
+        frequency, fmt, channels = mixer.get_init()
+        samples = int(sound.get_length() * frequency)
+        return samples * channels * (abs(fmt) // 8)
+    except (TypeError, ValueError):
+        # Mixer not initialized or not reporting its format
+        return None
+
+
+class SoundBank:
+    """LRU cache of decoded sounds with a memory budget"""
+
+    def __init__(self, audio_path, mixer, budget_bytes=32 * 1024 * 1024, metrics=NULL_METRICS,
+                 pack=None, stream_threshold=None):
+        """
+        Initialize the sound bank
+
+        Args:
+            audio_path: Directory containing the audio clips
+            mixer: pygame.mixer module (or compatible object) used to decode clips;
+                may be None until assigned before load_all()
+            budget_bytes: Maximum decoded audio kept in memory
+            metrics: Registry for clip decode timings
+            pack: Optional SoundPack to load clips from instead of audio_path
+            stream_threshold: Clips larger than this many bytes are left to
+                streaming instead of being decoded (None: decode everything)
+        """
+        self.audio_path = audio_path
+        self.mixer = mixer
+        self.pack = pack
+        self.stream_threshold = stream_threshold
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._load_timer = metrics.histogram('buzz_sound_load_seconds', 'Clip decode time')
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+
+        # name -> (Sound, decoded size in bytes), most recently used last
+        self._sounds = OrderedDict()
+        # name -> path for every clip found on disk
+        self._paths = {}
+        # name -> path for clips too large to decode
+        self._streams = {}
+        # name -> (path, size, mtime) of every clip, to spot changed files on reload
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+        # Background reload of evicted clips
+        self._pending = []
+        self._pending_cond = threading.Condition(self._lock)
+        self._loader_thread = None
+        self._running = True
+        # Bumped by unload(), so a reload finishing afterwards is dropped
+        self._generation = 0
+
+    def scan(self):
+        """Index the clips available in the audio directory or sound pack"""
+        paths = {}
+        streams = {}
+        stamps = {}
+        if os.path.isdir(self.audio_path):
+            for entry in os.scandir(self.audio_path):
+                if entry.is_file() and entry.name.lower().endswith(SOUND_EXTENSIONS):
+                    stat = entry.stat()
+                    if self._too_large(stat.st_size):
+                        streams[entry.name] = entry.path
+                    elif self.pack is None:
+                        paths[entry.name] = entry.path
+                    else:
+                        continue
+                    stamps[entry.name] = (entry.path, stat.st_size, stat.st_mtime_ns)
+        if self.pack is not None:
+            pack_mtime = os.stat(self.pack.path).st_mtime_ns
+            for name in self.pack.names():
+                # Clips in folders, such as the phrase tree, are decoded on demand elsewhere
+                if '/' in name:
+                    continue
+                if name not in streams and not self._too_large(self.pack.size(name)):
+                    paths[name] = self.pack.path
+                    stamps[name] = (self.pack.path, self.pack.size(name), pack_mtime)
+        with self._lock:
+            self._paths = paths
+            self._streams = streams
+            self._stamps = stamps
+        return sorted(paths)
+
+    def _too_large(self, size):
+        return self.stream_threshold is not None and size > self.stream_threshold
+
+    def stream_path(self, name):
+        """Return the file of a clip that should be streamed, or None"""
+        return self._streams.get(name)
+
+    def path_of(self, name):
+        """Return the file a clip can be streamed from, decoded or not, or None"""
+        path = self._streams.get(name)
+        if path is None:
+            path = os.path.join(self.audio_path, name)
+        return path if os.path.isfile(path) else None
+
+    def load_all(self):
+        """Scan the audio directory and decode every clip found"""
+        for name in self.scan():
+            self._load(name)
+        print(f"Sound bank: {len(self._sounds)} clip(s) loaded, "
+              f"{self.used_bytes / 1024:.0f} KiB decoded")
+
+    def reload(self, audio_path, pack=None, decode=True):
+        """
+        Rescan the clips, decoding only those that are new or changed on disk
+
+        Args:
+            audio_path: Directory containing the audio clips
+            pack: SoundPack to load clips from instead of audio_path
+            decode: Decode the changed clips now; otherwise they are only
+                dropped (e.g. while the mixer is down; load_all() refills)
+
+        Returns:
+            Sorted list of clips that were added, changed or removed
+        """
+        self.audio_path = audio_path
+        self.pack = pack
+        before = self._stamps
+        self.scan()
+        after = self._stamps
+        changed = sorted(name for name in set(before) | set(after) if before.get(name) != after.get(name))
+        with self._lock:
+            for name in changed:
+                entry = self._sounds.pop(name, None)
+                if entry is not None:
+                    self.used_bytes -= entry[1]
+        if decode:
+            for name in changed:
+                if name in self._paths:
+                    self._load(name)
+        return changed
+
+    def knows(self, name):
+        """Return True if the clip can be decoded into the bank"""
+        return name in self._paths
+
+    def get(self, name):
+        """
+        Return the decoded Sound for a clip, or None if it is not in memory
+
+        This is the hot path: it only looks at the cache. A miss on a known
+        clip schedules a background reload so a later press can play it.
+        """
+        with self._lock:
+            entry = self._sounds.get(name)
+            if entry is not None:
+                self._sounds.move_to_end(name)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            if name in self._paths and name not in self._pending:
+                self._pending.append(name)
+                self._ensure_loader()
+                self._pending_cond.notify()
+        return None
+
+    def stats(self):
+        """Return cache counters as a dictionary"""
+        with self._lock:
+            return {
+                'clips': len(self._sounds),
+                'known': len(self._paths),
+                'streams': len(self._streams),
+                'used_bytes': self.used_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'loads': self.loads,
+            }
+
+    def unload(self):
+        """Drop all decoded clips, e.g. before the mixer is shut down; load_all() refills"""
+        with self._lock:
+            self._pending.clear()
+            self._sounds.clear()
+            self.used_bytes = 0
+            self._generation += 1
+
+    def close(self):
+        """Stop the background loader and drop all decoded clips"""
+        with self._lock:
+            self._running = False
+            self._pending_cond.notify_all()
+            thread = self._loader_thread
+        if thread:
+            thread.join()
+        with self._lock:
+            self._sounds.clear()
+            self.used_bytes = 0
+
+    def _load(self, name, generation=None):
+        """
+        Decode a clip and insert it into the cache
+
+        Args:
+            name: Clip to decode
+            generation: The bank's generation when the load was requested;
+                the clip is dropped if unload() ran since (None: always keep)
+        """
+        path = self._paths.get(name)
+        if path is None:
+            return None
+        try:
+            with self._load_timer.time():
+                if self.pack is not None:
+                    sound = self.mixer.Sound(buffer=self.pack.clip(name))
+                else:
+                    sound = self.mixer.Sound(path)
+        except Exception as e:
+            print(f"Error loading sound {name}: {e}")
+            return None
+
+        size = self._decoded_size(name, sound, path)
+        if size > self.budget_bytes:
+            print(f"Sound {name} ({size} bytes) exceeds the sound bank budget")
+            return None
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                # Unloaded while decoding
+                return None
+            old = self._sounds.pop(name, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self._sounds[name] = (sound, size)
+            self.used_bytes += size
+            self.loads += 1
+            self._evict_locked(keep=name)
+        return sound
+
+    def _evict_locked(self, keep):
+        """Evict least recently used clips until within budget"""
+        while self.used_bytes > self.budget_bytes and len(self._sounds) > 1:
+            name = next(iter(self._sounds))
+            if name == keep:
+                self._sounds.move_to_end(name)
+                continue
+            _, size = self._sounds.pop(name)
+            self.used_bytes -= size
+            self.evictions += 1
+
+    def _decoded_size(self, name, sound, path):
+        """Estimate the memory used by a decoded clip"""
+        size = decoded_size(self.mixer, sound)
+        if size is not None:
+            return size
+        if self.pack is not None:
+            return len(self.pack.clip(name))
+        return os.path.getsize(path)
+
+    def _ensure_loader(self):
+        """Start the background loader thread (lock must be held)"""
+        if self._loader_thread is None or not self._loader_thread.is_alive():
+            self._loader_thread = threading.Thread(
+                target=self._loader_loop, name='sound-bank-loader', daemon=True
+            )
+            self._loader_thread.start()
+
+    def _loader_loop(self):
+        """Reload evicted clips requested from the hot path"""
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._pending_cond.wait()
+                if not self._running:
+                    return
+                name = self._pending[0]
+                generation = self._generation
+            self._load(name, generation)
+            with self._lock:
+                # unload() may have cleared the queue, and a new press queued it again
+                if generation == self._generation and name in self._pending:
+                    self._pending.remove(name)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Packed sound bank file for the Buzz Lightyear Controller
+
+A sound pack is one file holding every clip as raw PCM in the mixer
+format, so loading a clip is a slice of a memory map instead of opening
+and parsing a WAV file:
+
+    header   magic, version, frequency, size, channels, clip count, index size
+    index    per clip: name, offset, length
+    regions  raw PCM, each starting on a 4 KiB boundary
+
+SoundPack maps the file once and hands out memoryview slices that go
+straight into pygame.mixer.Sound(buffer=...). The file stays in the page
+cache, which the kernel can reclaim, instead of the Python heap.
+
+Packs are written by build_audio.py --pack.
+"""
+
+import mmap
+import os
+import struct
+
+PACK_MAGIC = b'BUZZPAK1'
+PACK_VERSION = 1
+PACK_NAME = 'sounds.pak'
+
+# Clip regions start on page boundaries so each clip maps independently
+PACK_ALIGNMENT = 4096
+
+_HEADER = struct.Struct('<8sIIhHII')
+_ENTRY = struct.Struct('<HQQ')
+
+
+def _align(offset):
+    return (offset + PACK_ALIGNMENT - 1) // PACK_ALIGNMENT * PACK_ALIGNMENT
+
+
+def write_pack(path, clips, frequency, size, channels):
+    """
+    Write a sound pack
+
+    Args:
+        path: Output file
+        clips: Iterable of (name, PCM bytes) already in the mixer format
+        frequency: Mixer sample rate in Hz
+        size: Mixer sample size as passed to mixer.init (-16, 16, 8)
+        channels: Mixer channel count
+    """
+    clips = [(name.encode('utf-8'), pcm) for name, pcm in clips]
+    index_bytes = sum(_ENTRY.size + len(name) for name, _ in clips)
+
+    entries = []
+    offset = _align(_HEADER.size + index_bytes)
+    for name, pcm in clips:
+        entries.append((name, offset, len(pcm)))
+        offset = _align(offset + len(pcm))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, frequency, size, channels,
+                             len(clips), index_bytes))
+        for name, offset, length in entries:
+            f.write(_ENTRY.pack(len(name), offset, length))
+            f.write(name)
+        for (name, offset, length), (_, pcm) in zip(entries, clips):
+            f.seek(offset)
+            f.write(pcm)
+        f.truncate(_align(f.tell()))
+    os.replace(tmp_path, path)
+
+
+class SoundPack:
+    """Read-only memory map of a sound pack"""
+
+    def __init__(self, path):
+        """
+        Map a sound pack and read its index
+
+        Args:
+            path: Pack file written by write_pack()
+
+        Raises:
+            ValueError: If the file is not a sound pack of a known version
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._view = memoryview(self._map)
+            self._read_index()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_index(self):
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{self.path} is too short to be a sound pack")
+        magic, version, frequency, size, channels, count, index_bytes = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{self.path} is not a version {PACK_VERSION} sound pack")
+        self.format = {'frequency': frequency, 'size': size, 'channels': channels}
+
+        # name -> (offset, length)
+        self._index = {}
+        position = _HEADER.size
+        for _ in range(count):
+            name_length, offset, length = _ENTRY.unpack_from(self._map, position)
+            position += _ENTRY.size
+            name = bytes(self._map[position:position + name_length]).decode('utf-8')
+            position += name_length
+            if offset + length > len(self._map):
+                raise ValueError(f"{self.path}: clip {name} runs past the end of the file")
+            self._index[name] = (offset, length)
+
+    def names(self):
+        """Return the clip names in the pack"""
+        return sorted(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def size(self, name):
+        """Return the PCM size of a clip in bytes"""
+        return self._index[name][1]
+
+    def clip(self, name):
+        """Return the PCM of a clip as a memoryview into the map (no copy)"""
+        offset, length = self._index[name]
+        return self._view[offset:offset + length]
+
+    def matches(self, frequency, size, channels):
+        """Return True if the pack was built for the given mixer format"""
+        return self.format == {'frequency': frequency, 'size': size, 'channels': channels}
+
+    def close(self):
+        """Unmap the pack once no clip views are in use"""
+        if self._map is None:
+            return
+        try:
+            if getattr(self, '_view', None) is not None:
+                self._view.release()
+            self._map.close()
+        except BufferError:
+            # A clip view is still referenced; the map is released with it
+            pass
+        self._map = None
+        self._view = None
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Strobe LED backends for the Buzz Lightyear Controller
+
+Three interchangeable ways to flash the wing strobe LEDs:
+
+- DeadlineStrobe toggles the pin from a thread that schedules every edge
+  against absolute time.monotonic() deadlines. Late wakeups do not push
+  later edges back, and edges that were missed entirely are skipped so the
+  strobe stays in phase instead of drifting.
+- PWMStrobe hands the pin to GPIO.PWM at the strobe frequency and 50% duty
+  cycle, so no Python loop runs at all.
+- PatternStrobe plays a strobe pattern on the shared LED pattern engine,
+  so the strobe and every other LED effect share one render loop.
+
+All report the measured jitter as p50/p99 in milliseconds.
+"""
+
+import time
+from collections import deque
+
+from deadline_worker import DeadlineWorker
+from event_dispatcher import percentile
+from led_patterns import LedEngine
+from metrics import NULL_METRICS
+
+
+def jitter_report(backend, samples, overruns=0):
+    """Build a jitter report from period error samples in seconds"""
+    return {
+        'backend': backend,
+        'samples': len(samples),
+        'jitter_p50_ms': percentile(samples, 0.50) * 1000,
+        'jitter_p99_ms': percentile(samples, 0.99) * 1000,
+        'overruns': overruns,
+    }
+
+
+class DeadlineStrobe:
+    """Software strobe scheduled against absolute monotonic deadlines"""
+
+    name = 'deadline'
+
+    def __init__(self, gpio, pin, frequency, clock=time.monotonic, scheduler=None,
+                 metrics=NULL_METRICS, leds=None, jitter_samples=512):
+        """
+        Initialize the strobe (the thread starts on first use)
+
+        Args:
+            gpio: GPIO module (or compatible object)
+            pin: Output pin driving the strobe LEDs
+            frequency: Flashes per second
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+            metrics: Registry for the period error histogram
+            leds: Unused; accepted so all backends share one signature
+            jitter_samples: Number of recent period errors kept
+        """
+        self.gpio = gpio
+        self.pin = pin
+        self.clock = clock
+        self.scheduler = scheduler
+        self.frequency = frequency
+        self.overruns = 0
+
+        self._worker = DeadlineWorker(self._step, 'strobe', clock, scheduler)
+        self._cond = self._worker.cond
+        self._active = False
+        self._jitter = deque(maxlen=jitter_samples)
+        self._period_error = metrics.histogram(
+            'buzz_strobe_period_error_seconds', 'Strobe period error')
+
+        # Current session: edge n is due at origin + n * half_period
+        self._origin = 0.0
+        self._half_period = 0.5 / frequency
+        self._edge = 0
+        self._last_rise = None
+
+    @property
+    def running(self):
+        return self._active
+
+    def start(self):
+        """Start flashing"""
+        with self._cond:
+            if self._active:
+                return
+            self._active = True
+            self._begin_session()
+
+    def stop(self):
+        """Stop flashing and leave the LEDs off"""
+        with self._cond:
+            self._active = False
+            self._worker.cancel()
+        self.gpio.output(self.pin, self.gpio.LOW)
+
+    def set_frequency(self, frequency):
+        """Change the strobe frequency in place, restarting the phase now"""
+        with self._cond:
+            self.frequency = frequency
+            if self._active:
+                self._begin_session()
+
+    def jitter_stats(self):
+        """Return measured period jitter for the running strobe"""
+        with self._cond:
+            return jitter_report(self.name, list(self._jitter), self.overruns)
+
+    def close(self):
+        """Stop the strobe thread"""
+        with self._cond:
+            self._active = False
+        self._worker.close()
+        self.gpio.output(self.pin, self.gpio.LOW)
+
+    def _begin_session(self):
+        """Start a new edge sequence at the current time (lock must be held)"""
+        self._half_period = 0.5 / self.frequency
+        self._origin = self.clock()
+        self._edge = 0
+        self._last_rise = None
+        self._worker.schedule(self._origin)
+
+    def _edge_time(self):
+        return self._origin + self._edge * self._half_period
+
+    def _step(self, now):
+        """
+        Write the edge that is due at or before now (lock must be held)
+
+        Returns:
+            Tuple of (time of the next edge, None)
+        """
+        # Edges that were missed entirely are skipped to keep the phase
+        behind = int((now - self._edge_time()) / self._half_period)
+        if behind > 0:
+            self.overruns += behind
+            self._edge += behind
+            if self._edge % 2:
+                # Landed on a falling edge; next rise re-measures the period
+                self._last_rise = None
+
+        rising = self._edge % 2 == 0
+        self.gpio.output(self.pin, self.gpio.HIGH if rising else self.gpio.LOW)
+        if rising:
+            if self._last_rise is not None:
+                error = abs((now - self._last_rise) - 2 * self._half_period)
+                self._jitter.append(error)
+                self._period_error.observe(error)
+            self._last_rise = now
+        self._edge += 1
+        return self._edge_time(), None
+
+
+class PWMStrobe:
+    """Strobe driven by GPIO.PWM at 50% duty cycle"""
+
+    name = 'pwm'
+
+    def __init__(self, gpio, pin, frequency, clock=None, scheduler=None, metrics=None, leds=None):
+        """
+        Initialize the strobe
+
+        Args:
+            gpio: GPIO module (or compatible object)
+            pin: Output pin driving the strobe LEDs
+            frequency: Flashes per second
+            clock: Unused; accepted so all backends share one signature
+            scheduler: Unused; accepted so all backends share one signature
+            metrics: Unused; accepted so all backends share one signature
+            leds: Unused; accepted so all backends share one signature
+        """
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self._pwm = gpio.PWM(pin, frequency)
+        self._active = False
+
+    @property
+    def running(self):
+        return self._active
+
+    def start(self):
+        """Start flashing"""
+        if not self._active:
+            self._active = True
+            self._pwm.start(50)
+
+    def stop(self):
+        """Stop flashing and leave the LEDs off"""
+        if self._active:
+            self._active = False
+            self._pwm.stop()
+        self.gpio.output(self.pin, self.gpio.LOW)
+
+    def set_frequency(self, frequency):
+        """Change the strobe frequency in place"""
+        self.frequency = frequency
+        self._pwm.ChangeFrequency(frequency)
+
+    def jitter_stats(self):
+        """
+        Return period jitter for the PWM strobe
+
+        Edges are generated outside Python, so there is nothing to sample;
+        the report is empty rather than guessed.
+        """
+        return jitter_report(self.name, [])
+
+    def close(self):
+        """Stop the PWM output"""
+        self.stop()
+
+
+class PatternStrobe:
+    """Strobe played as a pattern on the LED pattern engine"""
+
+    name = 'pattern'
+
+    # Effect name on the engine
+    EFFECT = 'strobe'
+
+    def __init__(self, gpio, pin, frequency, clock=time.monotonic, scheduler=None,
+                 metrics=NULL_METRICS, leds=None):
+        """
+        Initialize the strobe
+
+        Args:
+            gpio: GPIO module (or compatible object)
+            pin: Output pin driving the strobe LEDs
+            frequency: Flashes per second
+            clock: Monotonic time source, used if an engine is created
+            scheduler: Optional external timer source, used if an engine is created
+            metrics: Registry, used if an engine is created
+            leds: Shared LedEngine; when None the strobe runs its own
+        """
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self._owns_leds = leds is None
+        self.leds = leds if leds is not None else LedEngine(
+            gpio, clock=clock, scheduler=scheduler, metrics=metrics)
+        self._active = False
+
+    @property
+    def running(self):
+        return self._active
+
+    def start(self):
+        """Start flashing"""
+        if not self._active:
+            self._active = True
+            self.leds.start(self.EFFECT, [self.pin], 'strobe', frequency=self.frequency)
+
+    def stop(self):
+        """Stop flashing and leave the LEDs off"""
+        self._active = False
+        self.leds.set(self.pin, 0)
+
+    def set_frequency(self, frequency):
+        """Change the strobe frequency, restarting the phase now"""
+        self.frequency = frequency
+        if self._active:
+            self.leds.start(self.EFFECT, [self.pin], 'strobe', frequency=frequency)
+
+    def jitter_stats(self):
+        """
+        Return jitter for the pattern strobe
+
+        Edges land on the engine's frame deadlines, so the jitter is how
+        late those frames were written.
+        """
+        stats = self.leds.lateness_stats()
+        return {
+            'backend': self.name,
+            'samples': stats['samples'],
+            'jitter_p50_ms': stats['late_p50_ms'],
+            'jitter_p99_ms': stats['late_p99_ms'],
+            'overruns': stats['overruns'],
+        }
+
+    def close(self):
+        """Stop the strobe (and the engine, if it is the strobe's own)"""
+        self.stop()
+        if self._owns_leds:
+            self.leds.close()
+
+
+# Strobe backends selectable with config['strobe_backend']
+STROBE_BACKENDS = {
+    DeadlineStrobe.name: DeadlineStrobe,
+    PWMStrobe.name: PWMStrobe,
+    PatternStrobe.name: PatternStrobe,
+}
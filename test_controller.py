@@ -8,8 +8,16 @@ without requiring actual GPIO hardware.
 
 import time
 import sys
+import os
+import tempfile
+import socket
+import json
+import array
+import math
+import wave
 from unittest.mock import Mock, MagicMock, patch
 import threading
+import asyncio
 
 # Mock RPi.GPIO before importing buzz_controller
 sys.modules['RPi'] = MagicMock()
@@ -21,6 +29,32 @@ sys.modules['pygame.mixer'] = MagicMock()
 
 # Now import the controller
 from buzz_controller import BuzzController, WingPosition
+from async_controller import AsyncBuzzController
+from event_dispatcher import EventDispatcher
+from servo_motion import ServoMotionEngine
+from sound_bank import SoundBank
+from strobe import DeadlineStrobe, PWMStrobe
+from simulator import (DEFAULT_CLIPS, SimulatedBackend, VirtualClock, simulate_session,
+                       write_fake_pwmchip, write_silent_clips)
+from bench_latency import run_benchmark, compare
+from channel_pool import ChannelManager
+from build_audio import AudioCompiler, compiled_audio_path, read_wav
+from soundpack import PACK_NAME, SoundPack, write_pack
+from audio_stream import StreamPlayer
+from timeline import ShowRunner, compile_show, load_shows
+from led_patterns import LedEngine, render_pattern
+from input_gestures import GestureRecognizer
+from power_profile import measure
+from config_reload import ConfigWatcher
+from control_server import ControlError, ControlServer
+from control_client import ControlClient, load_test
+from costume_sync import ClockEstimator, CostumeSync, LoopbackNetwork, run_sync_test
+from recorder import EDGE, PIN, EventRecorder, load_recording, replay
+from perf_probe import compare_reports, probe_strobe, run_probes
+from phrase_library import PhraseLibrary
+from hardware_pwm import SysfsPWM, analog_audio_card, open_sysfs_pwm, pin_function
+from backends import SystemClock
+from metrics import MetricsRegistry, NULL_METRICS
 
 class TestBuzzController:
     """Test harness for BuzzController"""
@@ -114,6 +148,1331 @@ class TestBuzzController:
         assert not self.controller.strobe_running, "Strobe should be stopped"
         print("✓ Strobe stopped")
     
+    def test_sound_bank(self):
+        """Test sound bank preloading and LRU eviction"""
+        print("\n--- Testing Sound Bank ---")
+        
+        with tempfile.TemporaryDirectory() as audio_dir:
+            for name in ('a.wav', 'b.wav', 'c.wav', 'notes.txt'):
+                open(os.path.join(audio_dir, name), 'wb').close()
+            
+            # Every clip decodes to 1 s of 16-bit mono at 1 kHz = 2000 bytes
+            mixer = MagicMock()
+            mixer.get_init.return_value = (1000, -16, 1)
+            mixer.Sound.return_value.get_length.return_value = 1.0
+            
+            bank = SoundBank(audio_dir, mixer, budget_bytes=5000)
+            bank.load_all()
+            stats = bank.stats()
+            assert stats['known'] == 3, "Only audio files should be indexed"
+            assert stats['clips'] == 2, "Budget should hold two clips"
+            assert stats['evictions'] == 1, "Oldest clip should be evicted"
+            print("✓ Clips preloaded within budget")
+            
+            assert bank.get('c.wav') is not None, "Recent clip should hit"
+            assert bank.get('a.wav') is None, "Evicted clip should miss"
+            assert bank.get('missing.wav') is None, "Unknown clip should miss"
+            
+            # Evicted clip is reloaded in the background
+            for _ in range(50):
+                if bank.get('a.wav') is not None:
+                    break
+                time.sleep(0.01)
+            assert bank.get('a.wav') is not None, "Evicted clip should reload"
+            stats = bank.stats()
+            assert stats['used_bytes'] <= 5000, "Reload should respect budget"
+            print(f"✓ Evicted clip reloaded (hits={stats['hits']}, "
+                  f"misses={stats['misses']}, evictions={stats['evictions']})")
+            
+            # Unloading while the loader decodes drops the result and keeps the loader alive
+            decoding, release = threading.Event(), threading.Event()
+            sound = mixer.Sound.return_value
+            mixer.Sound.side_effect = lambda *args, **kwargs: (
+                decoding.set(), release.wait(1.0), sound)[-1]
+            assert bank.get('b.wav') is None, "Evicted clip should miss"
+            assert decoding.wait(1.0), "Loader should start decoding"
+            bank.unload()
+            release.set()
+            time.sleep(0.05)
+            assert bank.stats()['clips'] == 0, "Clip decoded before unload should be dropped"
+            assert bank._loader_thread.is_alive(), "Loader should survive the unload"
+            mixer.Sound.side_effect = None
+            print("✓ Unload during a background reload is safe")
+            bank.close()
+    
+    def test_servo_motion(self):
+        """Test non-blocking servo moves with preemption"""
+        print("\n--- Testing Servo Motion Engine ---")
+        
+        writes = []
+        completed = []
+        pwm = Mock()
+        pwm.ChangeDutyCycle.side_effect = writes.append
+        engine = ServoMotionEngine(pwm, move_time=0.2, full_range=5.0,
+                                   settle_time=0.02, on_complete=completed.append)
+        try:
+            # First move jumps from the unknown start position
+            engine.move_to(10.0)
+            assert engine.wait_idle(1.0), "Homing move should complete"
+            assert writes[0] == 10.0 and writes[-1] == 0, "Homing should jump then release"
+            print("✓ Homing jump and PWM release")
+            
+            # A move returns immediately and interpolates
+            writes.clear()
+            start = time.monotonic()
+            engine.move_to(5.0)
+            assert time.monotonic() - start < 0.05, "move_to should not block"
+            time.sleep(0.1)
+            
+            # Preempt mid-move: continue from the interpolated position
+            midpoint = engine.position
+            assert 5.0 < midpoint < 10.0, "Servo should be mid-move"
+            engine.move_to(10.0)
+            assert engine.wait_idle(1.0), "Preempted move should complete"
+            moves = [w for w in writes if w != 0]
+            turn = moves.index(min(moves))
+            assert min(moves) > 5.0, "Preempted move should never reach old target"
+            assert all(a <= b for a, b in zip(moves[turn:], moves[turn + 1:])), \
+                "New move should continue smoothly from the turn point"
+            assert completed[-1] == 10.0, "Completion should report the final target"
+            print(f"✓ Preempted at duty {midpoint:.2f}, completed at {completed[-1]}")
+        finally:
+            engine.stop()
+    
+    def test_event_dispatcher(self):
+        """Test priority ordering and backpressure in the dispatcher"""
+        print("\n--- Testing Event Dispatcher ---")
+        
+        order = []
+        gate = threading.Event()
+        dispatcher = EventDispatcher(workers=1, max_queue=3, policy='coalesce')
+        try:
+            # Block the single worker, then queue presses behind it
+            dispatcher.submit('busy', gate.wait, priority=0)
+            time.sleep(0.05)
+            dispatcher.submit('phrase', lambda: order.append('phrase'), priority=2)
+            dispatcher.submit('wing', lambda: order.append('wing'), priority=1)
+            dispatcher.submit('laser', lambda: order.append('laser'), priority=0)
+            assert not dispatcher.submit('wing', lambda: order.append('wing2'), priority=1), \
+                "Repeated press should be coalesced"
+            assert not dispatcher.submit('extra', lambda: order.append('extra'), priority=0), \
+                "Press beyond queue size should be dropped"
+            assert dispatcher.depth() == 3, "Queue should hold three events"
+            
+            gate.set()
+            assert dispatcher.wait_idle(1.0), "Queue should drain"
+            assert order == ['laser', 'wing', 'phrase'], f"Wrong order: {order}"
+            stats = dispatcher.stats()
+            assert stats['coalesced'] == 1 and stats['dropped'] == 1, "Backpressure not counted"
+            print(f"✓ Priority order {order}, queue wait p99 {stats['wait_p99_ms']:.1f} ms")
+        finally:
+            gate.set()
+            dispatcher.stop()
+        
+        # Edge callback only enqueues; a worker toggles the laser
+        laser_was_on = self.controller.laser_on
+        self.controller._on_button_edge(self.controller.config['laser_button_pin'])
+        assert self.controller.dispatcher.wait_idle(1.0), "Laser press should be handled"
+        assert self.controller.laser_on != laser_was_on, "Edge should toggle the laser"
+        self.controller._laser_button_callback(None)
+        print("✓ GPIO edge dispatched to worker")
+    
+    def test_strobe_backends(self):
+        """Test deadline-scheduled and PWM strobe backends"""
+        print("\n--- Testing Strobe Backends ---")
+        
+        gpio = Mock()
+        gpio.HIGH, gpio.LOW = 1, 0
+        levels = []
+        gpio.output.side_effect = lambda pin, level: levels.append(level)
+        
+        strobe = DeadlineStrobe(gpio, 23, frequency=50)
+        try:
+            strobe.start()
+            time.sleep(0.3)
+            strobe.stop()
+            stats = strobe.jitter_stats()
+        finally:
+            strobe.close()
+        flashes = levels.count(1)
+        assert 10 <= flashes <= 17, f"Expected ~15 flashes at 50 Hz, got {flashes}"
+        assert levels[-1] == 0, "LEDs should be off after stop"
+        assert stats['samples'] > 0, "Deadline strobe should sample jitter"
+        print(f"✓ Deadline strobe: {flashes} flashes, "
+              f"jitter p50 {stats['jitter_p50_ms']:.2f} ms / p99 {stats['jitter_p99_ms']:.2f} ms")
+        
+        gpio = Mock()
+        strobe = PWMStrobe(gpio, 23, frequency=10)
+        strobe.start()
+        gpio.PWM.return_value.start.assert_called_once_with(50)
+        strobe.set_frequency(15)
+        gpio.PWM.return_value.ChangeFrequency.assert_called_once_with(15)
+        strobe.stop()
+        gpio.PWM.return_value.stop.assert_called_once()
+        assert strobe.jitter_stats()['backend'] == 'pwm', "PWM backend should report itself"
+        print("✓ PWM strobe offloaded to GPIO.PWM at 50% duty")
+        
+        print(f"✓ Controller strobe backend: {self.controller.strobe_jitter()['backend']}")
+    
+    def test_async_controller(self):
+        """Test the asyncio controller with edges bridged from another thread"""
+        print("\n--- Testing Async Controller ---")
+        
+        async def scenario():
+            threads = threading.enumerate()
+            controller = AsyncBuzzController({'servo_move_time': 0.05})
+            config = controller.config
+            
+            # GPIO edges arrive on a foreign thread
+            edges = threading.Thread(target=lambda: [
+                controller._on_button_edge(config['laser_button_pin']),
+                controller._on_button_edge(config['wing_button_pin']),
+            ])
+            edges.start()
+            edges.join()
+            await asyncio.sleep(0.01)
+            assert controller.dispatcher.wait_idle(0), "Queued edges should have run"
+            assert controller.laser_on, "Laser edge should run on the loop"
+            assert controller.wing_position == WingPosition.HORIZONTAL, "Wing edge should run on the loop"
+            assert controller.strobe.running, "Strobe should be running"
+            
+            await asyncio.sleep(0.5)
+            assert controller.servo_motion.wait_idle(), "Servo move should have settled"
+            assert controller.servo_motion.position == config['servo_horizontal'], \
+                "Servo should reach the horizontal position"
+            helpers = [t.name for t in threading.enumerate() if t not in threads]
+            assert not helpers, f"Timers should run on the loop, not {helpers}"
+            print("✓ Edges bridged into the loop, servo and strobe ran as loop callbacks")
+            
+            # Show cues run from loop callbacks, not a show thread
+            cue_threads = []
+            move_to = controller.servo_motion.move_to
+            controller.servo_motion.move_to = lambda *args: (
+                cue_threads.append(threading.current_thread()), move_to(*args))
+            controller.shows.add(compile_show({'name': 'wave', 'tracks': {
+                'servo': [{'at': 0.0, 'target': 'vertical', 'duration': 0.02}],
+                'strobe': [{'at': 0.01, 'state': 'off'}]}}, *controller.show_targets()))
+            controller.play_show('wave')
+            await asyncio.sleep(0.1)
+            assert cue_threads == [threading.current_thread()], cue_threads
+            assert not controller.strobe.running, "Strobe cue should have run"
+            assert 'show-runner' not in [t.name for t in threading.enumerate()]
+            controller.servo_motion.move_to = move_to
+            print("✓ Show cues ran on the loop thread")
+            
+            await controller.shutdown()
+            assert not controller.strobe.running, "Strobe should be stopped"
+            pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            assert not pending, f"Tasks left after shutdown: {pending}"
+            print("✓ Awaitable shutdown left no tasks behind")
+        
+        asyncio.run(scenario())
+    
+    def test_simulated_backend(self):
+        """Test the simulated backend with bounce and a virtual clock"""
+        print("\n--- Testing Simulated Backend ---")
+        
+        # Bounce is visible to callbacks when bouncetime is disabled
+        backend = SimulatedBackend(bounce_count=2)
+        edges = []
+        backend.gpio.setup(5, backend.gpio.IN, pull_up_down=backend.gpio.PUD_UP)
+        backend.gpio.add_event_detect(5, backend.gpio.FALLING, callback=edges.append)
+        backend.press(5, hold=0.1)
+        backend.clock.advance(0.05)
+        assert len(edges) == 3, f"Two bounces should give 3 falling edges, got {len(edges)}"
+        backend.clock.advance(0.1)
+        assert len(edges) == 5, "Release bounce should add 2 more falling edges"
+        print("✓ Contact bounce injected as extra edges")
+        
+        # A full session runs on the virtual clock in far less wall time
+        start = time.perf_counter()
+        controller, backend = simulate_session(presses=200, bounce_count=3)
+        elapsed = time.perf_counter() - start
+        virtual = backend.clock.monotonic()
+        assert virtual > 30 and elapsed < virtual / 10, "Session should run faster than real time"
+        sounds = backend.events('sound')
+        assert len(sounds) == 200, f"Bouncetime should leave one sound per press, got {len(sounds)}"
+        
+        # Laser LED writes are timestamped at the press that caused them
+        laser_pin = controller.config['laser_button_pin']
+        presses = [e.time for e in backend.events('edge', laser_pin) if e.value == 0]
+        writes = [e.time for e in backend.events('output', controller.config['laser_led_pin'])]
+        assert presses and presses[0] in writes, "Laser write should share the press timestamp"
+        assert backend.events('pwm_duty', controller.config['servo_pin']), "Servo moves should be traced"
+        print(f"✓ 200 presses over {virtual:.0f} s virtual time in {elapsed * 1000:.0f} ms")
+    
+    def test_latency_benchmark(self):
+        """Test the latency benchmark and its regression check"""
+        print("\n--- Testing Latency Benchmark ---")
+        
+        results = run_benchmark(presses=6, scenarios=['idle'])
+        idle = results['scenarios']['idle']
+        for metric in ('laser.led', 'wing.servo', 'phrase.sound'):
+            assert idle[metric]['count'] == 2 and idle[metric]['lost'] == 0, \
+                f"{metric} should be measured for every press"
+        print(f"✓ Idle laser LED latency p99 {idle['laser.led']['p99_ms']:.2f} ms")
+        
+        assert not compare(results, results), "Results should not regress against themselves"
+        baseline = {'scenarios': {'idle': {'laser.led': dict(idle['laser.led'], p95_ms=0.0, p99_ms=0.0)}}}
+        regressions = compare(results, baseline, tolerance=0.0, slack_ms=0.0)
+        assert len(regressions) == 2, "Slower p95 and p99 should be flagged"
+        print("✓ Regressions against baseline detected")
+    
+    def test_metrics(self):
+        """Test hot-path metrics and their export"""
+        print("\n--- Testing Metrics ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, 'metrics.sock')
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'metrics_enabled': True,
+                                         'metrics_socket': socket_path}, backend=backend)
+            backend.press(controller.config['laser_button_pin'])
+            backend.clock.advance(0.5)
+            
+            text = controller.metrics.render()
+            assert 'buzz_button_edges_total{action="laser"} 1' in text, "Edge should be counted"
+            assert 'buzz_action_seconds_count{action="laser"} 1' in text, "Action should be timed"
+            assert 'buzz_dispatch_queue_depth 0' in text, "Gauges should be exported"
+            print("✓ Button edges counted and actions timed")
+            
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                served = b''.join(iter(lambda: client.recv(4096), b'')).decode()
+            assert 'buzz_servo_command_seconds_count' in served, "Socket should serve metrics"
+            print("✓ Metrics served on UNIX socket")
+            
+            controller.cleanup()
+            assert not os.path.exists(socket_path), "Socket should be removed on cleanup"
+        
+        registry = MetricsRegistry()
+        with registry.span('work_seconds'):
+            pass
+        assert 'work_seconds_bucket{le="+Inf"} 1' in registry.render(), "Span should be recorded"
+        with NULL_METRICS.span('work_seconds'):
+            NULL_METRICS.counter('presses').inc()
+        assert NULL_METRICS.render() == '', "Disabled metrics should record nothing"
+        print("✓ Disabled metrics are a no-op")
+    
+    def test_fast_start(self):
+        """Test that buttons work while audio is still starting"""
+        print("\n--- Testing Fast Start ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav', 'laser_off.wav'])
+            for policy, expected in (('queue', ['laser_on.wav']), ('skip', [])):
+                backend = SimulatedBackend()
+                gate = threading.Event()
+                mixer_init = backend.mixer.init
+                backend.mixer.init = lambda **kwargs: (gate.wait(2.0), mixer_init(**kwargs))
+                controller = BuzzController({'audio_path': tmp, 'fast_start': True,
+                                             'early_sound_policy': policy}, backend=backend)
+                
+                backend.press(controller.config['laser_button_pin'])
+                backend.clock.advance(0.1)
+                assert controller.laser_on, "Button should work before audio is ready"
+                assert not controller.audio_ready.is_set(), "Audio should still be starting"
+                
+                gate.set()
+                assert controller.audio_ready.wait(2.0), "Audio should become ready"
+                controller._audio_thread.join(2.0)
+                played = [e.target for e in backend.events('sound')]
+                assert played == expected, f"{policy}: early sounds {played}, expected {expected}"
+                assert 'buttons_ready' in controller.startup_timings
+                assert controller.startup_timings['buttons_ready'] < controller.startup_timings['audio_ready']
+                controller.cleanup()
+                print(f"✓ Early sound policy '{policy}' works, buttons ready before audio")
+    
+    def test_channel_pool(self):
+        """Test channel reservation, voice stealing and cut-previous"""
+        print("\n--- Testing Channel Pool ---")
+        
+        backend = SimulatedBackend(sound_length=5.0)
+        mixer = backend.mixer
+        mixer.init()
+        categories = {
+            'wing': {'priority': 0, 'reserved': 1, 'cut_previous': False},
+            'phrase': {'priority': 2, 'reserved': 0, 'cut_previous': False},
+            'beep': {'priority': 3, 'reserved': 0, 'cut_previous': True},
+        }
+        pool = ChannelManager(mixer, categories, channels=3, clock=backend.clock.monotonic)
+        sound = lambda name: mixer.Sound(name)
+        
+        pool.play(sound('a.wav'), 'phrase')
+        backend.clock.advance(0.1)
+        pool.play(sound('b.wav'), 'phrase')
+        backend.clock.advance(0.1)
+        assert pool.play(sound('c.wav'), 'phrase') is not None, "Phrase should steal a phrase"
+        stolen = [e.target for e in backend.events('sound_stop')]
+        assert stolen == ['a.wav'], f"Oldest phrase should be stolen, got {stolen}"
+        assert pool.play(sound('d.wav'), 'beep') is None, "Lower priority should be dropped"
+        assert pool.play(sound('open.wav'), 'wing').index == 0, "Wing should use its reserved channel"
+        print("✓ Reserved channel kept free, lowest priority stolen or dropped")
+        
+        pool.stop()
+        pool.play(sound('e.wav'), 'beep')
+        pool.play(sound('f.wav'), 'beep')
+        stats = pool.stats()
+        assert stats['categories']['beep']['cut'] == 1 and stats['busy'] == 1, \
+            "cut_previous should stop the previous sound of the category"
+        assert stats['stolen'] == 1 and stats['dropped'] == 1
+        print(f"✓ Stats: {stats['played']} played, {stats['stolen']} stolen, {stats['dropped']} dropped")
+    
+    def test_audio_compiler(self):
+        """Test clip conversion, silence trimming and the build cache"""
+        print("\n--- Testing Audio Compiler ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            # Stereo 44.1 kHz clip with 100 ms of leading silence
+            with wave.open(os.path.join(tmp, 'laser_on.wav'), 'wb') as clip:
+                clip.setnchannels(2)
+                clip.setsampwidth(2)
+                clip.setframerate(44100)
+                tone = [int(2000 * math.sin(i / 5.0)) for i in range(4410)]
+                clip.writeframes(array.array('h', [0] * 8820 + tone).tobytes())
+            
+            compiler = AudioCompiler(tmp, 22050, -16, 1)
+            manifest = compiler.build()
+            clip = manifest['clips']['laser_on.wav']
+            channels, rate = read_wav(os.path.join(compiled_audio_path(tmp), 'laser_on.wav'))
+            assert rate == 22050 and len(channels) == 1, "Clip should match the mixer format"
+            assert abs(clip['trimmed_ms'] - 100.0) < 1.0, "Leading silence should be trimmed"
+            assert abs(clip['duration'] - 0.05) < 0.001 and clip['decoded_bytes'] == 2 * len(channels[0])
+            print(f"✓ Converted to 22050 Hz mono, trimmed {clip['trimmed_ms']:.0f} ms, "
+                  f"gain {clip['gain_db']:+.1f} dB")
+            
+            compiler = AudioCompiler(tmp, 22050, -16, 1)
+            compiler.build()
+            assert compiler.results['laser_on.wav']['cached'], "Unchanged clip should be skipped"
+            print("✓ Unchanged clips skipped on rebuild")
+            
+            controller = BuzzController({'audio_path': tmp}, backend=SimulatedBackend())
+            assert controller.sound_bank.audio_path == compiled_audio_path(tmp), \
+                "Controller should load compiled clips"
+            controller.cleanup()
+            controller = BuzzController({'audio_path': tmp, 'mixer_frequency': 44100},
+                                        backend=SimulatedBackend())
+            assert controller.sound_bank.audio_path == tmp, "Mismatched build should be ignored"
+            controller.cleanup()
+            print("✓ Controller uses compiled clips only when the format matches")
+    
+    def test_sound_pack(self):
+        """Test the memory-mapped sound pack and loading clips from it"""
+        print("\n--- Testing Sound Pack ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            pack_path = os.path.join(tmp, 'test.pak')
+            clips = [('laser_on.wav', b'\x01\x00' * 1000), ('laser_off.wav', b'\x02\x00' * 300)]
+            write_pack(pack_path, clips, 22050, -16, 1)
+            pack = SoundPack(pack_path)
+            assert pack.names() == ['laser_off.wav', 'laser_on.wav']
+            assert bytes(pack.clip('laser_off.wav')) == clips[1][1], "Clip PCM should round-trip"
+            assert pack._index['laser_on.wav'][0] % 4096 == 0, "Clip regions should be page aligned"
+            assert pack.matches(22050, -16, 1) and not pack.matches(44100, -16, 1)
+            pack.close()
+            print("✓ Pack index, alignment and PCM round-trip")
+            
+            write_silent_clips(tmp, ['laser_on.wav'])
+            AudioCompiler(tmp, 22050, -16, 1).build(pack=True)
+            assert os.path.exists(os.path.join(compiled_audio_path(tmp), PACK_NAME))
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp}, backend=backend)
+            assert controller.sound_pack is not None, "Built pack should be used"
+            assert controller.sound_bank.stats()['clips'] == 1, "Clips should load from the pack"
+            backend.press(controller.config['laser_button_pin'])
+            backend.clock.advance(0.1)
+            assert backend.events('sound'), "Clip from the pack should play"
+            controller.cleanup()
+            print("✓ Controller plays clips from the mapped pack")
+            
+            # The phrase tree is compiled and packed under its path in the audio directory
+            write_silent_clips(os.path.join(tmp, 'phrases'), ['greetings/hello.wav', 'catchphrases/ranger.wav'])
+            manifest = AudioCompiler(tmp, 22050, -16, 1).build(pack=True)
+            assert 'phrases/greetings/hello.wav' in manifest['clips'], sorted(manifest['clips'])
+            assert os.path.exists(os.path.join(compiled_audio_path(tmp), 'phrases', 'greetings', 'hello.wav'))
+            controller = BuzzController({'audio_path': tmp}, backend=SimulatedBackend())
+            assert 'phrases/catchphrases/ranger.wav' in controller.sound_pack
+            assert controller.sound_bank.stats()['clips'] == 1, "Phrases should not preload into the bank"
+            phrase = controller.phrases.peek()
+            controller.phrases.wait_idle(2.0)
+            assert controller.phrases.get(phrase).name == '<buffer>', "Phrase should decode from the pack"
+            controller.cleanup()
+            print("✓ Phrase tree compiled and played from the pack")
+    
+    def test_audio_stream(self):
+        """Test streamed loops, track changes, ducking and the size threshold"""
+        print("\n--- Testing Audio Stream ---")
+        
+        backend = SimulatedBackend()
+        clock = backend.clock
+        music = backend.mixer.music
+        stream = StreamPlayer(music, volume=0.5, crossfade=1.0, duck_volume=0.2,
+                              clock=clock.monotonic, scheduler=clock)
+        stream.play('/sounds/hum.ogg')
+        clock.advance(1.0)
+        assert [e.value for e in backend.events('music_play')] == [-1], "Loop should play gaplessly"
+        assert music.get_volume() == 0.5, "Loop should fade in to full volume"
+        
+        stream.duck_for(0.3)
+        clock.advance(0.1)
+        assert abs(music.get_volume() - 0.1) < 1e-9, "Stream should duck under effects"
+        clock.advance(0.5)
+        assert music.get_volume() == 0.5, "Stream should recover after the effect"
+        print("✓ Loop fades in and ducks under effects")
+        
+        stream.play('/sounds/flight.ogg')
+        clock.advance(0.25)
+        assert 0.0 < music.get_volume() < 0.5 and stream.track == '/sounds/flight.ogg'
+        clock.advance(1.0)
+        loads = [e.target for e in backend.events('music_load')]
+        assert loads == ['hum.ogg', 'flight.ogg'] and music.get_volume() == 0.5, \
+            "Track change should fade out, switch and fade in"
+        stream.stop()
+        clock.advance(1.0)
+        assert not music.get_busy() and stream.track is None
+        stream.close()
+        print("✓ Track changes fade out and in, stop fades out")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['wings_open.wav', 'wings_close.wav'])
+            write_silent_clips(tmp, ['hum.wav', 'flight.wav', 'to_infinity.wav'], length=3.0)
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'stream_threshold_kb': 64,
+                                         'background_loop': 'hum.wav', 'wing_loop': 'flight.wav'},
+                                        backend=backend)
+            assert not controller.sound_bank.knows('to_infinity.wav'), "Large clip should not preload"
+            backend.clock.advance(1.0)
+            backend.press(controller.config['wing_button_pin'])
+            backend.clock.advance(2.0)
+            loads = [e.target for e in backend.events('music_load')]
+            assert loads == ['hum.wav', 'flight.wav'], f"Wings should switch loops, got {loads}"
+            controller._play_sound('to_infinity.wav', 'phrase')
+            backend.clock.advance(0.1)
+            assert backend.events('music_load')[-1].target == 'to_infinity.wav', \
+                "Large clip should stream"
+            backend.clock.advance(4.0)
+            assert backend.events('music_load')[-1].target == 'flight.wav', \
+                "Wing loop should resume after the large clip"
+            assert controller.stream.track.endswith('flight.wav') and backend.mixer.music.get_busy()
+            
+            controller.stream.stop()
+            backend.clock.advance(1.0)
+            controller._play_sound('to_infinity.wav', 'phrase')
+            backend.clock.advance(4.0)
+            assert controller.stream.track is None, "A finished one-shot should leave no track"
+            assert controller._release_audio(), "Audio should release once the clip has ended"
+            controller.cleanup()
+            print("✓ Controller streams loops per wing state and large clips, then resumes the loop")
+    
+    def test_show_timeline(self):
+        """Test show compilation, cue timing, preemption and queueing"""
+        print("\n--- Testing Show Timeline ---")
+        
+        pins = {'strobe': 23}
+        positions = {'horizontal': 5.0, 'vertical': 10.0}
+        show = compile_show({'name': 'flash', 'tracks': {
+            'sound': [{'at': 0.5, 'clip': 'beep.wav'}],
+            'led': [{'at': 0.0, 'pin': 'strobe', 'pattern': 'blink', 'count': 2, 'on': 0.1, 'off': 0.2}],
+        }}, pins, positions)
+        assert [(c.time, c.track, c.args) for c in show.cues] == [
+            (0.0, 'led', (23, 1)), (0.1, 'led', (23, 0)), (0.3, 'led', (23, 1)),
+            (0.4, 'led', (23, 0)), (0.5, 'sound', ('beep.wav', 'effect'))], "Cues should be flat and sorted"
+        try:
+            compile_show({'tracks': {'smoke': [{'at': 0}]}}, pins, positions)
+            assert False, "Unknown track should be rejected"
+        except ValueError:
+            pass
+        print("✓ Show compiled to a flat, time-sorted cue list")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'flash.json'), 'w') as f:
+                json.dump({'tracks': {'led': [{'at': 0.0, 'pin': 'strobe', 'pattern': 'blink',
+                                               'count': 3, 'on': 0.05, 'off': 0.05}],
+                                      'servo': [{'at': 0.2, 'target': 'horizontal', 'duration': 0.2}]}}, f)
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'show_path': tmp,
+                                         'button_shows': {'laser': 'flash'}}, backend=backend)
+            backend.clock.advance(1.0)
+            pressed = backend.clock.monotonic()
+            backend.press(controller.config['laser_button_pin'])
+            backend.clock.advance(1.0)
+            strobe_pin = controller.config['strobe_led_pin']
+            edges = [(round(e.time - pressed, 3), e.value) for e in backend.events('output', strobe_pin) if e.time >= pressed]
+            assert edges == [(0.0, 1), (0.05, 0), (0.1, 1), (0.15, 0), (0.2, 1), (0.25, 0)], edges
+            assert controller.wing_position == WingPosition.HORIZONTAL, "Servo cue should move the wings"
+            assert not controller.laser_on, "Mapped button should play its show instead"
+            assert controller.shows.lateness_stats()['late_max_ms'] == 0.0
+            controller.cleanup()
+        print("✓ Button-triggered show runs cues on their deadlines")
+        
+        clock = SimulatedBackend().clock
+        log = []
+        runner = ShowRunner({'led': lambda pin, level: log.append((round(clock.monotonic(), 3), pin, level))},
+                            clock=clock.monotonic, scheduler=clock)
+        long_show = compile_show({'name': 'long', 'priority': 1, 'tracks': {
+            'led': [{'at': 0.0, 'pin': 1}, {'at': 1.0, 'pin': 1, 'pattern': 'off'}]}}, {}, {})
+        urgent = compile_show({'name': 'urgent', 'priority': 0, 'tracks': {
+            'led': [{'at': 0.0, 'pin': 2}, {'at': 0.1, 'pin': 2, 'pattern': 'off'}]}}, {}, {})
+        later = compile_show({'name': 'later', 'priority': 2, 'tracks': {
+            'led': [{'at': 0.0, 'pin': 3}]}}, {}, {})
+        runner.trigger(long_show)
+        clock.advance(0.5)
+        runner.trigger(urgent)
+        runner.trigger(later)
+        assert runner.current == 'urgent', "More important show should preempt"
+        clock.advance(1.0)
+        assert log == [(0.0, 1, 1), (0.5, 1, 0), (0.5, 2, 1), (0.6, 2, 0), (0.6, 3, 1)], log
+        assert runner.wait_idle() and runner.lateness_stats()['shows_preempted'] == 1
+        runner.close()
+        print("✓ Shows preempt by priority and queue behind each other")
+        
+        show_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shows')
+        shipped = load_shows(show_path, pins, positions)
+        assert 'triple_flash' in shipped, "Example show should load"
+        for show in shipped.values():
+            clips = {c.args[0] for c in show.cues if c.track == 'sound'}
+            assert clips <= set(DEFAULT_CLIPS), f"{show.name} plays clips that are not shipped: {clips}"
+        print("✓ Shipped shows only play shipped clips")
+    
+    def test_led_patterns(self):
+        """Test pattern rendering, caching and the batched render loop"""
+        print("\n--- Testing LED Patterns ---")
+        
+        strobe = render_pattern('strobe', 100, frequency=10)
+        assert strobe.samples == (b'\x01' * 5 + b'\x00' * 5,), strobe.samples
+        assert render_pattern('strobe', 100, frequency=10) is strobe, "Renders should be cached"
+        chase = render_pattern('chase', 100, pins=3, step=0.1)
+        assert all(sum(s[i] for s in chase.samples) == 1 for i in range(chase.length)), \
+            "Chase should light one pin at a time"
+        breathe = render_pattern('breathe', 200, period=2.0)
+        assert 0.4 < sum(breathe.samples[0]) / breathe.length < 0.6, "Breathe should average half brightness"
+        sos = render_pattern('morse', 10, text='SOS', unit=0.1)
+        assert sum(sos.samples[0]) == 3 + 9 + 3, "SOS is 3 dots, 3 dashes, 3 dots"
+        print("✓ Patterns rendered once and cached by parameters")
+        
+        backend = SimulatedBackend()
+        clock = backend.clock
+        calls = []
+        output = backend.gpio.output
+        backend.gpio.output = lambda pins, levels: (calls.append(pins), output(pins, levels))
+        leds = LedEngine(backend.gpio, frame_rate=100, clock=clock.monotonic, scheduler=clock)
+        leds.start('strobe', [23], 'strobe', frequency=10)
+        leds.start('chase', [5, 6], 'chase', step=0.1)
+        clock.advance(0.2)
+        edges = [(round(e.time, 3), e.value) for e in backend.events('output', 23)]
+        assert edges == [(0.0, 1), (0.05, 0), (0.1, 1), (0.15, 0), (0.2, 1)], edges
+        assert calls[0] == [23, 5, 6], "Changed pins should be written in one call"
+        assert len(calls) == 5, f"Loop should only wake on changes ({len(calls)} writes)"
+        leds.set(6, 1)
+        assert leds.active() == ['strobe'], "Driving a pin should stop its effect"
+        leds.stop('strobe')
+        clock.advance(0.01)
+        assert backend.gpio.levels[23] == 0 and backend.gpio.levels[6] == 1
+        assert not clock.pending(), "Engine should sleep with nothing animated"
+        leds.close()
+        print("✓ One loop writes all changed pins per frame in a batched call")
+        
+        backend = SimulatedBackend()
+        controller = BuzzController({'audio_path': tempfile.gettempdir()}, backend=backend)
+        threads = threading.active_count()
+        controller.led_effect('glow', 'breathe', pins=('laser',), period=1.0)
+        controller._start_strobe()
+        backend.clock.advance(1.0)
+        assert threading.active_count() == threads, "Effects should not start threads"
+        assert controller.strobe_jitter()['backend'] == 'pattern'
+        controller.stop_led_effect('glow')
+        controller.cleanup()
+        print("✓ Controller strobe and effects share the engine")
+    
+    def test_input_gestures(self):
+        """Test leading-edge debounce, double taps, long presses and chords"""
+        print("\n--- Testing Input Gestures ---")
+        
+        backend = SimulatedBackend(bounce_count=3)
+        clock = backend.clock
+        gpio = backend.gpio
+        log = []
+        recognizer = GestureRecognizer(
+            gpio, {5: 'laser', 6: 'wing'},
+            lambda key, pin: log.append((round(clock.monotonic(), 3), key)),
+            bindings=['laser:double_tap', 'laser:long_press', 'laser+wing'],
+            clock=clock.monotonic, scheduler=clock
+        )
+        for pin in (5, 6):
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+            gpio.add_event_detect(pin, gpio.BOTH, callback=recognizer.on_edge)
+        clock.advance(1.0)
+        backend.press(5)
+        clock.advance(0.15)
+        backend.press(5)
+        clock.advance(1.0)
+        backend.press(5, hold=1.0)
+        clock.advance(2.0)
+        backend.press(6)
+        clock.advance(0.02)
+        backend.press(5)
+        clock.advance(1.0)
+        backend.press(6, hold=0.005)
+        clock.advance(0.03)
+        backend.press(6, hold=0.005)
+        clock.advance(1.0)
+        assert log == [(1.0, 'laser'), (1.15, 'laser:double_tap'), (2.15, 'laser'),
+                       (2.95, 'laser:long_press'), (4.15, 'wing'), (4.17, 'laser+wing'),
+                       (5.17, 'wing'), (5.2, 'wing')], log
+        assert recognizer.stats()['bounces'] > 0, "Bounce edges should be suppressed"
+        recognizer.close()
+        print("✓ Taps fire on the leading edge; double tap, long press and chord recognized")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SimulatedBackend(bounce_count=3)
+            controller = BuzzController({'audio_path': tmp, 'gestures': {'laser:long_press': 'wing'}},
+                                        backend=backend)
+            backend.clock.advance(1.0)
+            backend.press(controller.config['laser_button_pin'], hold=1.0)
+            backend.clock.advance(0.5)
+            assert controller.laser_on, "Tap should run at once"
+            assert controller.wing_position == WingPosition.VERTICAL
+            backend.clock.advance(1.0)
+            assert controller.wing_position == WingPosition.HORIZONTAL, "Long press should run its binding"
+            controller.cleanup()
+            try:
+                BuzzController({'audio_path': tmp, 'gestures': {'laser:triple_tap': 'wing'}},
+                               backend=SimulatedBackend())
+                assert False, "Unknown gesture should be rejected"
+            except ValueError:
+                pass
+        print("✓ Gesture bindings give buttons more than one action")
+    
+    def test_reconciler(self):
+        """Test that hammered toggles converge in at most one more motion"""
+        print("\n--- Testing Reconciler ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['wings_open.wav', 'wings_close.wav', 'laser_on.wav', 'laser_off.wav'])
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'metrics_enabled': True}, backend=backend)
+            backend.clock.advance(2.0)
+            servo_pin = controller.config['servo_pin']
+            moves = len(backend.events('pwm_duty', servo_pin))
+            
+            # Six presses while the first move is still running
+            for _ in range(6):
+                backend.press(controller.config['wing_button_pin'], hold=0.02)
+                backend.clock.advance(0.05)
+            assert controller.reconciler.actual('wings') == WingPosition.HORIZONTAL, \
+                "Servo should finish the first move before taking a new target"
+            backend.clock.advance(2.0)
+            sounds = [e.target for e in backend.events('sound')]
+            assert sounds == ['wings_open.wav', 'wings_close.wav'], f"One sound per applied move: {sounds}"
+            assert controller.reconciler.actual('wings') == WingPosition.VERTICAL
+            assert not controller.strobe_running, "Strobe should follow the final target"
+            duties = [e.value for e in backend.events('pwm_duty', servo_pin)[moves:] if e.value]
+            steps = [b - a for a, b in zip(duties, duties[1:]) if b != a]
+            reversals = sum(1 for a, b in zip(steps, steps[1:]) if a * b < 0)
+            assert reversals == 1, f"Servo should move out and back once, reversed {reversals} times"
+            
+            # Toggles that cancel out before they are applied do nothing
+            controller._laser_button_callback(None)
+            controller._laser_button_callback(None)
+            controller._laser_button_callback(None)
+            backend.clock.advance(1.0)
+            assert [e.target for e in backend.events('sound')][2:] == ['laser_on.wav'], \
+                "Cancelled laser toggles should not play"
+            stats = controller.reconciler.stats()
+            assert stats['coalesced'] >= 6, stats
+            assert 'buzz_transitions_coalesced_total' in controller.metrics.render()
+            controller.cleanup()
+        print(f"✓ 6 wing presses became 2 moves; {stats['coalesced']} transitions coalesced")
+    
+    def test_idle_mode(self):
+        """Test idle release and reacquire, and the event-driven run loop"""
+        print("\n--- Testing Idle Mode ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav'])
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'idle_timeout': 5.0}, backend=backend)
+            servo_pin = controller.config['servo_pin']
+            backend.clock.advance(4.0)
+            assert not controller.idle.idle, "Should stay awake before the timeout"
+            backend.clock.advance(2.0)
+            assert controller.idle.idle, "Should go idle after the timeout"
+            assert backend.events('pwm_stop', servo_pin), "Servo PWM should be released"
+            assert backend.events('mixer_quit'), "Mixer should be released"
+            assert not controller.audio_ready.is_set()
+            
+            backend.press(controller.config['laser_button_pin'])
+            backend.clock.advance(0.5)
+            assert not controller.idle.idle, "Press should wake the costume"
+            assert backend.events('pwm_start', servo_pin)[-1].time > backend.events('pwm_stop', servo_pin)[-1].time
+            assert len(backend.events('mixer_init')) == 2, "Mixer should be reacquired"
+            assert [e.target for e in backend.events('sound')] == ['laser_on.wav'], \
+                "Waking press should still play its sound"
+            assert controller.laser_on
+            assert controller.idle.stats()['idle_periods'] == 1
+            controller.cleanup()
+        print("✓ Servo PWM and mixer released when idle and reacquired on the next press")
+        
+        controller = BuzzController({'audio_path': tempfile.gettempdir()}, backend=SimulatedBackend())
+        runner = threading.Thread(target=controller.run)
+        runner.start()
+        time.sleep(0.05)
+        assert runner.is_alive(), "run() should block"
+        controller.request_shutdown()
+        runner.join(2.0)
+        assert not runner.is_alive(), "run() should return once shutdown is requested"
+        
+        stats = measure(0.05)
+        assert stats['cpu_ms_per_min'] >= 0 and 'threads' in stats
+        print("✓ run() blocks on an event instead of polling")
+    
+    def test_config_reload(self):
+        """Test the compiled config and reapplying only changed subsystems"""
+        print("\n--- Testing Config Reload ---")
+        
+        config = self.controller.config
+        assert config.laser_led_pin == config['laser_led_pin'] == 24
+        try:
+            config.laser_led_pin = 5
+            assert False, "Config should be read-only"
+        except AttributeError:
+            pass
+        for bad in ({'laser_led_pn': 5}, {'laser_led_pin': '5'}, {'servo_easing': 'bounce'}):
+            try:
+                BuzzController(bad, backend=SimulatedBackend())
+                assert False, f"Invalid config should be rejected: {bad}"
+            except ValueError:
+                pass
+        print("✓ Config compiled to a frozen object; typos, types and choices rejected")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav', 'laser_off.wav'])
+            backend = SimulatedBackend()
+            settings = {'audio_path': tmp, 'config_watch': False}
+            controller = BuzzController(settings, backend=backend)
+            backend.clock.advance(1.0)
+            strobe = controller.strobe
+            
+            settings.update(strobe_frequency=12, debounce_time=40, laser_button_pin=5,
+                            servo_vertical=11.0, servo_pin=12)
+            applied = controller.reload_config(settings)
+            assert applied == ['debounce_time', 'laser_button_pin', 'servo_vertical', 'strobe_frequency'], applied
+            assert controller.config.servo_pin == 18, "Restart-only settings keep their running value"
+            assert controller.strobe is strobe and strobe.frequency == 12, "Strobe should be retuned in place"
+            assert controller.inputs.lockout == 0.04
+            assert 5 in backend.gpio.detections and 27 not in backend.gpio.detections
+            backend.press(5)
+            backend.clock.advance(1.0)
+            assert controller.laser_on, "Moved button should work on its new pin"
+            assert controller.servo_motion.position == 11.0, "Wings should move to the new end position"
+            assert len(backend.events('mixer_init')) == 1, "Mixer should not be restarted"
+            
+            try:
+                controller.reload_config(dict(settings, gestures={'laser:wiggle': 'wing'}))
+                assert False, "Invalid gesture should be rejected"
+            except ValueError:
+                pass
+            assert controller.config.laser_button_pin == 5, "Rejected config should change nothing"
+            for frequency in (0, 150):
+                try:
+                    controller.reload_config(dict(settings, strobe_frequency=frequency))
+                    assert False, f"A {frequency} Hz strobe should be rejected at 200 frames per second"
+                except ValueError:
+                    pass
+            assert controller.config.strobe_frequency == strobe.frequency == 12
+            
+            # A step that fails while applying puts back the steps before it
+            with patch.object(controller, '_reload_shows', side_effect=OSError("disk gone")):
+                try:
+                    controller.reload_config(dict(settings, strobe_frequency=6, laser_button_pin=6))
+                    assert False, "A failed step should be raised"
+                except OSError:
+                    pass
+            assert controller.config.laser_button_pin == 5 and controller.config.strobe_frequency == 12
+            assert strobe.frequency == 12, "Strobe should be retuned back"
+            assert 5 in backend.gpio.detections and 6 not in backend.gpio.detections
+            backend.press(5)
+            backend.clock.advance(1.0)
+            assert not controller.laser_on, "Button should still work on its running pin"
+            
+            loads = controller.sound_bank.stats()['loads']
+            write_silent_clips(tmp, ['laser_on.wav'], length=0.25)
+            assert controller.reload_config(settings) == []
+            assert controller.sound_bank.stats()['loads'] == loads + 1, "Only the changed clip should reload"
+            
+            path = os.path.join(tmp, 'config.py')
+            with open(path, 'w') as f:
+                f.write(f"CONFIG = {{'audio_path': {tmp!r}, 'strobe_frequency': 8, 'config_watch': False}}\n")
+            controller.watch_config(path)
+            assert 'strobe_frequency' in controller.reload_config_file()
+            assert controller.config.laser_button_pin == 27, "Settings left out of the file take defaults"
+            with open(path, 'w') as f:
+                f.write("CONFIG = {'strobe_frequency': 'fast'}\n")
+            assert controller.reload_config_file() is None
+            assert controller.config.strobe_frequency == 8, "Bad file should keep the running config"
+            controller.cleanup()
+        print("✓ Reload reapplies only changed pins, timings and clips without restarting audio")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'config.py')
+            with open(path, 'w') as f:
+                f.write("CONFIG = {}\n")
+            changed = threading.Event()
+            watcher = ConfigWatcher(path, lambda p: changed.set(), settle=0.05, poll_interval=0.05)
+            time.sleep(0.05)
+            with open(path, 'w') as f:
+                f.write("CONFIG = {'strobe_frequency': 12}\n")
+            assert changed.wait(3.0), "Saving the file should trigger a reload"
+            watcher.close()
+            print(f"✓ Config file watched ({watcher.mode})")
+            
+            # On a scheduler the file is polled from timer callbacks, no thread
+            clock = VirtualClock()
+            changes = []
+            watcher = ConfigWatcher(path, changes.append, clock=clock.monotonic, scheduler=clock)
+            with open(path, 'w') as f:
+                f.write("CONFIG = {'strobe_frequency': 4}\n")
+            clock.advance(2.0)
+            assert not changes, "A change should wait to settle"
+            clock.advance(0.2)
+            assert changes == [path], "A settled change should be reported once"
+            clock.advance(10.0)
+            assert changes == [path], "An unchanged file should not be reported again"
+            watcher.close()
+            assert clock.pending() == 0, "Closing should cancel the poll timer"
+        print("✓ Config file polled on a scheduler")
+    
+    def test_control_server(self):
+        """Test remote presses, pipelining, batches, subscriptions and WebSocket clients"""
+        print("\n--- Testing Control Server ---")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav', 'laser_off.wav'])
+            socket_path = os.path.join(tmp, 'control.sock')
+            controller = BuzzController({
+                'audio_path': tmp,
+                'control_socket': socket_path,
+                'control_port': 0,
+                'control_host': '127.0.0.1',
+                'control_token': 'buzz',
+                'reconcile_hold': 0.0,
+                'recorder_path': tmp,
+            }, backend=SimulatedBackend(clock=SystemClock()))
+            port = controller.control.port
+            
+            async def connect(**kwargs):
+                client = await ControlClient.connect(**kwargs)
+                await client.request('auth', token='buzz')
+                return client
+            
+            async def exercise():
+                client = await ControlClient.connect(socket_path)
+                try:
+                    await client.request('state')
+                    assert False, "Commands should need the token"
+                except ControlError:
+                    pass
+                await client.request('auth', token='buzz')
+                
+                # Every request is sent before the first response is read
+                responses = await asyncio.gather(*[client.send('ping') for _ in range(50)])
+                assert all(r['ok'] for r in responses)
+                assert [r['id'] for r in responses] == sorted(r['id'] for r in responses)
+                
+                listener = await connect(port=port, websocket=True)
+                state = await listener.request('subscribe')
+                assert state['laser'] is False and state['wings'] == 'vertical'
+                results = await client.batch([{'cmd': 'press', 'action': 'laser'},
+                                              {'cmd': 'press', 'action': 'jetpack'}])
+                assert results[0]['ok'] and not results[1]['ok'], results
+                event = await asyncio.wait_for(listener.events.get(), 2.0)
+                assert event == {'event': 'state', 'key': 'laser', 'value': True}, event
+                assert (await client.request('state'))['laser'] is True
+                dumped, pong = await asyncio.gather(client.send('dump'), client.send('ping'))
+                assert os.path.isfile(dumped['result']) and pong['ok'], "Dump should answer in order"
+                await client.close()
+                await listener.close()
+                # With a token, pages from anywhere may connect; they still need the token
+                remote = await connect(port=port, websocket=True, origin='https://buzz.example')
+                await remote.close()
+                
+                return await load_test(lambda: connect(socket_path=socket_path),
+                                       clients=2, requests=200, window=8, command='state')
+            
+            result = asyncio.run(exercise())
+            assert result['errors'] == 0 and result['requests'] == 400, result
+            assert result['rtt_p99_ms'] > 0
+            controller.cleanup()
+            assert not os.path.exists(socket_path), "Socket should be removed on shutdown"
+            
+            try:
+                ControlServer(controller, host='0.0.0.0', port=0)
+                assert False, "An open port without a token should be refused"
+            except ValueError:
+                pass
+            
+            # Without a token, browsers may only connect from pages on this machine
+            controller = BuzzController({'audio_path': tmp, 'control_port': 0},
+                                        backend=SimulatedBackend(clock=SystemClock()))
+            port = controller.control.port
+            
+            async def origins():
+                try:
+                    await ControlClient.connect(port=port, websocket=True, origin='https://evil.example')
+                    assert False, "A page from another site should be refused"
+                except ConnectionError:
+                    pass
+                for origin in (None, 'http://localhost:8000', 'http://127.0.0.1'):
+                    client = await ControlClient.connect(port=port, websocket=True, origin=origin)
+                    assert (await client.request('state'))['laser'] is False
+                    await client.close()
+            
+            asyncio.run(origins())
+            assert controller.control.stats()['origins_refused'] == 1
+            controller.cleanup()
+        print(f"✓ Pipelined, batched and WebSocket clients; state round trip p99 {result['rtt_p99_ms']:.2f} ms")
+    
+    def test_costume_sync(self):
+        """Test clock estimation and cues run together on several costumes"""
+        print("\n--- Testing Costume Sync ---")
+        
+        # Remote clock 5 s ahead and 100 ppm fast, 1 ms each way
+        estimator = ClockEstimator()
+        for i in range(12):
+            t1 = i * 2.0
+            t2 = 5.0 + (t1 + 0.001) * 1.0001
+            t4 = (t2 + 0.0001 - 5.0) / 1.0001 + 0.001
+            estimator.add(t1, t2, t2 + 0.0001, t4)
+        assert estimator.synced
+        assert abs(estimator.drift - 100e-6) < 5e-6, f"Drift should be found: {estimator.drift}"
+        assert abs(estimator.to_remote(100.0) - (5.0 + 100.0 * 1.0001)) < 1e-4
+        assert abs(estimator.to_local(estimator.to_remote(42.0)) - 42.0) < 1e-9
+        print(f"✓ Offset and drift estimated ({estimator.drift * 1e6:.1f} ppm)")
+        
+        result = run_sync_test(costumes=3, cues=9, settle=20.0, drift_ppm=100.0, loss=0.02)
+        assert result['played'] == 9 and result['missed'] == 0, result
+        assert result['skew_max_ms'] < 2.0, f"Costumes should act together: {result['skew_max_ms']:.3f} ms"
+        assert result['unsynced_skew_max_ms'] > 1000, "Uncorrected clocks should be far apart"
+        assert all(stats['synced'] for stats in result['followers'].values())
+        print(f"✓ Cues run on every costume within {result['skew_max_ms']:.3f} ms despite loss and drift")
+        
+        follower = CostumeSync('follower', LoopbackNetwork(SimulatedBackend().clock).endpoint(),
+                               lambda action, value: None, name='buzz1',
+                               scheduler=SimulatedBackend().clock)
+        try:
+            follower.cue('wings', 'horizontal')
+            assert False, "Followers should not send cues"
+        except RuntimeError:
+            pass
+        follower.close()
+        
+        # Costumes left at the default name (every stock Pi is 'raspberrypi') still hear each other
+        with tempfile.TemporaryDirectory() as tmp, patch('socket.gethostname', return_value='raspberrypi'):
+            write_silent_clips(tmp, ['wings_open.wav', 'wings_close.wav'])
+            write_silent_clips(os.path.join(tmp, 'phrases'), [f'greetings/hello{i}.wav' for i in range(6)])
+            clock = VirtualClock()
+            network = LoopbackNetwork(clock)
+            costumes = []
+            for seed, role in enumerate(('leader', 'follower')):
+                controller = BuzzController({'audio_path': tmp, 'config_watch': False, 'random_seed': seed},
+                                            backend=SimulatedBackend(clock=clock))
+                controller.start_sync(role, network.endpoint())
+                costumes.append(controller)
+            leader, follower = costumes
+            assert leader.sync.name != follower.sync.name
+            assert leader.sync.name.startswith('raspberrypi-')
+            clock.advance(5.0)
+            leader.press('wing')
+            clock.advance(2.0)
+            assert follower.wing_position == WingPosition.HORIZONTAL, "Follower should follow the leader"
+            assert follower.sync.stats()['exchanges'] > 0
+            
+            # A phrase cue is decoded when it arrives, not when it is due
+            phrase = leader.phrases.peek()
+            assert follower.phrases.peek() != phrase
+            leader.press('phrase')
+            clock.advance(0.05)
+            follower.phrases.wait_idle(2.0)
+            assert follower.phrases.stats()['prefetches'] == 2, "Cued phrase should be decoded ahead"
+            clock.advance(1.0)
+            assert follower.backend.events('sound', os.path.basename(phrase))
+            assert follower.phrases.stats()['misses'] == 0, "Cued phrase should be in memory when due"
+            for controller in costumes:
+                controller.cleanup()
+        try:
+            BuzzController({'sync_role': 'captain'}, backend=SimulatedBackend())
+            assert False, "Unknown sync role should be rejected"
+        except ValueError:
+            pass
+        print("✓ Only the leader sends cues; unknown roles rejected")
+    
+    def test_event_recorder(self):
+        """Test recording a session, dumping it and replaying it"""
+        print("\n--- Testing Event Recorder ---")
+        
+        # The ring keeps the newest events, oldest first
+        recorder = EventRecorder(capacity=8)
+        for pin in range(20):
+            recorder.record(PIN, pin, 1)
+        events = recorder.events()
+        assert len(events) == 8 and events[-1].kind != PIN
+        assert [e.target for e in events[:-1]] == list(range(13, 20)), events
+        print("✓ Ring buffer keeps the newest events")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav', 'laser_off.wav', 'wings_open.wav',
+                                     'wings_close.wav', 'phrase1.wav', 'phrase2.wav'])
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'recorder_path': tmp}, backend=backend)
+            config = controller.config
+            for i, pin in enumerate([config.laser_button_pin, config.wing_button_pin,
+                                     config.phrase_button_pin, config.laser_button_pin]):
+                backend.clock.call_later(0.5 + i * 1.5, backend.press, pin)
+            backend.clock.call_later(7.0, controller.press, 'wing')
+            backend.clock.advance(10.0)
+            path = controller.dump_recording()
+            controller.cleanup()
+            
+            recording = load_recording(path)
+            kinds = {event.kind for event in recording.events}
+            assert EDGE in kinds and PIN in kinds, kinds
+            assert recording.meta['config']['laser_led_pin'] == config.laser_led_pin
+            result = replay(recording)
+        
+        assert result['inputs'] > 5
+        differing = {name: o for name, o in result['outputs'].items() if o['first_difference']}
+        assert not differing, differing
+        assert any(name.startswith('sound:') for name in result['outputs'])
+        print(f"✓ {len(recording.events)} events dumped and replayed; "
+              f"{len(result['outputs'])} outputs did the same")
+    
+    def test_perf_probe(self):
+        """Test the diagnose.py --perf probes on the simulated backend"""
+        print("\n--- Testing Performance Probes ---")
+        
+        from buzz_controller import DEFAULT_CONFIG
+        with tempfile.TemporaryDirectory() as tmp:
+            write_silent_clips(tmp, ['laser_on.wav', 'laser_off.wav'])
+            backend = SimulatedBackend(clock=SystemClock())
+            report = run_probes(backend, DEFAULT_CONFIG, audio_path=tmp,
+                                files=['laser_on.wav', 'laser_off.wav', 'jetpack.wav'],
+                                probes=('gpio_toggle', 'edge_latency', 'pwm_jitter', 'clip_decode'),
+                                seconds=0.1)
+        probes = report['probes']
+        assert set(probes) == {'gpio_toggle', 'edge_latency', 'pwm_jitter', 'clip_decode'}, probes
+        assert probes['gpio_toggle']['toggles_per_s'] > 0
+        assert probes['edge_latency']['count'] == 200 and probes['edge_latency']['lost'] == 0
+        assert 'skipped' in probes['pwm_jitter'], "Simulated PWM has no waveform to read back"
+        clips = probes['clip_decode']['clips']
+        assert clips['jetpack.wav'] == {'missing': True} and probes['clip_decode']['missing'] == 1
+        assert clips['laser_on.wav']['decoded_kib'] > 0
+        assert backend.mixer.get_init() is None, "The mixer should be closed afterwards"
+        # The report is plain JSON, so reports from two boards can be compared
+        baseline = json.loads(json.dumps(report))
+        rows = {metric: (value, base) for metric, value, base in compare_reports(report, baseline)}
+        assert rows['gpio_toggle.toggles_per_s'][0] == rows['gpio_toggle.toggles_per_s'][1]
+        assert 'strobe.max_frequency_hz' not in rows, "Probes that did not run are left out"
+        print(f"✓ GPIO {probes['gpio_toggle']['toggles_per_s']:,.0f} writes/s, "
+              f"edge callback p50 {probes['edge_latency']['p50_us']:.0f} us")
+        
+        strobe = probe_strobe(backend.gpio, DEFAULT_CONFIG['strobe_led_pin'], frequencies=(20, 50),
+                              seconds=0.2)
+        assert set(strobe['frequencies']) <= {'20', '50'}
+        assert all(stats['jitter_p99_ms'] >= stats['jitter_p50_ms']
+                   for stats in strobe['frequencies'].values())
+        print(f"✓ Software strobe keeps up to {strobe['max_frequency_hz']} Hz here")
+    
+    def test_phrase_library(self):
+        """Test phrase indexing, no-repeat selection and prefetch"""
+        print("\n--- Testing Phrase Library ---")
+        
+        import random
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'phrases')
+            index_path = os.path.join(tmp, 'compiled', 'phrase_index.json')
+            write_silent_clips(root, ['greetings/hello.wav', 'greetings/howdy.wav', 'greetings/hi.wav',
+                                      'catchphrases/infinity.wav', 'catchphrases/ranger.wav',
+                                      'catchphrases/star_command/come_in.wav'])
+            library = PhraseLibrary(root, index_path)
+            assert library.rebuilt and len(library) == 6
+            assert library.tags == ['catchphrases', 'greetings', 'star_command'], library.tags
+            assert not PhraseLibrary(root, index_path).rebuilt, "A fresh index should be reused"
+            
+            # Shuffle bag: every phrase once per round, never twice in a row
+            library = PhraseLibrary(root, index_path, rng=random.Random(1))
+            picks = [library.take() for _ in range(60)]
+            for start in range(0, 60, 6):
+                assert sorted(picks[start:start + 6]) == sorted(library.phrases), picks
+            assert all(a != b for a, b in zip(picks, picks[1:])), picks
+            
+            library = PhraseLibrary(root, index_path, mode='sequential')
+            assert [library.take() for _ in range(7)] == library.phrases + library.phrases[:1]
+            
+            # Weighted: greetings come up more often, but never within the last three picks
+            library = PhraseLibrary(root, index_path, mode='weighted', weights={'greetings': 4},
+                                    rng=random.Random(2))
+            picks = [library.take() for _ in range(600)]
+            assert all(len(set(picks[i:i + 4])) == 4 for i in range(len(picks) - 4))
+            greetings = sum(1 for pick in picks if pick.startswith('greetings/'))
+            assert greetings > 300, greetings
+            
+            # Zero weights leave phrases out until nothing else is left; negative weights are rejected
+            library = PhraseLibrary(root, index_path, mode='weighted', tags=['star_command'],
+                                    weights={'star_command': 0})
+            assert [library.take() for _ in range(3)] == ['catchphrases/star_command/come_in.wav'] * 3
+            library = PhraseLibrary(root, index_path, mode='weighted', rng=random.Random(3),
+                                    weights={'catchphrases': 0, 'greetings': 0})
+            assert len({library.take() for _ in range(60)}) == 6
+            for bad in ({'greetings': -1}, {'greetings': 'often'}):
+                try:
+                    PhraseLibrary(root, index_path, mode='weighted', weights=bad)
+                    assert False, f"Bad weights should be rejected: {bad}"
+                except ValueError:
+                    pass
+            try:
+                BuzzController({'audio_path': tmp, 'phrase_weights': {'greetings': -2}},
+                               backend=SimulatedBackend())
+                assert False, "Negative phrase weight should be rejected in the config"
+            except ValueError:
+                pass
+            
+            library = PhraseLibrary(root, index_path, tags=['star_command', 'greetings'])
+            assert len(library) == 4 and 'catchphrases/ranger.wav' not in library.phrases
+            print("✓ Shuffle, sequential, weighted and tag-filtered picks without repeats")
+            
+            # On the controller the next phrase is decoded while the current one plays
+            write_silent_clips(tmp, ['laser_on.wav'])
+            backend = SimulatedBackend()
+            controller = BuzzController({'audio_path': tmp, 'phrase_cache_mb': 0.05}, backend=backend)
+            assert controller.phrases.indexed and len(controller.phrases) == 6
+            for _ in range(8):
+                upcoming = controller.phrases.peek()
+                controller.phrases.wait_idle(2.0)
+                controller._phrase_button_callback(None)
+                assert backend.events('sound', os.path.basename(upcoming)), f"{upcoming} should have played"
+            stats = controller.phrases.stats()
+            assert stats['hits'] == 8 and stats['misses'] == 0, stats
+            assert stats['used_bytes'] <= stats['budget_bytes'] and stats['evictions'] > 0, stats
+            
+            write_silent_clips(root, ['greetings/greetings_cadet.wav'])
+            assert controller.phrases.stale()
+            controller.reload_config({'audio_path': tmp, 'phrase_mode': 'sequential'})
+            assert len(controller.phrases) == 7 and controller.phrases.mode == 'sequential'
+            controller.cleanup()
+        print(f"✓ {stats['hits']} presses played prefetched phrases within "
+              f"{stats['budget_bytes'] // 1024} KiB, {stats['evictions']} evicted")
+    
+    def test_hardware_pwm(self):
+        """Test the sysfs hardware PWM servo backend against a fake PWM chip"""
+        print("\n--- Testing Hardware PWM ---")
+        
+        def attribute(path, name):
+            with open(os.path.join(path, name)) as f:
+                return int(f.readline())
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            chip = write_fake_pwmchip(tmp, channels=1)
+            pwm = SysfsPWM(0, 0, 50, root=tmp)
+            pwm.start(7.5)
+            assert attribute(pwm.path, 'period') == 20000000
+            assert attribute(pwm.path, 'duty_cycle') == 1500000
+            assert attribute(pwm.path, 'enable') == 1
+            pwm.ChangeFrequency(100)
+            assert attribute(pwm.path, 'period') == 10000000
+            assert attribute(pwm.path, 'duty_cycle') == 750000
+            try:
+                pwm.ChangeDutyCycle(101)
+                assert False, "A duty cycle over 100% should be rejected"
+            except ValueError:
+                pass
+            pwm.close()
+            assert attribute(pwm.path, 'enable') == 0
+            print("✓ Period and duty cycle written in nanoseconds")
+            
+            # Exporting waits until the channel shows up, and close() unexports it again
+            write_fake_pwmchip(tmp, channels=2)
+            os.rename(os.path.join(chip, 'pwm1'), os.path.join(tmp, 'pwm1'))
+            threading.Timer(0.05, os.rename, args=(os.path.join(tmp, 'pwm1'), os.path.join(chip, 'pwm1'))).start()
+            pwm = SysfsPWM(0, 1, 50, root=tmp)
+            assert attribute(chip, 'export') == 1
+            pwm.close()
+            assert attribute(chip, 'unexport') == 1
+            try:
+                open_sysfs_pwm(22, 50, root=tmp)
+                assert False, "GPIO 22 has no hardware PWM channel"
+            except ValueError:
+                pass
+            print("✓ Channel exported on open and unexported on close")
+            
+            # The controller holds the wings with hardware pulses instead of releasing them
+            write_silent_clips(tmp, ['wings_open.wav', 'wings_close.wav'])
+            backend = SimulatedBackend(pwm_root=tmp)
+            controller = BuzzController({'audio_path': tmp, 'recorder_path': tmp}, backend=backend)
+            servo = controller.config.servo_pin
+            path = os.path.join(chip, 'pwm0')
+            controller.press('wing')
+            backend.clock.advance(2.99)  # Off the strobe's frame times, which replay orders differently
+            assert attribute(path, 'duty_cycle') == 1000000, "Horizontal should stay held at 5%"
+            assert attribute(path, 'enable') == 1
+            assert not backend.events('pwm_start', servo), "Software PWM should not run"
+            controller.press('wing')
+            backend.clock.advance(3.0)
+            assert attribute(path, 'duty_cycle') == 2000000
+            recording = load_recording(controller.dump_recording())
+            controller.cleanup()
+            assert attribute(path, 'enable') == 0
+            result = replay(recording)
+            differing = {name: o for name, o in result['outputs'].items() if o['first_difference']}
+            assert not differing, differing
+            
+            # Waking from idle puts the holding pulse back, not a 0% duty cycle
+            backend = SimulatedBackend(pwm_root=tmp)
+            controller = BuzzController({'audio_path': tmp, 'idle_timeout': 5.0}, backend=backend)
+            controller.press('wing')
+            backend.clock.advance(6.0)
+            assert controller.idle.idle and attribute(path, 'enable') == 0
+            controller.press('laser')
+            backend.clock.advance(0.01)
+            assert not controller.idle.idle
+            assert attribute(path, 'enable') == 1
+            assert attribute(path, 'duty_cycle') == 1000000, "Wings should be held horizontal after waking"
+            controller.cleanup()
+            
+            controller = BuzzController({'audio_path': tmp}, backend=SimulatedBackend())
+            assert controller._servo_sysfs is None and controller.servo_motion.release
+            controller.cleanup()
+            
+            # The 3.5mm jack shares the PWM block, so 'auto' leaves it to analog audio
+            backend = SimulatedBackend(pwm_root=tmp)
+            backend.sound_cards = os.path.join(tmp, 'cards')
+            with open(backend.sound_cards, 'w') as f:
+                f.write(" 0 [Headphones     ]: bcm2835_headpho - bcm2835 Headphones\n")
+            assert analog_audio_card(backend.sound_cards) == 'bcm2835 Headphones'
+            controller = BuzzController({'audio_path': tmp}, backend=backend)
+            assert controller._servo_sysfs is None, "Analog audio should keep the servo on software PWM"
+            controller.cleanup()
+            controller = BuzzController({'audio_path': tmp, 'servo_pwm': 'hardware'}, backend=backend)
+            assert controller._servo_sysfs is not None, "'hardware' should take the PWM block anyway"
+            controller.cleanup()
+            
+            # A channel routed to another pin (pwm,pin=12) would leave GPIO 18 without pulses
+            backend = SimulatedBackend(pwm_root=tmp, pin_functions={18: 'output', 12: 'PWM0_0'})
+            controller = BuzzController({'audio_path': tmp}, backend=backend)
+            assert controller._servo_sysfs is None, "An unrouted pin should keep to software PWM"
+            controller.cleanup()
+            try:
+                BuzzController({'audio_path': tmp, 'servo_pwm': 'hardware'}, backend=backend)
+                assert False, "'hardware' on an unrouted pin should be an error"
+            except OSError:
+                pass
+            controller = BuzzController({'audio_path': tmp, 'servo_pin': 12}, backend=backend)
+            assert controller._servo_sysfs is not None, "A routed pin should get hardware PWM"
+            controller.cleanup()
+            tool = (sys.executable, '-c', "print('18: a5    pd | lo // GPIO18 = PWM0_0')")
+            assert pin_function(18, tools=(('no-such-pinctrl', 'get'), tool)) == 'PWM0_0'
+            assert pin_function(18, tools=(('no-such-pinctrl', 'get'),)) is None
+        print("✓ Controller holds the servo on hardware PWM and falls back to software PWM")
+    
     def run_all_tests(self):
         """Run all tests"""
         print("=" * 50)
@@ -125,6 +1484,31 @@ class TestBuzzController:
             self.test_laser_toggle()
             self.test_phrase_button()
             self.test_strobe_timing()
+            self.test_sound_bank()
+            self.test_servo_motion()
+            self.test_event_dispatcher()
+            self.test_strobe_backends()
+            self.test_async_controller()
+            self.test_simulated_backend()
+            self.test_latency_benchmark()
+            self.test_metrics()
+            self.test_fast_start()
+            self.test_channel_pool()
+            self.test_audio_compiler()
+            self.test_sound_pack()
+            self.test_audio_stream()
+            self.test_show_timeline()
+            self.test_led_patterns()
+            self.test_input_gestures()
+            self.test_reconciler()
+            self.test_idle_mode()
+            self.test_config_reload()
+            self.test_control_server()
+            self.test_costume_sync()
+            self.test_event_recorder()
+            self.test_perf_probe()
+            self.test_phrase_library()
+            self.test_hardware_pwm()
             
             print("\n" + "=" * 50)
             print("ALL TESTS PASSED! ✓")
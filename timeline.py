@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Show timelines for the Buzz Lightyear Controller
+
+A show describes cues on several tracks in a JSON (or, with PyYAML
+installed, YAML) file:
+
+    {
+        "name": "triple_flash",
+        "priority": 1,
+        "mode": "preempt",
+        "tracks": {
+            "led":    [{"at": 0.0, "pin": "strobe", "pattern": "blink",
+                        "count": 3, "on": 0.1, "off": 0.1}],
+            "sound":  [{"at": 0.0, "clip": "laser_on.wav"}],
+            "servo":  [{"at": 0.6, "target": "horizontal", "duration": 0.3}],
+            "strobe": [{"at": 1.0, "state": "on"}, {"at": 3.0, "state": "off"}]
+        }
+    }
+
+Shows are compiled at load time into one flat list of cues sorted by
+time, so playing a show does no parsing: a single timing thread walks the
+list against monotonic deadlines and records how late every cue ran.
+
+Triggering a show while another is playing either preempts it (the
+running show is cut and its LEDs are switched off) or queues the new show
+to start when the running one ends. A show may only preempt a show of
+the same or lower importance (higher priority number); otherwise it is
+queued.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from functools import partial
+
+from deadline_worker import DeadlineWorker
+from event_dispatcher import percentile
+
+# Trigger modes
+SHOW_MODES = ('preempt', 'queue')
+
+# File types load_shows() picks up
+SHOW_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+
+class Cue:
+    """One action at an offset into a show"""
+
+    __slots__ = ('time', 'order', 'track', 'args')
+
+    def __init__(self, time, order, track, args):
+        self.time = time
+        self.order = order
+        self.track = track
+        self.args = args
+
+    def sort_key(self):
+        return (self.time, self.order)
+
+
+class Show:
+    """A compiled show: cues sorted by time"""
+
+    def __init__(self, name, cues, priority=0, mode='preempt'):
+        if mode not in SHOW_MODES:
+            raise ValueError(f"Unknown show mode: {mode}")
+        self.name = name
+        self.cues = sorted(cues, key=Cue.sort_key)
+        self.priority = priority
+        self.mode = mode
+        self.duration = self.cues[-1].time if self.cues else 0.0
+        # LED pins to switch off when the show is cut short
+        self.pins = sorted({cue.args[0] for cue in self.cues if cue.track == 'led'})
+
+
+def _resolve(value, names, kind):
+    """Map a symbolic name through names, passing numbers through"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if value in names:
+        return names[value]
+    raise ValueError(f"Unknown {kind}: {value!r}")
+
+
+def compile_show(data, pins, servo_positions):
+    """
+    Compile a show description into a Show
+
+    Args:
+        data: Parsed show file (dictionary)
+        pins: LED name -> GPIO pin
+        servo_positions: Position name -> duty cycle
+
+    Returns:
+        Show with a flat, time-sorted cue list
+
+    Raises:
+        ValueError: On unknown tracks, pins, patterns or positions
+    """
+    name = data.get('name', 'show')
+    cues = []
+
+    def add(at, track, *args):
+        if at < 0:
+            raise ValueError(f"{name}: cue time {at} is negative")
+        # Microsecond resolution keeps expanded pattern times exact
+        cues.append(Cue(round(float(at), 6), len(cues), track, args))
+
+    for track, entries in data.get('tracks', {}).items():
+        for entry in entries:
+            at = entry.get('at', 0.0)
+            if track == 'led':
+                pin = _resolve(entry['pin'], pins, 'LED')
+                pattern = entry.get('pattern', 'on')
+                if pattern == 'on':
+                    add(at, 'led', pin, 1)
+                elif pattern == 'off':
+                    add(at, 'led', pin, 0)
+                elif pattern == 'blink':
+                    on, off = entry.get('on', 0.1), entry.get('off', 0.1)
+                    for i in range(entry.get('count', 1)):
+                        start = at + i * (on + off)
+                        add(start, 'led', pin, 1)
+                        add(start + on, 'led', pin, 0)
+                else:
+                    raise ValueError(f"{name}: unknown LED pattern {pattern!r}")
+            elif track == 'servo':
+                duty = _resolve(entry['target'], servo_positions, 'servo position')
+                position = entry['target'] if entry['target'] in servo_positions else None
+                add(at, 'servo', duty, entry.get('duration'), position)
+            elif track == 'sound':
+                add(at, 'sound', entry['clip'], entry.get('category', 'effect'))
+            elif track == 'strobe':
+                state = entry.get('state', 'on')
+                if state not in ('on', 'off'):
+                    raise ValueError(f"{name}: unknown strobe state {state!r}")
+                add(at, 'strobe', state == 'on')
+            else:
+                raise ValueError(f"{name}: unknown track {track!r}")
+
+    return Show(name, cues, data.get('priority', 0), data.get('mode', 'preempt'))
+
+
+def load_show_file(path, pins, servo_positions):
+    """Read and compile one show file"""
+    with open(path) as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path}: YAML shows need PyYAML (pip3 install pyyaml)")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    data.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return compile_show(data, pins, servo_positions)
+
+
+def load_shows(show_path, pins, servo_positions):
+    """
+    Compile every show file in a directory
+
+    Returns:
+        Dictionary of show name -> Show (empty if the directory is missing)
+    """
+    shows = {}
+    if not os.path.isdir(show_path):
+        return shows
+    for entry in sorted(os.scandir(show_path), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(SHOW_EXTENSIONS):
+            try:
+                show = load_show_file(entry.path, pins, servo_positions)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading show {entry.name}: {e}")
+                continue
+            shows[show.name] = show
+    return shows
+
+
+def _raise_thread_priority(priority):
+    """Move the calling thread to SCHED_FIFO if the OS allows it"""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class ShowRunner:
+    """Plays compiled shows on one timing thread"""
+
+    def __init__(self, handlers, clock=time.monotonic, scheduler=None, realtime_priority=None,
+                 max_queue=4, lateness_samples=512):
+        """
+        Initialize the show runner
+
+        Args:
+            handlers: Track name -> callable taking the cue arguments
+                ('led', 'servo', 'sound', 'strobe')
+            clock: Monotonic time source in seconds
+            scheduler: Optional timer source with call_at(when, callback), such
+                as a virtual clock; when given, no thread is started
+            realtime_priority: SCHED_FIFO priority for the timing thread
+                (needs root; ignored where not permitted)
+            max_queue: Maximum shows waiting behind the running one
+            lateness_samples: Number of recent cue lateness samples kept
+        """
+        self.handlers = handlers
+        self.clock = clock
+        self.scheduler = scheduler
+        self.realtime_priority = realtime_priority
+        self.shows = {}
+
+        # Playback state, guarded by the condition's lock
+        self._worker = DeadlineWorker(self._step, 'show-runner', clock, scheduler,
+                                      on_start=self._raise_priority)
+        self._cond = self._worker.cond
+        self._show = None
+        self._start = 0.0
+        self._next = 0                # Index of the next cue in the running show
+        self._generation = 0          # Bumped whenever a show is cut
+        self._queue = deque(maxlen=max_queue)
+        self._lateness = deque(maxlen=lateness_samples)
+        self._late_max = 0.0
+        self._played = 0
+        self._preempted = 0
+
+    @property
+    def current(self):
+        """Name of the running show, or None"""
+        with self._cond:
+            return self._show.name if self._show else None
+
+    def add(self, show):
+        """Register a compiled show so it can be triggered by name"""
+        self.shows[show.name] = show
+
+    def trigger(self, show, mode=None):
+        """
+        Start a show, preempting or queueing behind the running one
+
+        Args:
+            show: Show or name of a registered show
+            mode: 'preempt' or 'queue' (default: the show's own mode)
+
+        Returns:
+            True if the show started or was queued, False if dropped
+        """
+        if not isinstance(show, Show):
+            if show not in self.shows:
+                print(f"Unknown show: {show}")
+                return False
+            show = self.shows[show]
+        mode = mode or show.mode
+        if mode not in SHOW_MODES:
+            raise ValueError(f"Unknown show mode: {mode}")
+
+        cut = None
+        with self._cond:
+            if self._show is None:
+                self._begin(show)
+            elif mode == 'preempt' and show.priority <= self._show.priority:
+                cut = self._show
+                self._preempted += 1
+                self._generation += 1
+                self._begin(show)
+            elif len(self._queue) < self._queue.maxlen:
+                self._queue.append(show)
+                return True
+            else:
+                print(f"Show queue full, dropping show: {show.name}")
+                return False
+        if cut is not None:
+            self._switch_off(cut)
+        return True
+
+    def stop(self):
+        """Cut the running show and clear the queue"""
+        with self._cond:
+            cut = self._show
+            self._show = None
+            self._generation += 1
+            self._queue.clear()
+            self._worker.cancel()
+            self._cond.notify_all()
+        if cut is not None:
+            self._switch_off(cut)
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until no show is running or queued; return True if idle
+
+        With an external scheduler nothing can progress while blocked, so
+        this only reports the current state.
+        """
+        with self._cond:
+            idle = lambda: self._show is None and not self._queue
+            if self.scheduler is not None:
+                return idle()
+            return self._cond.wait_for(idle, timeout)
+
+    def lateness_stats(self):
+        """Return cue lateness (p50/p99/max in ms) and show counters"""
+        with self._cond:
+            samples = list(self._lateness)
+            return {
+                'cues': len(samples),
+                'late_p50_ms': percentile(samples, 0.50) * 1000,
+                'late_p99_ms': percentile(samples, 0.99) * 1000,
+                'late_max_ms': self._late_max * 1000,
+                'shows_played': self._played,
+                'shows_preempted': self._preempted,
+            }
+
+    def close(self):
+        """Stop playback and the timing thread"""
+        self.stop()
+        self._worker.close()
+
+    def _begin(self, show):
+        """Start a show now (lock must be held)"""
+        self._show = show
+        self._start = self.clock()
+        self._next = 0
+        self._played += 1
+        self._worker.schedule(self._start)
+
+    def _deadline(self):
+        """Deadline of the next cue, or None (lock must be held)"""
+        if self._show is None:
+            return None
+        if self._next >= len(self._show.cues):
+            return self._start + self._show.duration
+        return self._start + self._show.cues[self._next].time
+
+    def _take_due(self, now):
+        """
+        Collect cues that are due and advance the show (lock must be held)
+
+        Returns:
+            Tuple of (show generation, list of (cue, scheduled time))
+        """
+        generation = self._generation
+        due = []
+        cues = self._show.cues
+        while self._next < len(cues) and self._start + cues[self._next].time <= now:
+            cue = cues[self._next]
+            due.append((cue, self._start + cue.time))
+            self._next += 1
+        if self._next >= len(cues):
+            # Show finished: start the next queued one
+            self._show = None
+            if self._queue:
+                self._begin(self._queue.popleft())
+            else:
+                self._cond.notify_all()
+        return generation, due
+
+    def _fire(self, generation, due):
+        """Run cue handlers and record lateness (lock must not be held)"""
+        lateness = []
+        for cue, scheduled in due:
+            if self._generation != generation:
+                # Preempted or stopped since the cues were taken
+                break
+            lateness.append(self.clock() - scheduled)
+            try:
+                self.handlers[cue.track](*cue.args)
+            except Exception as e:
+                print(f"Error running {cue.track} cue: {e}")
+        with self._cond:
+            for late in lateness:
+                self._lateness.append(late)
+                self._late_max = max(self._late_max, late)
+
+    def _switch_off(self, show):
+        """Leave no LED of a cut show lit"""
+        for pin in show.pins:
+            try:
+                self.handlers['led'](pin, 0)
+            except Exception as e:
+                print(f"Error switching off LED {pin}: {e}")
+
+    def _raise_priority(self):
+        """Worker thread start: move to SCHED_FIFO if configured"""
+        if self.realtime_priority is not None and not _raise_thread_priority(self.realtime_priority):
+            print("Show runner: real-time priority not permitted, using normal priority")
+
+    def _step(self, now):
+        """
+        Take the cues due at now (lock must be held)
+
+        Returns:
+            Tuple of (next cue deadline or None, call running the cues)
+        """
+        if self._show is None:
+            return None, None
+        generation, due = self._take_due(now)
+        return self._deadline(), partial(self._fire, generation, due)